@@ -1,8 +1,10 @@
 from logging import getLogger
 from os import EX_OK, EX_USAGE
 from os.path import isdir, isfile
+from time import perf_counter
 from warnings import warn
 from typing import Optional, Tuple, List
+from pylxd.exceptions import LXDAPIException
 
 from vnet_manager.conf import settings
 from vnet_manager.config.config import get_config
@@ -10,17 +12,25 @@ from vnet_manager.config.validate import ValidateConfig
 from vnet_manager.utils.version import show_version
 from vnet_manager.utils.user import request_confirmation, generate_bash_completion_script
 from vnet_manager.utils.files import write_file_to_disk, get_yaml_files_from_disk_path
+from vnet_manager.utils.trace import trace_span
 from vnet_manager.environment.lxc import ensure_vnet_lxc_environment, cleanup_vnet_lxc_environment
-from vnet_manager.operations.image import destroy_lxc_image
-from vnet_manager.operations.files import put_files_on_machine, generate_vnet_hosts_file, place_vnet_hosts_file_on_machines
+from vnet_manager.operations.image import destroy_lxc_image, export_lxc_image, import_lxc_image
+from vnet_manager.operations.files import generate_vnet_hosts_file
 from vnet_manager.actions.help import display_help_for_action
 from vnet_manager.operations.machine import (
     show_status,
     change_machine_status,
     create_machines,
     destroy_machines,
-    enable_type_specific_machine_configuration,
+    snapshot_machines,
+    reset_machines,
+    destroy_lxc_golden_containers,
+    destroy_lxc_warm_pool,
+    get_lxc_base_image_alias,
 )
+from vnet_manager.operations.metrics import record_action_duration, write_lab_metrics
+from vnet_manager.operations.packages import import_apt_packages
+from vnet_manager.operations.plan import generate_plan, show_plan, apply_plan
 from vnet_manager.operations.interface import (
     bring_up_vnet_interfaces,
     bring_down_vnet_interfaces,
@@ -38,17 +48,36 @@ class ActionManager:
     Use this class to initiate specific VNet action in a controlled manner
     """
 
-    def __init__(self, config_path: str = None, sniffer: bool = False, base_image: bool = False, no_hosts: bool = False):
+    def __init__(
+        self,
+        config_path: str = None,
+        sniffer: bool = False,
+        base_image: bool = False,
+        no_hosts: bool = False,
+        parallel: int = settings.VNET_PARALLEL_WORKERS,
+        graceful: bool = False,
+        stop_timeout: int = settings.LXC_STOP_TIMEOUT,
+        snapshot: str = settings.LXC_DEFAULT_SNAPSHOT_NAME,
+    ):
         """
         :param str config_path: The path to the config
         :param bool sniffer: Whether to enable sniffers on 'start'
         :param bool base_image: Whether to delete the base image on 'destroy'
+        :param bool no_hosts: Whether to skip the creation of /etc/hosts on 'create', 'plan' and 'apply'
+        :param int parallel: The amount of machines to operate on concurrently
+        :param bool graceful: Whether to shut the machines down gracefully on 'stop', instead of force stopping them
+        :param int stop_timeout: The amount of seconds to wait for a graceful stop on 'stop'
+        :param str snapshot: The name of the snapshot to take on 'snapshot' and to reset to on 'reset'
         """
         self.config_path = config_path
         self.config = None
         self.sniffer = sniffer
         self.base_image = base_image
         self.no_hosts = no_hosts
+        self.parallel = parallel
+        self.graceful = graceful
+        self.stop_timeout = stop_timeout
+        self.snapshot = snapshot
         self._machines = None
         self._config_validated = False
 
@@ -89,9 +118,26 @@ class ActionManager:
                 return EX_USAGE
         # Preform the action
         logger.info("Initiating {} action".format(action))
+        start = perf_counter()
         getattr(self, "preform_{}_action".format(action.replace("-", "_")))()
+        if settings.VNET_METRICS_DIR and self.config is not None:
+            self._update_metrics(action, perf_counter() - start)
         return EX_OK
 
+    def _update_metrics(self, action: str, duration: float):
+        """
+        Records the duration of the action and writes the Prometheus metrics of the lab
+        Failing to write the metrics does not fail the action
+        :param str action: The name of the action that was executed
+        :param float duration: The duration of the action in seconds
+        """
+        try:
+            if action in settings.METRICS_ACTIONS:
+                record_action_duration(self.config, action, duration)
+            write_lab_metrics(self.config)
+        except OSError as e:
+            logger.warning("Unable to write the VNet metrics to {}: {}".format(settings.VNET_METRICS_DIR, e))
+
     def parse_config(self) -> bool:
         """
         Parses the user config
@@ -128,11 +174,15 @@ class ActionManager:
             show_vnet_veth_interface_status(self.config)
 
     def preform_start_action(self):
-        bring_up_vnet_interfaces(self.config, sniffer=self.sniffer)
-        change_machine_status(self.config, machines=self._machines, status="start")
+        with trace_span("bring up interfaces"):
+            bring_up_vnet_interfaces(self.config, sniffer=self.sniffer)
+        with trace_span("start machines"):
+            change_machine_status(self.config, machines=self._machines, status="start", parallel=self.parallel)
 
     def preform_stop_action(self):
-        change_machine_status(self.config, machines=self._machines, status="stop")
+        change_machine_status(
+            self.config, machines=self._machines, status="stop", parallel=self.parallel, graceful=self.graceful, timeout=self.stop_timeout
+        )
         # If specific machines are specified, we don't want to mess with the interfaces
         if self._machines:
             logger.warning("Not bringing down VNet interfaces as we are only stopping specific machines, this may leave lingering sniffers")
@@ -141,32 +191,53 @@ class ActionManager:
 
     def preform_create_action(self):
         # Make sure the provider environments are correct
-        ensure_vnet_lxc_environment(self.config)
-        # Make the machines
-        create_machines(self.config, machines=self._machines)
-        # Put user requested file on the machines
-        put_files_on_machine(self.config)
+        with trace_span("ensure environment"):
+            ensure_vnet_lxc_environment(self.config)
         if not self.no_hosts:
-            # Put /etc/hosts on the machines
-            generate_vnet_hosts_file(self.config)
-            place_vnet_hosts_file_on_machines(self.config)
-        # Configure type specific stuff
-        enable_type_specific_machine_configuration(self.config)
+            # Generate the /etc/hosts file that is placed on the machines
+            with trace_span("generate hosts file"):
+                generate_vnet_hosts_file(self.config)
+        # Make the machines, each machine receives its network config, user files, hosts file and type specific config in one bundle
+        with trace_span("create machines"):
+            create_machines(self.config, machines=self._machines, parallel=self.parallel, hosts=not self.no_hosts)
+
+    def preform_plan_action(self):
+        show_plan(generate_plan(self.config, machines=self._machines, hosts=not self.no_hosts))
+
+    def preform_apply_action(self):
+        changes = generate_plan(self.config, machines=self._machines, hosts=not self.no_hosts)
+        show_plan(changes)
+        if changes:
+            request_confirmation(prompt="Apply the changes above (y/n)? ")
+            apply_plan(self.config, changes, parallel=self.parallel, hosts=not self.no_hosts)
 
     def preform_destroy_action(self):
         if self.base_image:
             request_confirmation(prompt="Are you sure you want to delete the VNet base images (y/n)? ")
-            destroy_lxc_image(settings.LXC_BASE_IMAGE_ALIAS, by_alias=True)
+            destroy_lxc_warm_pool()
+            alias = get_lxc_base_image_alias()
+            destroy_lxc_golden_containers(alias=alias)
+            destroy_lxc_image(alias, by_alias=True)
         else:
-            destroy_machines(self.config, machines=self._machines)
+            failed = destroy_machines(self.config, machines=self._machines, parallel=self.parallel)
             # If specific machines are specified, we don't want to mess with the interfaces
             if self._machines:
                 logger.warning(
                     "Not deleting VNet interfaces as we are only destroying specific machines, this may leave lingering sniffers"
                 )
+            elif failed:
+                logger.warning("Not deleting VNet interfaces as some machines could not be destroyed, they might still use them")
             else:
                 delete_vnet_interfaces(self.config)
 
+    def preform_snapshot_action(self):
+        with trace_span("snapshot machines"):
+            snapshot_machines(self.config, snapshot=self.snapshot, machines=self._machines, parallel=self.parallel)
+
+    def preform_reset_action(self):
+        with trace_span("reset machines"):
+            reset_machines(self.config, snapshot=self.snapshot, machines=self._machines, parallel=self.parallel)
+
     def preform_list_action(self):
         # First check if we have been passed a file or directory
         if isfile(self.config_path):
@@ -178,13 +249,15 @@ class ActionManager:
         elif isdir(self.config_path):
             # We exclude the default.yaml config file because it is not a valid user config
             yaml_files = get_yaml_files_from_disk_path(self.config_path)
+            # The machine statuses are collected once per provider and shared by all configs
+            provider_statuses = {}
             for path in yaml_files:
                 self.config_path = path
                 if not self.parse_config():
                     logger.error("Config {} does not seem to be a valid config, skipping".format(path))
                     continue
                 logger.info("Showing machine status for {}".format(path))
-                show_status(self.config)
+                show_status(self.config, provider_statuses=provider_statuses)
         else:
             logger.error(
                 "Path {} does not seem to be a file or a directory, did you forget to pass a config directory?".format(self.config_path)
@@ -203,3 +276,27 @@ class ActionManager:
     @staticmethod
     def preform_clean_action():
         cleanup_vnet_lxc_environment()
+
+    def preform_export_image_action(self):
+        alias = get_lxc_base_image_alias()
+        try:
+            export_lxc_image(alias, self.config_path)
+        except (LXDAPIException, OSError) as e:
+            logger.error("Unable to export LXC image {}: {}".format(alias, e))
+
+    def preform_import_image_action(self):
+        try:
+            alias = import_lxc_image(self.config_path, alias=get_lxc_base_image_alias())
+        except (LXDAPIException, OSError, RuntimeError) as e:
+            logger.error("Unable to import LXC image from {}: {}".format(self.config_path, e))
+            return
+        logger.info("LXC image {} imported".format(alias))
+
+    def preform_import_packages_action(self):
+        if not settings.VNET_APT_CACHE_DIR:
+            logger.error("No apt package cache configured, set the VNET_APT_CACHE_DIR environment variable to import packages")
+            return
+        try:
+            import_apt_packages(self.config_path)
+        except RuntimeError as e:
+            logger.error(e)
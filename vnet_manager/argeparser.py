@@ -22,13 +22,47 @@ def parse_vnet_args(args: Sequence = None) -> Namespace:
     )
     parser.add_argument("-y", "--yes", action="store_true", help="Answer yes to all questions")
     parser.add_argument("-nh", "--no-hosts", action="store_true", help="Disable creation of /etc/hosts")
+    parser.add_argument(
+        "-p",
+        "--parallel",
+        type=int,
+        default=settings.VNET_PARALLEL_WORKERS,
+        metavar="N",
+        help="The amount of machines to operate on concurrently (default: {})".format(settings.VNET_PARALLEL_WORKERS),
+    )
+
+    parser.add_argument(
+        "--trace",
+        metavar="FILE",
+        help="Record the duration of every phase, write them as a Chrome trace to FILE and show the slowest phases and machines",
+    )
 
     start_group = parser.add_argument_group("Start options", "These options can be specified for the start action")
     start_group.add_argument("-s", "--sniffer", action="store_true", help="Start a TCPdump sniffer on the VNet interfaces")
 
+    stop_group = parser.add_argument_group("Stop options", "These options can be specified for the stop action")
+    stop_group.add_argument(
+        "-g", "--graceful", action="store_true", help="Shut the machines down gracefully instead of force stopping them"
+    )
+    stop_group.add_argument(
+        "--stop-timeout",
+        type=int,
+        default=settings.LXC_STOP_TIMEOUT,
+        metavar="SECONDS",
+        help="Seconds to wait for a graceful stop before forcing it, used with --graceful (default: {})".format(settings.LXC_STOP_TIMEOUT),
+    )
+
     destroy_group = parser.add_argument_group("Destroy options", "These options can be specified for the destroy action")
     destroy_group.add_argument("-b", "--base-image", action="store_true", help="Destroy the base image instead of the machines")
 
+    snapshot_group = parser.add_argument_group("Snapshot options", "These options can be specified for the snapshot and reset actions")
+    snapshot_group.add_argument(
+        "--snapshot",
+        default=settings.LXC_DEFAULT_SNAPSHOT_NAME,
+        metavar="NAME",
+        help="The name of the snapshot to take or reset to (default: {})".format(settings.LXC_DEFAULT_SNAPSHOT_NAME),
+    )
+
     logging_group = parser.add_argument_group("Verbosity options", "Control output verbosity (can be supplied multiple times)")
     logging_group.add_argument("-v", "--verbose", action="count", default=0, help="Be more verbose")
     logging_group.add_argument("-q", "--quite", action="count", default=0, help="Be more quite")
@@ -49,10 +83,22 @@ def validate_argument_sanity(args: Namespace, parser: ArgumentParser) -> Namespa
         args.action = "show"
     if args.config == "default" and args.action in settings.CONFIG_REQUIRED_ACTIONS:
         parser.error("This action requires a config file to be passed")
+    if args.config == "default" and args.action in settings.PATH_REQUIRED_ACTIONS:
+        parser.error("This action requires a path to be passed")
     if args.sniffer and not args.action == "start":
         parser.error("The sniffer option only makes sense with the 'start' action")
     if args.base_image and not args.action == "destroy":
         parser.error("The base_image option only makes sense with the 'destroy' action")
-    if args.no_hosts and not args.action == "create":
-        parser.error("The no_hosts option only makes sense with the 'create' action")
+    if args.no_hosts and args.action not in settings.HOSTS_ACTIONS:
+        parser.error("The no_hosts option only makes sense with the following actions: {}".format(", ".join(settings.HOSTS_ACTIONS)))
+    if args.graceful and not args.action == "stop":
+        parser.error("The graceful option only makes sense with the 'stop' action")
+    if args.stop_timeout != settings.LXC_STOP_TIMEOUT and not args.action == "stop":
+        parser.error("The stop_timeout option only makes sense with the 'stop' action")
+    if args.snapshot != settings.LXC_DEFAULT_SNAPSHOT_NAME and args.action not in settings.SNAPSHOT_ACTIONS:
+        parser.error("The snapshot option only makes sense with the following actions: {}".format(", ".join(settings.SNAPSHOT_ACTIONS)))
+    if args.parallel < 1:
+        parser.error("The parallel option requires a positive amount of workers")
+    if args.parallel != settings.VNET_PARALLEL_WORKERS and args.action not in settings.PARALLEL_ACTIONS:
+        parser.error("The parallel option only makes sense with the following actions: {}".format(", ".join(settings.PARALLEL_ACTIONS)))
     return args
@@ -16,4 +16,6 @@ def get_config(path: str) -> dict:
     config = get_yaml_content(path)
     # Add the config directory
     config["config_dir"] = dirname(realpath(path))
+    # Add the config path, used to tag the resources created for this config
+    config["config_path"] = realpath(path)
     return config
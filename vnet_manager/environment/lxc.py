@@ -1,15 +1,30 @@
 import shlex
 from logging import getLogger
 from time import sleep
-from typing import Tuple, AnyStr
+from typing import Callable, Tuple, AnyStr
 
 from vnet_manager.operations.image import check_if_lxc_image_exists, create_lxc_image_from_container
 from vnet_manager.operations.profile import check_if_lxc_profile_exists, create_vnet_lxc_profile, delete_vnet_lxc_profile
-from vnet_manager.operations.storage import check_if_lxc_storage_pool_exists, create_lxc_storage_pool, delete_lxc_storage_pool
-from vnet_manager.operations.machine import create_lxc_base_image_container, change_lxc_machine_status, destroy_lxc_machine
+from vnet_manager.operations.storage import (
+    check_if_lxc_storage_pool_exists,
+    create_lxc_storage_pool,
+    delete_lxc_storage_pool,
+    mount_lxc_storage_pool_tmpfs,
+    unmount_lxc_storage_pool_tmpfs,
+)
+from vnet_manager.operations.packages import get_cached_apt_packages
+from vnet_manager.operations.machine import (
+    create_lxc_base_image_container,
+    change_lxc_machine_status,
+    destroy_lxc_machine,
+    destroy_lxc_golden_containers,
+    destroy_lxc_warm_pool,
+    get_lxc_base_image_alias,
+)
 from vnet_manager.environment.host import check_for_supported_os, check_for_installed_packages
 from vnet_manager.providers.lxc import get_lxd_client
 from vnet_manager.conf import settings
+from vnet_manager.utils.trace import trace_span
 from vnet_manager.utils.user import request_confirmation
 
 logger = getLogger(__name__)
@@ -39,9 +54,19 @@ def ensure_vnet_lxc_environment(config: dict):
     # Check if the storage pool exists
     if not check_if_lxc_storage_pool_exists(settings.LXC_STORAGE_POOL_NAME):
         logger.info("VNet LXC storage pool does not exist, creating it")
-        create_lxc_storage_pool(name=settings.LXC_STORAGE_POOL_NAME, driver=settings.LXC_STORAGE_POOL_DRIVER)
+        create_lxc_storage_pool(
+            name=settings.LXC_STORAGE_POOL_NAME,
+            driver=settings.LXC_STORAGE_POOL_DRIVER,
+            source=settings.LXC_STORAGE_POOL_SOURCE,
+            tmpfs=settings.LXC_STORAGE_POOL_TMPFS,
+        )
     else:
         logger.debug("VNet LXC storage pool {} found".format(settings.LXC_STORAGE_POOL_NAME))
+        if settings.LXC_STORAGE_POOL_TMPFS:
+            # The storage pool survives a reboot of the host, its tmpfs does not
+            mount_lxc_storage_pool_tmpfs(
+                settings.LXC_STORAGE_POOL_SOURCE or settings.LXC_STORAGE_POOL_TMPFS_PATH, size=settings.LXC_STORAGE_POOL_SIZE
+            )
 
     # Check if the profile exists
     if not check_if_lxc_profile_exists(settings.LXC_VNET_PROFILE):
@@ -50,16 +75,22 @@ def ensure_vnet_lxc_environment(config: dict):
     else:
         logger.debug("VNet profile {} found".format(settings.LXC_VNET_PROFILE))
 
-    # Check if the base image exists
-    if not check_if_lxc_image_exists(settings.LXC_BASE_IMAGE_ALIAS, by_alias=True):
-        logger.info("Base image does not exist, creating it")
-        create_lxc_base_image_container()
-        change_lxc_machine_status(settings.LXC_BASE_IMAGE_MACHINE_NAME, status="start")
-        configure_lxc_base_machine()
-        create_lxc_image_from_container(settings.LXC_BASE_IMAGE_MACHINE_NAME, alias=settings.LXC_BASE_IMAGE_ALIAS)
-        destroy_lxc_machine(settings.LXC_BASE_IMAGE_MACHINE_NAME, wait=False)
+    # Check if the base image of the current build inputs exists
+    alias = get_lxc_base_image_alias()
+    if not check_if_lxc_image_exists(alias, by_alias=True):
+        logger.info("Base image {} does not exist, creating it".format(alias))
+        with trace_span("create base image", machine=settings.LXC_BASE_IMAGE_MACHINE_NAME):
+            create_lxc_base_image_container()
+            change_lxc_machine_status(settings.LXC_BASE_IMAGE_MACHINE_NAME, status="start")
+            with trace_span("configure base machine", machine=settings.LXC_BASE_IMAGE_MACHINE_NAME):
+                configure_lxc_base_machine()
+            with trace_span("publish base image", machine=settings.LXC_BASE_IMAGE_MACHINE_NAME):
+                create_lxc_image_from_container(
+                    settings.LXC_BASE_IMAGE_MACHINE_NAME, alias=alias, description="VNet base image built with {}".format(alias)
+                )
+            destroy_lxc_machine(settings.LXC_BASE_IMAGE_MACHINE_NAME, wait=False)
     else:
-        logger.debug("Base image {} found".format(settings.LXC_BASE_IMAGE_ALIAS))
+        logger.debug("Base image {} found".format(alias))
 
 
 def cleanup_vnet_lxc_environment():
@@ -69,8 +100,13 @@ def cleanup_vnet_lxc_environment():
     """
     request_confirmation(message="Cleanup will delete the VNet LXC configurations, such as profile and storage pools")
     logger.info("Cleaning up VNet LXC configuration")
+    # The warm pool and golden containers use the profile, so they have to go first
+    destroy_lxc_warm_pool()
+    destroy_lxc_golden_containers()
     delete_vnet_lxc_profile(settings.LXC_VNET_PROFILE)
     delete_lxc_storage_pool(settings.LXC_STORAGE_POOL_NAME)
+    if settings.LXC_STORAGE_POOL_TMPFS:
+        unmount_lxc_storage_pool_tmpfs(settings.LXC_STORAGE_POOL_SOURCE or settings.LXC_STORAGE_POOL_TMPFS_PATH)
 
 
 def configure_lxc_base_machine():
@@ -78,6 +114,8 @@ def configure_lxc_base_machine():
     Configure the LXC base machine to get a fully functional VNet base machine which we can make an image from
     :raises RuntimeError: If the base machine is started without networking/dns
     """
+    if settings.VNET_APT_OFFLINE and not get_cached_apt_packages():
+        raise RuntimeError("Offline base image build requested, but there are no packages in the apt package cache")
     logger.info("Configuring LXC base machine {}, this might take a while".format(settings.LXC_BASE_IMAGE_MACHINE_NAME))
     client = get_lxd_client()
     machine = client.containers.get(settings.LXC_BASE_IMAGE_MACHINE_NAME)
@@ -87,6 +125,33 @@ def configure_lxc_base_machine():
         logger.debug(result)
         return result
 
+    if settings.VNET_APT_OFFLINE:
+        install_lxc_base_machine_packages_offline(execute_and_log)
+    else:
+        install_lxc_base_machine_packages(execute_and_log, machine)
+
+    # Disable radvd by default
+    execute_and_log("systemctl disable radvd")
+    # Disable cloud init messing with our networking
+    execute_and_log("bash -c 'echo network: {config: disabled} > /etc/cloud/cloud.cfg.d/99-disable-network-config.cfg'")
+    # Set the default VTYSH_PAGER
+    execute_and_log("bash -c 'export VTYSH_PAGER=more >> ~/.bashrc'")
+    # Make all files in the FRR dir owned by the frr user
+    execute_and_log(
+        "bash -c 'echo -e \"#!/bin/bash\nchown -R frr:frr /etc/frr\nsystemctl restart frr\" > /etc/rc.local; chmod +x /etc/rc.local'"
+    )
+    # All done, stop the container
+    machine.stop(wait=True)
+    logger.debug("LXC base machine {} successfully configured".format(settings.LXC_BASE_IMAGE_MACHINE_NAME))
+
+
+def install_lxc_base_machine_packages(execute_and_log: Callable, machine):
+    """
+    Installs the guest packages on the LXC base machine from the internet
+    :param callable execute_and_log: Executes a command on the base machine
+    :param pylxd.models.Container machine: The base machine
+    :raises RuntimeError: If the base machine is started without networking/dns
+    """
     # Check for DNS
     logger.debug("Checking for DNS connectivity")
     dns = False
@@ -123,16 +188,37 @@ def configure_lxc_base_machine():
         environment={"DEBIAN_FRONTEND": "noninteractive"},
     )
 
-    # Disable radvd by default
-    execute_and_log("systemctl disable radvd")
-    # Disable cloud init messing with our networking
-    execute_and_log("bash -c 'echo network: {config: disabled} > /etc/cloud/cloud.cfg.d/99-disable-network-config.cfg'")
-    # Set the default VTYSH_PAGER
-    execute_and_log("bash -c 'export VTYSH_PAGER=more >> ~/.bashrc'")
-    # Make all files in the FRR dir owned by the frr user
-    execute_and_log(
-        "bash -c 'echo -e \"#!/bin/bash\nchown -R frr:frr /etc/frr\nsystemctl restart frr\" > /etc/rc.local; chmod +x /etc/rc.local'"
+
+def install_lxc_base_machine_packages_offline(execute_and_log: Callable):
+    """
+    Installs the guest packages on the LXC base machine from the apt package cache, without network access
+    The cache is indexed into a local apt repository, from which apt resolves the guest packages and their dependencies
+    :param callable execute_and_log: Executes a command on the base machine
+    :raises RuntimeError: If the local apt repository can not be set up or the guest packages can not be installed
+    """
+    logger.info("Installing the guest packages from the apt package cache {}".format(settings.VNET_APT_CACHE_DIR))
+    index_path = settings.LXC_APT_OFFLINE_INDEX_GUEST_PATH
+    # Only use the local apt repository, the other apt sources can not be reached
+    apt_options = "-o Dir::Etc::SourceList={} -o Dir::Etc::SourceParts=- -o APT::Get::List-Cleanup=0".format(
+        settings.LXC_APT_OFFLINE_SOURCE_LIST
     )
-    # All done, stop the container
-    machine.stop(wait=True)
-    logger.debug("LXC base machine {} successfully configured".format(settings.LXC_BASE_IMAGE_MACHINE_NAME))
+    setup_commands = [
+        # The package paths in the index are relative to the root of the file: source
+        "bash -c 'mkdir -p {0} && cd / && apt-ftparchive packages {1} > {0}/Packages'".format(
+            index_path, settings.LXC_APT_CACHE_GUEST_PATH.lstrip("/")
+        ),
+        "bash -c 'echo \"deb [trusted=yes] file:/ {}/\" > {}'".format(index_path.lstrip("/"), settings.LXC_APT_OFFLINE_SOURCE_LIST),
+        "apt-get update {}".format(apt_options),
+    ]
+    for command in setup_commands:
+        if execute_and_log(command)[0] != 0:
+            raise RuntimeError("Unable to set up a local apt repository of the apt package cache, '{}' failed".format(command))
+    exit_code = execute_and_log(
+        "apt-get install -y --no-download {} -o Dpkg::Options::='--force-confdef' -o Dpkg::Options::='--force-confold' {}".format(
+            apt_options, " ".join(settings["PROVIDERS"]["lxc"]["guest_packages"])
+        ),
+        environment={"DEBIAN_FRONTEND": "noninteractive"},
+    )[0]
+    execute_and_log("rm -rf {} {}".format(settings.LXC_APT_OFFLINE_SOURCE_LIST, index_path))
+    if exit_code != 0:
+        raise RuntimeError("Unable to install the guest packages from the apt package cache, are all their dependencies in it?")
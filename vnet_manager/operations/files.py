@@ -1,8 +1,14 @@
+import tarfile
+from collections import OrderedDict
+from hashlib import sha256
+from io import BytesIO
+from json import dumps, loads
 from logging import getLogger
 from pylxd.exceptions import NotFound
 from os.path import isfile, isdir, join, basename
 from os import listdir
 from sys import modules
+from time import time
 from typing import AnyStr
 
 from vnet_manager.providers.lxc import get_lxd_client
@@ -12,20 +18,80 @@ from vnet_manager.utils.files import write_file_to_disk
 logger = getLogger(__name__)
 
 
-def put_files_on_machine(config: dict):
-    for name, data in config["machines"].items():
-        if "files" in data:
-            provider = settings.MACHINE_TYPE_PROVIDER_MAPPING[data["type"]]
-            logger.info("Putting requested files on machine {}".format(name))
-            select_files_and_put_on_machine(name, data["files"], provider)
+class FileBundle:
+    """
+    In-memory bundle of the files to place on a single machine
+    The bundle is delivered to the machine in one go by deliver_file_bundle()
+    """
+
+    def __init__(self, machine: str):
+        """
+        :param str machine: The name of the machine the files are meant for
+        """
+        self.machine = machine
+        self.files = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.files)
+
+    def add(self, guest_path: str, data: AnyStr):
+        """
+        Add file data to the bundle, overwrites any earlier data for the same guest path
+        :param str guest_path: The path to place the file at on the machine
+        :param data: The file contents
+        """
+        self.files[guest_path] = data.encode("utf-8") if isinstance(data, str) else data
+
+    def add_host_file(self, host_file_path: str, guest_file_path: str):
+        """
+        Add a local file to the bundle
+        :param str host_file_path: The file to copy to the guest
+        :param str guest_file_path: The path to copy the file to
+        """
+        logger.debug("Adding {} to the file bundle of machine {} at path {}".format(host_file_path, self.machine, guest_file_path))
+        with open(host_file_path, "rb") as fh:
+            self.add(guest_file_path, fh.read())
 
+    def hashes(self) -> dict:
+        """
+        :return: dict: The SHA-256 hash of the contents of each file in the bundle, by guest path
+        """
+        return {guest_path: sha256(data).hexdigest() for guest_path, data in self.files.items()}
 
-def select_files_and_put_on_machine(machine: str, files: dict, provider: str):
+    def changed_since(self, manifest: dict) -> "FileBundle":
+        """
+        Get the files that are not in a manifest of earlier placed files, or have different contents
+        :param dict manifest: The hashes of the files already on the machine, by guest path
+        :return: FileBundle: A bundle with only the new and changed files
+        """
+        changed = FileBundle(self.machine)
+        for guest_path, file_hash in self.hashes().items():
+            if manifest.get(guest_path) != file_hash:
+                changed.add(guest_path, self.files[guest_path])
+        return changed
+
+    def to_archive(self) -> bytes:
+        """
+        Pack the bundle in a tar archive, with the guest paths relative to /
+        :return: bytes: The tar archive
+        """
+        buffer = BytesIO()
+        mtime = int(time())
+        with tarfile.open(fileobj=buffer, mode="w") as tar:
+            for guest_path, data in self.files.items():
+                info = tarfile.TarInfo(name=guest_path.lstrip("/"))
+                info.size = len(data)
+                info.mode = 0o644
+                info.mtime = mtime
+                tar.addfile(info, BytesIO(data))
+        return buffer.getvalue()
+
+
+def add_files_to_bundle(bundle: FileBundle, files: dict):
     """
-    Checks if the requested files are files or a dict and calls the provider file place function for each file
-    :param str machine: The machine to put the files on
+    Checks if the requested files are files or a dict and adds each file to the bundle
+    :param FileBundle bundle: The bundle to add the files to
     :param dict files: The machines file dict from the config
-    :param str provider: The provider of the machine
     """
     # Get the files
     for host_path, guest_path in files.items():
@@ -33,16 +99,107 @@ def select_files_and_put_on_machine(machine: str, files: dict, provider: str):
             logger.debug("Getting files from file dir {}".format(host_path))
             files = [join(host_path, f) for f in listdir(host_path)]
             for file_path in files:
-                # Place the file on the machine
-                getattr(modules[__name__], "place_file_on_{}_machine".format(provider))(
-                    machine, file_path, join(guest_path, basename(file_path))
-                )
+                if isfile(file_path):
+                    bundle.add_host_file(file_path, join(guest_path, basename(file_path)))
         elif isfile(host_path):
-            getattr(modules[__name__], "place_file_on_{}_machine".format(provider))(machine, host_path, guest_path)
+            bundle.add_host_file(host_path, guest_path)
         else:
             logger.error("Tried to select file {} for copying, but it is neither a file nor a directory".format(host_path))
 
 
+def deliver_file_bundle(bundle: FileBundle, provider: str) -> bool:
+    """
+    Places all files of a bundle on its machine
+    :param FileBundle bundle: The bundle to deliver
+    :param str provider: The provider of the machine
+    :return: bool: True if the files have been placed, False otherwise
+    """
+    if not bundle:
+        return True
+    return getattr(modules[__name__], "deliver_file_bundle_to_{}_machine".format(provider))(bundle)
+
+
+def deliver_file_bundle_to_lxc_machine(bundle: FileBundle) -> bool:
+    """
+    Places all files of a bundle on a LXC container
+    Files that are unchanged since they were last placed, according to the manifest of the container, are skipped.
+    A stopped container gets all files, as its archive replaces any archive that is still waiting to be unpacked.
+    :param FileBundle bundle: The bundle to deliver
+    :return: bool: True if the files have been placed, False otherwise
+    """
+    try:
+        machine = get_lxd_client().containers.get(bundle.machine)
+    except NotFound:
+        logger.error("Tried to place {} files on LXC container {}, but the container does not exist".format(len(bundle), bundle.machine))
+        return False
+    manifest = get_lxc_file_manifest(machine)
+    changed = bundle.changed_since(manifest)
+    if not changed:
+        logger.debug("All {} files on LXC container {} are up to date".format(len(bundle), bundle.machine))
+        return True
+    running = machine.status.lower() == "running"
+    if not running:
+        changed = bundle
+    logger.debug("Placing {} of {} files on LXC container {}".format(len(changed), len(bundle), bundle.machine))
+    put_file_bundle_on_lxc_container(machine, changed, running=running)
+    # Record what has been placed, so the next run can skip these files
+    manifest.update(changed.hashes())
+    machine.config = dict(machine.config, **{settings.LXC_FILE_MANIFEST_CONFIG_KEY: dumps(manifest, sort_keys=True)})
+    machine.save(wait=True)
+    return True
+
+
+def put_file_bundle_on_lxc_container(machine, bundle: FileBundle, running: bool = True):
+    """
+    Writes the files of a bundle to a LXC container as a single archive
+    A running container extracts the archive right away, a stopped container keeps it until unpack_lxc_file_bundle() runs on start
+    :param pylxd.models.Container machine: The container to write the files to
+    :param FileBundle bundle: The files to write
+    :param bool running: Whether the container is running
+    """
+    machine.files.put(settings.VNET_FILE_BUNDLE_GUEST_PATH, bundle.to_archive())
+    if not running:
+        return
+    command = "tar -xf {0} -C / && rm -f {0}".format(settings.VNET_FILE_BUNDLE_GUEST_PATH)
+    if machine.execute(["sh", "-c", command])[0] == 0:
+        return
+    logger.warning("Unable to extract the file bundle on LXC container {}, placing the files one by one".format(bundle.machine))
+    for guest_path, data in bundle.files.items():
+        machine.files.put(guest_path, data)
+
+
+def unpack_lxc_file_bundle(machine) -> bool:
+    """
+    Unpacks the file bundle archive that was placed on a LXC container while it was stopped, if there is one
+    The container booted without the files, so VNET_FILE_BUNDLE_APPLY_COMMAND is run once the boot has finished
+    :param pylxd.models.Container machine: The running container
+    :return: bool: True if there was nothing to unpack or the files have been applied, False otherwise
+    """
+    command = (
+        "if [ -f {0} ]; then systemctl is-system-running --wait >/dev/null 2>&1; tar -xf {0} -C / && rm -f {0} && {{ {1}; }}; fi".format(
+            settings.VNET_FILE_BUNDLE_GUEST_PATH, settings.VNET_FILE_BUNDLE_APPLY_COMMAND
+        )
+    )
+    exit_code, _, stderr = machine.execute(["sh", "-c", command])
+    if exit_code != 0:
+        logger.error("Unable to unpack the file bundle on LXC container {}, got error: {}".format(machine.name, stderr))
+        return False
+    return True
+
+
+def get_lxc_file_manifest(machine) -> dict:
+    """
+    Gets the hashes of the files VNet placed on a LXC container earlier
+    :param pylxd.models.Container machine: The container to get the manifest of
+    :return: dict: The SHA-256 hashes of the placed files, by guest path
+    """
+    try:
+        return loads(machine.config.get(settings.LXC_FILE_MANIFEST_CONFIG_KEY, "{}"))
+    except ValueError:
+        logger.warning("Invalid file manifest found on LXC container {}, placing all files".format(machine.name))
+        return {}
+
+
 def write_file_to_lxc_container(container: str, file_path: str, data: AnyStr):
     """
     Writes file data to a path on the LXC container
@@ -57,26 +214,6 @@ def write_file_to_lxc_container(container: str, file_path: str, data: AnyStr):
         logger.error("Tried to write data to path {} on LXC container {}, but the container does not exist".format(file_path, container))
 
 
-def place_file_on_lxc_machine(container: str, host_file_path: str, guest_file_path: str):
-    """
-    Places a local file on a LXC container
-    :param str container: The container to place the file on
-    :param str host_file_path: The file to copy to the guest
-    :param str guest_file_path: The path to copy the file to
-    """
-    # Some sanity checks
-    if not isfile(host_file_path):
-        logger.error("Tried to copy {} to LXC container {}, but the file doesn't exists".format(host_file_path, container))
-        return
-
-    # Get the file contents
-    with open(host_file_path, "r") as fh:
-        file_data = fh.read()
-    # Place the file content
-    logger.debug("Copying {} to container {} at path {}".format(host_file_path, container, guest_file_path))
-    write_file_to_lxc_container(container, guest_file_path, file_data)
-
-
 def generate_vnet_hosts_file(config: dict):
     """
     Generates the machines /etc/hosts file based on the info in the config
@@ -93,14 +230,3 @@ def generate_vnet_hosts_file(config: dict):
                 vnet_hosts.append("{}   {}".format(int_data["ipv6"].split("/")[0], machine_name))
     vnet_etc_hosts_data = settings.VNET_STATIC_HOSTS_FILE_PART + "\n".join(vnet_hosts)
     write_file_to_disk(settings.VNET_ETC_HOSTS_FILE_PATH, vnet_etc_hosts_data)
-
-
-def place_vnet_hosts_file_on_machines(config: dict):
-    """
-    Places the generated /etc/hosts file on all VNet machines defined in the config
-    :param dict config: The config generated by get_config()
-    """
-    logger.info("Placing VNet /etc/hosts file on machines")
-    for name, data in config["machines"].items():
-        provider = settings.MACHINE_TYPE_PROVIDER_MAPPING[data["type"]]
-        select_files_and_put_on_machine(name, {settings.VNET_ETC_HOSTS_FILE_PATH: "/etc/hosts"}, provider)
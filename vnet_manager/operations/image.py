@@ -1,6 +1,8 @@
+from contextlib import closing
 from logging import getLogger
 from pylxd.exceptions import NotFound
 
+from vnet_manager.conf import settings
 from vnet_manager.providers.lxc import get_lxd_client
 from vnet_manager.operations.machine import change_lxc_machine_status
 
@@ -29,6 +31,7 @@ def check_if_lxc_image_exists(image: str, by_alias: bool = True) -> bool:
 def create_lxc_image_from_container(container: str, alias: str = None, description: str = None):
     """
     Create a LXC image from a container
+    The image is compressed with the LXC_IMAGE_COMPRESSION algorithm, LXD uses gzip when it is not set
     :param str container: The container to create the image from
     :param str alias: Creates an alias for the image
     :param str description: A description for the image alias
@@ -36,11 +39,18 @@ def create_lxc_image_from_container(container: str, alias: str = None, descripti
     # Stop it first
     change_lxc_machine_status(container, status="stop")
 
-    # Create the image
+    # Create the image, pylxd does not support passing the compression algorithm so we post the request ourselves
     logger.info("Creating image from LXC container {}".format(container))
     client = get_lxd_client()
-    container = client.containers.get(container)
-    img = container.publish(wait=True)
+    data = {"public": False, "source": {"type": "container", "name": container}}
+    if settings.LXC_IMAGE_COMPRESSION:
+        data["compression_algorithm"] = settings.LXC_IMAGE_COMPRESSION
+    if alias:
+        # The properties end up in the metadata of the image, so the alias can be restored when the image is imported elsewhere
+        data["properties"] = {settings.LXC_IMAGE_ALIAS_PROPERTY: alias}
+    response = client.api.images.post(json=data)
+    operation = client.operations.wait_for_operation(response.json()["operation"])
+    img = client.images.get(operation.metadata["fingerprint"])
     logger.info("Image {} created successfully".format(img.fingerprint))
 
     # Create the alias if requested
@@ -49,6 +59,47 @@ def create_lxc_image_from_container(container: str, alias: str = None, descripti
         img.add_alias(alias, description)
 
 
+def export_lxc_image(alias: str, path: str):
+    """
+    Export a LXC image to a unified image tarball
+    :param str alias: The alias of the image to export
+    :param str path: The path to write the image tarball to
+    :raises NotFound: If the image does not exist
+    """
+    client = get_lxd_client()
+    image = client.images.get_by_alias(alias)
+    logger.info("Exporting LXC image {} ({}) to {}".format(alias, image.fingerprint, path))
+    # Stream the image straight to the file, pylxd's export buffers the whole image in a temporary file first
+    with closing(client.api.images[image.fingerprint].export.get(stream=True)) as response, open(path, "wb") as fh:
+        for chunk in response.iter_content(chunk_size=settings.LXC_IMAGE_TRANSFER_CHUNK_SIZE):
+            fh.write(chunk)
+
+
+def import_lxc_image(path: str, alias: str = None) -> str:
+    """
+    Import a LXC image from an image tarball created by export_lxc_image()
+    An existing image with the same alias is replaced
+    :param str path: The path of the image tarball
+    :param str alias: The alias to give the image if it was not published with one
+    :return: str: The alias of the imported image
+    :raises RuntimeError: If the image has no alias and none was passed
+    """
+    logger.info("Importing LXC image from {}".format(path))
+    client = get_lxd_client()
+    with open(path, "rb") as fh:
+        fingerprint = client.images.create(fh, wait=True).fingerprint
+    image = client.images.get(fingerprint)
+    alias = image.properties.get(settings.LXC_IMAGE_ALIAS_PROPERTY, alias)
+    if not alias:
+        raise RuntimeError("Image {} imported from {} has no alias, unable to use it".format(fingerprint, path))
+    if check_if_lxc_image_exists(alias, by_alias=True):
+        logger.warning("Replacing existing LXC image {}".format(alias))
+        destroy_lxc_image(alias, by_alias=True)
+    logger.info("Adding alias {} to imported image {}".format(alias, fingerprint))
+    image.add_alias(alias, "Imported from {}".format(path))
+    return alias
+
+
 def destroy_lxc_image(image: str, by_alias: bool = True):
     """
     Destroy a LXC image
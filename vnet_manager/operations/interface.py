@@ -1,14 +1,16 @@
-import shlex
-from pyroute2 import IPRoute, NDB
+import errno
+import re
+from pyroute2.netlink.exceptions import NetlinkError
 from logging import getLogger
-from subprocess import check_call, CalledProcessError, Popen, DEVNULL
-from os.path import join
-from psutil import process_iter
+from subprocess import check_output, run, CalledProcessError
 from tabulate import tabulate
-from typing import List
+from typing import Dict, List, Optional, Tuple
 
 from vnet_manager.conf import settings
+from vnet_manager.providers.netlink import get_iproute, get_ndb
+from vnet_manager.operations.sniffer import get_running_sniffers, start_tcpdump_on_vnet_interface, stop_sniffers
 from vnet_manager.utils.mac import random_mac_generator
+from vnet_manager.utils.trace import trace_span
 
 logger = getLogger(__name__)
 
@@ -37,6 +39,28 @@ def get_machines_by_vnet_interface_name(config: dict, ifname: str) -> List[str]:
     return machines
 
 
+def get_vnet_link_statuses() -> Tuple[Dict[str, dict], Dict[int, dict]]:
+    """
+    Gets the status of all links on the host with a single netlink link dump
+    :return: tuple: The link statuses indexed by name and the link statuses indexed by ifindex
+    """
+    by_name, by_index = {}, {}
+    for link in get_iproute().get_links():
+        status = {
+            "index": link["index"],
+            "ifname": link.get_attr("IFLA_IFNAME"),
+            "state": link["state"],
+            "address": link.get_attr("IFLA_ADDRESS"),
+            # For veth interfaces this is the ifindex of the peer
+            "link": link.get_attr("IFLA_LINK"),
+            "master": link.get_attr("IFLA_MASTER"),
+            "stp": link.get_nested("IFLA_LINKINFO", "IFLA_INFO_DATA", "IFLA_BR_STP_STATE"),
+        }
+        by_name[status["ifname"]] = status
+        by_index[status["index"]] = status
+    return by_name, by_index
+
+
 def show_vnet_interface_status(config: dict):
     """
     Shows the VNet interface status to the user
@@ -45,19 +69,17 @@ def show_vnet_interface_status(config: dict):
     logger.info("Listing VNet interface statuses")
     header = ["Name", "Status", "L2_addr", "Sniffer", "STP", "Used by"]
     statuses = []
-    ip = IPRoute()
-    ndb = NDB(log=False)
-    for ifname in get_vnet_interface_names_from_config(config):
+    links, _ = get_vnet_link_statuses()
+    ifnames = get_vnet_interface_names_from_config(config)
+    sniffers = get_running_sniffers([ifname for ifname in ifnames if ifname in links])
+    for ifname in ifnames:
         used_by = get_machines_by_vnet_interface_name(config, ifname)
-        dev = ip.link_lookup(ifname=ifname)
-        if not dev:
+        if ifname not in links:
             # Link does not exist
             statuses.append([ifname, "NA", "NA", "NA", "NA", ", ".join(used_by)])
         else:
-            # Get the link info
-            sniffer = check_if_sniffer_exists(ifname)
-            with ndb.interfaces[ifname] as info:
-                statuses.append([ifname, info["state"], info["address"], sniffer, bool(info["br_stp_state"]), ", ".join(used_by)])
+            info = links[ifname]
+            statuses.append([ifname, info["state"], info["address"], ifname in sniffers, bool(info["stp"]), ", ".join(used_by)])
     print(tabulate(statuses, headers=header, tablefmt="pretty"))
 
 
@@ -70,22 +92,16 @@ def show_vnet_veth_interface_status(config: dict):
     logger.info("Listing VNet veth interface statuses")
     header = ["Name", "Status", "L2_addr", "Peer", "Master"]
     statuses = []
-    ip = IPRoute()
+    links, links_by_index = get_vnet_link_statuses()
     for name, data in config["veths"].items():
-        dev = ip.link_lookup(ifname=name)
-        if not dev:
+        if name not in links:
             # Link does not exist
             statuses.append([name, "NA", "NA", "NA", data["bridge"]])
         else:
-            # Get the link info
-            info = ip.link("get", index=dev[0])
-            state = info[0]["state"]
-            l2_addr = [attr[1] for attr in info[0]["attrs"] if attr[0] == "IFLA_ADDRESS"][0]
-            peer_id = [attr[1] for attr in info[0]["attrs"] if attr[0] == "IFLA_LINK"][0]
-            peer_name = [attr[1] for attr in ip.link("get", index=peer_id)[0]["attrs"] if attr[0] == "IFLA_IFNAME"][0]
-            master_id = [attr[1] for attr in info[0]["attrs"] if attr[0] == "IFLA_MASTER"][0]
-            master_name = [attr[1] for attr in ip.link("get", index=master_id)[0]["attrs"] if attr[0] == "IFLA_IFNAME"][0]
-            statuses.append([name, state, l2_addr, peer_name, master_name])
+            info = links[name]
+            peer_name = links_by_index.get(info["link"], {}).get("ifname", "NA")
+            master_name = links_by_index.get(info["master"], {}).get("ifname", "NA")
+            statuses.append([name, info["state"], info["address"], peer_name, master_name])
     print(tabulate(statuses, headers=header, tablefmt="pretty"))
 
 
@@ -95,7 +111,7 @@ def check_if_interface_exists(ifname: str) -> bool:
     :param str ifname: The interface name to check for
     :return: bool: True if the interface exists, False otherwise
     """
-    return bool(IPRoute().link_lookup(ifname=ifname))
+    return bool(get_iproute().link_lookup(ifname=ifname))
 
 
 def create_vnet_interface(ifname: str):
@@ -104,7 +120,7 @@ def create_vnet_interface(ifname: str):
     :param str ifname: The name of the interface to create
     """
     logger.info("Creating VNet bridge interface {}".format(ifname))
-    IPRoute().link("add", ifname=ifname, kind="bridge")
+    get_iproute().link("add", ifname=ifname, kind="bridge")
     # Bring up the interface
     configure_vnet_interface(ifname)
 
@@ -117,26 +133,89 @@ def create_veth_interface(name: str, data: dict):
     """
     # We only create the interface if it has a peer
     if "peer" in data:
-        IPRoute().link("add", ifname=name, kind="veth", peer=data["peer"])
+        get_iproute().link("add", ifname=name, kind="veth", peer=data["peer"])
 
 
-def create_vnet_interface_iptables_rules(ifname: str):
+def get_vnet_iptables_rules() -> Dict[str, Optional[List[str]]]:
+    """
+    Reads the filter table with a single iptables-save and picks out the rules that VNet manages
+    :return: dict: The 'jumps' from the OUTPUT chain to the VNet chain, the 'legacy' per interface DROP rules in the OUTPUT chain
+                   of older VNet versions and the rules of the VNet 'chain', which is None if the chain does not exist
+    :raises CalledProcessError: If iptables-save fails
+    """
+    chain = settings.VNET_IPTABLES_CHAIN
+    legacy = re.compile(r"^-A OUTPUT -o {}\S* -j DROP$".format(re.escape(settings.VNET_BRIDGE_NAME)))
+    rules = {"jumps": [], "legacy": [], "chain": None}
+    for line in check_output(["iptables-save", "-t", "filter"], universal_newlines=True).splitlines():
+        if line.startswith(":{} ".format(chain)):
+            rules["chain"] = []
+        elif line == "-A OUTPUT -j {}".format(chain):
+            rules["jumps"].append(line)
+        elif legacy.match(line):
+            rules["legacy"].append(line)
+        elif line.startswith("-A {} ".format(chain)) and rules["chain"] is not None:
+            rules["chain"].append(line)
+    return rules
+
+
+def restore_iptables_rules(rules: List[str]):
+    """
+    Applies rules to the filter table in a single atomic iptables-restore, without flushing the other chains
+    Note that iptables-restore flushes the user defined chains that are declared in the rules
+    :param list rules: The rules in the iptables-save format
+    :raises CalledProcessError: If iptables-restore fails
+    """
+    data = "\n".join(["*filter"] + rules + ["COMMIT", ""])
+    run(["iptables-restore", "--noflush"], input=data, universal_newlines=True, check=True)
+
+
+def ensure_vnet_iptables_rules():
     """
     VNet interfaces should act as dump bridges and should not have any connectivity to the outside world
-    So this function makes some IPtables rules to make sure the VNet interface cannot talk to the outside.
-    :param str ifname: The interface the create IPtables rules for
+    So this function (re)creates the VNet iptables chain, which drops all traffic from the host to the VNet interfaces.
+    A single wildcard rule matches all VNet interfaces, so the chain does not grow with the amount of VNet interfaces.
+    The rules are read with a single iptables-save, iptables-restore only runs when they have to change.
+    The per interface DROP rules of older VNet versions are removed in the same restore.
     """
-    rule = "OUTPUT -o {} -j DROP".format(ifname)
-    # First we check if the rule already exists
+    chain = settings.VNET_IPTABLES_CHAIN
+    drop = "-A {} -o {}+ -j DROP".format(chain, settings.VNET_BRIDGE_NAME)
     try:
-        check_call(shlex.split("iptables -C {}".format(rule)), stderr=DEVNULL)
-        logger.debug("IPtables DROP rule for VNet interface {} already exists, skipping creation".format(ifname))
-    except CalledProcessError:
-        logger.info("Creating IPtables DROP rule to the outside world for VNet interface {}".format(ifname))
-        try:
-            check_call(shlex.split("iptables -A {}".format(rule)))
-        except CalledProcessError as e:
-            logger.error("Unable to create IPtables rule, got output: {}".format(e.output))
+        current = get_vnet_iptables_rules()
+        rules = ["-D {}".format(rule[3:]) for rule in current["legacy"]]
+        if current["chain"] != [drop]:
+            # Declaring the chain creates it if it does not exist and flushes it if it does
+            rules += [":{} - [0:0]".format(chain), drop]
+        # Only one jump is kept, in case it was added twice
+        rules += ["-D OUTPUT -j {}".format(chain)] * (len(current["jumps"]) - 1)
+        if not current["jumps"]:
+            rules.append("-I OUTPUT -j {}".format(chain))
+        if not rules:
+            logger.debug("IPtables chain {} for the VNet interfaces is already in place".format(chain))
+            return
+        logger.info("Ensuring IPtables chain {} that drops traffic to the outside world for the VNet interfaces".format(chain))
+        restore_iptables_rules(rules)
+    except CalledProcessError as e:
+        logger.error("Unable to create the IPtables rules, got output: {}".format(e.output))
+
+
+def delete_vnet_iptables_rules():
+    """
+    Removes the VNet iptables chain, the jump to it from the OUTPUT chain and the per interface DROP rules of older VNet versions
+    The rules are read with a single iptables-save, iptables-restore only runs when there is something to delete
+    """
+    chain = settings.VNET_IPTABLES_CHAIN
+    try:
+        current = get_vnet_iptables_rules()
+        rules = ["-D {}".format(rule[3:]) for rule in current["legacy"] + current["jumps"]]
+        if current["chain"] is not None:
+            # The chain has to be flushed before it can be deleted, declaring it does that
+            rules += [":{} - [0:0]".format(chain), "-X {}".format(chain)]
+        if not rules:
+            return
+        logger.info("Deleting IPtables chain {}".format(chain))
+        restore_iptables_rules(rules)
+    except CalledProcessError as e:
+        logger.error("Unable to delete the IPtables rules, got output: {}".format(e.output))
 
 
 def configure_vnet_interface(ifname: str):
@@ -144,7 +223,7 @@ def configure_vnet_interface(ifname: str):
     Configures an vnet interface to be in the correct state for forwarding vnet machine traffic
     :param str ifname: The vnet interface to configure
     """
-    ip = IPRoute()
+    ip = get_iproute()
     dev = ip.link_lookup(ifname=ifname)[0]
     # Make sure it's set to down state
     ip.link("set", index=dev, state="down")
@@ -161,7 +240,7 @@ def configure_veth_interface(name: str, data: dict):
     :param dict data: The veth interface data (bridge name)
     """
     logger.info("Creating VNet veth interface {}".format(name))
-    ip = IPRoute()
+    ip = get_iproute()
     dev = ip.link_lookup(ifname=name)[0]
     bridge = ip.link_lookup(ifname=data["bridge"])[0]
     # Connect the veth interface to the bridge
@@ -174,17 +253,20 @@ def bring_up_vnet_interfaces(config: dict, sniffer: bool = False):
     :param dict config: The config generated by get_config()
     :param bool sniffer: Check for a sniffer process and create it if it does not exist
     """
-    ip = IPRoute()
-    for ifname in get_vnet_interface_names_from_config(config):
-        if not check_if_interface_exists(ifname):
-            create_vnet_interface(ifname)
-        # Block traffic to the outside world
-        create_vnet_interface_iptables_rules(ifname)
-        # Make sure the interface is up
-        ip.link("set", ifname=ifname, state="up")
-        if sniffer and not check_if_sniffer_exists(ifname):
-            # Create it
-            start_tcpdump_on_vnet_interface(ifname)
+    ip = get_iproute()
+    # Block traffic to the outside world
+    ensure_vnet_iptables_rules()
+    ifnames = get_vnet_interface_names_from_config(config)
+    sniffers = get_running_sniffers(ifnames) if sniffer else {}
+    for ifname in ifnames:
+        with trace_span("bring up interface", category="interface", interface=ifname):
+            if not check_if_interface_exists(ifname):
+                create_vnet_interface(ifname)
+            # Make sure the interface is up
+            ip.link("set", ifname=ifname, state="up")
+            if sniffer and ifname not in sniffers:
+                # Create it
+                start_tcpdump_on_vnet_interface(ifname)
     if "veths" in config:
         ensure_vnet_veth_interfaces(config)
 
@@ -197,41 +279,36 @@ def ensure_vnet_veth_interfaces(config: dict):
     """
     logger.info("VNet veth config found, ensuring interfaces")
     for name, data in config["veths"].items():
-        # Set STP on the master if required
-        if "stp" in data:
-            logger.info("{} STP on VNet interface {}".format("Enabling" if data["stp"] else "Disabling", data["bridge"]))
-            state = 1 if data["stp"] else 0
-            nbd = NDB(log=False)
-            with nbd.interfaces[data["bridge"]] as bridge:
-                bridge.set("br_stp_state", state)
-        if not check_if_interface_exists(name):
-            create_veth_interface(name, data)
-        # Always configure a VNet veth interface to make sure it is connected to its master bridge
-        configure_veth_interface(name, data)
-        configure_vnet_interface(name)
-
-
-def check_if_sniffer_exists(ifname: str) -> bool:
-    """
-    Check if there is already a sniffer running for a VNet interface
-    :param str ifname: The VNet interface name to check
-    :return bool: True if it exists, False otherwise
-    """
-    for process in process_iter():
-        process_line = process.cmdline()
-        if "tcpdump" in process_line and ifname in process_line:
-            logger.debug("A TCPdump sniffer for interface {} already exists".format(ifname))
-            return True
-    return False
+        with trace_span("ensure veth interface", category="interface", interface=name):
+            # Set STP on the master if required
+            if "stp" in data:
+                configure_vnet_interface_stp(data["bridge"], data["stp"])
+            if not check_if_interface_exists(name):
+                create_veth_interface(name, data)
+            # Always configure a VNet veth interface to make sure it is connected to its master bridge
+            configure_veth_interface(name, data)
+            configure_vnet_interface(name)
+
+
+def configure_vnet_interface_stp(ifname: str, stp: bool):
+    """
+    Enables or disables STP on a VNet bridge interface
+    :param str ifname: The name of the bridge interface
+    :param bool stp: Whether to enable STP
+    """
+    logger.info("{} STP on VNet interface {}".format("Enabling" if stp else "Disabling", ifname))
+    with get_ndb().interfaces[ifname] as bridge:
+        bridge.set("br_stp_state", 1 if stp else 0)
 
 
 def bring_down_vnet_interfaces(config: dict):
     """
     Brings down the VNet interfaces defined in the config
-    This will automatically kill any attached sniffer processes
+    The sniffers on the VNet interfaces are stopped first, so their last PCAP files are complete
     :param dict config: The config generated by get_config()
     """
-    ip = IPRoute()
+    ip = get_iproute()
+    stop_sniffers(get_vnet_interface_names_from_config(config))
     if "veths" in config:
         for name in config["veths"].keys():
             if check_if_interface_exists(name):
@@ -250,30 +327,28 @@ def bring_down_vnet_interfaces(config: dict):
 def delete_vnet_interfaces(config: dict):
     """
     Delete the VNet interfaces defined in the config
+    The existing interfaces are looked up with a single link dump, all deletions are done over the same netlink socket
     :param config:
     """
-    ip = IPRoute()
-    if "veths" in config:
-        for name, data in config["veths"].items():
-            # Veth interfaces are deleted in pairs, so we only delete the ones with a peer
-            if "peer" in data and check_if_interface_exists(name):
-                logger.info("Deleting VNet veth interface {}".format(name))
-                ip.link("del", ifname=name)
-    for ifname in get_vnet_interface_names_from_config(config):
-        # Delete the interface
-        if check_if_interface_exists(ifname):
-            logger.info("Deleting VNet interface {}".format(ifname))
-            ip.link("del", ifname=ifname)
-        else:
+    ip = get_iproute()
+    # Sniffers are normally stopped by the stop action already, but the VNet interfaces might never have been brought down
+    stop_sniffers(get_vnet_interface_names_from_config(config))
+    existing = {link.get_attr("IFLA_IFNAME"): link["index"] for link in ip.get_links()}
+    # Veth interfaces are deleted in pairs, so we only delete the ones with a peer
+    veths = [name for name, data in config.get("veths", {}).items() if "peer" in data]
+    to_delete = veths + get_vnet_interface_names_from_config(config)
+    for ifname in to_delete:
+        if ifname not in existing:
             # Device doesn't exist
             logger.info("Tried to delete VNet interface {}, but it is already gone. That's okay".format(ifname))
-
-
-def start_tcpdump_on_vnet_interface(ifname: str):
-    """
-    Starts a tcpdump process on a vnet interface
-    :param str ifname: The interface to start the tcpdump on
-    """
-    path = join(settings.VNET_SNIFFER_PCAP_DIR, "{}.pcap".format(ifname))
-    logger.info("Starting sniffer on VNet interface {}, PCAP location: {}".format(ifname, path))
-    Popen(shlex.split("tcpdump -i {} -U -w {}".format(ifname, path)))
+            continue
+        logger.info("Deleting VNet interface {}".format(ifname))
+        try:
+            ip.link("del", index=existing[ifname])
+        except NetlinkError as e:
+            # Removed by someone else in the meantime
+            if e.code != errno.ENODEV:
+                raise
+    # VNet interfaces of other labs might still need the iptables rules, so only delete them when no VNet interfaces remain
+    if not [ifname for ifname in existing if ifname.startswith(settings.VNET_BRIDGE_NAME) and ifname not in to_delete]:
+        delete_vnet_iptables_rules()
@@ -1,32 +1,93 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from fcntl import flock, LOCK_EX, LOCK_NB, LOCK_UN
+from hashlib import sha256
+from json import dumps, loads
+from os import makedirs
+from os.path import dirname
 from pylxd.exceptions import NotFound, LXDAPIException
-from sys import modules
+from subprocess import Popen, DEVNULL, STDOUT
+from sys import argv, executable, modules
 from logging import getLogger
 from tabulate import tabulate
 from time import sleep
-from yaml import safe_dump
-from typing import List
+from typing import Dict, List, Optional, Tuple
+from uuid import uuid4
+from yaml import dump
+
+try:
+    # Use the libyaml based emitter when PyYAML is built with it
+    from yaml import CSafeDumper as SafeDumper
+except ImportError:
+    from yaml import SafeDumper
 
 from vnet_manager.conf import settings
-from vnet_manager.operations.files import write_file_to_lxc_container
-from vnet_manager.providers.lxc import get_lxd_client
+from vnet_manager.log import setup_console_logging
+from vnet_manager.operations.files import (
+    write_file_to_lxc_container,
+    FileBundle,
+    add_files_to_bundle,
+    deliver_file_bundle,
+    put_file_bundle_on_lxc_container,
+    unpack_lxc_file_bundle,
+)
+from vnet_manager.operations.packages import ensure_apt_cache_dir
+from vnet_manager.providers.lxc import get_lxd_client, lxd_event_monitor
+from vnet_manager.providers.lxc_async import AsyncLXDClient, LXDAsyncAPIError, run_async
+from vnet_manager.utils.trace import trace_span
 from vnet_manager.utils.user import request_confirmation
 
 logger = getLogger(__name__)
+# Rendered netplan configs by hash of the machine network config
+_netplan_render_cache = {}
 
 
-def show_status(config: dict):
+def show_status(config: dict, provider_statuses: dict = None):
     """
     Print a table with the current machine statuses
     :param dict config: The config provided by vnet_manager.config.get_config()
+    :param dict provider_statuses: Machine statuses already collected per provider, see get_machine_statuses()
     """
     logger.info("Listing VNet machine statuses")
     header = ["Name", "Status", "Provider"]
+    print(tabulate(get_machine_statuses(config, provider_statuses=provider_statuses), headers=header, tablefmt="pretty"))
+
+
+def get_machine_statuses(config: dict, provider_statuses: dict = None) -> List[List[str]]:
+    """
+    Get the statuses of the machines in the config
+    The statuses of all machines of a provider are collected with a single query and joined against the config.
+    :param dict config: The config provided by vnet_manager.config.get_config()
+    :param dict provider_statuses: A {provider: {name: status}} cache, the statuses of missing providers are collected into it.
+        Pass the same dict for multiple configs to only query each provider once.
+    :return: list: [name, status, provider] per machine
+    """
+    provider_statuses = {} if provider_statuses is None else provider_statuses
     statuses = []
     for name, info in config["machines"].items():
         provider = settings.MACHINE_TYPE_PROVIDER_MAPPING[info["type"]]
-        # Call the relevant provider get_%s_machine_status function
-        statuses.append(getattr(modules[__name__], "get_{}_machine_status".format(provider))(name))
-    print(tabulate(statuses, headers=header, tablefmt="pretty"))
+        if provider not in provider_statuses:
+            # Call the relevant provider get_%s_machine_statuses function
+            provider_statuses[provider] = getattr(modules[__name__], "get_{}_machine_statuses".format(provider))()
+        statuses.append([name, provider_statuses[provider].get(name, "NA"), provider.upper()])
+    return statuses
+
+
+def get_lxc_machine_statuses() -> Dict[str, str]:
+    """
+    Gets the state of all LXC machines with a single recursive LXD query
+    :return: dict: {name: status}
+    """
+    return {name: instance["status"] for name, instance in get_lxc_instances().items()}
+
+
+def get_lxc_instances() -> Dict[str, dict]:
+    """
+    Gets the state, config and devices of all LXC machines with a single recursive LXD query
+    :return: dict: {name: LXD container metadata}
+    """
+    response = get_lxd_client().api.containers.get(params={"recursion": 1})
+    return {container["name"]: container for container in response.json()["metadata"]}
 
 
 def check_if_lxc_machine_exists(machine: str) -> bool:
@@ -38,48 +99,57 @@ def check_if_lxc_machine_exists(machine: str) -> bool:
     return get_lxd_client().containers.exists(machine)
 
 
-def get_lxc_machine_status(name: str) -> List[str]:
-    """
-    Gets the LXC machine state and returns a list
-    :param name: str: The name of the machine
-    :return: list: [name, state, provider]
-    """
-    # TODO: Let's not return a list here, simply the status
-    client = get_lxd_client()
-    try:
-        status = client.containers.get(name).status
-    except NotFound:
-        status = "NA"
-    return [name, status, "LXC"]
-
-
 # NOTE: Container should be `container: pylxd.models.container.Container`, but this breaks testing atm.
 def wait_for_lxc_machine_status(container, status: str):
     """
     Waits for a LXC machine to converge to the requested status
+    Wakes up on LXD lifecycle events for the container, polling with an exponential backoff is used as a fallback
     :param pylxd.client.Client.container() container: The container to wait for
     :param str status: The status to wait for
     :raise TimeoutError if wait time expires
     """
     logger.debug("Waiting for LXC container {} to get a {} status".format(container.name, status))
-    for i in range(1, settings.LXC_MAX_STATUS_WAIT_ATTEMPTS):
-        # Actually ask for the container.state().status, because container.status is a static value
-        if container.state().status.lower() == status.lower():
-            logger.debug("Container successfully converged to {} status".format(status))
-            return
-        # Container not in desired state yet, wait and try again
-        sleep_time = i * (settings.LXC_STATUS_WAIT_SLEEP * settings.LXC_STATUS_BACKOFF_MULTIPLIER)
-        logger.info("Container {} not yet in {} status, waiting for {} seconds".format(container.name, status, sleep_time))
-        sleep(sleep_time)
+    # Start watching before checking the state, so we can't miss the state change in between
+    event = lxd_event_monitor.watch(container.name)
+    try:
+        with trace_span("wait for status", category="lxd", machine=container.name, status=status):
+            sleep_time = settings.LXC_STATUS_WAIT_SLEEP * settings.LXC_STATUS_BACKOFF_MULTIPLIER
+            for _ in range(1, settings.LXC_MAX_STATUS_WAIT_ATTEMPTS):
+                # Actually ask for the container.state().status, because container.status is a static value
+                if container.state().status.lower() == status.lower():
+                    logger.debug("Container successfully converged to {} status".format(status))
+                    return
+                # Container not in desired state yet, wait for a lifecycle event or the next poll and try again
+                if event is not None and lxd_event_monitor.connected:
+                    logger.debug("Container {} not yet in {} status, waiting for a lifecycle event".format(container.name, status))
+                    event.wait(sleep_time)
+                    event.clear()
+                else:
+                    logger.info("Container {} not yet in {} status, waiting for {} seconds".format(container.name, status, sleep_time))
+                    sleep(sleep_time)
+                sleep_time = min(sleep_time * 2, settings.LXC_STATUS_WAIT_MAX_SLEEP)
+    finally:
+        lxd_event_monitor.unwatch(container.name, event)
     raise TimeoutError("Wait time for container {} to converge to {} status expired, giving up".format(container.name, status))
 
 
-def change_machine_status(config: dict, status: str = "stop", machines: List[str] = None):
+def change_machine_status(
+    config: dict,
+    status: str = "stop",
+    machines: List[str] = None,
+    parallel: int = settings.VNET_PARALLEL_WORKERS,
+    graceful: bool = False,
+    timeout: int = settings.LXC_STOP_TIMEOUT,
+):
     """
     Change the status of the passed machines to the requested state
+    The status changes are executed concurrently and a table with the result per machine is printed afterwards
     :param dict config: The config provided by get_config()
     :param str status: The status to change the machine to
     :param list machines: A list of machine names to stop/start, if None all will be changed
+    :param int parallel: The amount of machines to change the status of concurrently
+    :param bool graceful: Shut the machines down gracefully instead of force stopping them
+    :param int timeout: The amount of seconds to wait for a graceful stop before forcing it
     """
     # Check for valid status change
     if status not in settings.VALID_STATUSES:
@@ -88,70 +158,122 @@ def change_machine_status(config: dict, status: str = "stop", machines: List[str
     # Get all the machines from the config if not already provided
     machines = machines if machines else config["machines"].keys()
 
-    # For each machine get the provider and execute the relevant status change function
-    for machine in machines:
-        # First check if the machine exists
-        if machine not in config["machines"]:
-            logger.error("Tried to {} machine {}, but there is no config entry for it, skipping...".format(status, machine))
-            continue
-        # Get the provider
-        provider = settings.MACHINE_TYPE_PROVIDER_MAPPING[config["machines"][machine]["type"]]
-        # Call the provider change_status function
-        logger.info("{} machine {} with provider {}".format("Starting" if status == "start" else "Stopping", machine, provider))
-        getattr(modules[__name__], "change_{}_machine_status".format(provider))(machine, status=status)
+    results = {}
+    with ThreadPoolExecutor(max_workers=max(1, parallel)) as executor:
+        futures = {}
+        # For each machine get the provider and submit the relevant status change function
+        for machine in machines:
+            # First check if the machine exists
+            if machine not in config["machines"]:
+                logger.error("Tried to {} machine {}, but there is no config entry for it, skipping...".format(status, machine))
+                continue
+            # Get the provider
+            provider = settings.MACHINE_TYPE_PROVIDER_MAPPING[config["machines"][machine]["type"]]
+            # Call the provider change_status function
+            logger.info("{} machine {} with provider {}".format("Starting" if status == "start" else "Stopping", machine, provider))
+            func = getattr(modules[__name__], "change_{}_machine_status".format(provider))
+            futures[executor.submit(func, machine, status=status, graceful=graceful, timeout=timeout)] = machine
+        for future in as_completed(futures):
+            try:
+                results[futures[future]] = future.result()
+            except LXDAPIException as e:
+                logger.error("Unable to {} machine {}, got error: {}".format(status, futures[future], e))
+                results[futures[future]] = False
+
+    # Show the result per machine in the requested order
+    table = [[machine, status, "OK" if results[machine] else "FAILED"] for machine in machines if machine in results]
+    print(tabulate(table, headers=["Name", "Action", "Result"], tablefmt="pretty"))
 
 
-def change_lxc_machine_status(machine: str, status: str = "stop"):
+def change_lxc_machine_status(machine: str, status: str = "stop", graceful: bool = False, timeout: int = settings.LXC_STOP_TIMEOUT) -> bool:
     """
-    Start a LXC machine
+    Start or stop a LXC machine
     :param str machine: The name of the machine to change the status of
     :param str status: The status to change the LXC machine to
+    :param bool graceful: Shut the machine down gracefully instead of force stopping it
+    :param int timeout: The amount of seconds to wait for a graceful stop before forcing it
+    :return: bool: True if the machine converged to the requested status, False otherwise
     """
     client = get_lxd_client()
     try:
         machine = client.containers.get(machine)
     except NotFound:
         logger.error("Tried to change machine status of LXC container {}, but it doesn't exist!".format(machine))
-        return
+        return False
+    required_state = "Stopped" if status == "stop" else "Running"
+    if machine.status.lower() == required_state.lower():
+        logger.debug("LXC container {} is already {}".format(machine.name, required_state))
+        # The container might have been started outside of VNet, before the files placed on it were unpacked
+        return unpack_lxc_file_bundle(machine) if status == "start" else True
     # Change the status
-    if status == "stop":
-        machine.stop()
-    elif status == "start":
-        try:
-            # On start we wait, as we might catch invalid configs
-            machine.start(wait=True)
-        except LXDAPIException as e:
-            logger.error("Unable to start LXC container {}, got error: {}".format(machine.name, e))
-            return
-    # Take a short nap after issuing the start/stop command, so we might pass the first status check
-    sleep(1)
     try:
-        required_state = "Stopped" if status == "stop" else "Running"
+        with trace_span("{} container".format(status), category="lxd", machine=machine.name):
+            if status == "stop":
+                stop_lxc_container(machine, graceful=graceful, timeout=timeout)
+            elif status == "start":
+                # On start we wait, as we might catch invalid configs
+                machine.start(wait=True)
+    except LXDAPIException as e:
+        logger.error("Unable to {} LXC container {}, got error: {}".format(status, machine.name, e))
+        return False
+    try:
         wait_for_lxc_machine_status(machine, required_state)
-        logger.debug("LXC container {} is {}".format(machine.name, machine.state().status))
+        logger.debug("LXC container {} is {}".format(machine.name, required_state))
     except TimeoutError:
         logger.error("Unable to change LXC status container {}, got timeout after issuing {} command".format(machine.name, status))
+        return False
+    # The files placed on the container while it was stopped are unpacked now that it runs
+    return unpack_lxc_file_bundle(machine) if status == "start" else True
+
+
+# NOTE: Container should be `container: pylxd.models.container.Container`, but this breaks testing atm.
+def stop_lxc_container(container, graceful: bool = False, timeout: int = settings.LXC_STOP_TIMEOUT):
+    """
+    Stop a LXC container, forced unless a graceful stop is requested
+    A graceful stop that does not complete within the timeout is followed by a forced stop
+    :param pylxd.client.Client.container() container: The container to stop
+    :param bool graceful: Shut the container down gracefully before resorting to a forced stop
+    :param int timeout: The amount of seconds to wait for the graceful stop
+    :raises LXDAPIException: If the forced stop fails
+    """
+    if graceful:
+        try:
+            # LXD fails the operation when the container did not shut down within the timeout
+            container.stop(timeout=timeout, force=False, wait=True)
+            return
+        except LXDAPIException as e:
+            logger.warning("LXC container {} did not stop within {} seconds, forcing it. Error: {}".format(container.name, timeout, e))
+    container.stop(force=True)
 
 
-def create_machines(config: dict, machines: List[str] = None):
+def create_machines(config: dict, machines: List[str] = None, parallel: int = settings.VNET_PARALLEL_WORKERS, hosts: bool = True):
     """
     Meta function to call the other machine creation functions per provider
     :param dict config: The config generated by get_config()
     :param list machines: A list of machine to create, defaults to all machines in the config
+    :param int parallel: The amount of machines to create concurrently
+    :param bool hosts: Whether to place the VNet hosts file on the machines
     """
     # Get all the machines from the config if not already provided
     machines = machines if machines else config["machines"].keys()
-    create_lxc_machines_from_base_image(config, machines)
+    create_lxc_machines_from_base_image(config, machines, parallel=parallel, hosts=hosts)
 
 
-def create_lxc_machines_from_base_image(config: dict, containers: List[str]):
+def create_lxc_machines_from_base_image(
+    config: dict, containers: List[str], parallel: int = settings.VNET_PARALLEL_WORKERS, hosts: bool = True
+) -> List[str]:
     """
     Create LXC machines from the base image specified in the settings
+    The LXD create operations are submitted to a worker pool, each container is provisioned as soon as it is created.
+    Containers that already exist are provisioned again.
     :param dict config: The config generated by get_config()
     :param list containers: A list of machines to create
+    :param int parallel: The amount of containers to create concurrently
+    :param bool hosts: Whether to place the VNet hosts file on the containers
+    :return: list: The names of the containers that failed to be created or provisioned
     """
     containers_to_create = []
-    containers_already_created = False
+    containers_already_created = []
 
     # Get all the LXC machines to create
     for container in containers:
@@ -163,7 +285,7 @@ def create_lxc_machines_from_base_image(config: dict, containers: List[str]):
         # Quick check if the machine already exists
         elif check_if_lxc_machine_exists(container):
             logger.error("A LXC container with the name {} already exists, skipping".format(container))
-            containers_already_created = True
+            containers_already_created.append(container)
         # Check if LXC is the provider
         elif settings.MACHINE_TYPE_PROVIDER_MAPPING[config["machines"][container]["type"]].lower() == "lxc":
             logger.debug("Selecting LXC machine {} for creation".format(container))
@@ -171,36 +293,6 @@ def create_lxc_machines_from_base_image(config: dict, containers: List[str]):
         else:
             logger.debug("Machine {} is not provided by LXC, skipping LXC container creation".format(container))
 
-    # Create it
-    client = get_lxd_client()
-    for container in containers_to_create:
-        logger.debug("Generating LXC config for container {}".format(container))
-        # Interface config
-        # First add eth0 (default), which does nothing
-        device_config = {"eth0": {"type": "none"}}
-        # Then for each interface in the config add the configuration for that interface to the interfaces_config dict
-        for inet_name, inet_config in config["machines"][container]["interfaces"].items():
-            device_config[inet_name] = {
-                "name": inet_name,  # The name of the interface inside the instance
-                "host_name": "{}-{}".format(container, inet_name),  # The name of the interface inside the host
-                "parent": "{}{}".format(settings.VNET_BRIDGE_NAME, inet_config["bridge"]),  # The name of the host device
-                "type": "nic",
-                "nictype": "bridged",
-                "hwaddr": inet_config["mac"],
-            }
-        container_config = {
-            "name": container,
-            "source": {"alias": settings.LXC_BASE_IMAGE_ALIAS, "type": "image"},
-            "ephemeral": False,
-            "config": {"user.network-config": "disabled"},
-            "devices": device_config,
-            "profiles": [settings.LXC_VNET_PROFILE],
-        }
-        logger.info("Creating LXC container {}".format(container))
-        # TODO: Make this nicer by not waiting here but doing the configuration after we've created all containers
-        client.containers.create(container_config, wait=True)
-        place_lxc_interface_configuration_on_container(config, container)
-
     # Check with the user if it is okay to overwrite config files
     if containers_already_created:
         request_confirmation(
@@ -208,12 +300,207 @@ def create_lxc_machines_from_base_image(config: dict, containers: List[str]):
             "host and user config files on those containers",
         )
 
+    # Create them
+    client = get_lxd_client()
+    failed = {}
+    workers = max(1, parallel)
+    golden = None
+    warm_pool = containers_to_create and settings.LXC_WARM_POOL_SIZE > 0
+    if containers_to_create:
+        logger.info("Creating {} LXC containers using {} worker(s)".format(len(containers_to_create), workers))
+        if settings.LXC_CREATE_MODE == "clone":
+            golden = get_lxc_golden_container()
+    warm = assign_lxc_warm_pool_containers(containers_to_create) if warm_pool else {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(
+                create_lxc_machine_from_base_image, client, config, container, hosts=hosts, golden=golden, warm=warm.get(container)
+            ): container
+            for container in containers_to_create
+        }
+        futures.update(
+            {executor.submit(provision_machine, config, container, hosts=hosts): container for container in containers_already_created}
+        )
+        # Collect the results as they come in, one failing container should not abort the others
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:  # pylint: disable=broad-except
+                logger.error("Unable to create LXC container {}, got error: {}".format(futures[future], e))
+                failed[futures[future]] = str(e)
+    if warm_pool:
+        # All claims are done, so the refill never sees a container that is being claimed
+        start_lxc_warm_pool_refill(golden=golden, parallel=workers)
+    if failed:
+        logger.error("Failed to create the following LXC containers: {}".format(", ".join(sorted(failed))))
+    return sorted(failed)
+
+
+def generate_lxc_container_config(config: dict, container: str, golden: str = None, bundle: FileBundle = None) -> dict:
+    """
+    Generates the LXD container config for a VNet machine
+    :param dict config: The config generated by get_config()
+    :param str container: The name of the container to generate the LXD config for
+    :param str golden: The golden container to copy the container from, defaults to creating it from the base image
+    :param FileBundle bundle: The files that will be placed on the container, recorded in its file manifest
+    :return: dict: The LXD container config
+    """
+    logger.debug("Generating LXC config for container {}".format(container))
+    # Interface config
+    # First add eth0 (default), which does nothing
+    device_config = {"eth0": {"type": "none"}}
+    # Then for each interface in the config add the configuration for that interface to the interfaces_config dict
+    for inet_name, inet_config in config["machines"][container]["interfaces"].items():
+        device_config[inet_name] = {
+            "name": inet_name,  # The name of the interface inside the instance
+            "host_name": "{}-{}".format(container, inet_name),  # The name of the interface inside the host
+            "parent": "{}{}".format(settings.VNET_BRIDGE_NAME, inet_config["bridge"]),  # The name of the host device
+            "type": "nic",
+            "nictype": "bridged",
+            "hwaddr": inet_config["mac"],
+        }
+    lxd_config = {"user.network-config": "disabled"}
+    if "config_path" in config:
+        # Tag the container with the config it belongs to, so it can be found again when it is removed from the config
+        lxd_config["user.vnet.config"] = config["config_path"]
+    if bundle:
+        lxd_config[settings.LXC_FILE_MANIFEST_CONFIG_KEY] = dumps(bundle.hashes(), sort_keys=True)
+    if golden:
+        # Within a pool LXD copies the container with a storage level snapshot, the devices and config below replace those of the source
+        source = {"source": golden, "type": "copy", "container_only": True}
+        # LXD keeps the config keys of the source that are not set here, the copy must not be taken for a golden container
+        lxd_config[settings.LXC_GOLDEN_CONTAINER_CONFIG_KEY] = ""
+    else:
+        source = {"alias": get_lxc_base_image_alias(), "type": "image"}
+    return {
+        "name": container,
+        "source": source,
+        "ephemeral": False,
+        "config": lxd_config,
+        "devices": device_config,
+        "profiles": [settings.LXC_VNET_PROFILE],
+    }
+
+
+def create_lxc_machine_from_base_image(client, config: dict, container: str, hosts: bool = True, golden: str = None, warm: str = None):
+    """
+    Creates a single LXC machine from the base image and provisions it
+    The file manifest is part of the container config and the files are placed in a single archive, which is unpacked on start
+    :param pylxd.client.Client client: The LXD client to use
+    :param dict config: The config generated by get_config()
+    :param str container: The name of the container to create
+    :param bool hosts: Whether to place the VNet hosts file on the container
+    :param str golden: The golden container to clone the container from, defaults to creating it from the base image
+    :param str warm: The warm pool container to claim, the container is created when the claim fails
+    """
+    with trace_span("generate files", machine=container):
+        bundle = generate_machine_file_bundle(config, container, hosts=hosts)
+    container_config = generate_lxc_container_config(config, container, golden=golden, bundle=bundle)
+    machine = claim_lxc_warm_pool_container(client, warm, container_config) if warm else None
+    if machine is None:
+        with trace_span("create container", category="lxd", machine=container):
+            logger.info("Creating LXC container {}".format(container))
+            machine = client.containers.create(container_config, wait=True)
+    if bundle:
+        logger.info("Placing {} configuration files on machine {}".format(len(bundle), container))
+        with trace_span("push files", category="lxd", machine=container, files=len(bundle)):
+            put_file_bundle_on_lxc_container(machine, bundle, running=False)
+
+
+def claim_lxc_warm_pool_container(client, warm: str, container_config: dict):
+    """
+    Turns a warm pool container into a VNet machine by applying the config and devices of the machine and renaming it
+    The container is put back in the warm pool when the claim fails
+    :param pylxd.client.Client client: The LXD client to use
+    :param str warm: The name of the warm pool container
+    :param dict container_config: The LXD container config of the machine, as generated by generate_lxc_container_config()
+    :return: pylxd.models.Container: The claimed container, None if the machine has to be created instead
+    """
+    logger.info("Claiming LXC warm pool container {} for {}".format(warm, container_config["name"]))
+    with trace_span("claim container", category="lxd", machine=container_config["name"]):
+        try:
+            container = client.containers.get(warm)
+        except LXDAPIException as e:
+            logger.warning("Unable to claim LXC warm pool container {}, got error: {}".format(warm, e))
+            return None
+        pool_config, pool_devices = container.config, container.devices
+        # Keep the config LXD set on the container, like the volatile keys, and only add the config of the machine
+        machine_config = dict(pool_config, **container_config["config"])
+        # The warm pool config key is dropped before the rename, so a renamed container is never part of the pool
+        machine_config.pop(settings.LXC_WARM_POOL_CONFIG_KEY, None)
+        try:
+            container.config = machine_config
+            container.devices = dict(pool_devices, **container_config["devices"])
+            container.save(wait=True)
+            container.rename(container_config["name"], wait=True)
+        except LXDAPIException as e:
+            logger.warning("Unable to claim LXC warm pool container {}, got error: {}".format(warm, e))
+            rollback_lxc_warm_pool_claim(container, pool_config, pool_devices)
+            return None
+    return container
+
+
+def rollback_lxc_warm_pool_claim(container, pool_config: dict, pool_devices: dict):
+    """
+    Puts a container of which the claim failed back in the warm pool, the container is deleted if that fails as well
+    :param pylxd.models.Container container: The warm pool container
+    :param dict pool_config: The config of the container before the claim
+    :param dict pool_devices: The devices of the container before the claim
+    """
+    container.config = pool_config
+    container.devices = pool_devices
+    try:
+        container.save(wait=True)
+    except LXDAPIException as e:
+        logger.warning("Unable to put LXC container {} back in the warm pool, deleting it: {}".format(container.name, e))
+        destroy_lxc_machine(container.name, wait=True)
+
+
+def provision_machine(config: dict, machine: str, hosts: bool = True) -> bool:
+    """
+    Places all configuration files of a machine on it in a single transfer
+    :param dict config: The config generated by get_config()
+    :param str machine: The name of the machine to provision
+    :param bool hosts: Whether to place the VNet hosts file on the machine
+    :return: bool: True if the files have been placed, False otherwise
+    """
+    with trace_span("generate files", machine=machine):
+        bundle = generate_machine_file_bundle(config, machine, hosts=hosts)
+    logger.info("Placing {} configuration files on machine {}".format(len(bundle), machine))
+    with trace_span("push files", category="lxd", machine=machine, files=len(bundle)):
+        return deliver_file_bundle(bundle, settings.MACHINE_TYPE_PROVIDER_MAPPING[config["machines"][machine]["type"]].lower())
+
 
-def destroy_machines(config: dict, machines: List[str] = None):
+def generate_machine_file_bundle(config: dict, machine: str, hosts: bool = True) -> FileBundle:
+    """
+    Collects the network config, user files, hosts file and type specific config of a machine in a file bundle
+    :param dict config: The config generated by get_config()
+    :param str machine: The name of the machine to generate the bundle for
+    :param bool hosts: Whether to add the VNet hosts file to the bundle
+    :return: FileBundle: The file bundle of the machine
+    """
+    bundle = FileBundle(machine)
+    machine_data = config["machines"][machine]
+    logger.debug("Generating network config for machine {}".format(machine))
+    bundle.add(settings.VNET_NETPLAN_CONFIG_FILE_PATH, render_machine_netplan_config(config, machine))
+    if "files" in machine_data:
+        add_files_to_bundle(bundle, machine_data["files"])
+    if hosts:
+        add_files_to_bundle(bundle, {settings.VNET_ETC_HOSTS_FILE_PATH: "/etc/hosts"})
+    for func in settings.MACHINE_TYPE_CONFIG_FUNCTION_MAPPING[machine_data["type"]]:
+        with trace_span("type specific config", machine=machine, function=func):
+            getattr(modules[__name__], func)(machine, bundle=bundle)
+    return bundle
+
+
+def destroy_machines(config: dict, machines: List[str] = None, parallel: int = settings.VNET_PARALLEL_WORKERS) -> List[str]:
     """
     Destroy's the passed machines
+    With more than one worker the LXC machines are force stopped and deleted concurrently.
     :param dict config: The config generated by get config
     :param list machines: The machines to destroy, defaults to all machines in the config
+    :param int parallel: The amount of machines to destroy concurrently
+    :return: list: The names of the machines that failed to be destroyed
     """
     # Get all the machines from the config if not already provided
     machines = machines if machines else config["machines"].keys()
@@ -224,6 +511,8 @@ def destroy_machines(config: dict, machines: List[str] = None):
         prompt="This operation cannot be undone. Are you sure?! (yes/no) ",
     )
 
+    failed = {}
+    lxc_machines = []
     for machine in machines:
         # First check if the machine exists
         if machine not in config["machines"]:
@@ -231,8 +520,170 @@ def destroy_machines(config: dict, machines: List[str] = None):
             continue
         # Get the provider
         provider = settings.MACHINE_TYPE_PROVIDER_MAPPING[config["machines"][machine]["type"]]
+        if parallel > 1 and provider == "lxc":
+            lxc_machines.append(machine)
+            continue
         # Call the provider destroy function
-        getattr(modules[__name__], "destroy_{}_machine".format(provider))(machine)
+        try:
+            getattr(modules[__name__], "destroy_{}_machine".format(provider))(machine)
+        except LXDAPIException as e:
+            logger.error("Unable to destroy machine {}, got error: {}".format(machine, e))
+            failed[machine] = str(e)
+    if lxc_machines:
+        logger.info("Destroying {} LXC containers using {} concurrent request(s)".format(len(lxc_machines), parallel))
+        failed.update(run_async(destroy_lxc_machines_concurrently(lxc_machines, max_connections=parallel)))
+    if failed:
+        logger.error("Failed to destroy the following machines: {}".format(", ".join(sorted(failed))))
+    return sorted(failed)
+
+
+async def destroy_lxc_machines_concurrently(
+    machines: List[str], max_connections: int = settings.LXD_MAX_CONCURRENT_REQUESTS
+) -> Dict[str, str]:
+    """
+    Force stops and deletes LXC machines concurrently, all LXD operations are awaited together
+    :param list machines: The names of the machines to destroy
+    :param int max_connections: The maximum amount of concurrent requests to the LXD daemon
+    :return: dict: The error per machine that failed to be destroyed
+    """
+
+    async def destroy(machine: str):
+        if machine not in statuses:
+            logger.warning("Tried to delete LXC machine {}, but it does not exist. Maybe it was already deleted?".format(machine))
+            return
+        if statuses[machine].lower() == "running":
+            logger.info("Force stopping LXC container {}".format(machine))
+            await client.stop(machine, force=True)
+        logger.info("Deleting LXC container {}".format(machine))
+        await client.delete(machine)
+
+    async with AsyncLXDClient(max_connections=max_connections) as client:
+        statuses = await client.get_instance_statuses()
+        results = await asyncio.gather(*[destroy(machine) for machine in machines], return_exceptions=True)
+    return collect_lxc_machine_errors(machines, results, "destroy")
+
+
+def get_lxc_machines_from_config(config: dict, machines: List[str] = None) -> List[str]:
+    """
+    :param dict config: The config generated by get_config()
+    :param list machines: The machines to select, defaults to all machines in the config
+    :return: list: The names of the selected LXC machines that are in the config
+    """
+    selected = []
+    for machine in machines if machines else config["machines"].keys():
+        if machine not in config["machines"]:
+            logger.error("Tried to get the config for machine {}, but there is no config entry for this machine, skipping".format(machine))
+        elif settings.MACHINE_TYPE_PROVIDER_MAPPING[config["machines"][machine]["type"]] == "lxc":
+            selected.append(machine)
+    return selected
+
+
+def snapshot_machines(
+    config: dict,
+    snapshot: str = settings.LXC_DEFAULT_SNAPSHOT_NAME,
+    machines: List[str] = None,
+    parallel: int = settings.VNET_PARALLEL_WORKERS,
+) -> List[str]:
+    """
+    Takes a storage level snapshot of the passed machines, an existing snapshot with the same name is replaced
+    :param dict config: The config generated by get_config()
+    :param str snapshot: The name of the snapshot
+    :param list machines: The machines to snapshot, defaults to all machines in the config
+    :param int parallel: The amount of machines to snapshot concurrently
+    :return: list: The names of the machines that failed to be snapshotted
+    """
+    lxc_machines = get_lxc_machines_from_config(config, machines=machines)
+    logger.info("Taking snapshot {} of {} LXC containers using {} concurrent request(s)".format(snapshot, len(lxc_machines), parallel))
+    failed = run_async(snapshot_lxc_machines_concurrently(lxc_machines, snapshot, max_connections=parallel))
+    if failed:
+        logger.error("Failed to snapshot the following machines: {}".format(", ".join(sorted(failed))))
+    return sorted(failed)
+
+
+def reset_machines(
+    config: dict,
+    snapshot: str = settings.LXC_DEFAULT_SNAPSHOT_NAME,
+    machines: List[str] = None,
+    parallel: int = settings.VNET_PARALLEL_WORKERS,
+) -> List[str]:
+    """
+    Restores the passed machines from a snapshot taken by snapshot_machines()
+    :param dict config: The config generated by get_config()
+    :param str snapshot: The name of the snapshot
+    :param list machines: The machines to reset, defaults to all machines in the config
+    :param int parallel: The amount of machines to reset concurrently
+    :return: list: The names of the machines that failed to be reset
+    """
+    lxc_machines = get_lxc_machines_from_config(config, machines=machines)
+    logger.info("Restoring snapshot {} of {} LXC containers using {} concurrent request(s)".format(snapshot, len(lxc_machines), parallel))
+    failed = run_async(restore_lxc_machines_concurrently(lxc_machines, snapshot, max_connections=parallel))
+    if failed:
+        logger.error("Failed to reset the following machines: {}".format(", ".join(sorted(failed))))
+    return sorted(failed)
+
+
+async def snapshot_lxc_machines_concurrently(
+    machines: List[str], snapshot: str, max_connections: int = settings.LXD_MAX_CONCURRENT_REQUESTS
+) -> Dict[str, str]:
+    """
+    Takes a snapshot of LXC machines concurrently, an existing snapshot with the same name is deleted first
+    :param list machines: The names of the machines to snapshot
+    :param str snapshot: The name of the snapshot
+    :param int max_connections: The maximum amount of concurrent requests to the LXD daemon
+    :return: dict: The error per machine that failed to be snapshotted
+    """
+
+    async def take_snapshot(machine: str):
+        try:
+            await client.delete_snapshot(machine, snapshot)
+            logger.debug("Replacing snapshot {} of LXC container {}".format(snapshot, machine))
+        except LXDAsyncAPIError as e:
+            if e.status_code != 404:
+                raise
+        with trace_span("snapshot container", category="lxd", machine=machine):
+            await client.create_snapshot(machine, snapshot)
+
+    async with AsyncLXDClient(max_connections=max_connections) as client:
+        results = await asyncio.gather(*[take_snapshot(machine) for machine in machines], return_exceptions=True)
+    return collect_lxc_machine_errors(machines, results, "snapshot")
+
+
+async def restore_lxc_machines_concurrently(
+    machines: List[str], snapshot: str, max_connections: int = settings.LXD_MAX_CONCURRENT_REQUESTS
+) -> Dict[str, str]:
+    """
+    Restores LXC machines from a snapshot concurrently
+    :param list machines: The names of the machines to restore
+    :param str snapshot: The name of the snapshot
+    :param int max_connections: The maximum amount of concurrent requests to the LXD daemon
+    :return: dict: The error per machine that failed to be restored
+    """
+
+    async def restore(machine: str):
+        with trace_span("restore container", category="lxd", machine=machine):
+            await client.restore_snapshot(machine, snapshot)
+
+    async with AsyncLXDClient(max_connections=max_connections) as client:
+        results = await asyncio.gather(*[restore(machine) for machine in machines], return_exceptions=True)
+    return collect_lxc_machine_errors(machines, results, "restore")
+
+
+def collect_lxc_machine_errors(machines: List[str], results: list, operation: str) -> Dict[str, str]:
+    """
+    Collects the LXD API errors of concurrently operated machines, other exceptions are raised
+    :param list machines: The names of the machines
+    :param list results: The results of the operation per machine, as returned by asyncio.gather(return_exceptions=True)
+    :param str operation: The name of the operation, used for logging
+    :return: dict: The error per machine that failed
+    """
+    failed = {}
+    for machine, result in zip(machines, results):
+        if isinstance(result, (LXDAsyncAPIError, LXDAPIException)):
+            logger.error("Unable to {} LXC container {}, got error: {}".format(operation, machine, result))
+            failed[machine] = str(result)
+        elif isinstance(result, BaseException):
+            raise result
+    return failed
 
 
 def destroy_lxc_machine(machine: str, wait: bool = False):
@@ -291,62 +742,331 @@ def create_lxc_base_image_container():
             "alias": str(settings["PROVIDERS"]["lxc"]["base_image"]["os"]),
         },
     }
+    if settings.VNET_APT_CACHE_DIR:
+        # Reuse the packages of earlier builds and keep the packages downloaded by this build
+        logger.info("Using apt package cache {}".format(settings.VNET_APT_CACHE_DIR))
+        ensure_apt_cache_dir()
+        machine_config["devices"]["apt-cache"] = {
+            "type": "disk",
+            "source": settings.VNET_APT_CACHE_DIR,
+            "path": settings.LXC_APT_CACHE_GUEST_PATH,
+        }
     logger.info("Creating LXC base image container")
-    client.containers.create(machine_config, wait=True)
+    container = client.containers.create(machine_config, wait=True)
+    if settings.VNET_APT_CACHE_DIR:
+        # Root in the container has to be able to write to the cache
+        ensure_apt_cache_dir(*get_lxc_machine_root_ids(container))
 
 
-def enable_type_specific_machine_configuration(config: dict):
+def get_lxc_machine_root_ids(container) -> Tuple[Optional[int], Optional[int]]:
     """
-    Call type and provider specific machine configuration functions based on the settings
-    :param dict config: The config generated by get_config()
+    Gets the host uid and gid root in an unprivileged LXC container maps to
+    :param pylxd.models.Container container: The container to get the ids of
+    :return: tuple: The uid and gid, None if the container does not map them
+    """
+    uid = gid = None
+    try:
+        idmap = loads(container.config.get("volatile.idmap.next", "[]"))
+    except ValueError:
+        idmap = []
+    for entry in idmap:
+        if entry.get("Nsid") == 0:
+            if entry.get("Isuid"):
+                uid = entry["Hostid"]
+            if entry.get("Isgid"):
+                gid = entry["Hostid"]
+    return uid, gid
+
+
+def get_lxc_golden_container() -> Optional[str]:
+    """
+    Gets the golden container of the base image, creating it if it does not exist yet
+    The golden container is a stopped container created from the base image, which new machines are copied from.
+    Its name contains the fingerprint of the base image, so a rebuilt base image gets a new golden container.
+    :return: str: The name of the golden container, None if it could not be created
+    """
+    client = get_lxd_client()
+    try:
+        alias = get_lxc_base_image_alias()
+        fingerprint = get_lxc_base_image_fingerprint()
+        name = "{}{}".format(settings.LXC_GOLDEN_CONTAINER_PREFIX, fingerprint[:12])
+        if check_if_lxc_machine_exists(name):
+            return name
+        # Golden containers of previous builds of the base image are stale
+        destroy_lxc_golden_containers(alias=alias)
+        logger.info("Creating LXC golden container {} from base image {}".format(name, alias))
+        with trace_span("create golden container", category="lxd", machine=name):
+            client.containers.create(
+                {
+                    "name": name,
+                    "source": {"alias": alias, "type": "image"},
+                    "ephemeral": False,
+                    "config": {"user.network-config": "disabled", settings.LXC_GOLDEN_CONTAINER_CONFIG_KEY: alias},
+                    "devices": {"eth0": {"type": "none"}},
+                    "profiles": [settings.LXC_VNET_PROFILE],
+                },
+                wait=True,
+            )
+    except LXDAPIException as e:
+        logger.warning("Unable to create the LXC golden container, creating the machines from the base image instead: {}".format(e))
+        return None
+    return name
+
+
+def destroy_lxc_golden_containers(alias: str = None):
+    """
+    Deletes the LXC golden containers
+    :param str alias: Only delete the golden containers of this base image alias, defaults to all golden containers
+    """
+    for name, instance in get_lxc_instances().items():
+        golden_alias = instance.get("config", {}).get(settings.LXC_GOLDEN_CONTAINER_CONFIG_KEY)
+        if check_if_lxc_golden_container(name, instance) and (alias is None or golden_alias == alias):
+            destroy_lxc_machine(name, wait=True)
+
+
+def check_if_lxc_golden_container(name: str, instance: dict) -> bool:
+    """
+    Check if a LXC container is a golden container
+    Both the name and the config key are checked, as LXD copies the config key onto the containers cloned from a golden container
+    :param str name: The name of the container
+    :param dict instance: The LXD instance data of the container, as returned by get_lxc_instances()
+    :return: bool: True if the container is a golden container, False otherwise
+    """
+    return name.startswith(settings.LXC_GOLDEN_CONTAINER_PREFIX) and bool(
+        instance.get("config", {}).get(settings.LXC_GOLDEN_CONTAINER_CONFIG_KEY)
+    )
+
+
+def get_lxc_base_image_build_fingerprint() -> str:
     """
-    for machine_name, machine_data in config["machines"].items():
-        for func in settings.MACHINE_TYPE_CONFIG_FUNCTION_MAPPING[machine_data["type"]]:
-            getattr(modules[__name__], func)(machine_name)
+    Gets the fingerprint of the inputs the base image is built from, a change to any of them requires a new base image
+    :return: str: The build fingerprint
+    """
+    build_inputs = {
+        "base_image": settings["PROVIDERS"]["lxc"]["base_image"],
+        "guest_packages": sorted(settings["PROVIDERS"]["lxc"]["guest_packages"]),
+        "frr_release": settings.FRR_RELEASE,
+    }
+    return sha256(dumps(build_inputs, sort_keys=True).encode()).hexdigest()[:12]
+
+
+def get_lxc_base_image_alias() -> str:
+    """
+    Gets the alias of the base image
+    VNet base images are versioned by their build fingerprint, so base images built from different inputs can coexist.
+    Custom base images are used as is.
+    :return: str: The alias of the base image
+    """
+    if not settings.LXC_BASE_IMAGE_VERSIONED:
+        return settings.LXC_BASE_IMAGE_ALIAS
+    return "{}-{}".format(settings.LXC_BASE_IMAGE_ALIAS, get_lxc_base_image_build_fingerprint())
+
+
+def get_lxc_base_image_fingerprint() -> str:
+    """
+    :raises NotFound: If the base image does not exist
+    :return: str: The fingerprint of the base image
+    """
+    return get_lxd_client().images.get_by_alias(get_lxc_base_image_alias()).fingerprint
+
+
+def get_lxc_warm_pool_containers() -> List[str]:
+    """
+    Gets the warm pool containers that were created from the current base image
+    :return: list: The names of the warm pool containers
+    """
+    try:
+        fingerprint = get_lxc_base_image_fingerprint()
+    except LXDAPIException:
+        return []
+    return sorted(
+        name
+        for name, instance in get_lxc_instances().items()
+        if instance.get("config", {}).get(settings.LXC_WARM_POOL_CONFIG_KEY) == fingerprint
+    )
+
+
+def assign_lxc_warm_pool_containers(containers: List[str]) -> Dict[str, str]:
+    """
+    Hands out the warm pool containers up front, so the create workers never claim the same one
+    Nothing is handed out while the warm pool is refilled, as the refill might still be creating the containers
+    :param list containers: The names of the machines to create
+    :return: dict: The warm pool container per machine, machines without one are created instead
+    """
+    if check_if_lxc_warm_pool_refill_running():
+        logger.info("The LXC warm pool is being refilled, creating the containers instead of claiming them")
+        return {}
+    return dict(zip(containers, get_lxc_warm_pool_containers()))
+
+
+def check_if_lxc_warm_pool_refill_running() -> bool:
+    """
+    Checks if a warm pool refill is running, by trying to take its lock
+    :return: bool: True if a refill holds the lock, False otherwise
+    """
+    makedirs(dirname(settings.LXC_WARM_POOL_REFILL_LOCK), exist_ok=True)
+    with open(settings.LXC_WARM_POOL_REFILL_LOCK, "a") as lock:
+        try:
+            flock(lock, LOCK_EX | LOCK_NB)
+        except BlockingIOError:
+            return True
+        flock(lock, LOCK_UN)
+    return False
+
+
+def start_lxc_warm_pool_refill(golden: str = None, parallel: int = settings.VNET_PARALLEL_WORKERS):
+    """
+    Starts refilling the LXC warm pool in a detached process, so the command does not wait for the refill
+    The output of the refill process is appended to LXC_WARM_POOL_REFILL_LOG
+    :param str golden: The golden container to clone the warm pool containers from, defaults to creating them from the base image
+    :param int parallel: The amount of warm pool containers to create concurrently
+    """
+    logger.info("Refilling the LXC warm pool in the background, logging to {}".format(settings.LXC_WARM_POOL_REFILL_LOG))
+    makedirs(dirname(settings.LXC_WARM_POOL_REFILL_LOG), exist_ok=True)
+    with open(settings.LXC_WARM_POOL_REFILL_LOG, "a") as log:
+        # The refill gets its own session, so it outlives vnet-manager and is not hit by signals sent to the terminal
+        Popen(
+            [executable, "-m", "vnet_manager.operations.machine", str(parallel)] + ([golden] if golden else []),
+            stdin=DEVNULL,
+            stdout=log,
+            stderr=STDOUT,
+            start_new_session=True,
+        )
+
+
+def run_lxc_warm_pool_refill(golden: str = None, parallel: int = settings.VNET_PARALLEL_WORKERS):
+    """
+    Refills the LXC warm pool while holding the refill lock, the entrypoint of the refill process
+    A refill waits for a running refill to finish, so it sees the containers that refill created
+    :param str golden: The golden container to clone the warm pool containers from, defaults to creating them from the base image
+    :param int parallel: The amount of warm pool containers to create concurrently
+    """
+    makedirs(dirname(settings.LXC_WARM_POOL_REFILL_LOCK), exist_ok=True)
+    with open(settings.LXC_WARM_POOL_REFILL_LOCK, "a") as lock:
+        flock(lock, LOCK_EX)
+        refill_lxc_warm_pool(golden=golden, parallel=parallel)
+
+
+def refill_lxc_warm_pool(golden: str = None, size: int = settings.LXC_WARM_POOL_SIZE, parallel: int = settings.VNET_PARALLEL_WORKERS):
+    """
+    Creates stopped containers from the base image until the warm pool holds the requested amount of containers
+    Warm pool containers of a previous base image are deleted.
+    :param str golden: The golden container to clone the warm pool containers from, defaults to creating them from the base image
+    :param int size: The amount of containers the warm pool should hold
+    :param int parallel: The amount of warm pool containers to create concurrently
+    """
+    client = get_lxd_client()
+    try:
+        fingerprint = get_lxc_base_image_fingerprint()
+        pool = []
+        for name, instance in get_lxc_instances().items():
+            warm = instance.get("config", {}).get(settings.LXC_WARM_POOL_CONFIG_KEY)
+            if not warm:
+                continue
+            if warm == fingerprint:
+                pool.append(name)
+            else:
+                destroy_lxc_machine(name, wait=True)
+        source = (
+            {"source": golden, "type": "copy", "container_only": True} if golden else {"alias": get_lxc_base_image_alias(), "type": "image"}
+        )
+    except LXDAPIException as e:
+        logger.warning("Unable to refill the LXC warm pool, got error: {}".format(e))
+        return
+    missing = max(0, size - len(pool))
+    if missing:
+        logger.info("Refilling the LXC warm pool with {} container(s)".format(missing))
+    with ThreadPoolExecutor(max_workers=max(1, parallel)) as executor:
+        futures = [
+            executor.submit(
+                client.containers.create,
+                {
+                    "name": "{}{}".format(settings.LXC_WARM_POOL_CONTAINER_PREFIX, uuid4().hex[:12]),
+                    "source": source,
+                    "ephemeral": False,
+                    "config": {
+                        "user.network-config": "disabled",
+                        settings.LXC_WARM_POOL_CONFIG_KEY: fingerprint,
+                        # Do not inherit the golden container marker when copying the golden container
+                        settings.LXC_GOLDEN_CONTAINER_CONFIG_KEY: "",
+                    },
+                    "devices": {"eth0": {"type": "none"}},
+                    "profiles": [settings.LXC_VNET_PROFILE],
+                },
+                wait=True,
+            )
+            for _ in range(missing)
+        ]
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except LXDAPIException as e:
+                logger.warning("Unable to create a LXC warm pool container, got error: {}".format(e))
 
 
-def enable_lxc_ip_forwarding(container_name: str):
+def destroy_lxc_warm_pool():
+    """
+    Deletes all LXC warm pool containers
+    """
+    for name, instance in get_lxc_instances().items():
+        if instance.get("config", {}).get(settings.LXC_WARM_POOL_CONFIG_KEY):
+            destroy_lxc_machine(name, wait=True)
+
+
+def enable_lxc_ip_forwarding(container_name: str, bundle: FileBundle = None):
     """
     Enables LXC IP forwarding for a machine
     (Wrapper function for configure_lxc_ip_forwarding)
     :param container_name: str The name of the container
+    :param FileBundle bundle: Add the config files to this bundle instead of writing them to the container
     """
-    configure_lxc_ip_forwarding(container_name, enable=True)
+    configure_lxc_ip_forwarding(container_name, enable=True, bundle=bundle)
 
 
-def disable_lxc_ip_forwarding(container_name: str):
+def disable_lxc_ip_forwarding(container_name: str, bundle: FileBundle = None):
     """
     Disables LXC IP forwarding for a machine
     (Wrapper function for configure_lxc_ip_forwarding)
     :param container_name: str The name of the container
+    :param FileBundle bundle: Add the config files to this bundle instead of writing them to the container
     """
-    configure_lxc_ip_forwarding(container_name, enable=False)
+    configure_lxc_ip_forwarding(container_name, enable=False, bundle=bundle)
 
 
-def configure_lxc_ip_forwarding(container_name: str, enable: bool = True):
+def configure_lxc_ip_forwarding(container_name: str, enable: bool = True, bundle: FileBundle = None):
     """
     Configure a LXC machine to enable IP forwarding
     :param str container_name: The name of the container to enable IP forwarding on
     :param bool enable: Whether to enable IP forwarding or disable it
+    :param FileBundle bundle: Add the config files to this bundle instead of writing them to the container
     """
     value = 1 if enable else 0
+    sysctl_files = {
+        "/etc/sysctl.d/20-net.ipv4.ip_forward.conf": "net.ipv4.ip_forward={}\n".format(value),
+        "/etc/sysctl.d/20-net.ipv6.conf.all.forwarding.conf": "net.ipv6.conf.all.forwarding={}\n".format(value),
+    }
     logger.info("{} IP forwarding on LXC container {}".format("Enabling" if enable else "Disabling", container_name))
-    write_file_to_lxc_container(container_name, "/etc/sysctl.d/20-net.ipv4.ip_forward.conf", "net.ipv4.ip_forward={}\n".format(value))
-    write_file_to_lxc_container(
-        container_name, "/etc/sysctl.d/20-net.ipv6.conf.all.forwarding.conf", "net.ipv6.conf.all.forwarding={}\n".format(value)
-    )
+    for path, data in sysctl_files.items():
+        if bundle is not None:
+            bundle.add(path, data)
+        else:
+            write_file_to_lxc_container(container_name, path, data)
 
 
-def place_lxc_interface_configuration_on_container(config: dict, container: str):
+def render_machine_netplan_config(config: dict, machine: str) -> str:
     """
-    Places the interfaces configuration on the LXC container
+    Renders the Netplan config of a machine to YAML
+    The output is memoized on a hash of the interface, VLAN and bridge config of the machine, so unchanged machines are rendered once
     :param dict config: The config generated by get_config()
-    :param str container: The name of the container to place the interfaces configuration on
+    :param str machine: The machine name to render the netplan config for
+    :return: str: The netplan config YAML
     """
-    logger.debug("Generating network config for LXC container {}".format(container))
-    network_conf = generate_machine_netplan_config(config, container)
-    logger.info("Placing network config on LXC container {}".format(container))
-    write_file_to_lxc_container(container, settings.VNET_NETPLAN_CONFIG_FILE_PATH, safe_dump(network_conf))
+    machine_config = config["machines"][machine]
+    network_config = {key: machine_config[key] for key in ("interfaces", "vlans", "bridges") if key in machine_config}
+    key = sha256(dumps(network_config, sort_keys=True).encode("utf-8")).hexdigest()
+    if key not in _netplan_render_cache:
+        _netplan_render_cache[key] = dump(generate_machine_netplan_config(config, machine), Dumper=SafeDumper)
+    return _netplan_render_cache[key]
 
 
 def generate_machine_netplan_config(config: dict, machine: str) -> dict:
@@ -403,3 +1123,8 @@ def generate_machine_netplan_config(config: dict, machine: str) -> dict:
             }
             network_conf["network"]["bridges"][br_name].update(no_dhcp)
     return network_conf
+
+
+if __name__ == "__main__":
+    setup_console_logging()
+    run_lxc_warm_pool_refill(golden=argv[2] if len(argv) > 2 else None, parallel=int(argv[1]))
@@ -0,0 +1,163 @@
+from json import dumps, load
+from logging import getLogger
+from os import chmod, replace
+from os.path import basename, dirname, join, splitext
+from tempfile import NamedTemporaryFile
+from time import time
+from typing import List
+
+
+from vnet_manager.conf import settings
+from vnet_manager.operations.interface import get_vnet_interface_names_from_config, get_vnet_link_statuses
+from vnet_manager.operations.sniffer import get_running_sniffers
+from vnet_manager.operations.machine import get_machine_statuses
+
+logger = getLogger(__name__)
+
+
+def get_lab_name(config: dict) -> str:
+    """
+    :param dict config: The config generated by get_config()
+    :return: str: The name of the lab, which is the name of the config file without extension
+    """
+    return splitext(basename(config.get("config_path", "default")))[0]
+
+
+def write_file_atomically(path: str, data: str):
+    """
+    Writes a file by renaming a temporary file in the same directory, so readers never see a partial file
+    :param str path: The path of the file to write
+    :param str data: The contents of the file
+    """
+    with NamedTemporaryFile("w", dir=dirname(path), prefix=".", suffix=".tmp", delete=False) as fh:
+        fh.write(data)
+    # The node_exporter usually runs as another user
+    chmod(fh.name, 0o644)
+    replace(fh.name, path)
+
+
+def get_action_duration_state_path(lab: str) -> str:
+    """
+    :param str lab: The name of the lab
+    :return: str: The path of the file the action duration histograms of the lab are kept in
+    """
+    return join(settings.VNET_METRICS_DIR, ".vnet_manager_{}.json".format(lab))
+
+
+def get_lab_metrics_path(lab: str) -> str:
+    """
+    :param str lab: The name of the lab
+    :return: str: The path of the .prom file of the lab
+    """
+    return join(settings.VNET_METRICS_DIR, "vnet_manager_{}.prom".format(lab))
+
+
+def load_action_durations(lab: str) -> dict:
+    """
+    Loads the action duration histograms of a lab
+    The histograms are kept in a state file between runs, as every run of vnet-manager is a new process
+    :param str lab: The name of the lab
+    :return: dict: {action: {"buckets": [count per bucket], "sum": float, "count": int}}
+    """
+    try:
+        with open(get_action_duration_state_path(lab)) as fh:
+            durations = load(fh)
+    except (OSError, ValueError):
+        return {}
+    # Start over when the buckets have been changed
+    if durations.get("le") != settings.VNET_METRICS_DURATION_BUCKETS:
+        return {}
+    return durations.get("actions", {})
+
+
+def record_action_duration(config: dict, action: str, duration: float):
+    """
+    Adds the duration of an action to the action duration histogram of the lab
+    :param dict config: The config generated by get_config()
+    :param str action: The name of the action
+    :param float duration: The duration of the action in seconds
+    """
+    lab = get_lab_name(config)
+    durations = load_action_durations(lab)
+    histogram = durations.setdefault(action, {"buckets": [0] * len(settings.VNET_METRICS_DURATION_BUCKETS), "sum": 0.0, "count": 0})
+    for i, le in enumerate(settings.VNET_METRICS_DURATION_BUCKETS):
+        if duration <= le:
+            histogram["buckets"][i] += 1
+    histogram["sum"] += duration
+    histogram["count"] += 1
+    state = {"le": settings.VNET_METRICS_DURATION_BUCKETS, "actions": durations}
+    write_file_atomically(get_action_duration_state_path(lab), dumps(state))
+
+
+def format_labels(**labels) -> str:
+    """
+    :param labels: The label names and values
+    :return: str: The labels in the Prometheus text format, with the values escaped
+    """
+    escaped = ['{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for k, v in labels.items()]
+    return "{" + ",".join(escaped) + "}"
+
+
+def generate_lab_metrics(config: dict) -> List[str]:
+    """
+    Generates the Prometheus metrics of a lab in the text exposition format
+    :param dict config: The config generated by get_config()
+    :return: list: The metric lines
+    """
+    lab = get_lab_name(config)
+    lines = [
+        "# HELP vnet_machine_running Whether the VNet machine is running",
+        "# TYPE vnet_machine_running gauge",
+    ]
+    statuses = get_machine_statuses(config)
+    for name, status, provider in statuses:
+        lines.append(
+            "vnet_machine_running{} {}".format(format_labels(lab=lab, machine=name, provider=provider.lower()), int(status == "Running"))
+        )
+    lines += ["# HELP vnet_machine_exists Whether the VNet machine exists", "# TYPE vnet_machine_exists gauge"]
+    for name, status, provider in statuses:
+        lines.append(
+            "vnet_machine_exists{} {}".format(format_labels(lab=lab, machine=name, provider=provider.lower()), int(status != "NA"))
+        )
+
+    links, _ = get_vnet_link_statuses()
+    interfaces = [(ifname, "bridge") for ifname in get_vnet_interface_names_from_config(config)]
+    interfaces += [(name, "veth") for name in config.get("veths", {})]
+    lines += ["# HELP vnet_interface_up Whether the VNet interface exists and is up", "# TYPE vnet_interface_up gauge"]
+    for ifname, kind in interfaces:
+        up = ifname in links and links[ifname]["state"] == "up"
+        lines.append("vnet_interface_up{} {}".format(format_labels(lab=lab, interface=ifname, kind=kind), int(up)))
+    lines += ["# HELP vnet_sniffer_running Whether a sniffer is running on the VNet bridge", "# TYPE vnet_sniffer_running gauge"]
+    # No need to look for sniffers on interfaces that do not exist
+    sniffers = get_running_sniffers([ifname for ifname, kind in interfaces if kind == "bridge" and ifname in links])
+    for ifname, kind in interfaces:
+        if kind == "bridge":
+            running = ifname in sniffers
+            lines.append("vnet_sniffer_running{} {}".format(format_labels(lab=lab, interface=ifname), int(running)))
+
+    lines += ["# HELP vnet_action_duration_seconds The duration of the VNet actions", "# TYPE vnet_action_duration_seconds histogram"]
+    for action, histogram in sorted(load_action_durations(lab).items()):
+        for le, count in zip(settings.VNET_METRICS_DURATION_BUCKETS, histogram["buckets"]):
+            lines.append("vnet_action_duration_seconds_bucket{} {}".format(format_labels(lab=lab, action=action, le=le), count))
+        lines.append(
+            "vnet_action_duration_seconds_bucket{} {}".format(format_labels(lab=lab, action=action, le="+Inf"), histogram["count"])
+        )
+        lines.append("vnet_action_duration_seconds_sum{} {}".format(format_labels(lab=lab, action=action), histogram["sum"]))
+        lines.append("vnet_action_duration_seconds_count{} {}".format(format_labels(lab=lab, action=action), histogram["count"]))
+
+    lines += [
+        "# HELP vnet_metrics_updated_timestamp_seconds When the metrics of the lab were written",
+        "# TYPE vnet_metrics_updated_timestamp_seconds gauge",
+    ]
+    lines.append("vnet_metrics_updated_timestamp_seconds{} {}".format(format_labels(lab=lab), round(time(), 3)))
+    return lines
+
+
+def write_lab_metrics(config: dict):
+    """
+    Writes the Prometheus metrics of a lab to a .prom file for the node_exporter textfile collector
+    :param dict config: The config generated by get_config()
+    """
+    path = get_lab_metrics_path(get_lab_name(config))
+    logger.debug("Writing VNet metrics to {}".format(path))
+    write_file_atomically(path, "\n".join(generate_lab_metrics(config)) + "\n")
@@ -0,0 +1,66 @@
+import tarfile
+from logging import getLogger
+from os import chown, listdir, makedirs
+from os.path import basename, isdir, isfile, join
+from shutil import copyfile, copyfileobj
+from typing import List
+
+from vnet_manager.conf import settings
+
+logger = getLogger(__name__)
+
+
+def get_cached_apt_packages() -> List[str]:
+    """
+    :return: list: The names of the .deb packages in the apt package cache, empty if the cache is disabled
+    """
+    if not settings.VNET_APT_CACHE_DIR or not isdir(settings.VNET_APT_CACHE_DIR):
+        return []
+    return sorted(f for f in listdir(settings.VNET_APT_CACHE_DIR) if f.endswith(".deb"))
+
+
+def ensure_apt_cache_dir(uid: int = None, gid: int = None):
+    """
+    Creates the apt package cache directory on the host
+    Passing an uid and gid makes the cache and its packages owned by them,
+    so root in an unprivileged container (which maps to another uid on the host) can write to the cache
+    :param int uid: The uid to make the cache owned by
+    :param int gid: The gid to make the cache owned by
+    """
+    makedirs(join(settings.VNET_APT_CACHE_DIR, "partial"), exist_ok=True)
+    if uid is None or gid is None:
+        return
+    logger.debug("Changing the owner of apt package cache {} to {}:{}".format(settings.VNET_APT_CACHE_DIR, uid, gid))
+    for path in [settings.VNET_APT_CACHE_DIR, join(settings.VNET_APT_CACHE_DIR, "partial")]:
+        chown(path, uid, gid)
+    for package in get_cached_apt_packages():
+        chown(join(settings.VNET_APT_CACHE_DIR, package), uid, gid)
+
+
+def import_apt_packages(bundle: str) -> int:
+    """
+    Imports the .deb packages of a bundle into the apt package cache
+    :param str bundle: A directory or a (compressed) tar archive containing .deb packages
+    :return: int: The amount of imported packages
+    :raises RuntimeError: If the bundle is not a directory or a tar archive
+    """
+    ensure_apt_cache_dir()
+    imported = 0
+    if isdir(bundle):
+        for package in sorted(listdir(bundle)):
+            if package.endswith(".deb") and isfile(join(bundle, package)):
+                copyfile(join(bundle, package), join(settings.VNET_APT_CACHE_DIR, package))
+                imported += 1
+    elif isfile(bundle) and tarfile.is_tarfile(bundle):
+        with tarfile.open(bundle) as tar:
+            for member in tar.getmembers():
+                if not member.isfile() or not member.name.endswith(".deb"):
+                    continue
+                # Only use the file name, so members can't be placed outside of the cache
+                with tar.extractfile(member) as src, open(join(settings.VNET_APT_CACHE_DIR, basename(member.name)), "wb") as dst:
+                    copyfileobj(src, dst)
+                imported += 1
+    else:
+        raise RuntimeError("Package bundle {} is not a directory or a tar archive".format(bundle))
+    logger.info("Imported {} packages from {} into the apt package cache {}".format(imported, bundle, settings.VNET_APT_CACHE_DIR))
+    return imported
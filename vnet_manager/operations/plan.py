@@ -0,0 +1,249 @@
+from concurrent.futures import ThreadPoolExecutor
+from logging import getLogger
+from pylxd.exceptions import NotFound, LXDAPIException
+from tabulate import tabulate
+from typing import Callable, Dict, List
+
+from vnet_manager.conf import settings
+from vnet_manager.environment.lxc import ensure_vnet_lxc_environment
+from vnet_manager.operations.files import FileBundle, deliver_file_bundle, generate_vnet_hosts_file, get_lxc_file_manifest
+from vnet_manager.operations.interface import (
+    get_vnet_interface_names_from_config,
+    get_vnet_link_statuses,
+    create_vnet_interface,
+    ensure_vnet_iptables_rules,
+    create_veth_interface,
+    configure_veth_interface,
+    configure_vnet_interface,
+    configure_vnet_interface_stp,
+)
+from vnet_manager.operations.machine import (
+    get_lxc_instances,
+    generate_lxc_container_config,
+    generate_machine_file_bundle,
+    create_lxc_machines_from_base_image,
+    destroy_lxc_machine,
+    collect_lxc_machine_errors,
+)
+from vnet_manager.providers.lxc import get_lxd_client
+
+logger = getLogger(__name__)
+
+
+def generate_plan(config: dict, machines: List[str] = None, hosts: bool = True) -> List[dict]:
+    """
+    Compares the config with the live VNet environment and computes the minimal set of changes to bring it in line with the config
+    Each change is a dict with the 'resource', 'name', 'change' and 'details' keys, plus the data needed to apply it
+    :param dict config: The config generated by get_config()
+    :param list machines: A list of machines to plan for, defaults to all machines in the config
+    :param bool hosts: Whether the VNet hosts file should be placed on the machines
+    :return: list: The changes, in the order they should be applied
+    """
+    if hosts:
+        # The hosts file is compared with the one on the machines, so it has to be up to date
+        generate_vnet_hosts_file(config)
+    changes = plan_vnet_interface_changes(config)
+    changes += plan_lxc_machine_changes(config, machines=machines, hosts=hosts)
+    return changes
+
+
+def plan_vnet_interface_changes(config: dict) -> List[dict]:
+    """
+    Computes the VNet bridge and veth interface changes, the live state of all links is fetched with a single link dump
+    Bridges are compared on their state and STP setting, veths on their state and master.
+    Interfaces that are no longer in the config are never deleted, as other VNet configs on the host might use them.
+    :param dict config: The config generated by get_config()
+    :return: list: The interface changes
+    """
+    changes = []
+    links, by_index = get_vnet_link_statuses()
+    for ifname in get_vnet_interface_names_from_config(config):
+        if ifname not in links:
+            changes.append({"resource": "bridge", "name": ifname, "change": "create", "details": "missing"})
+        elif links[ifname]["state"] != "up":
+            changes.append({"resource": "bridge", "name": ifname, "change": "modify", "details": "down"})
+    # The last veth that sets STP on a bridge wins, like when the veths are ensured
+    stp = {data["bridge"]: data["stp"] for data in config.get("veths", {}).values() if "stp" in data}
+    for ifname, enabled in stp.items():
+        if bool(links.get(ifname, {}).get("stp")) != enabled:
+            details = "stp {}".format("on" if enabled else "off")
+            changes.append({"resource": "bridge", "name": ifname, "change": "stp", "details": details, "stp": enabled})
+    for name, data in config.get("veths", {}).items():
+        if name not in links:
+            # Veths without a peer are created together with their peer
+            if "peer" in data:
+                changes.append(
+                    {"resource": "veth", "name": name, "change": "create", "details": "peer {}".format(data["peer"]), "data": data}
+                )
+            continue
+        master = by_index.get(links[name]["master"], {}).get("ifname")
+        if master != data["bridge"]:
+            changes.append(
+                {"resource": "veth", "name": name, "change": "modify", "details": "master {}".format(data["bridge"]), "data": data}
+            )
+        elif links[name]["state"] != "up":
+            changes.append({"resource": "veth", "name": name, "change": "modify", "details": "down", "data": data})
+    return changes
+
+
+def plan_lxc_machine_changes(config: dict, machines: List[str] = None, hosts: bool = True) -> List[dict]:
+    """
+    Computes the LXC machine changes, the live state of all containers is fetched with a single query
+    :param dict config: The config generated by get_config()
+    :param list machines: A list of machines to plan for, defaults to all machines in the config
+    :param bool hosts: Whether the VNet hosts file should be placed on the machines
+    :return: list: The machine changes
+    """
+    changes = []
+    instances = get_lxc_instances()
+    selected = machines if machines else config["machines"].keys()
+    for machine in selected:
+        if machine not in config["machines"]:
+            logger.error("Tried to plan changes for machine {}, but the machine was not found in the config, skipping".format(machine))
+            continue
+        if settings.MACHINE_TYPE_PROVIDER_MAPPING[config["machines"][machine]["type"]].lower() != "lxc":
+            continue
+        if machine not in instances:
+            changes.append({"resource": "machine", "name": machine, "change": "create", "details": "missing"})
+            continue
+        devices = generate_lxc_container_config(config, machine)["devices"]
+        live_devices = instances[machine].get("devices", {})
+        changed_devices = sorted(name for name in set(devices) | set(live_devices) if devices.get(name) != live_devices.get(name))
+        if changed_devices:
+            details = "devices {}".format(", ".join(changed_devices))
+            changes.append({"resource": "machine", "name": machine, "change": "modify", "details": details, "devices": devices})
+        bundle = get_changed_lxc_machine_files(generate_machine_file_bundle(config, machine, hosts=hosts))
+        if bundle:
+            details = "files {}".format(", ".join(bundle.files))
+            changes.append({"resource": "machine", "name": machine, "change": "provision", "details": details, "bundle": bundle})
+    # Containers created from this config that are no longer in it are removed, only when planning for the whole config
+    if not machines and "config_path" in config:
+        for name, instance in sorted(instances.items()):
+            if instance.get("config", {}).get("user.vnet.config") == config["config_path"] and name not in config["machines"]:
+                changes.append({"resource": "machine", "name": name, "change": "delete", "details": "not in config"})
+    return changes
+
+
+def get_changed_lxc_machine_files(bundle: FileBundle) -> FileBundle:
+    """
+    Compares the files in a bundle with the files on the LXC container
+    Files that match the file manifest of the container are not read back from the container
+    :param FileBundle bundle: The desired files of the container
+    :return: FileBundle: A bundle with only the files that are missing or differ on the container
+    """
+    changed = FileBundle(bundle.machine)
+    container = get_lxd_client().containers.get(bundle.machine)
+    for guest_path, data in bundle.changed_since(get_lxc_file_manifest(container)).files.items():
+        try:
+            if container.files.get(guest_path) == data:
+                continue
+        except (NotFound, LXDAPIException):
+            # The file does not exist (yet)
+            pass
+        changed.add(guest_path, data)
+    return changed
+
+
+def show_plan(changes: List[dict]):
+    """
+    Shows the planned changes to the user
+    :param list changes: The changes generated by generate_plan()
+    """
+    if not changes:
+        logger.info("The VNet environment matches the config, nothing to do")
+        return
+    rows = [[change["resource"], change["name"], change["change"], change["details"]] for change in changes]
+    print(tabulate(rows, headers=["Resource", "Name", "Change", "Details"], tablefmt="pretty"))
+    print("Interfaces that are no longer in the config are not deleted, use 'destroy' to remove them")
+
+
+def apply_plan(config: dict, changes: List[dict], parallel: int = settings.VNET_PARALLEL_WORKERS, hosts: bool = True) -> List[str]:
+    """
+    Applies the changes generated by generate_plan()
+    The machine changes are applied concurrently, a machine that fails does not stop the changes to the other machines
+    :param dict config: The config generated by get_config()
+    :param list changes: The changes to apply
+    :param int parallel: The amount of machines to operate on concurrently
+    :param bool hosts: Whether the VNet hosts file should be placed on newly created machines
+    :return: list: The names of the machines of which a change failed
+    """
+    by_change = {}
+    for change in changes:
+        by_change.setdefault((change["resource"], change["change"]), []).append(change)
+
+    for change in by_change.get(("machine", "delete"), []):
+        destroy_lxc_machine(change["name"], wait=True)
+    if by_change.get(("bridge", "create")):
+        ensure_vnet_iptables_rules()
+    for change in by_change.get(("bridge", "create"), []):
+        create_vnet_interface(change["name"])
+    for change in by_change.get(("bridge", "modify"), []):
+        configure_vnet_interface(change["name"])
+    for change in by_change.get(("bridge", "stp"), []):
+        configure_vnet_interface_stp(change["name"], change["stp"])
+    for change in by_change.get(("veth", "create"), []) + by_change.get(("veth", "modify"), []):
+        if change["change"] == "create":
+            create_veth_interface(change["name"], change["data"])
+        configure_veth_interface(change["name"], change["data"])
+        configure_vnet_interface(change["name"])
+
+    failed = set()
+    to_create = [change["name"] for change in by_change.get(("machine", "create"), [])]
+    if to_create:
+        ensure_vnet_lxc_environment(config)
+        failed.update(create_lxc_machines_from_base_image(config, to_create, parallel=parallel, hosts=hosts))
+
+    with ThreadPoolExecutor(max_workers=max(1, parallel)) as executor:
+        failed.update(
+            apply_lxc_machine_changes(executor, update_lxc_machine_devices, by_change.get(("machine", "modify"), []), "devices", "update")
+        )
+        failed.update(
+            apply_lxc_machine_changes(executor, provision_lxc_machine, by_change.get(("machine", "provision"), []), "bundle", "provision")
+        )
+    if failed:
+        logger.error("Failed to apply the changes to the following machines: {}".format(", ".join(sorted(failed))))
+    return sorted(failed)
+
+
+def apply_lxc_machine_changes(
+    executor: ThreadPoolExecutor, func: Callable, changes: List[dict], key: str, operation: str
+) -> Dict[str, str]:
+    """
+    Applies a type of machine change to the machines concurrently and collects the errors per machine
+    :param ThreadPoolExecutor executor: The executor to apply the changes with
+    :param callable func: The function that applies a change, called with the machine name and the change data
+    :param list changes: The changes to apply
+    :param str key: The key of the change data in the changes
+    :param str operation: The name of the operation, used for logging
+    :return: dict: The error per machine that failed
+    """
+    machines = [change["name"] for change in changes]
+    futures = [executor.submit(func, change["name"], change[key]) for change in changes]
+    results = [future.exception() or future.result() for future in futures]
+    failed = collect_lxc_machine_errors(machines, results, operation)
+    # Failures that were already logged are reported with a False result
+    failed.update({machine: "{} failed".format(operation) for machine, result in zip(machines, results) if result is False})
+    return failed
+
+
+def provision_lxc_machine(machine: str, bundle: FileBundle) -> bool:
+    """
+    Places the changed files on a LXC container
+    :param str machine: The name of the container
+    :param FileBundle bundle: The changed files of the container
+    :return: bool: True if the files have been placed, False otherwise
+    """
+    logger.info("Placing {} changed files on LXC container {}".format(len(bundle), machine))
+    return deliver_file_bundle(bundle, "lxc")
+
+
+def update_lxc_machine_devices(machine: str, devices: dict):
+    """
+    Replaces the devices of a LXC container
+    :param str machine: The name of the container
+    :param dict devices: The new LXD devices config
+    """
+    logger.info("Updating the devices of LXC container {}".format(machine))
+    container = get_lxd_client().containers.get(machine)
+    container.devices = devices
+    container.save(wait=True)
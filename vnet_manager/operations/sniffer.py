@@ -0,0 +1,300 @@
+import gzip
+import re
+import shlex
+import sys
+from logging import getLogger
+from os import getpid, listdir, makedirs, remove, replace, stat
+from os.path import join
+from shutil import copyfileobj, copystat
+from signal import signal, SIGINT, SIGTERM
+from subprocess import Popen, TimeoutExpired, DEVNULL, STDOUT
+from threading import Event
+from typing import Dict, List, Optional
+
+from psutil import Process, process_iter, wait_procs, NoSuchProcess, AccessDenied
+
+from vnet_manager.conf import settings
+from vnet_manager.log import setup_console_logging
+
+logger = getLogger(__name__)
+
+
+def get_sniffer_pid_file(ifname: str) -> str:
+    """
+    :param str ifname: The VNet interface name
+    :return: str: The path of the PID file of the sniffer on the VNet interface
+    """
+    return join(settings.VNET_SNIFFER_PID_DIR, "{}.pid".format(ifname))
+
+
+def register_sniffer(ifname: str, pid: int):
+    """
+    Records the PID of a sniffer in the sniffer registry
+    :param str ifname: The VNet interface the sniffer runs on
+    :param int pid: The PID of the sniffer
+    """
+    makedirs(settings.VNET_SNIFFER_PID_DIR, exist_ok=True)
+    with open(get_sniffer_pid_file(ifname), "w") as fh:
+        fh.write("{}\n".format(pid))
+
+
+def unregister_sniffer(ifname: str):
+    """
+    Removes a sniffer from the sniffer registry
+    :param str ifname: The VNet interface the sniffer runs on
+    """
+    try:
+        remove(get_sniffer_pid_file(ifname))
+    except FileNotFoundError:
+        pass
+
+
+def get_registered_sniffer_pid(ifname: str) -> Optional[int]:
+    """
+    Gets the PID of the sniffer on a VNet interface from the sniffer registry
+    Stale registrations, of sniffers that are gone or of PIDs that have been reused, are removed
+    :param str ifname: The VNet interface name
+    :return: int: The PID of the sniffer, None if there is no registered sniffer running
+    """
+    try:
+        with open(get_sniffer_pid_file(ifname)) as fh:
+            pid = int(fh.read().strip())
+    except (OSError, ValueError):
+        return None
+    try:
+        if ifname in Process(pid).cmdline():
+            return pid
+    except (NoSuchProcess, AccessDenied):
+        pass
+    logger.debug("Removing stale sniffer registration for VNet interface {}".format(ifname))
+    unregister_sniffer(ifname)
+    return None
+
+
+def scan_for_sniffers() -> Dict[str, int]:
+    """
+    Walks the processes once, looking for tcpdump processes that are not in the sniffer registry (like ones started by hand)
+    :return: dict: {ifname: pid} of the tcpdump processes found
+    """
+    sniffers = {}
+    for process in process_iter(["name"]):
+        # Only read the command line of tcpdump processes, reading it is expensive
+        if process.info["name"] != "tcpdump":
+            continue
+        try:
+            cmdline = process.cmdline()
+        except (NoSuchProcess, AccessDenied):
+            continue
+        for i, arg in enumerate(cmdline[:-1]):
+            if arg == "-i":
+                sniffers[cmdline[i + 1]] = process.pid
+    return sniffers
+
+
+def get_running_sniffers(ifnames: List[str]) -> Dict[str, int]:
+    """
+    Gets the running sniffers of VNet interfaces
+    The sniffer registry is checked first, the processes are only walked (once) for interfaces that are not in it
+    :param list ifnames: The VNet interface names
+    :return: dict: {ifname: pid} of the VNet interfaces with a running sniffer
+    """
+    sniffers = {}
+    for ifname in ifnames:
+        pid = get_registered_sniffer_pid(ifname)
+        if pid is not None:
+            sniffers[ifname] = pid
+    unregistered = [ifname for ifname in ifnames if ifname not in sniffers]
+    if unregistered:
+        scanned = scan_for_sniffers()
+        sniffers.update({ifname: scanned[ifname] for ifname in unregistered if ifname in scanned})
+    return sniffers
+
+
+def check_if_sniffer_exists(ifname: str) -> bool:
+    """
+    Check if there is already a sniffer running for a VNet interface
+    :param str ifname: The VNet interface name to check
+    :return bool: True if it exists, False otherwise
+    """
+    if ifname in get_running_sniffers([ifname]):
+        logger.debug("A TCPdump sniffer for interface {} already exists".format(ifname))
+        return True
+    return False
+
+
+def get_sniffer_capture_path(ifname: str) -> str:
+    """
+    :param str ifname: The VNet interface name
+    :return: str: The path tcpdump writes the PCAP file(s) of the sniffer on the VNet interface to
+    """
+    if settings.VNET_SNIFFER_ROTATE_SECONDS:
+        # Rotating by time needs a strftime pattern in the file name, otherwise tcpdump overwrites the same file
+        return join(settings.VNET_SNIFFER_PCAP_DIR, "{}-%Y%m%d-%H%M%S.pcap".format(ifname))
+    return join(settings.VNET_SNIFFER_PCAP_DIR, "{}.pcap".format(ifname))
+
+
+def get_sniffer_log_path(ifname: str) -> str:
+    """
+    :param str ifname: The VNet interface name
+    :return: str: The path of the log file of the sniffer supervisor (and tcpdump) on the VNet interface
+    """
+    return join(settings.VNET_SNIFFER_PCAP_DIR, "{}.log".format(ifname))
+
+
+def get_tcpdump_command(ifname: str) -> List[str]:
+    """
+    Generates the tcpdump command of the sniffer on a VNet interface
+    The maximum amount of files is enforced by the sniffer supervisor, as tcpdump exits when it hits -W combined with -G
+    :param str ifname: The VNet interface name
+    :return: list: The tcpdump command
+    """
+    command = ["tcpdump", "-i", ifname, "-U", "-w", get_sniffer_capture_path(ifname)]
+    if settings.VNET_SNIFFER_SNAPLEN:
+        command += ["-s", str(settings.VNET_SNIFFER_SNAPLEN)]
+    if settings.VNET_SNIFFER_ROTATE_SIZE:
+        command += ["-C", str(settings.VNET_SNIFFER_ROTATE_SIZE)]
+    if settings.VNET_SNIFFER_ROTATE_SECONDS:
+        command += ["-G", str(settings.VNET_SNIFFER_ROTATE_SECONDS)]
+    return command + shlex.split(settings.VNET_SNIFFER_FILTER)
+
+
+def get_sniffer_capture_files(ifname: str) -> List[str]:
+    """
+    Gets the (rotated and compressed) PCAP files of the sniffer on a VNet interface
+    :param str ifname: The VNet interface name
+    :return: list: The paths of the PCAP files, from oldest to newest
+    """
+    # tcpdump adds a counter to the file name when rotating by size
+    pattern = re.compile(r"^{}(\.pcap|-\d{{8}}-\d{{6}}\.pcap)\d*(\.gz)?$".format(re.escape(ifname)))
+    try:
+        paths = [join(settings.VNET_SNIFFER_PCAP_DIR, f) for f in listdir(settings.VNET_SNIFFER_PCAP_DIR) if pattern.match(f)]
+    except FileNotFoundError:
+        return []
+    return sorted(paths, key=lambda path: (stat(path).st_mtime, path))
+
+
+def compress_capture_file(path: str) -> str:
+    """
+    Gzip compresses a PCAP file, the compressed file keeps the modification time of the original
+    :param str path: The path of the PCAP file
+    :return: str: The path of the compressed file
+    """
+    logger.debug("Compressing PCAP file {}".format(path))
+    # Compress to a temporary file, so an interrupted compression does not leave a broken .gz file behind
+    tmp_path = "{}.gz.tmp".format(path)
+    with open(path, "rb") as src, gzip.open(tmp_path, "wb") as dst:
+        copyfileobj(src, dst)
+    copystat(path, tmp_path)
+    replace(tmp_path, "{}.gz".format(path))
+    remove(path)
+    return "{}.gz".format(path)
+
+
+def rotate_sniffer_capture_files(ifname: str, final: bool = False):
+    """
+    Compresses the rotated PCAP files of the sniffer on a VNet interface and removes the oldest files above the maximum
+    :param str ifname: The VNet interface name
+    :param bool final: Whether the sniffer has stopped, so the newest PCAP file can be compressed as well
+    """
+    files = get_sniffer_capture_files(ifname)
+    # The newest uncompressed file is the one tcpdump is writing to
+    uncompressed = [path for path in files if not path.endswith(".gz")]
+    current = uncompressed[-1] if uncompressed and not final else None
+    if settings.VNET_SNIFFER_COMPRESS:
+        files = [compress_capture_file(path) if path in uncompressed and path != current else path for path in files]
+    if settings.VNET_SNIFFER_MAX_FILES:
+        for path in files[: -settings.VNET_SNIFFER_MAX_FILES]:
+            if path != current:
+                logger.debug("Removing PCAP file {}, the sniffer keeps {} files".format(path, settings.VNET_SNIFFER_MAX_FILES))
+                remove(path)
+
+
+def supervise_sniffer(ifname: str) -> int:
+    """
+    Runs tcpdump on a VNet interface until it exits or the supervisor is told to stop (SIGTERM)
+    In the meantime the rotated PCAP files are compressed and the oldest files are removed
+    :param str ifname: The VNet interface name
+    :return: int: 0 if the sniffer was stopped, the exit code of tcpdump otherwise
+    """
+    stop = Event()
+    for signum in (SIGTERM, SIGINT):
+        signal(signum, lambda *_: stop.set())
+    tcpdump = Popen(get_tcpdump_command(ifname), stdin=DEVNULL)
+    logger.info("Supervising sniffer on VNet interface {} (PID {})".format(ifname, tcpdump.pid))
+    while not stop.wait(settings.VNET_SNIFFER_SUPERVISOR_INTERVAL):
+        if tcpdump.poll() is not None:
+            logger.error("Sniffer on VNet interface {} exited with code {}".format(ifname, tcpdump.returncode))
+            break
+        rotate_sniffer_capture_files(ifname)
+    if tcpdump.poll() is None:
+        tcpdump.terminate()
+        try:
+            tcpdump.wait(timeout=settings.VNET_SNIFFER_STOP_TIMEOUT)
+        except TimeoutExpired:
+            tcpdump.kill()
+            tcpdump.wait()
+    rotate_sniffer_capture_files(ifname, final=True)
+    # The registration might already have been replaced by a new sniffer
+    if get_registered_sniffer_pid(ifname) == getpid():
+        unregister_sniffer(ifname)
+    return 0 if stop.is_set() else tcpdump.returncode
+
+
+def start_tcpdump_on_vnet_interface(ifname: str):
+    """
+    Starts a sniffer supervisor, which runs tcpdump, on a vnet interface and records it in the sniffer registry
+    :param str ifname: The interface to start the tcpdump on
+    """
+    logger.info("Starting sniffer on VNet interface {}, PCAP location: {}".format(ifname, get_sniffer_capture_path(ifname)))
+    makedirs(settings.VNET_SNIFFER_PCAP_DIR, exist_ok=True)
+    log_path = get_sniffer_log_path(ifname)
+    # The supervisor gets its own session, so it outlives vnet-manager and is not hit by signals sent to the terminal
+    with open(log_path, "a") as log:
+        process = Popen(
+            [sys.executable, "-m", "vnet_manager.operations.sniffer", ifname],
+            stdin=DEVNULL,
+            stdout=log,
+            stderr=STDOUT,
+            start_new_session=True,
+        )
+    # A sniffer that cannot start (like tcpdump missing or the interface being gone) exits right away
+    try:
+        process.wait(timeout=settings.VNET_SNIFFER_STARTUP_TIMEOUT)
+    except TimeoutExpired:
+        register_sniffer(ifname, process.pid)
+        return
+    logger.error(
+        "Sniffer on VNet interface {} exited with code {} right after starting, see {}".format(ifname, process.returncode, log_path)
+    )
+
+
+def stop_sniffers(ifnames: List[str]):
+    """
+    Stops the sniffers on VNet interfaces and waits for them to exit
+    Sniffers that do not stop within VNET_SNIFFER_STOP_TIMEOUT are killed, together with their tcpdump process
+    :param list ifnames: The VNet interface names
+    """
+    processes = []
+    for ifname, pid in get_running_sniffers(ifnames).items():
+        logger.info("Stopping sniffer on VNet interface {}".format(ifname))
+        try:
+            process = Process(pid)
+            children = process.children(recursive=True)
+            process.terminate()
+            processes += [process] + children
+        except NoSuchProcess:
+            pass
+    _, alive = wait_procs(processes, timeout=settings.VNET_SNIFFER_STOP_TIMEOUT)
+    for process in alive:
+        logger.warning("Sniffer process {} did not stop in time, killing it".format(process.pid))
+        try:
+            process.kill()
+        except NoSuchProcess:
+            pass
+    for ifname in ifnames:
+        unregister_sniffer(ifname)
+
+
+if __name__ == "__main__":
+    setup_console_logging()
+    sys.exit(supervise_sniffer(sys.argv[1]))
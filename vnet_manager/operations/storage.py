@@ -1,4 +1,8 @@
+import re
 from logging import getLogger
+from os import makedirs
+from os.path import ismount
+from subprocess import check_call
 from pylxd.exceptions import LXDAPIException
 
 from vnet_manager.providers.lxc import get_lxd_client
@@ -17,21 +21,88 @@ def check_if_lxc_storage_pool_exists(name: str = settings.LXC_STORAGE_POOL_NAME)
     return get_lxd_client().storage_pools.exists(name)
 
 
-def create_lxc_storage_pool(name: str = settings.LXC_STORAGE_POOL_NAME, driver: str = settings.LXC_STORAGE_POOL_DRIVER):
+def generate_lxc_storage_pool_config(driver: str, source: str = None, size: str = settings.LXC_STORAGE_POOL_SIZE) -> dict:
+    """
+    Generates the config of a LXC storage pool
+    Without a source LXD creates a loop file of the passed size, dir pools have no size as they use the filesystem they are on
+    :param str driver: The storage pool driver
+    :param str source: An existing block device, btrfs subvolume, zfs dataset or directory to create the pool on
+    :param str size: The size of the loop file
+    :return: dict: The storage pool config
+    """
+    if source:
+        return {"source": source}
+    if driver == "dir":
+        return {}
+    return {"size": size}
+
+
+def get_tmpfs_size(size: str) -> str:
+    """
+    Converts a LXD size, like 30GB or 512MiB, to a tmpfs size
+    :param str size: The LXD size
+    :return: str: The tmpfs size
+    :raises ValueError: If the size cannot be parsed
+    """
+    match = re.match(r"^(\d+)\s*([kKmMgGtT]?)(i?B)?$", size.strip())
+    if not match:
+        raise ValueError("Unable to convert storage pool size {} to a tmpfs size".format(size))
+    return "{}{}".format(match.group(1), match.group(2).lower())
+
+
+def mount_lxc_storage_pool_tmpfs(path: str = settings.LXC_STORAGE_POOL_TMPFS_PATH, size: str = settings.LXC_STORAGE_POOL_SIZE):
+    """
+    Mounts a tmpfs to put a RAM backed dir storage pool on, nothing is done if something is already mounted on the path
+    :param str path: The path to mount the tmpfs on
+    :param str size: The maximum size of the tmpfs
+    """
+    makedirs(path, exist_ok=True)
+    if ismount(path):
+        logger.debug("Storage pool tmpfs {} already mounted".format(path))
+        return
+    logger.info("Mounting a tmpfs of {} on {} for the LXC storage pool".format(size, path))
+    check_call(["mount", "-t", "tmpfs", "-o", "size={},mode=0711".format(get_tmpfs_size(size)), "tmpfs", path])
+
+
+def unmount_lxc_storage_pool_tmpfs(path: str = settings.LXC_STORAGE_POOL_TMPFS_PATH):
+    """
+    Unmounts the tmpfs of a RAM backed storage pool, the pool must be deleted first
+    :param str path: The path the tmpfs is mounted on
+    """
+    if not ismount(path):
+        return
+    logger.info("Unmounting the LXC storage pool tmpfs {}".format(path))
+    check_call(["umount", path])
+
+
+def create_lxc_storage_pool(
+    name: str = settings.LXC_STORAGE_POOL_NAME,
+    driver: str = settings.LXC_STORAGE_POOL_DRIVER,
+    source: str = settings.LXC_STORAGE_POOL_SOURCE,
+    tmpfs: bool = settings.LXC_STORAGE_POOL_TMPFS,
+):
     """
     Creates a new LXC storage pool with the passed driver and name
     :param str name: The name of the storage pool to create (default from settings)
     :param str driver: The driver to use (default from settings)
+    :param str source: The block device, btrfs subvolume or directory to create the pool on, defaults to a loop file (default from settings)
+    :param bool tmpfs: Put the pool on a tmpfs, requires the dir driver (default from settings)
+    :raises RuntimeError: If the pool already exists or could not be created
     """
     # Sanity check, we don't want to create duplicate pools
     if check_if_lxc_storage_pool_exists(name):
         raise RuntimeError("LXC storage pool {} already exists, cannot create duplicate".format(name))
+    if tmpfs:
+        if driver != "dir":
+            raise RuntimeError("A tmpfs storage pool requires the dir driver, not {}".format(driver))
+        source = source if source else settings.LXC_STORAGE_POOL_TMPFS_PATH
+        mount_lxc_storage_pool_tmpfs(source, size=settings.LXC_STORAGE_POOL_SIZE)
 
     # Make it
     logger.info("Creating LXC storage pool {} with driver {}".format(name, driver))
     client = get_lxd_client()
     try:
-        client.storage_pools.create({"name": name, "driver": driver, "config": {"size": settings.LXC_STORAGE_POOL_SIZE}})
+        client.storage_pools.create({"name": name, "driver": driver, "config": generate_lxc_storage_pool_config(driver, source=source)})
         logger.info("Storage pool {} with driver {} successfully created".format(name, driver))
     except LXDAPIException as e:
         logger.critical("Got API error while creating storage pool {}. Error: {}".format(name, e))
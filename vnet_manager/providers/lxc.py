@@ -1,9 +1,309 @@
-from pylxd import client
+import atexit
+import socket
+from functools import partial
+from inspect import signature
+from json import loads
+from logging import getLogger
+from threading import BoundedSemaphore, Event, Lock, Thread
+from typing import Optional
+from urllib.parse import unquote, urlparse
+
+from pylxd import client, __version__ as pylxd_version
+from pylxd.client import _APINode, EventType  # pylint: disable=protected-access
+from requests.adapters import HTTPAdapter
+from ws4py.client import WebSocketBaseClient
+from urllib3.connection import HTTPConnection
+from urllib3.connectionpool import HTTPConnectionPool
+
+from vnet_manager.conf import settings
+
+logger = getLogger(__name__)
+
+LXD_UNIX_SOCKET_SCHEME = "http+unix://"
+# The pylxd releases that open a new session for every API node, of which the (private) _APINode is known to keep its session
+# in .session and to build its child nodes with self.__class__. Sharing the session in these releases relies on that.
+SHARED_SESSION_PYLXD_VERSIONS = ("2.2", "2.3")
+
+
+class UnixSocketConnection(HTTPConnection):
+    """
+    A HTTP connection to a unix socket (the LXD daemon socket)
+    """
+
+    def __init__(self, socket_path: str, timeout: int = 60):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
+
+class UnixSocketConnectionPool(HTTPConnectionPool):
+    """
+    A keep-alive connection pool to a unix socket
+    """
+
+    def __init__(self, socket_path: str, maxsize: int):
+        super().__init__("localhost", maxsize=maxsize, block=False)
+        self.socket_path = socket_path
+
+    def _new_conn(self) -> UnixSocketConnection:
+        return UnixSocketConnection(self.socket_path)
+
+
+class PooledUnixSocketAdapter(HTTPAdapter):
+    """
+    Requests adapter that keeps a single keep-alive connection pool per unix socket
+    The pool holds enough idle connections to serve all concurrent workers
+    """
+
+    def __init__(self, pool_size: int):
+        self.pool_size = pool_size
+        self._pools = {}
+        self._pools_lock = Lock()
+        super().__init__()
+
+    def get_connection(self, url, proxies=None) -> UnixSocketConnectionPool:
+        # pylxd encodes the socket path as the host part of the url
+        socket_path = unquote(urlparse(url).netloc)
+        with self._pools_lock:
+            if socket_path not in self._pools:
+                self._pools[socket_path] = UnixSocketConnectionPool(socket_path, maxsize=self.pool_size)
+            return self._pools[socket_path]
+
+    def get_connection_with_tls_context(self, request, verify, proxies=None, cert=None) -> UnixSocketConnectionPool:
+        # Newer versions of requests use this method instead of get_connection()
+        return self.get_connection(request.url, proxies)
+
+    def request_url(self, request, proxies) -> str:
+        return request.path_url
+
+    def close(self):
+        with self._pools_lock:
+            for pool in self._pools.values():
+                pool.close()
+            self._pools.clear()
+
+
+class LXDClientManager:
+    """
+    Process wide manager for LXD clients
+    Hands out a shared client per set of client arguments instead of opening a new one on every call.
+    All API calls of a client go through one pooled HTTP session and the amount of in-flight requests is capped.
+    """
+
+    def __init__(self, max_requests: int = settings.LXD_MAX_CONCURRENT_REQUESTS):
+        """
+        :param int max_requests: The maximum amount of concurrent in-flight requests to the LXD daemon
+        """
+        self.max_requests = max_requests
+        self._clients = {}
+        self._lock = Lock()
+
+    def get_client(self, **kwargs) -> client.Client:
+        """
+        Get the shared pylxd client.Client() for the passed parameters, creates it on first use
+        :return: pylxd.client.Client()
+        """
+        key = tuple(sorted(kwargs.items()))
+        with self._lock:
+            if key not in self._clients:
+                logger.debug("Creating new shared LXD client")
+                lxd_client = client.Client(**kwargs)
+                self._share_session(lxd_client)
+                self._clients[key] = lxd_client
+            return self._clients[key]
+
+    def _share_session(self, lxd_client: client.Client):
+        """
+        Make all API nodes of the client use a single pooled session with a capped amount of in-flight requests
+        :param pylxd.client.Client lxd_client: The client to configure
+        """
+        api = getattr(lxd_client, "api", None)
+        if not isinstance(api, _APINode):
+            return
+        session = api.session
+        session.mount(LXD_UNIX_SOCKET_SCHEME, PooledUnixSocketAdapter(self.max_requests))
+        session.request = _limit_concurrency(session.request, BoundedSemaphore(self.max_requests))
+        if check_if_api_node_shares_session():
+            return
+        if ".".join(pylxd_version.split(".")[:2]) in SHARED_SESSION_PYLXD_VERSIONS:
+            api.__class__ = SharedSessionAPINode
+        else:
+            logger.debug("pylxd {} opens a session per API node, only the root API node uses the pooled session".format(pylxd_version))
+
+    def reset(self):
+        """
+        Close and forget all shared clients
+        """
+        with self._lock:
+            for lxd_client in self._clients.values():
+                api = getattr(lxd_client, "api", None)
+                if isinstance(api, _APINode):
+                    api.session.close()
+            self._clients = {}
+
+
+def check_if_api_node_shares_session() -> bool:
+    """
+    Check if the pylxd API nodes hand their session down to their child nodes by themselves
+    :return: bool: True if they do, False if every API node opens a new session
+    """
+    return "session" in signature(_APINode.__init__).parameters
+
+
+class SharedSessionAPINode(_APINode):
+    """
+    pylxd API node that hands its session down to every child node, instead of each node opening a new session
+    """
+
+    def __getattr__(self, name):
+        return self._with_session(super().__getattr__(name))
+
+    def __getitem__(self, item):
+        return self._with_session(super().__getitem__(item))
+
+    def _with_session(self, node):
+        node.session = self.session
+        return node
+
+
+def _limit_concurrency(func, semaphore: BoundedSemaphore):
+    def limited(*args, **kwargs):
+        with semaphore:
+            return func(*args, **kwargs)
+
+    return limited
+
+
+class LXDEventMonitor:
+    """
+    A single shared subscription to the LXD lifecycle event stream (/1.0/events)
+    Callers watch an instance and are woken up as soon as a lifecycle event for that instance comes in.
+    When the event stream is unavailable watch() returns None and callers should fall back to polling.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._watchers = {}
+        self._websocket = None
+        self._available = True
+
+    @property
+    def connected(self) -> bool:
+        return self._websocket is not None
+
+    def watch(self, name: str) -> Optional[Event]:
+        """
+        Start watching an instance for lifecycle events, subscribes to the event stream on first use
+        :param str name: The name of the instance to watch
+        :return: threading.Event: Set on every lifecycle event of the instance, None if the event stream is unavailable
+        """
+        with self._lock:
+            if not self._ensure_subscription():
+                return None
+            event = Event()
+            self._watchers.setdefault(name, []).append(event)
+            return event
+
+    def unwatch(self, name: str, event: Optional[Event]):
+        """
+        Stop watching an instance
+        :param str name: The name of the watched instance
+        :param threading.Event event: The event returned by watch()
+        """
+        with self._lock:
+            if event in self._watchers.get(name, []):
+                self._watchers[name].remove(event)
+                if not self._watchers[name]:
+                    del self._watchers[name]
+
+    def dispatch(self, message: dict):
+        """
+        Wake up all watchers of the instance the lifecycle event is about
+        :param dict message: The decoded event message from LXD
+        """
+        if message.get("type") != "lifecycle":
+            return
+        # The source looks like /1.0/containers/<name> or /1.0/instances/<name>?project=default
+        source = message.get("metadata", {}).get("source", "")
+        name = urlparse(source).path.rstrip("/").split("/")[-1]
+        with self._lock:
+            for event in self._watchers.get(name, []):
+                event.set()
+
+    def closed(self):
+        """
+        Called when the event stream goes away, wakes all watchers so they fall back to polling
+        """
+        logger.debug("LXD event stream closed")
+        with self._lock:
+            self._websocket = None
+            self._available = False
+            for events in self._watchers.values():
+                for event in events:
+                    event.set()
+
+    def stop(self):
+        """
+        Close the event stream subscription
+        """
+        websocket = self._websocket
+        if websocket is not None:
+            websocket.close()
+
+    def _ensure_subscription(self) -> bool:
+        # Must be called with the lock held
+        if self._websocket is not None:
+            return True
+        if not self._available:
+            return False
+        try:
+            websocket = get_lxd_client().events(
+                websocket_client=partial(LXDLifecycleWebsocketClient, monitor=self), event_types={EventType.Lifecycle}
+            )
+            websocket.connect()
+        except Exception as e:  # pylint: disable=broad-except
+            # Any failure here just means we have to poll
+            logger.debug("Unable to subscribe to the LXD event stream, falling back to polling. Error: {}".format(e))
+            self._available = False
+            return False
+        logger.debug("Subscribed to the LXD lifecycle event stream")
+        self._websocket = websocket
+        Thread(target=websocket.run, name="lxd-events", daemon=True).start()
+        return True
+
+
+class LXDLifecycleWebsocketClient(WebSocketBaseClient):
+    """
+    Websocket client that passes the LXD lifecycle events on to the LXDEventMonitor
+    """
+
+    def __init__(self, url: str, monitor: LXDEventMonitor = None, **kwargs):
+        super().__init__(url, **kwargs)
+        self.monitor = monitor
+
+    def received_message(self, message):
+        try:
+            self.monitor.dispatch(loads(message.data.decode("utf-8")))
+        except ValueError:
+            logger.debug("Received invalid message from the LXD event stream, ignoring")
+
+    def closed(self, code, reason=None):
+        self.monitor.closed()
+
+
+lxd_client_manager = LXDClientManager()
+lxd_event_monitor = LXDEventMonitor()
+atexit.register(lxd_event_monitor.stop)
 
 
 def get_lxd_client(**kwargs) -> client.Client:
     """
-    Get an LXC client.Client() with the passed parameters
+    Get the shared LXC client.Client() for the passed parameters
     :return: pylxd.client.Client()
     """
-    return client.Client(**kwargs)
+    return lxd_client_manager.get_client(**kwargs)
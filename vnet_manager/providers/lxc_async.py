@@ -0,0 +1,350 @@
+import asyncio
+from json import dumps, loads
+from logging import getLogger
+from os import environ
+from os.path import exists, join
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import quote, urlencode
+
+from vnet_manager.conf import settings
+
+logger = getLogger(__name__)
+
+
+class LXDAsyncAPIError(Exception):
+    """
+    Raised when the LXD API returns an error
+    """
+
+    def __init__(self, status_code: int, error: str):
+        super().__init__("LXD API error {}: {}".format(status_code, error))
+        self.status_code = status_code
+        self.error = error
+
+
+def get_lxd_socket_path() -> str:
+    """
+    Finds the LXD unix socket, the same way pylxd does
+    :return: str: The path to the LXD unix socket
+    """
+    if "LXD_DIR" in environ:
+        return join(environ["LXD_DIR"], "unix.socket")
+    if exists("/var/lib/lxd/unix.socket"):
+        return "/var/lib/lxd/unix.socket"
+    return "/var/snap/lxd/common/lxd/unix.socket"
+
+
+class AsyncLXDClient:
+    """
+    asyncio client for the LXD REST API over the LXD unix socket
+    Requests are sent over a pool of keep-alive connections, the amount of concurrent connections is capped.
+    Any amount of operations can be awaited concurrently on a single event loop.
+    """
+
+    def __init__(self, socket_path: str = None, max_connections: int = settings.LXD_MAX_CONCURRENT_REQUESTS):
+        """
+        :param str socket_path: The path to the LXD unix socket, defaults to the socket found by get_lxd_socket_path()
+        :param int max_connections: The maximum amount of concurrent connections to the LXD daemon
+        """
+        self.socket_path = socket_path if socket_path else get_lxd_socket_path()
+        self.max_connections = max_connections
+        self._idle = []
+        self._semaphore = None
+
+    async def __aenter__(self) -> "AsyncLXDClient":
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """
+        Close all idle connections
+        """
+        for _, writer in self._idle:
+            writer.close()
+        self._idle = []
+
+    async def request(self, method: str, path: str, body: bytes = b"", headers: dict = None) -> Tuple[int, dict, bytes]:
+        """
+        Send a HTTP request to the LXD daemon
+        :param str method: The HTTP method
+        :param str path: The request path, including the query string
+        :param bytes body: The request body
+        :param dict headers: Extra request headers
+        :return: tuple: The status code, the (lower case) response headers and the response body
+        """
+        if self._semaphore is None:
+            # Created here so it belongs to the running event loop
+            self._semaphore = asyncio.Semaphore(self.max_connections)
+        async with self._semaphore:
+            reused = bool(self._idle)
+            reader, writer = self._idle.pop() if reused else await asyncio.open_unix_connection(self.socket_path)
+            try:
+                response = await self._send(reader, writer, method, path, body, headers)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                writer.close()
+                if not reused:
+                    raise
+                # The daemon closed the idle connection, retry once on a new one
+                reader, writer = await asyncio.open_unix_connection(self.socket_path)
+                try:
+                    response = await self._send(reader, writer, method, path, body, headers)
+                except BaseException:
+                    writer.close()
+                    raise
+            except BaseException:
+                # Never put a connection in an unknown state back in the pool
+                writer.close()
+                raise
+            status, response_headers, data, keep_alive = response
+            if keep_alive:
+                self._idle.append((reader, writer))
+            else:
+                writer.close()
+            return status, response_headers, data
+
+    @staticmethod
+    async def _send(reader, writer, method: str, path: str, body: bytes, headers: dict = None) -> Tuple[int, dict, bytes, bool]:
+        lines = ["{} {} HTTP/1.1".format(method, path), "Host: lxd", "Content-Length: {}".format(len(body))]
+        lines += ["{}: {}".format(key, value) for key, value in (headers or {}).items()]
+        writer.write("\r\n".join(lines).encode("latin-1") + b"\r\n\r\n" + body)
+        await writer.drain()
+
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionError("Connection closed by the LXD daemon")
+        status = int(status_line.split()[1])
+        response_headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            key, value = line.decode("latin-1").split(":", 1)
+            response_headers[key.strip().lower()] = value.strip()
+
+        keep_alive = response_headers.get("connection", "").lower() != "close"
+        if method == "HEAD" or status in (204, 304) or 100 <= status < 200:
+            data = b""
+        elif response_headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b";")[0], 16)
+                if size == 0:
+                    # Skip the trailer
+                    while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                        pass
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            data = b"".join(chunks)
+        elif "content-length" in response_headers:
+            data = await reader.readexactly(int(response_headers["content-length"]))
+        else:
+            data = await reader.read()
+            keep_alive = False
+        return status, response_headers, data, keep_alive
+
+    async def api(self, method: str, path: str, json: dict = None, params: dict = None) -> dict:
+        """
+        Call the LXD API
+        :param str method: The HTTP method
+        :param str path: The API path, like /1.0/containers
+        :param dict json: The request body
+        :param dict params: The query parameters
+        :raises LXDAsyncAPIError: If LXD returns an error
+        :return: dict: The decoded LXD response
+        """
+        if params:
+            path = "{}?{}".format(path, urlencode(params))
+        body = dumps(json).encode("utf-8") if json is not None else b""
+        status, _, data = await self.request(method, path, body, {"Content-Type": "application/json"} if json is not None else None)
+        return self._check_response(status, data)
+
+    @staticmethod
+    def _check_response(status: int, data: bytes) -> dict:
+        try:
+            response = loads(data.decode("utf-8"))
+        except ValueError as e:
+            raise LXDAsyncAPIError(status, "Invalid response from the LXD daemon") from e
+        if status >= 400 or response.get("type") == "error":
+            raise LXDAsyncAPIError(response.get("error_code", status), response.get("error", ""))
+        return response
+
+    async def wait_for_operation(self, response: dict, timeout: int = None) -> dict:
+        """
+        Wait for an async LXD operation to finish
+        :param dict response: The LXD response that started the operation
+        :param int timeout: The maximum amount of seconds to wait, defaults to no timeout
+        :raises LXDAsyncAPIError: If the operation failed
+        :return: dict: The operation metadata
+        """
+        if response.get("type") != "async":
+            return response.get("metadata", {})
+        params = {"timeout": timeout} if timeout is not None else None
+        operation = (await self.api("GET", "{}/wait".format(response["operation"]), params=params))["metadata"]
+        if operation.get("status_code", 200) >= 400:
+            raise LXDAsyncAPIError(operation["status_code"], operation.get("err", ""))
+        return operation
+
+    @staticmethod
+    def _instance_path(name: str, *parts: str) -> str:
+        return "/".join(["/1.0/containers", quote(name, safe="")] + list(parts))
+
+    async def get_instances(self) -> List[dict]:
+        """
+        Get all containers including their state, config and devices with a single recursive query
+        :return: list: The LXD container metadata
+        """
+        return (await self.api("GET", "/1.0/containers", params={"recursion": 1}))["metadata"]
+
+    async def get_instance_statuses(self) -> Dict[str, str]:
+        """
+        :return: dict: The status of all containers, by name
+        """
+        return {instance["name"]: instance["status"] for instance in await self.get_instances()}
+
+    async def get_instance(self, name: str) -> dict:
+        """
+        :param str name: The name of the container
+        :return: dict: The LXD container metadata
+        """
+        return (await self.api("GET", self._instance_path(name)))["metadata"]
+
+    async def create(self, config: dict, wait: bool = True) -> dict:
+        """
+        Create a container
+        :param dict config: The LXD container config, as generated by generate_lxc_container_config()
+        :param bool wait: Wait for the container to be created
+        :return: dict: The LXD response, or the operation metadata if waited for
+        """
+        response = await self.api("POST", "/1.0/containers", json=config)
+        return await self.wait_for_operation(response) if wait else response
+
+    async def change_state(
+        self, name: str, action: str, timeout: int = settings.LXC_STOP_TIMEOUT, force: bool = False, wait: bool = True
+    ) -> dict:
+        """
+        Change the state of a container
+        :param str name: The name of the container
+        :param str action: The state action, like start, stop or restart
+        :param int timeout: The amount of seconds LXD waits for the action to complete
+        :param bool force: Force the state change
+        :param bool wait: Wait for the state change to complete
+        :return: dict: The LXD response, or the operation metadata if waited for
+        """
+        state = {"action": action, "timeout": timeout, "force": force}
+        response = await self.api("PUT", self._instance_path(name, "state"), json=state)
+        return await self.wait_for_operation(response) if wait else response
+
+    async def start(self, name: str, wait: bool = True) -> dict:
+        return await self.change_state(name, "start", wait=wait)
+
+    async def stop(self, name: str, timeout: int = settings.LXC_STOP_TIMEOUT, force: bool = False, wait: bool = True) -> dict:
+        return await self.change_state(name, "stop", timeout=timeout, force=force, wait=wait)
+
+    async def delete(self, name: str, wait: bool = True) -> dict:
+        """
+        Delete a (stopped) container
+        :param str name: The name of the container
+        :param bool wait: Wait for the deletion to complete
+        :return: dict: The LXD response, or the operation metadata if waited for
+        """
+        response = await self.api("DELETE", self._instance_path(name))
+        return await self.wait_for_operation(response) if wait else response
+
+    async def create_snapshot(self, name: str, snapshot: str, wait: bool = True) -> dict:
+        """
+        Take a (stateless) snapshot of a container
+        :param str name: The name of the container
+        :param str snapshot: The name of the snapshot
+        :param bool wait: Wait for the snapshot to be taken
+        :return: dict: The LXD response, or the operation metadata if waited for
+        """
+        response = await self.api("POST", self._instance_path(name, "snapshots"), json={"name": snapshot, "stateful": False})
+        return await self.wait_for_operation(response) if wait else response
+
+    async def delete_snapshot(self, name: str, snapshot: str, wait: bool = True) -> dict:
+        """
+        Delete a snapshot of a container
+        :param str name: The name of the container
+        :param str snapshot: The name of the snapshot
+        :param bool wait: Wait for the deletion to complete
+        :return: dict: The LXD response, or the operation metadata if waited for
+        """
+        response = await self.api("DELETE", self._instance_path(name, "snapshots", quote(snapshot, safe="")))
+        return await self.wait_for_operation(response) if wait else response
+
+    async def restore_snapshot(self, name: str, snapshot: str, wait: bool = True) -> dict:
+        """
+        Restore a container from a snapshot, LXD restarts a running container around the restore
+        :param str name: The name of the container
+        :param str snapshot: The name of the snapshot
+        :param bool wait: Wait for the restore to complete
+        :return: dict: The LXD response, or the operation metadata if waited for
+        """
+        response = await self.api("PUT", self._instance_path(name), json={"restore": snapshot})
+        return await self.wait_for_operation(response) if wait else response
+
+    async def put_file(self, name: str, path: str, data: bytes, mode: Optional[str] = None):
+        """
+        Write a file to a container
+        :param str name: The name of the container
+        :param str path: The path of the file in the container
+        :param bytes data: The file contents
+        :param str mode: The file mode, like 0644
+        """
+        headers = {"Content-Type": "application/octet-stream", "X-LXD-type": "file"}
+        if mode:
+            headers["X-LXD-mode"] = mode
+        request_path = "{}?{}".format(self._instance_path(name, "files"), urlencode({"path": path}))
+        status, _, response = await self.request("POST", request_path, data, headers)
+        self._check_response(status, response)
+
+    async def get_file(self, name: str, path: str) -> bytes:
+        """
+        Read a file from a container
+        :param str name: The name of the container
+        :param str path: The path of the file in the container
+        :return: bytes: The file contents
+        """
+        request_path = "{}?{}".format(self._instance_path(name, "files"), urlencode({"path": path}))
+        status, _, data = await self.request("GET", request_path)
+        if status >= 400:
+            self._check_response(status, data)
+        return data
+
+    async def execute(self, name: str, command: List[str]) -> Tuple[int, bytes, bytes]:
+        """
+        Run a command in a container and collect its output
+        :param str name: The name of the container
+        :param list command: The command to run
+        :return: tuple: The exit code, stdout and stderr of the command
+        """
+        request = {"command": command, "wait-for-websocket": False, "interactive": False, "record-output": True}
+        operation = await self.wait_for_operation(await self.api("POST", self._instance_path(name, "exec"), json=request))
+        metadata = operation.get("metadata") or {}
+        output = metadata.get("output", {})
+        stdout, stderr = await asyncio.gather(*[self._get_log(output.get(fd)) for fd in ("1", "2")])
+        return metadata.get("return", -1), stdout, stderr
+
+    async def _get_log(self, path: Optional[str]) -> bytes:
+        if not path:
+            return b""
+        status, _, data = await self.request("GET", path)
+        if status >= 400:
+            self._check_response(status, data)
+        return data
+
+
+def run_async(coroutine):
+    """
+    Run a coroutine to completion on a new event loop
+    :param coroutine: The coroutine to run
+    :return: The result of the coroutine
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
@@ -0,0 +1,73 @@
+import atexit
+from logging import getLogger
+from threading import Lock
+
+from pyroute2 import IPRoute, NDB
+
+logger = getLogger(__name__)
+
+
+class NetlinkSessionManager:
+    """
+    Keeps a single netlink session per run, which is shared by all interface operations
+    The IPRoute socket is opened on first use, the NDB (which starts threads and a database) only when it is needed.
+    """
+
+    def __init__(self):
+        self._iproute = None
+        self._ndb = None
+        self._lock = Lock()
+
+    def get_iproute(self) -> IPRoute:
+        """
+        Get the shared IPRoute socket, opens it on first use
+        :return: pyroute2.IPRoute()
+        """
+        with self._lock:
+            if self._iproute is None:
+                logger.debug("Opening shared IPRoute netlink socket")
+                self._iproute = IPRoute()
+            return self._iproute
+
+    def get_ndb(self) -> NDB:
+        """
+        Get the shared NDB, starts it on first use
+        :return: pyroute2.NDB()
+        """
+        with self._lock:
+            if self._ndb is None:
+                logger.debug("Starting shared NDB")
+                self._ndb = NDB(log=False)
+            return self._ndb
+
+    def close(self):
+        """
+        Close the shared IPRoute socket and stop the shared NDB
+        """
+        with self._lock:
+            if self._ndb is not None:
+                self._ndb.close()
+                self._ndb = None
+            if self._iproute is not None:
+                self._iproute.close()
+                self._iproute = None
+
+
+netlink_session_manager = NetlinkSessionManager()
+atexit.register(netlink_session_manager.close)
+
+
+def get_iproute() -> IPRoute:
+    """
+    Get the shared IPRoute socket of this run
+    :return: pyroute2.IPRoute()
+    """
+    return netlink_session_manager.get_iproute()
+
+
+def get_ndb() -> NDB:
+    """
+    Get the shared NDB of this run
+    :return: pyroute2.NDB()
+    """
+    return netlink_session_manager.get_ndb()
@@ -79,9 +79,13 @@ PROVIDERS = {
         },
     }
 }
+# The name of the snapshot taken by the 'snapshot' action and restored by the 'reset' action, unless --snapshot is passed
+LXC_DEFAULT_SNAPSHOT_NAME = "vnet-snapshot"
 # The 'list' action also requires a config, but because it is handled differently we don't add it to CONFIG_REQUIRED_ACTIONS
-CONFIG_REQUIRED_ACTIONS = ["show", "start", "stop", "status", "create", "destroy"]
-VALID_ACTIONS = CONFIG_REQUIRED_ACTIONS + ["list", "clean", "version", "bash-completion"]
+CONFIG_REQUIRED_ACTIONS = ["show", "start", "stop", "status", "create", "destroy", "plan", "apply", "snapshot", "reset"]
+VALID_ACTIONS = CONFIG_REQUIRED_ACTIONS + ["list", "clean", "version", "bash-completion", "import-packages", "export-image", "import-image"]
+# The actions that take a path instead of a config
+PATH_REQUIRED_ACTIONS = ["import-packages", "export-image", "import-image"]
 HELP_TEXT_ACTION_MAPPING = {
     "list": """Lists the status of the config files in a particular directory.
 Usage: vnet-manager list <dir>.
@@ -93,16 +97,20 @@ No interface status will be shown, as these might overlap for some configs.
     """,
     "start": """Starts up a previously built config.
 This action will also bring up/start required VNet interfaces and enable sniffers if the --sniffer option is passed.
+Use the --parallel option to start multiple machines concurrently.
     """,
     "stop": """Stops a previously started config.
 This action will also bring down the corresponding VNet interfaces.
+The machines are force stopped. Use the --graceful option to shut them down gracefully instead,
+a machine that does not stop within --stop-timeout seconds is forced to stop.
     """,
     "status": """Shows the current status of the supplied config file.
     """,
     "destroy": """Destroys a previously built config.
 This action will delete the corresponding machines and VNet interfaces.
-Use this action in combination with the --base-image parameter to delete the VNet base images.
+Use this action in combination with the --base-image parameter to delete the VNet base image of the current build inputs.
 When the --base-image parameter is given any config file can be passed.
+With --parallel the machines are force stopped and deleted concurrently.
     """,
     "clean": """Purge VNet specific provider configuration from the system.
 This action can only be executed if all VNet configs on the system are destroyed.
@@ -110,11 +118,66 @@ Only use this action when you wish to reset or uninstall VNet-manager.
     """,
     "create": """Builds a VNet configuration so it can be started using the 'start' action.
 This action will create a base image for all providers present in the configuration if they do not exist yet.
+Use the --parallel option to create multiple machines concurrently, failures are reported per machine.
     """,
+    "plan": """Shows the changes needed to bring the VNet environment in line with the config, without making them.
+The config is compared with the live LXD containers, their devices and files and the VNet bridge and veth interfaces.
+Containers that were created from the config but are no longer in it are listed for deletion.
+    """,
+    "apply": """Makes the changes shown by the 'plan' action.
+Only missing machines are created, changed devices are updated and changed files are pushed, everything else is left alone.
+Use the --parallel option to update multiple machines concurrently.
+    """,
+    "snapshot": """Takes a storage level snapshot of every machine in the config, so the lab can be reset to this state later.
+Use the --snapshot option to name the snapshot (default: {snapshot}), an existing snapshot with the same name is replaced.
+Use the --parallel option to snapshot multiple machines concurrently.
+    """.format(
+        snapshot=LXC_DEFAULT_SNAPSHOT_NAME
+    ),
+    "reset": """Resets every machine in the config to a snapshot taken with the 'snapshot' action.
+Use the --snapshot option to select the snapshot (default: {snapshot}), running machines are restarted by LXD.
+Use the --parallel option to reset multiple machines concurrently.
+    """.format(
+        snapshot=LXC_DEFAULT_SNAPSHOT_NAME
+    ),
     "bash-completion": """Places the VNet-manager bash completion script""",
+    "export-image": """Exports the LXC base image to a unified image tarball.
+Usage: vnet-manager export-image <file>.
+The base image of the current build inputs is exported, other hosts can import it with the 'import-image' action.
+    """,
+    "import-image": """Imports a LXC base image from an image tarball created by the 'export-image' action.
+Usage: vnet-manager import-image <file>.
+The image gets the alias it was exported with, an existing image with that alias is replaced.
+    """,
+    "import-packages": """Imports .deb packages into the apt package cache used to build the LXC base image.
+Usage: vnet-manager import-packages <bundle>.
+In which the <bundle> is a directory or a tar archive containing .deb packages.
+Requires the VNET_APT_CACHE_DIR environment variable to be set, set VNET_APT_OFFLINE=true to build the base image from the cache only.
+    """,
 }
 VNET_BRIDGE_NAME = "vnet-br"
+# The iptables chain (in the filter table) holding the rules that keep the VNet bridges from talking to the outside world
+VNET_IPTABLES_CHAIN = "VNET-OUTPUT"
 VNET_SNIFFER_PCAP_DIR = getenv("VNET_SNIFFER_PCAP_DIR", "/tmp")
+# The directory of the sniffer registry, which holds a PID file per sniffer started by vnet-manager
+VNET_SNIFFER_PID_DIR = getenv("VNET_SNIFFER_PID_DIR", "/run/vnet-manager/sniffers")
+# The amount of bytes the sniffers capture of every packet, 0 captures full packets
+VNET_SNIFFER_SNAPLEN = int(getenv("VNET_SNIFFER_SNAPLEN", "0"))
+# A BPF filter expression selecting the packets the sniffers capture, like 'not ip6', captures everything if empty
+VNET_SNIFFER_FILTER = getenv("VNET_SNIFFER_FILTER", "")
+# Start a new PCAP file when the current one reaches this size in MB and/or is this many seconds old, 0 disables rotation
+VNET_SNIFFER_ROTATE_SIZE = int(getenv("VNET_SNIFFER_ROTATE_SIZE", "0"))
+VNET_SNIFFER_ROTATE_SECONDS = int(getenv("VNET_SNIFFER_ROTATE_SECONDS", "0"))
+# The maximum amount of PCAP files kept per sniffer (the oldest are removed), 0 keeps all files
+VNET_SNIFFER_MAX_FILES = int(getenv("VNET_SNIFFER_MAX_FILES", "0"))
+# Whether the sniffer supervisor gzip compresses the rotated PCAP files
+VNET_SNIFFER_COMPRESS = getenv("VNET_SNIFFER_COMPRESS", "false").lower() == "true"
+# How often (in seconds) the sniffer supervisor compresses and removes rotated PCAP files
+VNET_SNIFFER_SUPERVISOR_INTERVAL = 5
+# How long (in seconds) a new sniffer must keep running before it is considered to be started
+VNET_SNIFFER_STARTUP_TIMEOUT = 1
+# How long (in seconds) stopping a sniffer may take, including compressing its last PCAP file, before it is killed
+VNET_SNIFFER_STOP_TIMEOUT = 30
 SUPPORTED_MACHINE_TYPES = ["host", "router"]
 MACHINE_TYPE_PROVIDER_MAPPING = {
     "host": "lxc",
@@ -126,7 +189,20 @@ MACHINE_TYPE_CONFIG_FUNCTION_MAPPING = {
     "router": ["enable_{}_ip_forwarding".format(MACHINE_TYPE_PROVIDER_MAPPING["router"])],
 }
 VALID_STATUSES = ["start", "stop"]
+# The default amount of machines to operate on concurrently, can be overridden with --parallel
+VNET_PARALLEL_WORKERS = int(getenv("VNET_PARALLEL_WORKERS", "1"))
+# The actions that support the --parallel option
+PARALLEL_ACTIONS = ["create", "start", "stop", "apply", "destroy", "snapshot", "reset"]
+# The actions that support the --snapshot option
+SNAPSHOT_ACTIONS = ["snapshot", "reset"]
+# The actions that place the VNet hosts file on the machines, support the --no-hosts option
+HOSTS_ACTIONS = ["create", "plan", "apply"]
 VNET_FORCE_ENV_VAR = "VNET_FORCE"
+# The directory of the node_exporter textfile collector to write Prometheus metrics to, metrics are disabled if not set
+VNET_METRICS_DIR = getenv("VNET_METRICS_DIR")
+# The actions of which the duration is recorded in the metrics
+METRICS_ACTIONS = ["create", "start", "stop", "destroy"]
+VNET_METRICS_DURATION_BUCKETS = [1, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600]
 VNET_ETC_HOSTS_FILE_PATH = "/tmp/.vnet_etc_hosts"
 VNET_STATIC_HOSTS_FILE_PART = """
 127.0.0.1 localhost
@@ -143,6 +219,10 @@ ff02::3 ip6-allhosts
 
 """
 VNET_NETPLAN_CONFIG_FILE_PATH = "/etc/netplan/10-vnet-config.yaml"
+# Guest path the file bundle archive is placed at before extraction, a stopped machine keeps it there until it is started
+VNET_FILE_BUNDLE_GUEST_PATH = "/var/tmp/.vnet-file-bundle.tar"
+# Runs after a file bundle is unpacked on a machine that was started without the files, to apply the network and service config
+VNET_FILE_BUNDLE_APPLY_COMMAND = "if command -v netplan >/dev/null; then netplan apply; fi; if [ -x /etc/rc.local ]; then /etc/rc.local; fi"
 VNET_BASH_COMPLETION_TEMPLATE = """#!/usr/bin/env bash
 
 _{name}_completions() {{
@@ -166,12 +246,55 @@ VNET_BASH_COMPLETION_PATH = "/etc/bash_completion.d/{}.bash".format(PYTHON_PACKA
 LXC_MAX_STATUS_WAIT_ATTEMPTS = 15
 LXC_STATUS_WAIT_SLEEP = 4
 LXC_STATUS_BACKOFF_MULTIPLIER = 0.3
+LXC_STATUS_WAIT_MAX_SLEEP = 10
+LXC_STOP_TIMEOUT = 30  # Seconds to wait for a graceful stop before forcing it
 LXC_STORAGE_POOL_NAME = "vnet-pool"
-LXC_STORAGE_POOL_DRIVER = "btrfs"
-LXC_STORAGE_POOL_SIZE = "30GB"
+LXC_STORAGE_POOL_DRIVER = getenv("VNET_LXC_STORAGE_POOL_DRIVER", "btrfs")
+# The size of the loop file the pool is created on, or of the tmpfs
+LXC_STORAGE_POOL_SIZE = getenv("VNET_LXC_STORAGE_POOL_SIZE", "30GB")
+# An existing block device, btrfs subvolume, zfs dataset or directory to create the pool on instead of a loop file
+LXC_STORAGE_POOL_SOURCE = getenv("VNET_LXC_STORAGE_POOL_SOURCE")
+# Put a dir storage pool on a tmpfs, for throwaway labs. Everything in the pool is gone after a reboot
+LXC_STORAGE_POOL_TMPFS = getenv("VNET_LXC_STORAGE_POOL_TMPFS", "false").lower() == "true"
+LXC_STORAGE_POOL_TMPFS_PATH = "/var/lib/vnet-manager/pool"
 LXC_BASE_IMAGE_ALIAS = getenv("VNET_LXC_BASE_IMAGE", "vnet-base-image")
+# The VNet base images get the fingerprint of their build inputs appended to the alias, custom base images are used as is
+LXC_BASE_IMAGE_VERSIONED = getenv("VNET_LXC_BASE_IMAGE") is None
 LXC_BASE_IMAGE_MACHINE_NAME = "vnet-base"
+# The compression algorithm used when publishing images: none, zstd, xz, etc. LXD uses gzip when not set
+# "none" is the fastest to publish but takes the most disk space, zstd is much faster than gzip at a similar size
+LXC_IMAGE_COMPRESSION = getenv("VNET_LXC_IMAGE_COMPRESSION")
+# Image property holding the alias of the image, restored when an exported image is imported
+LXC_IMAGE_ALIAS_PROPERTY = "vnet.alias"
+LXC_IMAGE_TRANSFER_CHUNK_SIZE = 1024 * 1024
 LXC_VNET_PROFILE = "vnet-profile"
+# Host directory with .deb packages that is mounted as the apt archive of the base image build container, unset disables it
+# Packages downloaded during a build are kept in it, so the next build can reuse them
+VNET_APT_CACHE_DIR = getenv("VNET_APT_CACHE_DIR")
+# Build the base image with only the packages in VNET_APT_CACHE_DIR, without downloading anything
+VNET_APT_OFFLINE = getenv("VNET_APT_OFFLINE", "false").lower() == "true"
+LXC_APT_CACHE_GUEST_PATH = "/var/cache/apt/archives"
+# The offline build indexes the apt package cache into a local apt repository, these only exist during the build
+LXC_APT_OFFLINE_INDEX_GUEST_PATH = "/var/lib/vnet-manager/apt"
+LXC_APT_OFFLINE_SOURCE_LIST = "/etc/apt/sources.list.d/vnet-offline.list"
+# How LXC machines are created: "image" unpacks the base image for every machine,
+# "clone" copies a stopped golden container, which is a storage level snapshot on btrfs and zfs pools
+LXC_CREATE_MODE = getenv("VNET_LXC_CREATE_MODE", "image")
+LXC_GOLDEN_CONTAINER_PREFIX = "vnet-golden-"
+# Container config key holding the alias of the base image a golden container was created from
+LXC_GOLDEN_CONTAINER_CONFIG_KEY = "user.vnet.golden"
+# The amount of stopped containers to keep ready for new machines, 0 disables the warm pool
+LXC_WARM_POOL_SIZE = int(getenv("VNET_LXC_WARM_POOL_SIZE", "0"))
+LXC_WARM_POOL_CONTAINER_PREFIX = "vnet-warm-"
+# Container config key holding the fingerprint of the base image a warm pool container was created from
+LXC_WARM_POOL_CONFIG_KEY = "user.vnet.warm"
+# The warm pool is refilled by a detached process after the claims, these are its lock and log file
+LXC_WARM_POOL_REFILL_LOCK = "/run/vnet-manager/warm-pool.lock"
+LXC_WARM_POOL_REFILL_LOG = "/run/vnet-manager/warm-pool.log"
+# Container config key holding the hashes of the files placed on the container, used to skip unchanged files
+LXC_FILE_MANIFEST_CONFIG_KEY = "user.vnet.files"
+# The maximum amount of concurrent in-flight requests to the LXD daemon, also sizes the LXD connection pool
+LXD_MAX_CONCURRENT_REQUESTS = int(getenv("VNET_LXD_MAX_CONCURRENT_REQUESTS", "16"))
 
 # FRR settings
 FRR_RELEASE = "frr-stable"
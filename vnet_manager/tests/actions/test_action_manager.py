@@ -1,5 +1,5 @@
 from os import EX_OK, EX_USAGE
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, ANY
 
 from vnet_manager.tests import VNetTestCase
 from vnet_manager.actions.manager import ActionManager
@@ -22,17 +22,28 @@ class TestActionManager(VNetTestCase):
         self.bring_down_vnet_interfaces = self.set_up_patch("vnet_manager.actions.manager.bring_down_vnet_interfaces")
         self.ensure_vnet_lxc_environment = self.set_up_patch("vnet_manager.actions.manager.ensure_vnet_lxc_environment")
         self.create_machines = self.set_up_patch("vnet_manager.actions.manager.create_machines")
-        self.put_files_on_machine = self.set_up_patch("vnet_manager.actions.manager.put_files_on_machine")
         self.generate_vnet_hosts_file = self.set_up_patch("vnet_manager.actions.manager.generate_vnet_hosts_file")
-        self.place_vnet_hosts_file_on_machines = self.set_up_patch("vnet_manager.actions.manager.place_vnet_hosts_file_on_machines")
-        self.enable_type_specific_machine_configuration = self.set_up_patch(
-            "vnet_manager.actions.manager.enable_type_specific_machine_configuration"
-        )
         self.request_confirmation = self.set_up_patch("vnet_manager.actions.manager.request_confirmation")
+        self.generate_plan = self.set_up_patch("vnet_manager.actions.manager.generate_plan")
+        self.show_plan = self.set_up_patch("vnet_manager.actions.manager.show_plan")
+        self.apply_plan = self.set_up_patch("vnet_manager.actions.manager.apply_plan")
         self.destroy_lxc_image = self.set_up_patch("vnet_manager.actions.manager.destroy_lxc_image")
-        self.destroy_machines = self.set_up_patch("vnet_manager.actions.manager.destroy_machines")
+        self.destroy_lxc_golden_containers = self.set_up_patch("vnet_manager.actions.manager.destroy_lxc_golden_containers")
+        self.destroy_lxc_warm_pool = self.set_up_patch("vnet_manager.actions.manager.destroy_lxc_warm_pool")
+        self.get_lxc_base_image_alias = self.set_up_patch(
+            "vnet_manager.actions.manager.get_lxc_base_image_alias", return_value="vnet-base-image-0123456789ab"
+        )
+        self.destroy_machines = self.set_up_patch("vnet_manager.actions.manager.destroy_machines", return_value=[])
+        self.snapshot_machines = self.set_up_patch("vnet_manager.actions.manager.snapshot_machines", return_value=[])
+        self.reset_machines = self.set_up_patch("vnet_manager.actions.manager.reset_machines", return_value=[])
         self.delete_vnet_interfaces = self.set_up_patch("vnet_manager.actions.manager.delete_vnet_interfaces")
+        self.record_action_duration = self.set_up_patch("vnet_manager.actions.manager.record_action_duration")
+        self.write_lab_metrics = self.set_up_patch("vnet_manager.actions.manager.write_lab_metrics")
         self.cleanup_vnet_lxc_environment = self.set_up_patch("vnet_manager.actions.manager.cleanup_vnet_lxc_environment")
+        self.import_apt_packages = self.set_up_patch("vnet_manager.actions.manager.import_apt_packages")
+        self.export_lxc_image = self.set_up_patch("vnet_manager.actions.manager.export_lxc_image")
+        self.import_lxc_image = self.set_up_patch("vnet_manager.actions.manager.import_lxc_image")
+        self.set_up_patch("vnet_manager.actions.manager.settings.VNET_APT_CACHE_DIR", "/var/cache/vnet-apt")
         self.display_help_for_action = self.set_up_patch("vnet_manager.actions.manager.display_help_for_action")
         self.isfile = self.set_up_patch("vnet_manager.actions.manager.isfile")
         self.isdir = self.set_up_patch("vnet_manager.actions.manager.isdir")
@@ -112,6 +123,14 @@ class TestActionManager(VNetTestCase):
         manager.execute("list")
         self.assertEqual(3, self.show_status.call_count)
 
+    def test_action_manager_shares_provider_statuses_between_configs_with_list_action(self):
+        self.get_yaml_file_from_disk_path.return_value = ["file1", "file2"]
+        self.isfile.return_value = False
+        manager = ActionManager(config_path="blaap")
+        manager.execute("list")
+        first, second = [c[1]["provider_statuses"] for c in self.show_status.call_args_list]
+        self.assertIs(first, second)
+
     def test_action_manager_does_nothing_when_not_file_and_not_dir_with_list_action(self):
         self.isfile.return_value = False
         self.isdir.return_value = False
@@ -160,24 +179,49 @@ class TestActionManager(VNetTestCase):
     def test_action_manager_calls_change_machine_status_with_start_action(self):
         manager = ActionManager(config_path="blaap")
         manager.execute("start")
-        self.change_machine_status.assert_called_once_with(self.validator.updated_config, machines=None, status="start")
+        self.change_machine_status.assert_called_once_with(
+            self.validator.updated_config, machines=None, status="start", parallel=settings.VNET_PARALLEL_WORKERS
+        )
 
     def test_action_manager_calls_change_machine_status_with_start_action_and_machines(self):
         manager = ActionManager(config_path="blaap")
         manager.machines = ["machine"]
         manager.execute("start")
-        self.change_machine_status.assert_called_once_with(self.validator.updated_config, machines=["machine"], status="start")
+        self.change_machine_status.assert_called_once_with(
+            self.validator.updated_config, machines=["machine"], status="start", parallel=settings.VNET_PARALLEL_WORKERS
+        )
 
     def test_action_manager_calls_change_machine_status_with_stop_action(self):
         manager = ActionManager(config_path="blaap")
         manager.execute("stop")
-        self.change_machine_status.assert_called_once_with(self.validator.updated_config, machines=None, status="stop")
+        self.change_machine_status.assert_called_once_with(
+            self.validator.updated_config,
+            machines=None,
+            status="stop",
+            parallel=settings.VNET_PARALLEL_WORKERS,
+            graceful=False,
+            timeout=settings.LXC_STOP_TIMEOUT,
+        )
+
+    def test_action_manager_calls_change_machine_status_with_stop_action_and_graceful(self):
+        manager = ActionManager(config_path="blaap", graceful=True, stop_timeout=5, parallel=2)
+        manager.execute("stop")
+        self.change_machine_status.assert_called_once_with(
+            self.validator.updated_config, machines=None, status="stop", parallel=2, graceful=True, timeout=5
+        )
 
     def test_action_manager_calls_change_machine_status_with_stop_action_and_machines(self):
         manager = ActionManager(config_path="blaap")
         manager.machines = ["machine"]
         manager.execute("stop")
-        self.change_machine_status.assert_called_once_with(self.validator.updated_config, machines=["machine"], status="stop")
+        self.change_machine_status.assert_called_once_with(
+            self.validator.updated_config,
+            machines=["machine"],
+            status="stop",
+            parallel=settings.VNET_PARALLEL_WORKERS,
+            graceful=False,
+            timeout=settings.LXC_STOP_TIMEOUT,
+        )
 
     def test_action_manager_calls_bring_down_vnet_interfaces_with_stop_action(self):
         manager = ActionManager(config_path="blaap")
@@ -198,34 +242,28 @@ class TestActionManager(VNetTestCase):
     def test_action_manager_calls_create_machines_with_create_action(self):
         manager = ActionManager(config_path="blaap")
         manager.execute("create")
-        self.create_machines.assert_called_once_with(self.validator.updated_config, machines=None)
+        self.create_machines.assert_called_once_with(
+            self.validator.updated_config, machines=None, parallel=settings.VNET_PARALLEL_WORKERS, hosts=True
+        )
 
     def test_action_manager_calls_create_machines_with_create_action_and_machines(self):
         manager = ActionManager(config_path="blaap")
         manager.machines = ["machine"]
         manager.execute("create")
-        self.create_machines.assert_called_once_with(self.validator.updated_config, machines=["machine"])
-
-    def test_action_manager_calls_put_files_on_machine_with_create_action(self):
-        manager = ActionManager(config_path="blaap")
-        manager.execute("create")
-        self.put_files_on_machine.assert_called_once_with(self.validator.updated_config)
+        self.create_machines.assert_called_once_with(
+            self.validator.updated_config, machines=["machine"], parallel=settings.VNET_PARALLEL_WORKERS, hosts=True
+        )
 
-    def test_action_manager_calls_place_vnet_hosts_file_on_machines_with_create_action(self):
-        manager = ActionManager(config_path="blaap")
+    def test_action_manager_calls_create_machines_with_create_action_and_parallel(self):
+        manager = ActionManager(config_path="blaap", parallel=4)
         manager.execute("create")
-        self.place_vnet_hosts_file_on_machines.assert_called_once_with(self.validator.updated_config)
+        self.create_machines.assert_called_once_with(self.validator.updated_config, machines=None, parallel=4, hosts=True)
 
     def test_action_manager_calls_generate_vnet_hosts_file_with_create_action(self):
         manager = ActionManager(config_path="blaap")
         manager.execute("create")
         self.generate_vnet_hosts_file.assert_called_once_with(self.validator.updated_config)
 
-    def test_action_manager_calls_enable_type_specific_machine_configuration(self):
-        manager = ActionManager(config_path="blaap")
-        manager.execute("create")
-        self.enable_type_specific_machine_configuration.assert_called_once_with(self.validator.updated_config)
-
     def test_action_manager_calls_ensure_vnet_lxc_environment_with_create_action_and_nohosts(self):
         manager = ActionManager(config_path="blaap", no_hosts=True)
         manager.execute("create")
@@ -234,49 +272,118 @@ class TestActionManager(VNetTestCase):
     def test_action_manager_calls_create_machines_with_create_action_and_nohosts(self):
         manager = ActionManager(config_path="blaap", no_hosts=True)
         manager.execute("create")
-        self.create_machines.assert_called_once_with(self.validator.updated_config, machines=None)
+        self.create_machines.assert_called_once_with(
+            self.validator.updated_config, machines=None, parallel=settings.VNET_PARALLEL_WORKERS, hosts=False
+        )
 
     def test_action_manager_calls_create_machines_with_create_action_and_machines_and_nohosts(self):
         manager = ActionManager(config_path="blaap", no_hosts=True)
         manager.machines = ["machine"]
         manager.execute("create")
-        self.create_machines.assert_called_once_with(self.validator.updated_config, machines=["machine"])
-
-    def test_action_manager_calls_put_files_on_machine_with_create_action_and_nohosts(self):
-        manager = ActionManager(config_path="blaap", no_hosts=True)
-        manager.execute("create")
-        self.put_files_on_machine.assert_called_once_with(self.validator.updated_config)
-
-    def test_action_manager_calls_place_vnet_hosts_file_on_machines_with_create_action_and_nohosts(self):
-        manager = ActionManager(config_path="blaap", no_hosts=True)
-        manager.execute("create")
-        self.assertFalse(self.place_vnet_hosts_file_on_machines.called)
+        self.create_machines.assert_called_once_with(
+            self.validator.updated_config, machines=["machine"], parallel=settings.VNET_PARALLEL_WORKERS, hosts=False
+        )
 
     def test_action_manager_calls_generate_vnet_hosts_file_with_create_action_and_nohosts(self):
         manager = ActionManager(config_path="blaap", no_hosts=True)
         manager.execute("create")
         self.assertFalse(self.generate_vnet_hosts_file.called)
 
-    def test_action_manager_calls_enable_type_specific_machine_configuration_and_nohosts(self):
+    def test_action_manager_calls_generate_plan_with_plan_action(self):
         manager = ActionManager(config_path="blaap", no_hosts=True)
-        manager.execute("create")
-        self.enable_type_specific_machine_configuration.assert_called_once_with(self.validator.updated_config)
+        manager.machines = ["machine"]
+        manager.execute("plan")
+        self.generate_plan.assert_called_once_with(self.validator.updated_config, machines=["machine"], hosts=False)
+
+    def test_action_manager_shows_the_plan_without_applying_it_with_plan_action(self):
+        manager = ActionManager(config_path="blaap")
+        manager.execute("plan")
+        self.show_plan.assert_called_once_with(self.generate_plan.return_value)
+        self.assertFalse(self.apply_plan.called)
+
+    def test_action_manager_applies_the_plan_after_confirmation_with_apply_action(self):
+        manager = ActionManager(config_path="blaap", parallel=4)
+        manager.execute("apply")
+        self.show_plan.assert_called_once_with(self.generate_plan.return_value)
+        self.request_confirmation.assert_called_once_with(prompt="Apply the changes above (y/n)? ")
+        self.apply_plan.assert_called_once_with(self.validator.updated_config, self.generate_plan.return_value, parallel=4, hosts=True)
+
+    def test_action_manager_does_not_apply_an_empty_plan_with_apply_action(self):
+        self.generate_plan.return_value = []
+        manager = ActionManager(config_path="blaap")
+        manager.execute("apply")
+        self.assertFalse(self.request_confirmation.called)
+        self.assertFalse(self.apply_plan.called)
 
     def test_action_manager_calls_destroy_machines_with_destroy_action(self):
         manager = ActionManager(config_path="blaap")
         manager.execute("destroy")
-        self.destroy_machines.assert_called_once_with(self.validator.updated_config, machines=None)
+        self.destroy_machines.assert_called_once_with(self.validator.updated_config, machines=None, parallel=settings.VNET_PARALLEL_WORKERS)
 
     def test_action_manager_calls_cleanup_vnet_lxc_environment_with_clean_action(self):
         manager = ActionManager()
         manager.execute("clean")
         self.cleanup_vnet_lxc_environment.assert_called_once_with()
 
+    def test_action_manager_calls_snapshot_machines_with_snapshot_action(self):
+        manager = ActionManager(config_path="blaap", snapshot="clean", parallel=8)
+        manager.execute("snapshot")
+        self.snapshot_machines.assert_called_once_with(self.validator.updated_config, snapshot="clean", machines=None, parallel=8)
+
+    def test_action_manager_calls_reset_machines_with_reset_action(self):
+        manager = ActionManager(config_path="blaap")
+        manager.machines = ["router100"]
+        manager.execute("reset")
+        self.reset_machines.assert_called_once_with(
+            self.validator.updated_config,
+            snapshot=settings.LXC_DEFAULT_SNAPSHOT_NAME,
+            machines=["router100"],
+            parallel=settings.VNET_PARALLEL_WORKERS,
+        )
+
+    def test_action_manager_calls_export_lxc_image_with_export_image_action(self):
+        manager = ActionManager(config_path="/tmp/image.tar")
+        manager.execute("export-image")
+        self.export_lxc_image.assert_called_once_with("vnet-base-image-0123456789ab", "/tmp/image.tar")
+
+    def test_action_manager_does_not_raise_when_the_image_cannot_be_exported(self):
+        self.export_lxc_image.side_effect = OSError("blaap")
+        manager = ActionManager(config_path="/tmp/image.tar")
+        self.assertEqual(manager.execute("export-image"), EX_OK)
+
+    def test_action_manager_calls_import_lxc_image_with_import_image_action(self):
+        manager = ActionManager(config_path="/tmp/image.tar")
+        manager.execute("import-image")
+        self.import_lxc_image.assert_called_once_with("/tmp/image.tar", alias="vnet-base-image-0123456789ab")
+
+    def test_action_manager_does_not_raise_when_the_image_cannot_be_imported(self):
+        self.import_lxc_image.side_effect = RuntimeError("blaap")
+        manager = ActionManager(config_path="/tmp/image.tar")
+        self.assertEqual(manager.execute("import-image"), EX_OK)
+
+    def test_action_manager_calls_import_apt_packages_with_import_packages_action(self):
+        manager = ActionManager(config_path="/tmp/packages.tar")
+        manager.execute("import-packages")
+        self.import_apt_packages.assert_called_once_with("/tmp/packages.tar")
+
+    def test_action_manager_does_not_import_packages_without_apt_package_cache(self):
+        self.set_up_patch("vnet_manager.actions.manager.settings.VNET_APT_CACHE_DIR", "")
+        manager = ActionManager(config_path="/tmp/packages.tar")
+        manager.execute("import-packages")
+        self.assertFalse(self.import_apt_packages.called)
+
+    def test_action_manager_does_not_raise_when_the_package_bundle_is_invalid(self):
+        self.import_apt_packages.side_effect = RuntimeError("blaap")
+        manager = ActionManager(config_path="/tmp/packages.tar")
+        self.assertEqual(manager.execute("import-packages"), EX_OK)
+
     def test_action_manager_calls_destroy_machines_with_destroy_action_and_machines(self):
         manager = ActionManager(config_path="blaap")
         manager.machines = ["machine"]
         manager.execute("destroy")
-        self.destroy_machines.assert_called_once_with(self.validator.updated_config, machines=["machine"])
+        self.destroy_machines.assert_called_once_with(
+            self.validator.updated_config, machines=["machine"], parallel=settings.VNET_PARALLEL_WORKERS
+        )
         self.assertFalse(self.destroy_lxc_image.called)
 
     def test_action_manager_calls_delete_vnet_interfaces_with_destroy_action(self):
@@ -284,6 +391,17 @@ class TestActionManager(VNetTestCase):
         manager.execute("destroy")
         self.delete_vnet_interfaces.assert_called_once_with(self.validator.updated_config)
 
+    def test_action_manager_calls_destroy_machines_with_destroy_action_and_parallel(self):
+        manager = ActionManager(config_path="blaap", parallel=8)
+        manager.execute("destroy")
+        self.destroy_machines.assert_called_once_with(self.validator.updated_config, machines=None, parallel=8)
+
+    def test_action_manager_does_not_call_delete_vnet_interfaces_when_machines_failed_to_be_destroyed(self):
+        self.destroy_machines.return_value = ["router100"]
+        manager = ActionManager(config_path="blaap")
+        manager.execute("destroy")
+        self.assertFalse(self.delete_vnet_interfaces.called)
+
     def test_action_manager_does_not_call_delete_vnet_interfaces_with_destroy_action_and_machines(self):
         manager = ActionManager(config_path="blaap")
         manager.machines = ["machine"]
@@ -293,9 +411,19 @@ class TestActionManager(VNetTestCase):
     def test_action_manager_calls_destroy_lxc_image_with_destroy_action_and_base_image(self):
         manager = ActionManager(config_path="blaap", base_image=True)
         manager.execute("destroy")
-        self.destroy_lxc_image.assert_called_once_with(settings.LXC_BASE_IMAGE_ALIAS, by_alias=True)
+        self.destroy_lxc_image.assert_called_once_with("vnet-base-image-0123456789ab", by_alias=True)
         self.assertFalse(self.destroy_machines.called)
 
+    def test_action_manager_calls_destroy_lxc_golden_containers_with_destroy_action_and_base_image(self):
+        manager = ActionManager(config_path="blaap", base_image=True)
+        manager.execute("destroy")
+        self.destroy_lxc_golden_containers.assert_called_once_with(alias="vnet-base-image-0123456789ab")
+
+    def test_action_manager_calls_destroy_lxc_warm_pool_with_destroy_action_and_base_image(self):
+        manager = ActionManager(config_path="blaap", base_image=True)
+        manager.execute("destroy")
+        self.destroy_lxc_warm_pool.assert_called_once_with()
+
     def test_action_manager_calls_request_confirmation_with_destroy_action_and_base_image(self):
         manager = ActionManager(config_path="blaap", base_image=True)
         manager.execute("destroy")
@@ -306,3 +434,29 @@ class TestActionManager(VNetTestCase):
         manager.machines = ["1", "2", "3"]
         self.assertEqual(manager.machines, ["1", "2", "3"])
         self.assertIsInstance(ActionManager.machines, property)
+
+    def test_action_manager_does_not_write_metrics_by_default(self):
+        manager = ActionManager(config_path="blaap")
+        manager.execute("create")
+        self.assertFalse(self.record_action_duration.called)
+        self.assertFalse(self.write_lab_metrics.called)
+
+    def test_action_manager_records_the_action_duration_and_writes_metrics(self):
+        self.set_up_patch("vnet_manager.actions.manager.settings.VNET_METRICS_DIR", "/var/lib/node_exporter")
+        manager = ActionManager(config_path="blaap")
+        manager.execute("create")
+        self.record_action_duration.assert_called_once_with(self.validator.updated_config, "create", ANY)
+        self.write_lab_metrics.assert_called_once_with(self.validator.updated_config)
+
+    def test_action_manager_only_writes_metrics_for_actions_without_duration(self):
+        self.set_up_patch("vnet_manager.actions.manager.settings.VNET_METRICS_DIR", "/var/lib/node_exporter")
+        manager = ActionManager(config_path="blaap")
+        manager.execute("show")
+        self.assertFalse(self.record_action_duration.called)
+        self.write_lab_metrics.assert_called_once_with(self.validator.updated_config)
+
+    def test_action_manager_does_not_fail_when_the_metrics_cannot_be_written(self):
+        self.set_up_patch("vnet_manager.actions.manager.settings.VNET_METRICS_DIR", "/var/lib/node_exporter")
+        self.write_lab_metrics.side_effect = PermissionError()
+        manager = ActionManager(config_path="blaap")
+        self.assertEqual(manager.execute("create"), EX_OK)
@@ -21,6 +21,7 @@ class TestGetConfig(VNetTestCase):
     def test_get_config_user_config_takes_precedence_over_defaults_config(self):
         config = get_config("blaap")
         del config["config_dir"]
+        del config["config_path"]
         self.assertEqual(config, settings.CONFIG)
 
     def test_get_config_calls_dirname_function(self):
@@ -30,3 +31,7 @@ class TestGetConfig(VNetTestCase):
     def test_get_config_sets_config_dir_based_on_dirname_function(self):
         config = get_config("blaap")
         self.assertEqual(config["config_dir"], self.config_dir.return_value)
+
+    def test_get_config_sets_config_path_to_the_real_path(self):
+        config = get_config("blaap")
+        self.assertEqual(config["config_path"], realpath("blaap"))
@@ -23,6 +23,9 @@ class TestEnsureVNetLXCEnvironment(VNetTestCase):
         self.create_lxc_image_from_container = self.set_up_patch("vnet_manager.environment.lxc.create_lxc_image_from_container")
         self.destroy_lxc_machine = self.set_up_patch("vnet_manager.environment.lxc.destroy_lxc_machine")
         self.logger = self.set_up_patch("vnet_manager.environment.lxc.logger")
+        self.get_lxc_base_image_alias = self.set_up_patch(
+            "vnet_manager.environment.lxc.get_lxc_base_image_alias", return_value="vnet-base-image-0123456789ab"
+        )
 
     def test_ensure_vnet_lxc_environment_does_nothing_if_no_lxc_machines_in_config(self):
         self.config["machines"] = {}
@@ -53,7 +56,25 @@ class TestEnsureVNetLXCEnvironment(VNetTestCase):
     def test_ensure_vnet_lxc_environment_calls_create_vnet_storage_pool_if_does_not_exist(self):
         self.check_if_lxc_storage_pool_exists.return_value = False
         ensure_vnet_lxc_environment(self.config)
-        self.create_lxc_storage_pool.assert_called_once_with(name=settings.LXC_STORAGE_POOL_NAME, driver=settings.LXC_STORAGE_POOL_DRIVER)
+        self.create_lxc_storage_pool.assert_called_once_with(
+            name=settings.LXC_STORAGE_POOL_NAME,
+            driver=settings.LXC_STORAGE_POOL_DRIVER,
+            source=settings.LXC_STORAGE_POOL_SOURCE,
+            tmpfs=settings.LXC_STORAGE_POOL_TMPFS,
+        )
+
+    def test_ensure_vnet_lxc_environment_does_not_mount_a_tmpfs_for_an_existing_storage_pool_by_default(self):
+        mount_lxc_storage_pool_tmpfs = self.set_up_patch("vnet_manager.environment.lxc.mount_lxc_storage_pool_tmpfs")
+        self.check_if_lxc_storage_pool_exists.return_value = True
+        ensure_vnet_lxc_environment(self.config)
+        self.assertFalse(mount_lxc_storage_pool_tmpfs.called)
+
+    def test_ensure_vnet_lxc_environment_mounts_the_tmpfs_of_an_existing_storage_pool(self):
+        self.set_up_patch("vnet_manager.environment.lxc.settings.LXC_STORAGE_POOL_TMPFS", True)
+        mount_lxc_storage_pool_tmpfs = self.set_up_patch("vnet_manager.environment.lxc.mount_lxc_storage_pool_tmpfs")
+        self.check_if_lxc_storage_pool_exists.return_value = True
+        ensure_vnet_lxc_environment(self.config)
+        mount_lxc_storage_pool_tmpfs.assert_called_once_with(settings.LXC_STORAGE_POOL_TMPFS_PATH, size=settings.LXC_STORAGE_POOL_SIZE)
 
     def test_ensure_vnet_lxc_environment_does_not_call_create_vnet_profile_if_it_exists(self):
         self.check_if_lxc_profile_exists.return_value = True
@@ -74,7 +95,11 @@ class TestEnsureVNetLXCEnvironment(VNetTestCase):
         self.assertFalse(self.configure_lxc_base_machine.called)
         self.assertFalse(self.create_lxc_image_from_container.called)
         self.assertFalse(self.destroy_lxc_machine.called)
-        self.logger.debug.has_calls(call("Base image {} found".format(settings.LXC_BASE_IMAGE_ALIAS)))
+        self.logger.debug.has_calls(call("Base image vnet-base-image-0123456789ab found"))
+
+    def test_ensure_vnet_lxc_environment_checks_for_the_base_image_of_the_current_build_inputs(self):
+        ensure_vnet_lxc_environment(self.config)
+        self.check_if_lxc_image_exists.assert_called_once_with("vnet-base-image-0123456789ab", by_alias=True)
 
     def test_ensure_vnet_lxc_environment_calls_base_image_creation_funtions_when_it_does_not_exist(self):
         self.check_if_lxc_image_exists.return_value = False
@@ -83,7 +108,9 @@ class TestEnsureVNetLXCEnvironment(VNetTestCase):
         self.change_lxc_machine_status.assert_called_once_with(settings.LXC_BASE_IMAGE_MACHINE_NAME, status="start")
         self.configure_lxc_base_machine.assert_called_once_with()
         self.create_lxc_image_from_container.assert_called_once_with(
-            settings.LXC_BASE_IMAGE_MACHINE_NAME, alias=settings.LXC_BASE_IMAGE_ALIAS
+            settings.LXC_BASE_IMAGE_MACHINE_NAME,
+            alias="vnet-base-image-0123456789ab",
+            description="VNet base image built with vnet-base-image-0123456789ab",
         )
         self.destroy_lxc_machine.assert_called_once_with(settings.LXC_BASE_IMAGE_MACHINE_NAME, wait=False)
 
@@ -93,6 +120,9 @@ class TestCleanupVNetLXCEnvironment(VNetTestCase):
         self.confirm = self.set_up_patch("vnet_manager.environment.lxc.request_confirmation")
         self.delete_vnet_lxc_profile = self.set_up_patch("vnet_manager.environment.lxc.delete_vnet_lxc_profile")
         self.delete_lxc_storage_pool = self.set_up_patch("vnet_manager.environment.lxc.delete_lxc_storage_pool")
+        self.destroy_lxc_golden_containers = self.set_up_patch("vnet_manager.environment.lxc.destroy_lxc_golden_containers")
+        self.destroy_lxc_warm_pool = self.set_up_patch("vnet_manager.environment.lxc.destroy_lxc_warm_pool")
+        self.unmount_lxc_storage_pool_tmpfs = self.set_up_patch("vnet_manager.environment.lxc.unmount_lxc_storage_pool_tmpfs")
 
     def test_cleanup_vnet_lxc_environment_calls_correct_functions(self):
         cleanup_vnet_lxc_environment()
@@ -100,6 +130,30 @@ class TestCleanupVNetLXCEnvironment(VNetTestCase):
         self.delete_vnet_lxc_profile.assert_called_once_with(settings.LXC_VNET_PROFILE)
         self.delete_lxc_storage_pool.assert_called_once_with(settings.LXC_STORAGE_POOL_NAME)
 
+    def test_cleanup_vnet_lxc_environment_does_not_unmount_a_tmpfs_by_default(self):
+        cleanup_vnet_lxc_environment()
+        self.assertFalse(self.unmount_lxc_storage_pool_tmpfs.called)
+
+    def test_cleanup_vnet_lxc_environment_unmounts_the_storage_pool_tmpfs(self):
+        self.set_up_patch("vnet_manager.environment.lxc.settings.LXC_STORAGE_POOL_TMPFS", True)
+        cleanup_vnet_lxc_environment()
+        self.unmount_lxc_storage_pool_tmpfs.assert_called_once_with(settings.LXC_STORAGE_POOL_TMPFS_PATH)
+
+    def test_cleanup_vnet_lxc_environment_destroys_the_warm_pool_and_golden_containers_before_the_profile(self):
+        manager = MagicMock()
+        manager.attach_mock(self.destroy_lxc_warm_pool, "destroy_lxc_warm_pool")
+        manager.attach_mock(self.destroy_lxc_golden_containers, "destroy_lxc_golden_containers")
+        manager.attach_mock(self.delete_vnet_lxc_profile, "delete_vnet_lxc_profile")
+        cleanup_vnet_lxc_environment()
+        self.assertEqual(
+            manager.mock_calls,
+            [
+                call.destroy_lxc_warm_pool(),
+                call.destroy_lxc_golden_containers(),
+                call.delete_vnet_lxc_profile(settings.LXC_VNET_PROFILE),
+            ],
+        )
+
 
 class TestConfigureLXCBaseMachine(VNetTestCase):
     def setUp(self) -> None:
@@ -165,3 +219,73 @@ class TestConfigureLXCBaseMachine(VNetTestCase):
     def test_configure_lxc_base_machine_call_machine_stop_(self):
         configure_lxc_base_machine()
         self.machine.stop.assert_called_once_with(wait=True)
+
+    def test_configure_lxc_base_machine_installs_the_guest_packages_from_a_local_repository_when_offline(self):
+        self.set_up_patch("vnet_manager.environment.lxc.settings.VNET_APT_OFFLINE", True)
+        self.set_up_patch("vnet_manager.environment.lxc.get_cached_apt_packages", return_value=["frr_7.5_amd64.deb"])
+        apt_options = "-o Dir::Etc::SourceList={} -o Dir::Etc::SourceParts=- -o APT::Get::List-Cleanup=0".format(
+            settings.LXC_APT_OFFLINE_SOURCE_LIST
+        )
+        configure_lxc_base_machine()
+        self.machine.execute.assert_has_calls(
+            [
+                call(
+                    shlex.split(
+                        "bash -c 'mkdir -p {0} && cd / && apt-ftparchive packages var/cache/apt/archives > {0}/Packages'".format(
+                            settings.LXC_APT_OFFLINE_INDEX_GUEST_PATH
+                        )
+                    )
+                ),
+                call(
+                    shlex.split(
+                        "bash -c 'echo \"deb [trusted=yes] file:/ var/lib/vnet-manager/apt/\" > {}'".format(
+                            settings.LXC_APT_OFFLINE_SOURCE_LIST
+                        )
+                    )
+                ),
+                call(shlex.split("apt-get update {}".format(apt_options))),
+                call(
+                    shlex.split(
+                        "apt-get install -y --no-download {} -o Dpkg::Options::='--force-confdef' -o Dpkg::Options::='--force-confold' "
+                        "{}".format(apt_options, " ".join(settings["PROVIDERS"]["lxc"]["guest_packages"]))
+                    ),
+                    environment={"DEBIAN_FRONTEND": "noninteractive"},
+                ),
+                call(shlex.split("rm -rf {} {}".format(settings.LXC_APT_OFFLINE_SOURCE_LIST, settings.LXC_APT_OFFLINE_INDEX_GUEST_PATH))),
+            ]
+        )
+
+    def test_configure_lxc_base_machine_raises_when_the_local_repository_can_not_be_set_up(self):
+        self.set_up_patch("vnet_manager.environment.lxc.settings.VNET_APT_OFFLINE", True)
+        self.set_up_patch("vnet_manager.environment.lxc.get_cached_apt_packages", return_value=["frr_7.5_amd64.deb"])
+        self.machine.execute.return_value = [127]
+        with self.assertRaises(RuntimeError):
+            configure_lxc_base_machine()
+        self.assertEqual(self.machine.execute.call_count, 1)
+
+    def test_configure_lxc_base_machine_raises_when_the_offline_install_fails(self):
+        self.set_up_patch("vnet_manager.environment.lxc.settings.VNET_APT_OFFLINE", True)
+        self.set_up_patch("vnet_manager.environment.lxc.get_cached_apt_packages", return_value=["frr_7.5_amd64.deb"])
+        self.machine.execute.side_effect = lambda command, **_: [100] if command[:2] == ["apt-get", "install"] else [0]
+        with self.assertRaises(RuntimeError):
+            configure_lxc_base_machine()
+        # The local repository is removed all the same
+        self.machine.execute.assert_called_with(
+            shlex.split("rm -rf {} {}".format(settings.LXC_APT_OFFLINE_SOURCE_LIST, settings.LXC_APT_OFFLINE_INDEX_GUEST_PATH))
+        )
+
+    def test_configure_lxc_base_machine_does_not_use_the_network_when_offline(self):
+        self.set_up_patch("vnet_manager.environment.lxc.settings.VNET_APT_OFFLINE", True)
+        self.set_up_patch("vnet_manager.environment.lxc.get_cached_apt_packages", return_value=["frr_7.5_amd64.deb"])
+        configure_lxc_base_machine()
+        commands = [" ".join(c[0][0]) for c in self.machine.execute.call_args_list]
+        self.assertNotIn("host -t A google.com", commands)
+        self.assertNotIn("apt-get update", commands)
+        self.assertFalse(any("curl" in command for command in commands))
+
+    def test_configure_lxc_base_machine_raises_when_offline_without_cached_packages(self):
+        self.set_up_patch("vnet_manager.environment.lxc.settings.VNET_APT_OFFLINE", True)
+        self.set_up_patch("vnet_manager.environment.lxc.get_cached_apt_packages", return_value=[])
+        with self.assertRaises(RuntimeError):
+            configure_lxc_base_machine()
+        self.assertFalse(self.client.containers.get.called)
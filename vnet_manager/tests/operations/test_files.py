@@ -1,128 +1,242 @@
+import tarfile
 from copy import deepcopy
+from hashlib import sha256
+from io import BytesIO
+from json import dumps, loads
 from unittest.mock import call, patch, mock_open, MagicMock
 from os.path import join
 from pylxd.exceptions import NotFound
 
 from vnet_manager.tests import VNetTestCase
 from vnet_manager.operations.files import (
-    put_files_on_machine,
-    select_files_and_put_on_machine,
-    place_file_on_lxc_machine,
+    add_files_to_bundle,
+    FileBundle,
+    deliver_file_bundle,
+    deliver_file_bundle_to_lxc_machine,
+    put_file_bundle_on_lxc_container,
+    unpack_lxc_file_bundle,
     generate_vnet_hosts_file,
-    place_vnet_hosts_file_on_machines,
     write_file_to_lxc_container,
 )
 from vnet_manager.conf import settings
 
 
-class TestPutFilesOnMachine(VNetTestCase):
-    def setUp(self) -> None:
-        # Use VALIDATED_CONFIG because here the files part has been expanded to the absolute paths
-        self.config = deepcopy(settings.VALIDATED_CONFIG)
-        self.select_and_put_on_machine = self.set_up_patch("vnet_manager.operations.files.select_files_and_put_on_machine")
-
-    def test_put_files_on_machine_gets_file_paths_from_config_and_calls_select_files_and_put_on_machine(self):
-        calls = [
-            call(name, data["files"], settings.MACHINE_TYPE_PROVIDER_MAPPING[data["type"]])
-            for name, data in self.config["machines"].items()
-            if "files" in data
-        ]
-        put_files_on_machine(self.config)
-        self.select_and_put_on_machine.assert_has_calls(calls)
-
-    def test_put_files_on_machine_does_not_call_select_files_and_put_on_machine_when_there_are_no_machines_with_files(self):
-        del self.config["machines"]["router100"]
-        del self.config["machines"]["router101"]
-        put_files_on_machine(self.config)
-        self.assertFalse(self.select_and_put_on_machine.called)
-
-
-class TestSelectFilesAndPutOnMachine(VNetTestCase):
+class TestAddFilesToBundle(VNetTestCase):
     def setUp(self) -> None:
         self.logger = self.set_up_patch("vnet_manager.operations.files.logger")
         self.is_dir = self.set_up_patch("vnet_manager.operations.files.isdir")
         self.is_dir.return_value = True
         self.is_file = self.set_up_patch("vnet_manager.operations.files.isfile")
         self.is_file.return_value = True
-        self.place_file_on_lxc_machine = self.set_up_patch("vnet_manager.operations.files.place_file_on_lxc_machine")
         self.list_dir = self.set_up_patch("vnet_manager.operations.files.listdir")
         self.list_dir.return_value = ["file1", "file2", "file3"]
-        self.machine = "router100"
+        self.bundle = MagicMock()
         self.files = settings.VALIDATED_CONFIG["machines"]["router100"]["files"]
 
-    def test_select_files_and_put_on_machine_calls_check_methods_to_check_for_file_or_dir(self):
+    def test_add_files_to_bundle_calls_check_methods_to_check_for_file_or_dir(self):
         self.is_dir.return_value = False
-        select_files_and_put_on_machine(self.machine, self.files, "lxc")
+        add_files_to_bundle(self.bundle, self.files)
         self.is_dir.assert_called_once_with(next(iter(self.files)))
         self.is_file.assert_called_once_with(next(iter(self.files)))
 
-    def test_select_files_and_put_on_machine_put_a_single_file_on_machine(self):
+    def test_add_files_to_bundle_adds_a_single_file(self):
         self.is_dir.return_value = False
-        select_files_and_put_on_machine(self.machine, self.files, "lxc")
-        self.place_file_on_lxc_machine.assert_called_once_with(self.machine, next(iter(self.files)), next(iter(self.files.values())))
+        add_files_to_bundle(self.bundle, self.files)
+        self.bundle.add_host_file.assert_called_once_with(next(iter(self.files)), next(iter(self.files.values())))
 
-    def test_select_files_and_put_on_machine_calls_listdir_function(self):
-        select_files_and_put_on_machine(self.machine, self.files, "lxc")
+    def test_add_files_to_bundle_calls_listdir_function(self):
+        add_files_to_bundle(self.bundle, self.files)
         self.list_dir.assert_called_once_with(next(iter(self.files)))
 
-    def test_select_files_and_put_on_machine_calls_place_method_for_each_file_in_dir(self):
-        select_files_and_put_on_machine(self.machine, self.files, "lxc")
+    def test_add_files_to_bundle_adds_each_file_in_dir(self):
+        add_files_to_bundle(self.bundle, self.files)
         calls = [
-            call(self.machine, join(next(iter(self.files)), file), join(next(iter(self.files.values())), file))
-            for file in self.list_dir.return_value
+            call(join(next(iter(self.files)), file), join(next(iter(self.files.values())), file)) for file in self.list_dir.return_value
         ]
-        self.place_file_on_lxc_machine.assert_has_calls(calls)
+        self.bundle.add_host_file.assert_has_calls(calls)
 
-    def test_select_files_and_put_on_machine_logs_error_if_file_is_not_a_dir_or_file(self):
+    def test_add_files_to_bundle_logs_error_if_file_is_not_a_dir_or_file(self):
         self.is_dir.return_value = False
         self.is_file.return_value = False
-        select_files_and_put_on_machine(self.machine, self.files, "lxc")
+        add_files_to_bundle(self.bundle, self.files)
         self.logger.error.assert_called_once_with(
             "Tried to select file {} for copying, but it is neither a file nor a directory".format(next(iter(self.files)))
         )
 
 
-class TestPlaceFileOnLXCContainer(VNetTestCase):
+class TestFileBundle(VNetTestCase):
+    def setUp(self) -> None:
+        self.bundle = FileBundle("router100")
+
+    def test_file_bundle_add_encodes_strings(self):
+        self.bundle.add("/etc/hosts", "data")
+        self.assertEqual(self.bundle.files["/etc/hosts"], b"data")
+
+    def test_file_bundle_add_overwrites_earlier_data(self):
+        self.bundle.add("/etc/hosts", b"data")
+        self.bundle.add("/etc/hosts", b"other")
+        self.assertEqual(len(self.bundle), 1)
+        self.assertEqual(self.bundle.files["/etc/hosts"], b"other")
+
+    @patch("builtins.open", new_callable=mock_open, read_data=b"data")
+    def test_file_bundle_add_host_file_reads_the_file_in_binary_mode(self, open_mock):
+        self.bundle.add_host_file("/root/host", "/root/guest")
+        open_mock.assert_called_once_with("/root/host", "rb")
+        self.assertEqual(self.bundle.files["/root/guest"], b"data")
+
+    def test_file_bundle_hashes_returns_the_sha256_of_each_file(self):
+        self.bundle.add("/etc/hosts", "data")
+        self.assertEqual(self.bundle.hashes(), {"/etc/hosts": sha256(b"data").hexdigest()})
+
+    def test_file_bundle_changed_since_returns_new_and_changed_files(self):
+        self.bundle.add("/etc/hosts", "data")
+        self.bundle.add("/etc/frr/frr.conf", "frr")
+        self.bundle.add("/etc/frr/daemons", "daemons")
+        manifest = {"/etc/hosts": sha256(b"data").hexdigest(), "/etc/frr/frr.conf": sha256(b"old").hexdigest()}
+        changed = self.bundle.changed_since(manifest)
+        self.assertEqual(changed.machine, "router100")
+        self.assertEqual(list(changed.files), ["/etc/frr/frr.conf", "/etc/frr/daemons"])
+
+    def test_file_bundle_to_archive_contains_all_files_relative_to_root(self):
+        self.bundle.add("/etc/hosts", "hosts")
+        self.bundle.add("/etc/frr/frr.conf", "frr")
+        with tarfile.open(fileobj=BytesIO(self.bundle.to_archive())) as tar:
+            self.assertEqual(tar.getnames(), ["etc/hosts", "etc/frr/frr.conf"])
+            self.assertEqual(tar.extractfile("etc/frr/frr.conf").read(), b"frr")
+            self.assertEqual(tar.getmember("etc/hosts").mode, 0o644)
+
+
+class TestDeliverFileBundle(VNetTestCase):
+    def setUp(self) -> None:
+        self.deliver_file_bundle_to_lxc_machine = self.set_up_patch("vnet_manager.operations.files.deliver_file_bundle_to_lxc_machine")
+        self.bundle = FileBundle("router100")
+        self.bundle.add("/etc/hosts", "data")
+
+    def test_deliver_file_bundle_calls_the_provider_function(self):
+        ret = deliver_file_bundle(self.bundle, "lxc")
+        self.deliver_file_bundle_to_lxc_machine.assert_called_once_with(self.bundle)
+        self.assertEqual(ret, self.deliver_file_bundle_to_lxc_machine.return_value)
+
+    def test_deliver_file_bundle_does_nothing_for_an_empty_bundle(self):
+        self.assertTrue(deliver_file_bundle(FileBundle("router100"), "lxc"))
+        self.assertFalse(self.deliver_file_bundle_to_lxc_machine.called)
+
+
+class TestDeliverFileBundleToLXCMachine(VNetTestCase):
     def setUp(self) -> None:
         self.get_lxd_client = self.set_up_patch("vnet_manager.operations.files.get_lxd_client")
         self.machine = MagicMock()
+        self.machine.status = "Running"
+        self.machine.execute.return_value = (0, "", "")
+        self.machine.config = {"user.network-config": "disabled"}
         self.get_lxd_client.return_value.containers.get.return_value = self.machine
-        self.is_file = self.set_up_patch("vnet_manager.operations.files.isfile")
-        self.host_file_p = "/root/host"
-        self.guest_file_p = "/root/guest"
-
-    @patch("builtins.open", new_callable=mock_open, read_data="data")
-    def test_place_file_on_lxc_machine_calls_lxd_client(self, _):
-        place_file_on_lxc_machine("router100", self.host_file_p, self.guest_file_p)
-        self.get_lxd_client.assert_called_once_with()
+        self.bundle = FileBundle("router100")
+        self.bundle.add("/etc/hosts", "hosts")
+        self.bundle.add("/etc/frr/frr.conf", "frr")
+
+    def test_deliver_file_bundle_to_lxc_machine_gets_the_container_once(self):
+        deliver_file_bundle_to_lxc_machine(self.bundle)
+        self.get_lxd_client.return_value.containers.get.assert_called_once_with("router100")
+
+    def test_deliver_file_bundle_to_lxc_machine_puts_a_single_archive_on_a_running_container(self):
+        deliver_file_bundle_to_lxc_machine(self.bundle)
+        self.machine.files.put.assert_called_once_with(settings.VNET_FILE_BUNDLE_GUEST_PATH, self.bundle.to_archive())
+
+    def test_deliver_file_bundle_to_lxc_machine_extracts_the_archive(self):
+        self.assertTrue(deliver_file_bundle_to_lxc_machine(self.bundle))
+        self.machine.execute.assert_called_once_with(
+            ["sh", "-c", "tar -xf {0} -C / && rm -f {0}".format(settings.VNET_FILE_BUNDLE_GUEST_PATH)]
+        )
 
-    @patch("builtins.open", new_callable=mock_open, read_data="data")
-    def test_place_file_on_lxc_machine_calls_open(self, open_mock):
-        place_file_on_lxc_machine("router100", self.host_file_p, self.guest_file_p)
-        open_mock.assert_called_once_with(self.host_file_p, "r")
+    def test_deliver_file_bundle_to_lxc_machine_puts_files_one_by_one_if_extraction_fails(self):
+        self.machine.execute.return_value = (1, "", "tar: not found")
+        self.assertTrue(deliver_file_bundle_to_lxc_machine(self.bundle))
+        self.machine.files.put.assert_has_calls([call("/etc/hosts", b"hosts"), call("/etc/frr/frr.conf", b"frr")])
+        self.assertEqual(self.machine.files.put.call_count, 3)
+
+    def test_deliver_file_bundle_to_lxc_machine_leaves_the_archive_on_a_stopped_container(self):
+        self.machine.status = "Stopped"
+        deliver_file_bundle_to_lxc_machine(self.bundle)
+        self.assertFalse(self.machine.execute.called)
+        self.machine.files.put.assert_called_once_with(settings.VNET_FILE_BUNDLE_GUEST_PATH, self.bundle.to_archive())
+
+    def test_deliver_file_bundle_to_lxc_machine_records_the_placed_files_in_the_manifest(self):
+        deliver_file_bundle_to_lxc_machine(self.bundle)
+        self.assertEqual(self.machine.config["user.network-config"], "disabled")
+        self.assertEqual(loads(self.machine.config[settings.LXC_FILE_MANIFEST_CONFIG_KEY]), self.bundle.hashes())
+        self.machine.save.assert_called_once_with(wait=True)
+
+    def test_deliver_file_bundle_to_lxc_machine_skips_files_that_match_the_manifest(self):
+        manifest = {"/etc/hosts": self.bundle.hashes()["/etc/hosts"], "/etc/other": "1234"}
+        self.machine.config[settings.LXC_FILE_MANIFEST_CONFIG_KEY] = dumps(manifest)
+        deliver_file_bundle_to_lxc_machine(self.bundle)
+        changed = FileBundle("router100")
+        changed.add("/etc/frr/frr.conf", "frr")
+        self.machine.files.put.assert_called_once_with(settings.VNET_FILE_BUNDLE_GUEST_PATH, changed.to_archive())
+        manifest.update(self.bundle.hashes())
+        self.assertEqual(loads(self.machine.config[settings.LXC_FILE_MANIFEST_CONFIG_KEY]), manifest)
+
+    def test_deliver_file_bundle_to_lxc_machine_puts_all_files_on_a_stopped_container_with_changes(self):
+        self.machine.config[settings.LXC_FILE_MANIFEST_CONFIG_KEY] = dumps({"/etc/hosts": self.bundle.hashes()["/etc/hosts"]})
+        self.machine.status = "Stopped"
+        deliver_file_bundle_to_lxc_machine(self.bundle)
+        self.machine.files.put.assert_called_once_with(settings.VNET_FILE_BUNDLE_GUEST_PATH, self.bundle.to_archive())
+
+    def test_deliver_file_bundle_to_lxc_machine_does_nothing_if_all_files_match_the_manifest(self):
+        self.machine.config[settings.LXC_FILE_MANIFEST_CONFIG_KEY] = dumps(self.bundle.hashes())
+        self.assertTrue(deliver_file_bundle_to_lxc_machine(self.bundle))
+        self.assertFalse(self.machine.files.put.called)
+        self.assertFalse(self.machine.save.called)
 
-    @patch("builtins.open", new_callable=mock_open, read_data="data")
-    def test_place_file_on_lxc_machine_calls_open_read_function(self, open_mock):
-        place_file_on_lxc_machine("router100", self.host_file_p, self.guest_file_p)
-        handle = open_mock()
-        handle.read.assert_called_once_with()
+    def test_deliver_file_bundle_to_lxc_machine_places_all_files_with_an_invalid_manifest(self):
+        self.machine.config[settings.LXC_FILE_MANIFEST_CONFIG_KEY] = "blaap"
+        deliver_file_bundle_to_lxc_machine(self.bundle)
+        self.machine.files.put.assert_called_once_with(settings.VNET_FILE_BUNDLE_GUEST_PATH, self.bundle.to_archive())
 
-    @patch("builtins.open", new_callable=mock_open, read_data="data")
-    def test_place_file_on_lxc_machine_does_nothing_if_container_not_found(self, _):
-        self.get_lxd_client.side_effect = NotFound(response=b"response")
-        place_file_on_lxc_machine("router100", self.host_file_p, self.guest_file_p)
+    def test_deliver_file_bundle_to_lxc_machine_returns_false_if_container_does_not_exist(self):
+        self.get_lxd_client.return_value.containers.get.side_effect = NotFound(response="blaap")
+        self.assertFalse(deliver_file_bundle_to_lxc_machine(self.bundle))
         self.assertFalse(self.machine.files.put.called)
 
-    @patch("builtins.open", new_callable=mock_open, read_data="data")
-    def test_place_file_on_lxc_machine_does_nothing_if_file_is_not_a_file(self, open_mock):
-        self.is_file.return_value = False
-        place_file_on_lxc_machine("router100", self.host_file_p, self.guest_file_p)
-        self.assertFalse(open_mock.called)
 
-    @patch("builtins.open", new_callable=mock_open, read_data="data")
-    def test_place_file_on_lxc_machine_calls_files_put_method_on_machine(self, _):
-        place_file_on_lxc_machine("router100", self.host_file_p, self.guest_file_p)
-        self.machine.files.put.assert_called_once_with(self.guest_file_p, "data")
+class TestPutFileBundleOnLXCContainer(VNetTestCase):
+    def setUp(self) -> None:
+        self.machine = MagicMock()
+        self.machine.execute.return_value = (0, "", "")
+        self.bundle = FileBundle("router100")
+        self.bundle.add("/etc/hosts", "hosts")
+
+    def test_put_file_bundle_on_lxc_container_extracts_the_archive_on_a_running_container(self):
+        put_file_bundle_on_lxc_container(self.machine, self.bundle)
+        self.machine.files.put.assert_called_once_with(settings.VNET_FILE_BUNDLE_GUEST_PATH, self.bundle.to_archive())
+        self.assertTrue(self.machine.execute.called)
+
+    def test_put_file_bundle_on_lxc_container_only_puts_the_archive_on_a_stopped_container(self):
+        put_file_bundle_on_lxc_container(self.machine, self.bundle, running=False)
+        self.machine.files.put.assert_called_once_with(settings.VNET_FILE_BUNDLE_GUEST_PATH, self.bundle.to_archive())
+        self.assertFalse(self.machine.execute.called)
+        # The container is never fetched, the status of a created container is known
+        self.assertFalse(self.machine.sync.called)
+
+
+class TestUnpackLXCFileBundle(VNetTestCase):
+    def setUp(self) -> None:
+        self.logger = self.set_up_patch("vnet_manager.operations.files.logger")
+        self.machine = MagicMock()
+        self.machine.execute.return_value = (0, "", "")
+
+    def test_unpack_lxc_file_bundle_unpacks_the_archive_and_applies_the_files(self):
+        self.assertTrue(unpack_lxc_file_bundle(self.machine))
+        command = self.machine.execute.call_args[0][0]
+        self.assertEqual(command[:2], ["sh", "-c"])
+        self.assertIn("if [ -f {} ]".format(settings.VNET_FILE_BUNDLE_GUEST_PATH), command[2])
+        self.assertIn("tar -xf {0} -C / && rm -f {0}".format(settings.VNET_FILE_BUNDLE_GUEST_PATH), command[2])
+        self.assertIn(settings.VNET_FILE_BUNDLE_APPLY_COMMAND, command[2])
+
+    def test_unpack_lxc_file_bundle_logs_an_error_when_unpacking_fails(self):
+        self.machine.execute.return_value = (2, "", "tar: invalid archive")
+        self.assertFalse(unpack_lxc_file_bundle(self.machine))
+        self.assertTrue(self.logger.error.called)
 
 
 class TestWriteFilesToLXCContainer(VNetTestCase):
@@ -168,14 +282,3 @@ class TestGenerateVNetHostsFile(VNetTestCase):
         generate_vnet_hosts_file(self.config)
         handle = open_mock()
         handle.write.assert_called_once_with(self.excepted_hosts_file)
-
-
-class TestPlaceVNetHostsFileOnMachines(VNetTestCase):
-    def setUp(self) -> None:
-        self.select_and_put = self.set_up_patch("vnet_manager.operations.files.select_files_and_put_on_machine")
-        self.config = deepcopy(settings.CONFIG)
-
-    def test_place_vnet_hosts_file_on_machines_calls_select_and_put_for_each_machine(self):
-        calls = [call(name, {settings.VNET_ETC_HOSTS_FILE_PATH: "/etc/hosts"}, "lxc") for name in self.config["machines"]]
-        place_vnet_hosts_file_on_machines(self.config)
-        self.select_and_put.assert_has_calls(calls)
@@ -1,8 +1,18 @@
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
 from unittest.mock import MagicMock
 from pylxd.exceptions import NotFound
 
 from vnet_manager.tests import VNetTestCase
-from vnet_manager.operations.image import check_if_lxc_image_exists, create_lxc_image_from_container, destroy_lxc_image
+from vnet_manager.conf import settings
+from vnet_manager.operations.image import (
+    check_if_lxc_image_exists,
+    create_lxc_image_from_container,
+    export_lxc_image,
+    import_lxc_image,
+    destroy_lxc_image,
+)
 
 
 class TestCheckIfLXCImageExists(VNetTestCase):
@@ -57,10 +67,11 @@ class TestCreateLXCImageFromContainer(VNetTestCase):
         self.lxd_client = self.set_up_patch("vnet_manager.operations.image.get_lxd_client")
         self.client = MagicMock()
         self.lxd_client.return_value = self.client
-        self.container = MagicMock()
         self.image = MagicMock()
-        self.client.containers.get.return_value = self.container
-        self.container.publish.return_value = self.image
+        self.client.api.images.post.return_value.json.return_value = {"operation": "/1.0/operations/1"}
+        self.client.operations.wait_for_operation.return_value.metadata = {"fingerprint": "abcd"}
+        self.client.images.get.return_value = self.image
+        self.set_up_patch("vnet_manager.operations.image.settings.LXC_IMAGE_COMPRESSION", "")
 
     def test_create_lxc_image_from_container_call_change_lxc_machine_status(self):
         create_lxc_image_from_container("test")
@@ -70,13 +81,16 @@ class TestCreateLXCImageFromContainer(VNetTestCase):
         create_lxc_image_from_container("test")
         self.lxd_client.assert_called_once_with()
 
-    def test_create_lxc_image_from_container_calls_container_get_method(self):
+    def test_create_lxc_image_from_container_publishes_the_container(self):
         create_lxc_image_from_container("test")
-        self.client.containers.get.assert_called_once_with("test")
+        self.client.api.images.post.assert_called_once_with(json={"public": False, "source": {"type": "container", "name": "test"}})
+        self.client.operations.wait_for_operation.assert_called_once_with("/1.0/operations/1")
+        self.client.images.get.assert_called_once_with("abcd")
 
-    def test_create_lxc_image_from_container_calls_publish_on_container(self):
+    def test_create_lxc_image_from_container_passes_the_compression_algorithm(self):
+        self.set_up_patch("vnet_manager.operations.image.settings.LXC_IMAGE_COMPRESSION", "zstd")
         create_lxc_image_from_container("test")
-        self.container.publish.assert_called_once_with(wait=True)
+        self.assertEqual(self.client.api.images.post.call_args[1]["json"]["compression_algorithm"], "zstd")
 
     def test_create_lxc_image_from_container_does_not_add_alias_by_default(self):
         create_lxc_image_from_container("test")
@@ -87,6 +101,73 @@ class TestCreateLXCImageFromContainer(VNetTestCase):
         create_lxc_image_from_container("test", alias="test_alias", description="test_desc")
         self.image.add_alias.assert_called_once_with("test_alias", "test_desc")
 
+    def test_create_lxc_image_from_container_stores_the_alias_in_the_image_properties(self):
+        create_lxc_image_from_container("test", alias="test_alias")
+        self.assertEqual(self.client.api.images.post.call_args[1]["json"]["properties"], {settings.LXC_IMAGE_ALIAS_PROPERTY: "test_alias"})
+
+
+class TestExportLXCImage(VNetTestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = mkdtemp()
+        self.addCleanup(rmtree, self.tmp_dir)
+        self.client = MagicMock()
+        self.set_up_patch("vnet_manager.operations.image.get_lxd_client", return_value=self.client)
+        self.client.images.get_by_alias.return_value.fingerprint = "abcd"
+        self.response = self.client.api.images.__getitem__.return_value.export.get.return_value
+        self.response.iter_content.return_value = [b"image", b"data"]
+
+    def test_export_lxc_image_streams_the_image_to_the_file(self):
+        export_lxc_image("test", join(self.tmp_dir, "image.tar"))
+        self.client.images.get_by_alias.assert_called_once_with("test")
+        self.client.api.images.__getitem__.assert_called_once_with("abcd")
+        self.client.api.images.__getitem__.return_value.export.get.assert_called_once_with(stream=True)
+        with open(join(self.tmp_dir, "image.tar"), "rb") as fh:
+            self.assertEqual(fh.read(), b"imagedata")
+
+    def test_export_lxc_image_closes_the_response(self):
+        export_lxc_image("test", join(self.tmp_dir, "image.tar"))
+        self.response.close.assert_called_once_with()
+
+
+class TestImportLXCImage(VNetTestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = mkdtemp()
+        self.addCleanup(rmtree, self.tmp_dir)
+        self.path = join(self.tmp_dir, "image.tar")
+        with open(self.path, "wb") as fh:
+            fh.write(b"imagedata")
+        self.client = self.set_up_patch("vnet_manager.operations.image.get_lxd_client").return_value
+        self.client.images.create.return_value.fingerprint = "abcd"
+        self.image = self.client.images.get.return_value
+        self.image.properties = {settings.LXC_IMAGE_ALIAS_PROPERTY: "vnet-base-image-0123456789ab"}
+        self.check_if_image_exists = self.set_up_patch("vnet_manager.operations.image.check_if_lxc_image_exists", return_value=False)
+        self.destroy_lxc_image = self.set_up_patch("vnet_manager.operations.image.destroy_lxc_image")
+
+    def test_import_lxc_image_uploads_the_image_file(self):
+        import_lxc_image(self.path)
+        fh = self.client.images.create.call_args[0][0]
+        self.assertEqual(fh.name, self.path)
+        self.client.images.get.assert_called_once_with("abcd")
+
+    def test_import_lxc_image_restores_the_alias_of_the_image(self):
+        self.assertEqual(import_lxc_image(self.path, alias="blaap"), "vnet-base-image-0123456789ab")
+        self.image.add_alias.assert_called_once_with("vnet-base-image-0123456789ab", "Imported from {}".format(self.path))
+
+    def test_import_lxc_image_uses_the_passed_alias_for_images_without_alias(self):
+        self.image.properties = {}
+        self.assertEqual(import_lxc_image(self.path, alias="blaap"), "blaap")
+
+    def test_import_lxc_image_raises_for_images_without_any_alias(self):
+        self.image.properties = {}
+        with self.assertRaises(RuntimeError):
+            import_lxc_image(self.path)
+        self.assertFalse(self.image.add_alias.called)
+
+    def test_import_lxc_image_replaces_the_existing_image(self):
+        self.check_if_image_exists.return_value = True
+        import_lxc_image(self.path)
+        self.destroy_lxc_image.assert_called_once_with("vnet-base-image-0123456789ab", by_alias=True)
+
 
 class TestDestroyLXCImage(VNetTestCase):
     def setUp(self) -> None:
@@ -1,27 +1,29 @@
-import shlex
-from os.path import join
-from subprocess import DEVNULL, CalledProcessError
-from unittest.mock import Mock, MagicMock, ANY, call
+import errno
+from subprocess import CalledProcessError
+from unittest.mock import Mock, MagicMock, call
 from copy import deepcopy
+from pyroute2.netlink.exceptions import NetlinkError
 
 from vnet_manager.tests import VNetTestCase
 from vnet_manager.operations.interface import (
     get_vnet_interface_names_from_config,
     get_machines_by_vnet_interface_name,
+    get_vnet_link_statuses,
     show_vnet_interface_status,
     show_vnet_veth_interface_status,
     check_if_interface_exists,
     create_vnet_interface,
     create_veth_interface,
-    create_vnet_interface_iptables_rules,
+    get_vnet_iptables_rules,
+    restore_iptables_rules,
+    ensure_vnet_iptables_rules,
+    delete_vnet_iptables_rules,
     configure_vnet_interface,
     configure_veth_interface,
     bring_up_vnet_interfaces,
     ensure_vnet_veth_interfaces,
-    check_if_sniffer_exists,
     bring_down_vnet_interfaces,
     delete_vnet_interfaces,
-    start_tcpdump_on_vnet_interface,
 )
 from vnet_manager.conf import settings
 
@@ -51,27 +53,66 @@ class TestGetMachinesByVNetInterfaceName(VNetTestCase):
             self.assertEqual(get_machines_by_vnet_interface_name(settings.CONFIG, interface), interface_mapping[interface])
 
 
+def link(index: int, ifname: str, state: str = "up", stp: int = None, **attrs) -> MagicMock:
+    mock = MagicMock()
+    attrs = dict({"IFLA_IFNAME": ifname, "IFLA_ADDRESS": "mac{}".format(index)}, **attrs)
+    mock.get_attr.side_effect = attrs.get
+    mock.get_nested.return_value = stp
+    mock.__getitem__.side_effect = {"index": index, "state": state}.__getitem__
+    return mock
+
+
+class TestGetVNetLinkStatuses(VNetTestCase):
+    def setUp(self) -> None:
+        self.iproute = self.set_up_patch("vnet_manager.operations.interface.get_iproute")
+        self.iproute.return_value.get_links.return_value = [
+            link(1, "vnet-br0", stp=1),
+            link(2, "vnet-veth0", IFLA_LINK=3, IFLA_MASTER=1),
+            link(3, "vnet-veth1", state="down", IFLA_LINK=2),
+        ]
+
+    def test_get_vnet_link_statuses_dumps_the_links_once(self):
+        get_vnet_link_statuses()
+        self.iproute.return_value.get_links.assert_called_once_with()
+        self.assertFalse(self.iproute.return_value.link.called)
+
+    def test_get_vnet_link_statuses_indexes_the_links_by_name_and_ifindex(self):
+        by_name, by_index = get_vnet_link_statuses()
+        self.assertEqual(sorted(by_name), ["vnet-br0", "vnet-veth0", "vnet-veth1"])
+        self.assertEqual(sorted(by_index), [1, 2, 3])
+        self.assertIs(by_name["vnet-veth0"], by_index[2])
+
+    def test_get_vnet_link_statuses_parses_the_link_attributes(self):
+        by_name, _ = get_vnet_link_statuses()
+        self.assertEqual(
+            by_name["vnet-veth0"],
+            {"index": 2, "ifname": "vnet-veth0", "state": "up", "address": "mac2", "link": 3, "master": 1, "stp": None},
+        )
+        self.assertEqual(by_name["vnet-br0"]["stp"], 1)
+
+    def test_get_vnet_link_statuses_gets_the_stp_state_from_the_bridge_info(self):
+        get_vnet_link_statuses()
+        self.iproute.return_value.get_links.return_value[0].get_nested.assert_called_once_with(
+            "IFLA_LINKINFO", "IFLA_INFO_DATA", "IFLA_BR_STP_STATE"
+        )
+
+
 class TestShowVNetInterfaceStatus(VNetTestCase):
     def setUp(self) -> None:
-        self.iproute_obj = Mock()
-        self.iproute = self.set_up_patch("vnet_manager.operations.interface.IPRoute")
-        self.iproute.return_value = self.iproute_obj
-        self.iproute_obj.link_lookup.return_value = "dev1"
-        self.ndb_obj = MagicMock()
-        self.ndb = self.set_up_patch("vnet_manager.operations.interface.NDB", themock=MagicMock())
-        self.check_if_sniffer_exists = self.set_up_patch("vnet_manager.operations.interface.check_if_sniffer_exists")
-        self.check_if_sniffer_exists.return_value = True
+        self.iproute = self.set_up_patch("vnet_manager.operations.interface.get_iproute")
+        self.iproute.return_value.get_links.return_value = [link(1, "vnet-br0", stp=1)]
+        self.get_running_sniffers = self.set_up_patch("vnet_manager.operations.interface.get_running_sniffers")
+        self.get_running_sniffers.return_value = {"vnet-br0": 42}
         self.tabulate = self.set_up_patch("vnet_manager.operations.interface.tabulate")
         self.interfaces = self.set_up_patch("vnet_manager.operations.interface.get_vnet_interface_names_from_config")
         self.interfaces.return_value = ["vnet-br0"]
 
-    def test_show_vnet_interface_status_calls_iproute(self):
-        show_vnet_interface_status(settings.CONFIG)
-        self.iproute.assert_called_once_with()
-
-    def test_show_vnet_interface_status_calls_ndb(self):
+    def test_show_vnet_interface_status_dumps_the_links_once(self):
+        self.interfaces.return_value = ["vnet-br{}".format(i) for i in range(500)]
         show_vnet_interface_status(settings.CONFIG)
-        self.ndb.assert_called_once_with(log=False)
+        self.iproute.return_value.get_links.assert_called_once_with()
+        self.assertFalse(self.iproute.return_value.link_lookup.called)
+        self.assertFalse(self.iproute.return_value.link.called)
 
     def test_show_vnet_interfaces_status_calls_get_vnet_interface_names_from_config(self):
         show_vnet_interface_status(settings.CONFIG)
@@ -83,37 +124,39 @@ class TestShowVNetInterfaceStatus(VNetTestCase):
         show_vnet_interface_status(settings.CONFIG)
         machines.assert_called_once_with(settings.CONFIG, self.interfaces.return_value[0])
 
-    def test_show_vnet_interface_status_calls_link_lookup(self):
-        show_vnet_interface_status(settings.CONFIG)
-        self.iproute_obj.link_lookup.assert_called_once_with(ifname=self.interfaces.return_value[0])
-
-    def test_show_vnet_interface_status_calls_check_if_sniffer_exists(self):
+    def test_show_vnet_interface_status_looks_up_the_sniffers_of_existing_interfaces_once(self):
+        self.interfaces.return_value = ["vnet-br0", "vnet-br1"]
         show_vnet_interface_status(settings.CONFIG)
-        self.check_if_sniffer_exists.assert_called_once_with(self.interfaces.return_value[0])
+        self.get_running_sniffers.assert_called_once_with(["vnet-br0"])
 
     def test_show_vnet_interface_status_calls_tabulate(self):
         show_vnet_interface_status(settings.CONFIG)
         self.tabulate.assert_called_once_with(
-            [["vnet-br0", ANY, ANY, self.check_if_sniffer_exists.return_value, True, "router100, router101"]],
+            [["vnet-br0", "up", "mac1", True, True, "router100, router101"]],
             headers=["Name", "Status", "L2_addr", "Sniffer", "STP", "Used by"],
             tablefmt="pretty",
         )
 
+    def test_show_vnet_interface_status_shows_disabled_stp(self):
+        self.iproute.return_value.get_links.return_value = [link(1, "vnet-br0", stp=0)]
+        show_vnet_interface_status(settings.CONFIG)
+        self.assertFalse(self.tabulate.call_args[0][0][0][4])
+
     def test_show_vnet_interface_status_makes_correct_output_if_interface_does_not_exist(self):
-        self.iproute_obj.link_lookup.return_value = []
+        self.iproute.return_value.get_links.return_value = []
         show_vnet_interface_status(settings.CONFIG)
-        self.assertFalse(self.check_if_sniffer_exists.called)
+        self.get_running_sniffers.assert_called_once_with([])
         self.tabulate.assert_called_once_with(
             [["vnet-br0", "NA", "NA", "NA", "NA", "router100, router101"]],
             headers=["Name", "Status", "L2_addr", "Sniffer", "STP", "Used by"],
             tablefmt="pretty",
         )
 
-    def test_show_vnet_interface_status_displays_result_if_check_if_sniffer_exists(self):
-        self.check_if_sniffer_exists.return_value = False
+    def test_show_vnet_interface_status_displays_result_if_no_sniffer_exists(self):
+        self.get_running_sniffers.return_value = {}
         show_vnet_interface_status(settings.CONFIG)
         self.tabulate.assert_called_once_with(
-            [["vnet-br0", ANY, ANY, self.check_if_sniffer_exists.return_value, True, "router100, router101"]],
+            [["vnet-br0", "up", "mac1", False, True, "router100, router101"]],
             headers=["Name", "Status", "L2_addr", "Sniffer", "STP", "Used by"],
             tablefmt="pretty",
         )
@@ -121,48 +164,40 @@ class TestShowVNetInterfaceStatus(VNetTestCase):
 
 class TestShowVNetVethInterfaceStatus(VNetTestCase):
     def setUp(self) -> None:
-        self.iproute_obj = Mock()
-        self.iproute = self.set_up_patch("vnet_manager.operations.interface.IPRoute")
-        self.iproute.return_value = self.iproute_obj
-        self.iproute_obj.link.return_value = [
-            {
-                "state": "up",
-                "attrs": [
-                    ("IFLA_ADDRESS", "mac"),
-                    ("IFLA_LINK", "dev2"),
-                    ("IFLA_IFNAME", "peer"),
-                    ("IFLA_MASTER", "eth0"),
-                    ("IFLA_IFNAME", "master"),
-                ],
-            }
+        self.iproute = self.set_up_patch("vnet_manager.operations.interface.get_iproute")
+        self.iproute.return_value.get_links.return_value = [
+            link(1, "vnet-br0"),
+            link(2, "vnet-br1"),
+            link(3, "vnet-veth0", IFLA_LINK=4, IFLA_MASTER=1),
+            link(4, "vnet-veth1", state="down", IFLA_LINK=3, IFLA_MASTER=2),
         ]
-        self.iproute_obj.link_lookup.return_value = ["dev1"]
         self.tabulate = self.set_up_patch("vnet_manager.operations.interface.tabulate")
 
-    def test_show_vnet_veth_interface_status_calls_iproute(self):
-        show_vnet_veth_interface_status(settings.CONFIG)
-        self.iproute.assert_called_once_with()
-
-    def test_show_vnet_veth_interface_status_calls_ip_lookup(self):
-        calls = [call(ifname=i) for i in settings.CONFIG["veths"]]
+    def test_show_vnet_veth_interface_status_dumps_the_links_once(self):
         show_vnet_veth_interface_status(settings.CONFIG)
-        self.iproute_obj.link_lookup.assert_has_calls(calls)
+        self.iproute.return_value.get_links.assert_called_once_with()
+        self.assertFalse(self.iproute.return_value.link_lookup.called)
+        self.assertFalse(self.iproute.return_value.link.called)
 
-    def test_show_vnet_veth_interface_status_calls_ip_link(self):
+    def test_show_vnet_veth_interface_status_calls_tabulate(self):
         show_vnet_veth_interface_status(settings.CONFIG)
-        calls = [call("get", index="dev1"), call("get", index="dev2"), call("get", index="eth0")]
-        self.iproute_obj.link.assert_has_calls(calls)
+        self.tabulate.assert_called_once_with(
+            [["vnet-veth1", "down", "mac4", "vnet-veth0", "vnet-br1"], ["vnet-veth0", "up", "mac3", "vnet-veth1", "vnet-br0"]],
+            headers=["Name", "Status", "L2_addr", "Peer", "Master"],
+            tablefmt="pretty",
+        )
 
-    def test_show_vnet_veth_interface_status_calls_tabulate(self):
+    def test_show_vnet_veth_interface_status_shows_na_for_an_unknown_peer_and_master(self):
+        self.iproute.return_value.get_links.return_value = [link(3, "vnet-veth0", IFLA_LINK=42), link(4, "vnet-veth1")]
         show_vnet_veth_interface_status(settings.CONFIG)
         self.tabulate.assert_called_once_with(
-            [["vnet-veth1", "up", "mac", "peer", "peer"], ["vnet-veth0", "up", "mac", "peer", "peer"]],
+            [["vnet-veth1", "up", "mac4", "NA", "NA"], ["vnet-veth0", "up", "mac3", "NA", "NA"]],
             headers=["Name", "Status", "L2_addr", "Peer", "Master"],
             tablefmt="pretty",
         )
 
     def test_show_vnet_veth_interface_status_calls_tabulate_when_dev_does_not_exist(self):
-        self.iproute_obj.link_lookup.return_value = []
+        self.iproute.return_value.get_links.return_value = []
         show_vnet_veth_interface_status(settings.CONFIG)
         self.tabulate.assert_called_once_with(
             [["vnet-veth1", "NA", "NA", "NA", "vnet-br1"], ["vnet-veth0", "NA", "NA", "NA", "vnet-br0"]],
@@ -173,7 +208,7 @@ class TestShowVNetVethInterfaceStatus(VNetTestCase):
 
 class TestCheckIfInterfaceExists(VNetTestCase):
     def setUp(self) -> None:
-        self.iproute = self.set_up_patch("vnet_manager.operations.interface.IPRoute")
+        self.iproute = self.set_up_patch("vnet_manager.operations.interface.get_iproute")
         self.iproute.return_value.link_lookup.return_value = [1]
 
     def test_check_if_interface_exists_calls_iproute_lookup(self):
@@ -190,7 +225,7 @@ class TestCheckIfInterfaceExists(VNetTestCase):
 
 class TestCreateVNetInterface(VNetTestCase):
     def setUp(self) -> None:
-        self.iproute = self.set_up_patch("vnet_manager.operations.interface.IPRoute")
+        self.iproute = self.set_up_patch("vnet_manager.operations.interface.get_iproute")
         self.configure_int = self.set_up_patch("vnet_manager.operations.interface.configure_vnet_interface")
 
     def test_create_vnet_interface_calls_iproute_link_add(self):
@@ -204,7 +239,7 @@ class TestCreateVNetInterface(VNetTestCase):
 
 class TestCreateVethInterface(VNetTestCase):
     def setUp(self) -> None:
-        self.iproute = self.set_up_patch("vnet_manager.operations.interface.IPRoute")
+        self.iproute = self.set_up_patch("vnet_manager.operations.interface.get_iproute")
 
     def test_create_veth_interface_calls_iproute_link_add(self):
         create_veth_interface("vnet-veth0", settings.CONFIG["veths"]["vnet-veth0"])
@@ -215,36 +250,150 @@ class TestCreateVethInterface(VNetTestCase):
         self.assertFalse(self.iproute.return_value.link.called)
 
 
-class TestCreateVNetInterfaceIPtablesDropRules(VNetTestCase):
+IPTABLES_SAVE = """# Generated by iptables-save
+*filter
+:INPUT ACCEPT [0:0]
+:OUTPUT ACCEPT [0:0]
+:VNET-OUTPUT - [0:0]
+-A OUTPUT -o eth0 -j DROP
+-A OUTPUT -j VNET-OUTPUT
+-A VNET-OUTPUT -o vnet-br+ -j DROP
+COMMIT
+"""
+
+
+class TestGetVNetIPtablesRules(VNetTestCase):
     def setUp(self) -> None:
-        self.check_call = self.set_up_patch("vnet_manager.operations.interface.check_call")
-        self.check_call.side_effect = [CalledProcessError(1, "test"), 0]
+        self.check_output = self.set_up_patch("vnet_manager.operations.interface.check_output", return_value=IPTABLES_SAVE)
+
+    def test_get_vnet_iptables_rules_reads_the_filter_table_once(self):
+        get_vnet_iptables_rules()
+        self.check_output.assert_called_once_with(["iptables-save", "-t", "filter"], universal_newlines=True)
+
+    def test_get_vnet_iptables_rules_returns_the_vnet_rules(self):
+        self.assertEqual(
+            get_vnet_iptables_rules(),
+            {"jumps": ["-A OUTPUT -j VNET-OUTPUT"], "legacy": [], "chain": ["-A VNET-OUTPUT -o vnet-br+ -j DROP"]},
+        )
+
+    def test_get_vnet_iptables_rules_returns_the_rules_of_older_versions(self):
+        self.check_output.return_value = IPTABLES_SAVE.replace(
+            "-A OUTPUT -j VNET-OUTPUT", "-A OUTPUT -o vnet-br0 -j DROP\n-A OUTPUT -o vnet-br12 -j DROP"
+        )
+        self.assertEqual(get_vnet_iptables_rules()["legacy"], ["-A OUTPUT -o vnet-br0 -j DROP", "-A OUTPUT -o vnet-br12 -j DROP"])
+
+    def test_get_vnet_iptables_rules_returns_no_chain_if_it_does_not_exist(self):
+        self.check_output.return_value = "*filter\n:OUTPUT ACCEPT [0:0]\nCOMMIT\n"
+        self.assertEqual(get_vnet_iptables_rules(), {"jumps": [], "legacy": [], "chain": None})
+
+
+class TestRestoreIPtablesRules(VNetTestCase):
+    def setUp(self) -> None:
+        self.run = self.set_up_patch("vnet_manager.operations.interface.run")
+
+    def test_restore_iptables_rules_calls_iptables_restore_once(self):
+        restore_iptables_rules([":VNET-OUTPUT - [0:0]", "-A VNET-OUTPUT -o vnet-br+ -j DROP"])
+        self.run.assert_called_once_with(
+            ["iptables-restore", "--noflush"],
+            input="*filter\n:VNET-OUTPUT - [0:0]\n-A VNET-OUTPUT -o vnet-br+ -j DROP\nCOMMIT\n",
+            universal_newlines=True,
+            check=True,
+        )
+
+    def test_restore_iptables_rules_raises_if_iptables_restore_fails(self):
+        self.run.side_effect = CalledProcessError(1, "test")
+        with self.assertRaises(CalledProcessError):
+            restore_iptables_rules([])
+
+
+class TestEnsureVNetIPtablesRules(VNetTestCase):
+    def setUp(self) -> None:
+        self.check_output = self.set_up_patch("vnet_manager.operations.interface.check_output", return_value=IPTABLES_SAVE)
+        self.run = self.set_up_patch("vnet_manager.operations.interface.run")
         self.logger = self.set_up_patch("vnet_manager.operations.interface.logger")
 
-    def test_create_vnet_interface_iptables_drop_rules_makes_correct_check_call_calls(self):
-        calls = [
-            call(shlex.split("iptables -C OUTPUT -o dev1 -j DROP"), stderr=DEVNULL),
-            call(shlex.split("iptables -A OUTPUT -o dev1 -j DROP")),
-        ]
-        create_vnet_interface_iptables_rules("dev1")
-        self.check_call.assert_has_calls(calls)
-        self.logger.info.assert_called_once_with("Creating IPtables DROP rule to the outside world for VNet interface dev1")
+    def restored_rules(self) -> list:
+        return self.run.call_args[1]["input"].splitlines()[1:-1]
 
-    def test_create_vnet_interface_iptables_drop_rules_does_not_add_rules_if_they_already_exist(self):
-        self.check_call.side_effect = [0, 0]
-        create_vnet_interface_iptables_rules("dev1")
-        self.check_call.assert_called_once_with(shlex.split("iptables -C OUTPUT -o dev1 -j DROP"), stderr=DEVNULL)
-        self.logger.debug.assert_called_once_with("IPtables DROP rule for VNet interface dev1 already exists, skipping creation")
+    def test_ensure_vnet_iptables_rules_only_reads_the_rules_if_they_are_in_place(self):
+        ensure_vnet_iptables_rules()
+        self.assertEqual(self.check_output.call_count + self.run.call_count, 1)
 
-    def test_create_vnet_interface_iptables_drop_rules_logs_error_if_both_commands_fail(self):
-        self.check_call.side_effect = [CalledProcessError(1, "test"), CalledProcessError(1, "test")]
-        create_vnet_interface_iptables_rules("dev1")
-        self.logger.error.assert_called_once_with("Unable to create IPtables rule, got output: None")
+    def test_ensure_vnet_iptables_rules_creates_the_chain_and_the_jump(self):
+        self.check_output.return_value = "*filter\n:OUTPUT ACCEPT [0:0]\nCOMMIT\n"
+        ensure_vnet_iptables_rules()
+        self.run.assert_called_once()
+        self.assertEqual(self.restored_rules(), [":VNET-OUTPUT - [0:0]", "-A VNET-OUTPUT -o vnet-br+ -j DROP", "-I OUTPUT -j VNET-OUTPUT"])
+
+    def test_ensure_vnet_iptables_rules_does_not_add_the_jump_twice(self):
+        self.check_output.return_value = IPTABLES_SAVE.replace("-A VNET-OUTPUT -o vnet-br+ -j DROP\n", "")
+        ensure_vnet_iptables_rules()
+        self.assertEqual(self.restored_rules(), [":VNET-OUTPUT - [0:0]", "-A VNET-OUTPUT -o vnet-br+ -j DROP"])
+
+    def test_ensure_vnet_iptables_rules_removes_duplicate_jumps(self):
+        self.check_output.return_value = IPTABLES_SAVE.replace(
+            "-A OUTPUT -j VNET-OUTPUT", "-A OUTPUT -j VNET-OUTPUT\n-A OUTPUT -j VNET-OUTPUT"
+        )
+        ensure_vnet_iptables_rules()
+        self.assertEqual(self.restored_rules(), ["-D OUTPUT -j VNET-OUTPUT"])
+
+    def test_ensure_vnet_iptables_rules_removes_the_rules_of_older_versions_in_the_same_restore(self):
+        self.check_output.return_value = IPTABLES_SAVE.replace("-A OUTPUT -j VNET-OUTPUT", "-A OUTPUT -o vnet-br0 -j DROP")
+        ensure_vnet_iptables_rules()
+        self.run.assert_called_once()
+        self.assertEqual(self.restored_rules(), ["-D OUTPUT -o vnet-br0 -j DROP", "-I OUTPUT -j VNET-OUTPUT"])
+
+    def test_ensure_vnet_iptables_rules_logs_error_if_iptables_restore_fails(self):
+        self.check_output.return_value = ""
+        self.run.side_effect = CalledProcessError(1, "test")
+        ensure_vnet_iptables_rules()
+        self.logger.error.assert_called_once_with("Unable to create the IPtables rules, got output: None")
+
+    def test_ensure_vnet_iptables_rules_logs_error_if_iptables_save_fails(self):
+        self.check_output.side_effect = CalledProcessError(1, "test")
+        ensure_vnet_iptables_rules()
+        self.assertFalse(self.run.called)
+        self.logger.error.assert_called_once_with("Unable to create the IPtables rules, got output: None")
+
+
+class TestDeleteVNetIPtablesRules(VNetTestCase):
+    def setUp(self) -> None:
+        self.check_output = self.set_up_patch("vnet_manager.operations.interface.check_output", return_value=IPTABLES_SAVE)
+        self.run = self.set_up_patch("vnet_manager.operations.interface.run")
+        self.logger = self.set_up_patch("vnet_manager.operations.interface.logger")
+
+    def restored_rules(self) -> list:
+        return self.run.call_args[1]["input"].splitlines()[1:-1]
+
+    def test_delete_vnet_iptables_rules_deletes_the_jump_and_the_chain(self):
+        delete_vnet_iptables_rules()
+        self.run.assert_called_once()
+        self.assertEqual(self.restored_rules(), ["-D OUTPUT -j VNET-OUTPUT", ":VNET-OUTPUT - [0:0]", "-X VNET-OUTPUT"])
+
+    def test_delete_vnet_iptables_rules_only_deletes_the_chain_if_there_is_no_jump(self):
+        self.check_output.return_value = IPTABLES_SAVE.replace("-A OUTPUT -j VNET-OUTPUT\n", "")
+        delete_vnet_iptables_rules()
+        self.assertEqual(self.restored_rules(), [":VNET-OUTPUT - [0:0]", "-X VNET-OUTPUT"])
+
+    def test_delete_vnet_iptables_rules_deletes_the_rules_of_older_versions(self):
+        self.check_output.return_value = "*filter\n:OUTPUT ACCEPT [0:0]\n-A OUTPUT -o vnet-br1 -j DROP\nCOMMIT\n"
+        delete_vnet_iptables_rules()
+        self.assertEqual(self.restored_rules(), ["-D OUTPUT -o vnet-br1 -j DROP"])
+
+    def test_delete_vnet_iptables_rules_only_reads_the_rules_if_there_is_nothing_to_delete(self):
+        self.check_output.return_value = "*filter\n:OUTPUT ACCEPT [0:0]\nCOMMIT\n"
+        delete_vnet_iptables_rules()
+        self.assertEqual(self.check_output.call_count + self.run.call_count, 1)
+
+    def test_delete_vnet_iptables_rules_logs_error_if_iptables_restore_fails(self):
+        self.run.side_effect = CalledProcessError(1, "test")
+        delete_vnet_iptables_rules()
+        self.logger.error.assert_called_once_with("Unable to delete the IPtables rules, got output: None")
 
 
 class TestConfigureVNetInterface(VNetTestCase):
     def setUp(self) -> None:
-        self.iproute = self.set_up_patch("vnet_manager.operations.interface.IPRoute")
+        self.iproute = self.set_up_patch("vnet_manager.operations.interface.get_iproute")
         self.iproute_obj = Mock()
         self.iproute.return_value = self.iproute_obj
         self.iproute_obj.link_lookup.return_value = [1]
@@ -274,7 +423,7 @@ class TestConfigureVNetInterface(VNetTestCase):
 
 class TestConfigureVethInterface(VNetTestCase):
     def setUp(self) -> None:
-        self.iproute = self.set_up_patch("vnet_manager.operations.interface.IPRoute")
+        self.iproute = self.set_up_patch("vnet_manager.operations.interface.get_iproute")
         self.iproute_obj = Mock()
         self.iproute.return_value = self.iproute_obj
         self.iproute_obj.link_lookup.side_effect = [[1], [2]]
@@ -296,7 +445,7 @@ class TestConfigureVethInterface(VNetTestCase):
 
 class TestBringUpVNetInterfaces(VNetTestCase):
     def setUp(self) -> None:
-        self.iproute = self.set_up_patch("vnet_manager.operations.interface.IPRoute")
+        self.iproute = self.set_up_patch("vnet_manager.operations.interface.get_iproute")
         self.iproute_obj = Mock()
         self.iproute.return_value = self.iproute_obj
         self.get_vnet_interface_names = self.set_up_patch("vnet_manager.operations.interface.get_vnet_interface_names_from_config")
@@ -304,9 +453,8 @@ class TestBringUpVNetInterfaces(VNetTestCase):
         self.check_if_interface_exists = self.set_up_patch("vnet_manager.operations.interface.check_if_interface_exists")
         self.check_if_interface_exists.return_value = False
         self.create_vnet_interface = self.set_up_patch("vnet_manager.operations.interface.create_vnet_interface")
-        self.create_vnet_interface_block_rules = self.set_up_patch("vnet_manager.operations.interface.create_vnet_interface_iptables_rules")
-        self.check_if_sniffer_exists = self.set_up_patch("vnet_manager.operations.interface.check_if_sniffer_exists")
-        self.check_if_sniffer_exists.return_value = False
+        self.ensure_vnet_iptables_rules = self.set_up_patch("vnet_manager.operations.interface.ensure_vnet_iptables_rules")
+        self.get_running_sniffers = self.set_up_patch("vnet_manager.operations.interface.get_running_sniffers", return_value={})
         self.start_tcpdump_on_interface = self.set_up_patch("vnet_manager.operations.interface.start_tcpdump_on_vnet_interface")
         self.ensure_vnet_veth_interfaces = self.set_up_patch("vnet_manager.operations.interface.ensure_vnet_veth_interfaces")
         self.config = deepcopy(settings.CONFIG)
@@ -333,9 +481,9 @@ class TestBringUpVNetInterfaces(VNetTestCase):
         bring_up_vnet_interfaces(self.config)
         self.assertFalse(self.create_vnet_interface.called)
 
-    def test_bring_up_vnet_interfaces_calls_create_vnet_interface_iptables_rules(self):
+    def test_bring_up_vnet_interfaces_ensures_the_iptables_rules_once(self):
         bring_up_vnet_interfaces(self.config)
-        self.create_vnet_interface_block_rules.assert_has_calls(self.expected_vnet_interface_calls)
+        self.ensure_vnet_iptables_rules.assert_called_once_with()
 
     def test_bring_up_vnet_interfaces_calls_ip_link_to_bring_up_interfaces(self):
         calls = [call("set", ifname=i, state="up") for i in self.get_vnet_interface_names.return_value]
@@ -350,12 +498,16 @@ class TestBringUpVNetInterfaces(VNetTestCase):
         bring_up_vnet_interfaces(self.config, sniffer=True)
         self.start_tcpdump_on_interface.assert_has_calls(self.expected_vnet_interface_calls)
 
-    def test_bring_up_vnet_interfaces_calls_check_if_sniffer_exists(self):
+    def test_bring_up_vnet_interfaces_looks_up_the_sniffers_once(self):
         bring_up_vnet_interfaces(self.config, sniffer=True)
-        self.check_if_sniffer_exists.assert_has_calls(self.expected_vnet_interface_calls)
+        self.get_running_sniffers.assert_called_once_with(["int1", "int2"])
+
+    def test_bring_up_vnet_interfaces_does_not_look_up_the_sniffers_by_default(self):
+        bring_up_vnet_interfaces(self.config)
+        self.assertFalse(self.get_running_sniffers.called)
 
     def test_bring_up_vnet_interfaces_does_not_call_start_sniffer_when_the_sniffer_already_exists(self):
-        self.check_if_sniffer_exists.return_value = True
+        self.get_running_sniffers.return_value = {"int1": 42, "int2": 43}
         bring_up_vnet_interfaces(self.config, sniffer=True)
         self.assertFalse(self.start_tcpdump_on_interface.called)
 
@@ -372,7 +524,7 @@ class TestBringUpVNetInterfaces(VNetTestCase):
 class TestEnsureVNetVethInterfaces(VNetTestCase):
     def setUp(self) -> None:
         self.config = deepcopy(settings.CONFIG)
-        self.ndb = self.set_up_patch("vnet_manager.operations.interface.NDB", themock=MagicMock())
+        self.ndb = self.set_up_patch("vnet_manager.operations.interface.get_ndb", themock=MagicMock())
         self.check_if_interface_exists = self.set_up_patch("vnet_manager.operations.interface.check_if_interface_exists")
         self.check_if_interface_exists.return_value = False
         self.create_veth_interface = self.set_up_patch("vnet_manager.operations.interface.create_veth_interface")
@@ -381,7 +533,7 @@ class TestEnsureVNetVethInterfaces(VNetTestCase):
 
     def test_ensure_vnet_veth_interfaces_calls_ndb(self):
         ensure_vnet_veth_interfaces(self.config)
-        self.ndb.assert_called_with(log=False)
+        self.ndb.assert_called_with()
 
     def test_ensure_vnet_veth_interfaces_set_stp_state_to_correct_state_according_to_config(self):
         ensure_vnet_veth_interfaces(self.config)
@@ -423,33 +575,23 @@ class TestEnsureVNetVethInterfaces(VNetTestCase):
         self.configure_vnet_interface.assert_has_calls(calls)
 
 
-class TestCheckIfSnifferExists(VNetTestCase):
-    def setUp(self) -> None:
-        self.process = Mock()
-        self.process_iter = self.set_up_patch("vnet_manager.operations.interface.process_iter")
-        self.process_iter.return_value = [self.process]
-        self.process.cmdline.return_value = "testprocess testargs"
-
-    def test_check_if_sniffer_exists_returns_false_if_sniffer_does_not_exist(self):
-        self.assertFalse(check_if_sniffer_exists("dev0"))
-
-    def test_check_if_sniffer_exists_returns_true_if_sniffer_exists(self):
-        self.process.cmdline.return_value = "/usr/sbin/tcpdump -i dev1 -n"
-        self.assertTrue(check_if_sniffer_exists("dev1"))
-
-
 class TestBringDownVNetInterfaces(VNetTestCase):
     def setUp(self) -> None:
-        self.iproute = self.set_up_patch("vnet_manager.operations.interface.IPRoute")
+        self.iproute = self.set_up_patch("vnet_manager.operations.interface.get_iproute")
         self.iproute_obj = Mock()
         self.iproute.return_value = self.iproute_obj
         self.check_if_interface_exists = self.set_up_patch("vnet_manager.operations.interface.check_if_interface_exists")
+        self.stop_sniffers = self.set_up_patch("vnet_manager.operations.interface.stop_sniffers")
         self.config = deepcopy(settings.CONFIG)
 
     def test_bring_down_vnet_interfaces_calls_iproute(self):
         bring_down_vnet_interfaces(self.config)
         self.iproute.assert_called_once_with()
 
+    def test_bring_down_vnet_interfaces_stops_the_sniffers(self):
+        bring_down_vnet_interfaces(self.config)
+        self.stop_sniffers.assert_called_once_with(["vnet-br0", "vnet-br1"])
+
     def test_bring_down_vnet_interfaces_check_if_interface_exists_for_each_interface_in_config(self):
         calls = [call("vnet-veth1"), call("vnet-veth0"), call("vnet-br0"), call("vnet-br1")]
         bring_down_vnet_interfaces(self.config)
@@ -484,54 +626,72 @@ class TestBringDownVNetInterfaces(VNetTestCase):
 
 class TestDeleteVNetInterfaces(VNetTestCase):
     def setUp(self) -> None:
-        self.iproute = self.set_up_patch("vnet_manager.operations.interface.IPRoute")
+        self.iproute = self.set_up_patch("vnet_manager.operations.interface.get_iproute")
         self.iproute_obj = Mock()
         self.iproute.return_value = self.iproute_obj
-        self.check_if_interface_exists = self.set_up_patch("vnet_manager.operations.interface.check_if_interface_exists")
+        self.iproute_obj.get_links.return_value = [
+            self.link("lo", 1),
+            self.link("vnet-veth0", 10),
+            self.link("vnet-veth1", 11),
+            self.link("vnet-br0", 12),
+            self.link("vnet-br1", 13),
+        ]
+        self.delete_vnet_iptables_rules = self.set_up_patch("vnet_manager.operations.interface.delete_vnet_iptables_rules")
+        self.stop_sniffers = self.set_up_patch("vnet_manager.operations.interface.stop_sniffers")
         self.config = deepcopy(settings.CONFIG)
 
+    @staticmethod
+    def link(ifname: str, index: int) -> MagicMock:
+        link = MagicMock()
+        link.get_attr.return_value = ifname
+        link.__getitem__.return_value = index
+        return link
+
     def test_delete_vnet_interfaces_calls_iproute(self):
         delete_vnet_interfaces(self.config)
         self.iproute.assert_called_once_with()
 
-    def test_delete_vnet_interfaces_does_nothing_if_interfaces_do_not_exist(self):
-        self.check_if_interface_exists.return_value = False
+    def test_delete_vnet_interfaces_stops_the_sniffers(self):
         delete_vnet_interfaces(self.config)
-        self.assertFalse(self.iproute_obj.link.called)
+        self.stop_sniffers.assert_called_once_with(["vnet-br0", "vnet-br1"])
 
-    def test_delete_vnet_interfaces_check_if_interface_exists_for_each_interface_in_config(self):
-        calls = [call("vnet-veth0"), call("vnet-br0"), call("vnet-br1")]
+    def test_delete_vnet_interfaces_dumps_the_links_once(self):
         delete_vnet_interfaces(self.config)
-        self.check_if_interface_exists.assert_has_calls(calls)
-        self.assertEqual(self.check_if_interface_exists.call_count, 3)
+        self.iproute_obj.get_links.assert_called_once_with()
 
-    def test_delete_vnet_interfaces_does_not_check_veth_interfaces_if_not_in_config(self):
-        calls = [call("vnet-br0"), call("vnet-br1")]
-        del self.config["veths"]
+    def test_delete_vnet_interfaces_does_nothing_if_interfaces_do_not_exist(self):
+        self.iproute_obj.get_links.return_value = [self.link("lo", 1)]
         delete_vnet_interfaces(self.config)
-        self.check_if_interface_exists.assert_has_calls(calls)
-        self.assertEqual(self.check_if_interface_exists.call_count, 2)
+        self.assertFalse(self.iproute_obj.link.called)
 
     def test_delete_vnet_interfaces_calls_ip_link_to_delete_interfaces(self):
-        calls = [call("del", ifname=i) for i in ["vnet-veth0", "vnet-br0", "vnet-br1"]]
+        calls = [call("del", index=i) for i in [10, 12, 13]]
         delete_vnet_interfaces(self.config)
         self.iproute_obj.link.assert_has_calls(calls)
         self.assertEqual(self.iproute_obj.link.call_count, 3)
 
     def test_delete_vnet_interfaces_down_not_delete_veth_interfaces_if_not_in_config(self):
-        calls = [call("del", ifname=i) for i in ["vnet-br0", "vnet-br1"]]
+        calls = [call("del", index=i) for i in [12, 13]]
         del self.config["veths"]
         delete_vnet_interfaces(self.config)
         self.iproute_obj.link.assert_has_calls(calls)
         self.assertEqual(self.iproute_obj.link.call_count, 2)
 
+    def test_delete_vnet_interfaces_ignores_interfaces_that_are_already_gone(self):
+        self.iproute_obj.link.side_effect = [NetlinkError(errno.ENODEV), None, None]
+        delete_vnet_interfaces(self.config)
+        self.assertEqual(self.iproute_obj.link.call_count, 3)
+
+    def test_delete_vnet_interfaces_deletes_the_iptables_rules_when_no_vnet_interfaces_remain(self):
+        delete_vnet_interfaces(self.config)
+        self.delete_vnet_iptables_rules.assert_called_once_with()
 
-class TestStartTcpdumpOnVNetInterface(VNetTestCase):
-    def setUp(self) -> None:
-        self.popen = self.set_up_patch("vnet_manager.operations.interface.Popen")
+    def test_delete_vnet_interfaces_keeps_the_iptables_rules_while_other_vnet_interfaces_remain(self):
+        self.iproute_obj.get_links.return_value.append(self.link("vnet-br2", 14))
+        delete_vnet_interfaces(self.config)
+        self.assertFalse(self.delete_vnet_iptables_rules.called)
 
-    def test_start_tcpdump_on_vnet_interface_makes_correct_popen_call(self):
-        start_tcpdump_on_vnet_interface("dev1")
-        self.popen.assert_called_once_with(
-            shlex.split("tcpdump -i dev1 -U -w {}".format(join(settings.VNET_SNIFFER_PCAP_DIR, "dev1.pcap")))
-        )
+    def test_delete_vnet_interfaces_raises_other_netlink_errors(self):
+        self.iproute_obj.link.side_effect = NetlinkError(errno.EPERM)
+        with self.assertRaises(NetlinkError):
+            delete_vnet_interfaces(self.config)
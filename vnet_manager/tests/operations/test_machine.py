@@ -1,49 +1,129 @@
+import asyncio
 from copy import deepcopy
-from unittest.mock import Mock, MagicMock, call
-from pylxd.exceptions import NotFound
-from yaml import safe_dump
+from json import dumps
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+from threading import Thread
+from unittest.mock import ANY, Mock, MagicMock, call
+from pylxd.exceptions import NotFound, LXDAPIException
+from yaml import safe_dump, safe_load
 
 from vnet_manager.tests import VNetTestCase
 from vnet_manager.conf import settings
 from vnet_manager.operations.machine import (
     show_status,
+    get_machine_statuses,
+    get_lxc_machine_statuses,
+    get_lxc_instances,
     check_if_lxc_machine_exists,
-    get_lxc_machine_status,
     wait_for_lxc_machine_status,
     change_machine_status,
     change_lxc_machine_status,
     create_machines,
     create_lxc_machines_from_base_image,
+    generate_lxc_container_config,
     destroy_machines,
+    destroy_lxc_machines_concurrently,
     destroy_lxc_machine,
-    place_lxc_interface_configuration_on_container,
     generate_machine_netplan_config,
+    render_machine_netplan_config,
     create_lxc_base_image_container,
-    enable_type_specific_machine_configuration,
+    get_lxc_golden_container,
+    destroy_lxc_golden_containers,
+    claim_lxc_warm_pool_container,
+    get_lxc_warm_pool_containers,
+    get_lxc_machine_root_ids,
+    get_lxc_base_image_alias,
+    get_lxc_base_image_build_fingerprint,
+    snapshot_machines,
+    reset_machines,
+    refill_lxc_warm_pool,
+    check_if_lxc_warm_pool_refill_running,
+    start_lxc_warm_pool_refill,
+    run_lxc_warm_pool_refill,
+    destroy_lxc_warm_pool,
     configure_lxc_ip_forwarding,
+    provision_machine,
+    generate_machine_file_bundle,
 )
+from vnet_manager.operations.files import FileBundle
+from vnet_manager.tests.providers.test_lxc_async import FakeLXDServer
 
 
 class TestShowStatus(VNetTestCase):
     def setUp(self) -> None:
         self.tabulate = self.set_up_patch("vnet_manager.operations.machine.tabulate")
-        self.get_lxc_machine_status = self.set_up_patch("vnet_manager.operations.machine.get_lxc_machine_status")
-        self.get_lxc_machine_status.return_value = ["router", "up", "LXC"]
-        self.config = deepcopy(settings.CONFIG)
-        # Only 1 machine for less output
-        self.config["machines"].pop("router101", None)
-        self.config["machines"].pop("host102", None)
+        self.get_machine_statuses = self.set_up_patch("vnet_manager.operations.machine.get_machine_statuses")
+        self.get_machine_statuses.return_value = [["router100", "Running", "LXC"]]
+
+    def test_show_status_calls_get_machine_statuses(self):
+        show_status(settings.CONFIG)
+        self.get_machine_statuses.assert_called_once_with(settings.CONFIG, provider_statuses=None)
 
-    def test_show_status_call_get_lxc_machine_status(self):
-        show_status(self.config)
-        self.get_lxc_machine_status.assert_called_once_with("router100")
+    def test_show_status_passes_provider_statuses(self):
+        show_status(settings.CONFIG, provider_statuses={"lxc": {}})
+        self.get_machine_statuses.assert_called_once_with(settings.CONFIG, provider_statuses={"lxc": {}})
 
     def test_show_status_makes_correct_tabulate_call(self):
-        show_status(self.config)
+        show_status(settings.CONFIG)
         self.tabulate.assert_called_once_with(
-            [self.get_lxc_machine_status.return_value], headers=["Name", "Status", "Provider"], tablefmt="pretty"
+            self.get_machine_statuses.return_value, headers=["Name", "Status", "Provider"], tablefmt="pretty"
+        )
+
+
+class TestGetMachineStatuses(VNetTestCase):
+    def setUp(self) -> None:
+        self.get_lxc_machine_statuses = self.set_up_patch("vnet_manager.operations.machine.get_lxc_machine_statuses")
+        self.get_lxc_machine_statuses.return_value = {"router100": "Running", "router101": "Stopped", "other": "Running"}
+
+    def test_get_machine_statuses_queries_each_provider_once(self):
+        get_machine_statuses(settings.CONFIG)
+        self.get_lxc_machine_statuses.assert_called_once_with()
+
+    def test_get_machine_statuses_joins_statuses_against_the_config(self):
+        self.assertEqual(
+            get_machine_statuses(settings.CONFIG),
+            [["router100", "Running", "LXC"], ["router101", "Stopped", "LXC"], ["host102", "NA", "LXC"]],
         )
 
+    def test_get_machine_statuses_uses_and_fills_the_provider_statuses_cache(self):
+        provider_statuses = {}
+        get_machine_statuses(settings.CONFIG, provider_statuses=provider_statuses)
+        get_machine_statuses(settings.CONFIG, provider_statuses=provider_statuses)
+        self.get_lxc_machine_statuses.assert_called_once_with()
+        self.assertEqual(provider_statuses, {"lxc": self.get_lxc_machine_statuses.return_value})
+
+
+class TestGetLXCMachineStatuses(VNetTestCase):
+    def setUp(self) -> None:
+        self.lxd_client = self.set_up_patch("vnet_manager.operations.machine.get_lxd_client")
+        self.response = self.lxd_client.return_value.api.containers.get.return_value
+        self.response.json.return_value = {
+            "metadata": [{"name": "router100", "status": "Running"}, {"name": "router101", "status": "Stopped"}]
+        }
+
+    def test_get_lxc_machine_statuses_does_a_single_recursive_query(self):
+        get_lxc_machine_statuses()
+        self.lxd_client.return_value.api.containers.get.assert_called_once_with(params={"recursion": 1})
+
+    def test_get_lxc_machine_statuses_returns_status_by_name(self):
+        self.assertEqual(get_lxc_machine_statuses(), {"router100": "Running", "router101": "Stopped"})
+
+
+class TestGetLXCInstances(VNetTestCase):
+    def setUp(self) -> None:
+        self.lxd_client = self.set_up_patch("vnet_manager.operations.machine.get_lxd_client")
+        self.response = self.lxd_client.return_value.api.containers.get.return_value
+        self.response.json.return_value = {"metadata": [{"name": "router100", "status": "Running", "devices": {}}]}
+
+    def test_get_lxc_instances_does_a_single_recursive_query(self):
+        get_lxc_instances()
+        self.lxd_client.return_value.api.containers.get.assert_called_once_with(params={"recursion": 1})
+
+    def test_get_lxc_instances_returns_metadata_by_name(self):
+        self.assertEqual(get_lxc_instances(), {"router100": {"name": "router100", "status": "Running", "devices": {}}})
+
 
 class TestCheckIfLXCMachineExists(VNetTestCase):
     def setUp(self) -> None:
@@ -60,34 +140,13 @@ class TestCheckIfLXCMachineExists(VNetTestCase):
         self.assertFalse(check_if_lxc_machine_exists("test"))
 
 
-class TestGetLXCMachineStatus(VNetTestCase):
-    def setUp(self) -> None:
-        self.machine = Mock()
-        self.lxd_client = self.set_up_patch("vnet_manager.operations.machine.get_lxd_client")
-        self.lxd_client.return_value = self.machine
-
-    def test_get_lxc_machine_calls_lxd_client(self):
-        get_lxc_machine_status("test")
-        self.lxd_client.assert_called_once_with()
-
-    def test_get_lxc_machine_status_calls_get_method(self):
-        get_lxc_machine_status("test")
-        self.machine.containers.get.assert_called_once_with("test")
-
-    def test_get_lxc_machine_status_returns_list_with_status_of_container(self):
-        self.machine.containers.get.return_value.status = "banaan"
-        self.assertEqual(get_lxc_machine_status("test"), ["test", "banaan", "LXC"])
-
-    def test_get_lxc_machine_status_returns_na_on_not_found_exception(self):
-        self.machine.containers.get.side_effect = NotFound(response="blaap")
-        self.assertEqual(get_lxc_machine_status("test"), ["test", "NA", "LXC"])
-
-
 class TestWaitForLXCMachineStatus(VNetTestCase):
     def setUp(self) -> None:
         self.machine = MagicMock()
         self.machine.state.return_value.status = "123"
         self.sleep = self.set_up_patch("vnet_manager.operations.machine.sleep")
+        self.event_monitor = self.set_up_patch("vnet_manager.operations.machine.lxd_event_monitor")
+        self.event_monitor.watch.return_value = None
 
     def test_wait_for_lxc_machine_status_calls_state(self):
         wait_for_lxc_machine_status(self.machine, "123")
@@ -107,10 +166,38 @@ class TestWaitForLXCMachineStatus(VNetTestCase):
         self.machine.state.return_value.status = "RuNNING"
         wait_for_lxc_machine_status(self.machine, "rUNNing")
 
+    def test_wait_for_lxc_machine_status_watches_the_container_for_lifecycle_events(self):
+        wait_for_lxc_machine_status(self.machine, "123")
+        self.event_monitor.watch.assert_called_once_with(self.machine.name)
+        self.event_monitor.unwatch.assert_called_once_with(self.machine.name, None)
+
+    def test_wait_for_lxc_machine_status_waits_for_lifecycle_event_instead_of_sleeping(self):
+        event = Mock()
+        self.event_monitor.watch.return_value = event
+        self.event_monitor.connected = True
+        self.machine.state.return_value.status = "456"
+        with self.assertRaises(TimeoutError):
+            wait_for_lxc_machine_status(self.machine, "123")
+        event.wait.assert_called_once_with(settings.LXC_STATUS_WAIT_SLEEP * settings.LXC_STATUS_BACKOFF_MULTIPLIER)
+        self.assertFalse(self.sleep.called)
+        self.event_monitor.unwatch.assert_called_once_with(self.machine.name, event)
+
+    def test_wait_for_lxc_machine_status_returns_after_lifecycle_event(self):
+        event = Mock()
+        self.event_monitor.watch.return_value = event
+        self.event_monitor.connected = True
+        self.machine.state.side_effect = [Mock(status="Stopped"), Mock(status="Running")]
+        self.set_up_patch("vnet_manager.operations.machine.settings.LXC_MAX_STATUS_WAIT_ATTEMPTS", 5)
+        wait_for_lxc_machine_status(self.machine, "Running")
+        event.wait.assert_called_once()
+        self.assertEqual(self.machine.state.call_count, 2)
+
 
 class TestChangeMachineStatus(VNetTestCase):
     def setUp(self) -> None:
         self.change_lxc_machine_status = self.set_up_patch("vnet_manager.operations.machine.change_lxc_machine_status")
+        self.change_lxc_machine_status.return_value = True
+        self.tabulate = self.set_up_patch("vnet_manager.operations.machine.tabulate")
 
     def test_change_machine_status_raises_not_implemented_error_when_invalid_status(self):
         with self.assertRaises(NotImplementedError):
@@ -118,17 +205,19 @@ class TestChangeMachineStatus(VNetTestCase):
 
     def test_change_machine_status_calls_change_lxc_machine_status_with_machines_from_config(self):
         change_machine_status(settings.CONFIG)
-        calls = [call(m, status="stop") for m in settings.CONFIG["machines"].keys()]
+        calls = [call(m, status="stop", graceful=False, timeout=settings.LXC_STOP_TIMEOUT) for m in settings.CONFIG["machines"].keys()]
         self.change_lxc_machine_status.assert_has_calls(calls)
 
     def test_change_machine_status_calls_change_lxc_machine_status_only_with_given_machine_list(self):
         machines = ["router100"]
         change_machine_status(settings.CONFIG, machines=machines)
-        self.change_lxc_machine_status.assert_called_once_with(machines[0], status="stop")
+        self.change_lxc_machine_status.assert_called_once_with(
+            machines[0], status="stop", graceful=False, timeout=settings.LXC_STOP_TIMEOUT
+        )
 
     def test_change_machine_status_calls_change_lxc_machine_status_with_different_status(self):
         change_machine_status(settings.CONFIG, status="start")
-        calls = [call(m, status="start") for m in settings.CONFIG["machines"].keys()]
+        calls = [call(m, status="start", graceful=False, timeout=settings.LXC_STOP_TIMEOUT) for m in settings.CONFIG["machines"].keys()]
         self.change_lxc_machine_status.assert_has_calls(calls)
 
     def test_change_machine_status_skips_non_existent_machines(self):
@@ -136,6 +225,30 @@ class TestChangeMachineStatus(VNetTestCase):
         change_machine_status(settings.CONFIG, machines=machines)
         self.assertFalse(self.change_lxc_machine_status.called)
 
+    def test_change_machine_status_passes_graceful_and_timeout(self):
+        change_machine_status(settings.CONFIG, machines=["router100"], graceful=True, timeout=5)
+        self.change_lxc_machine_status.assert_called_once_with("router100", status="stop", graceful=True, timeout=5)
+
+    def test_change_machine_status_changes_all_machines_with_multiple_workers(self):
+        change_machine_status(settings.CONFIG, status="start", parallel=3)
+        self.assertEqual(self.change_lxc_machine_status.call_count, 3)
+
+    def test_change_machine_status_prints_result_table_in_machine_order(self):
+        self.change_lxc_machine_status.side_effect = lambda machine, **kwargs: machine != "router101"
+        change_machine_status(settings.CONFIG, status="start")
+        self.tabulate.assert_called_once_with(
+            [["router100", "start", "OK"], ["router101", "start", "FAILED"], ["host102", "start", "OK"]],
+            headers=["Name", "Action", "Result"],
+            tablefmt="pretty",
+        )
+
+    def test_change_machine_status_reports_api_errors_as_failed(self):
+        response = Mock(status_code=500)
+        response.json.return_value = {"error": "blaap"}
+        self.change_lxc_machine_status.side_effect = LXDAPIException(response)
+        change_machine_status(settings.CONFIG, machines=["router100"])
+        self.tabulate.assert_called_once_with([["router100", "stop", "FAILED"]], headers=["Name", "Action", "Result"], tablefmt="pretty")
+
 
 class TestChangeLXCMachineStatus(VNetTestCase):
     def setUp(self) -> None:
@@ -146,22 +259,40 @@ class TestChangeLXCMachineStatus(VNetTestCase):
         self.client.containers.get.return_value = self.machine
         self.sleep = self.set_up_patch("vnet_manager.operations.machine.sleep")
         self.wait_for_lxc_machine_status = self.set_up_patch("vnet_manager.operations.machine.wait_for_lxc_machine_status")
+        self.unpack_lxc_file_bundle = self.set_up_patch("vnet_manager.operations.machine.unpack_lxc_file_bundle", return_value=True)
 
     def test_change_lxc_machine_status_calls_lxd_client(self):
         change_lxc_machine_status("banaan")
         self.lxd_client.assert_called_once_with()
 
-    def test_change_lxc_machine_status_calls_sleep(self):
+    def test_change_lxc_machine_status_does_not_call_sleep(self):
         change_lxc_machine_status("banaan")
-        self.sleep.assert_called_once_with(1)
+        self.assertFalse(self.sleep.called)
 
     def test_change_lxc_machine_status_calls_containers_get(self):
         change_lxc_machine_status("banaan")
         self.client.containers.get.assert_called_once_with("banaan")
 
-    def test_change_lxc_machine_status_calls_machine_stop_by_default(self):
+    def test_change_lxc_machine_status_calls_forced_machine_stop_by_default(self):
         change_lxc_machine_status("banaan")
-        self.machine.stop.assert_called_once_with()
+        self.machine.stop.assert_called_once_with(force=True)
+
+    def test_change_lxc_machine_status_calls_graceful_machine_stop_when_passed(self):
+        change_lxc_machine_status("banaan", graceful=True)
+        self.machine.stop.assert_called_once_with(timeout=settings.LXC_STOP_TIMEOUT, force=False, wait=True)
+
+    def test_change_lxc_machine_status_forces_stop_when_graceful_stop_fails(self):
+        response = Mock(status_code=500)
+        response.json.return_value = {"error": "blaap"}
+        self.machine.stop.side_effect = [LXDAPIException(response), None]
+        self.assertTrue(change_lxc_machine_status("banaan", graceful=True, timeout=5))
+        self.machine.stop.assert_has_calls([call(timeout=5, force=False, wait=True), call(force=True)])
+
+    def test_change_lxc_machine_status_does_nothing_when_machine_already_in_requested_state(self):
+        self.machine.status = "Stopped"
+        self.assertTrue(change_lxc_machine_status("banaan"))
+        self.assertFalse(self.machine.stop.called)
+        self.assertFalse(self.wait_for_lxc_machine_status.called)
 
     def test_change_lxc_machine_status_does_not_call_start_by_default(self):
         change_lxc_machine_status("banaan")
@@ -169,7 +300,7 @@ class TestChangeLXCMachineStatus(VNetTestCase):
 
     def test_change_lxc_machine_status_deals_with_not_found_error(self):
         self.client.containers.get.side_effect = NotFound(response="blaap")
-        change_lxc_machine_status("banaan")
+        self.assertFalse(change_lxc_machine_status("banaan"))
         self.assertFalse(self.machine.stop.called)
         self.assertFalse(self.machine.start.called)
         self.assertFalse(self.wait_for_lxc_machine_status.called)
@@ -178,6 +309,31 @@ class TestChangeLXCMachineStatus(VNetTestCase):
         change_lxc_machine_status("banaan", status="start")
         self.machine.start.assert_called_once_with(wait=True)
 
+    def test_change_lxc_machine_status_returns_false_when_start_fails(self):
+        response = Mock(status_code=500)
+        response.json.return_value = {"error": "blaap"}
+        self.machine.start.side_effect = LXDAPIException(response)
+        self.assertFalse(change_lxc_machine_status("banaan", status="start"))
+        self.assertFalse(self.wait_for_lxc_machine_status.called)
+
+    def test_change_lxc_machine_status_unpacks_the_file_bundle_after_start(self):
+        self.assertTrue(change_lxc_machine_status("banaan", status="start"))
+        self.unpack_lxc_file_bundle.assert_called_once_with(self.machine)
+
+    def test_change_lxc_machine_status_returns_false_when_the_file_bundle_cannot_be_unpacked(self):
+        self.unpack_lxc_file_bundle.return_value = False
+        self.assertFalse(change_lxc_machine_status("banaan", status="start"))
+
+    def test_change_lxc_machine_status_unpacks_the_file_bundle_when_machine_already_running(self):
+        self.machine.status = "Running"
+        self.assertTrue(change_lxc_machine_status("banaan", status="start"))
+        self.assertFalse(self.machine.start.called)
+        self.unpack_lxc_file_bundle.assert_called_once_with(self.machine)
+
+    def test_change_lxc_machine_status_does_not_unpack_the_file_bundle_on_stop(self):
+        change_lxc_machine_status("banaan", status="stop")
+        self.assertFalse(self.unpack_lxc_file_bundle.called)
+
     def test_change_lxc_machine_status_does_not_call_stop_when_start_passed(self):
         change_lxc_machine_status("banaan", status="start")
         self.assertFalse(self.machine.stop.called)
@@ -192,7 +348,10 @@ class TestChangeLXCMachineStatus(VNetTestCase):
 
     def test_change_lxc_machine_status_catches_timeout_error(self):
         self.wait_for_lxc_machine_status.side_effect = TimeoutError()
-        change_lxc_machine_status("banaan")
+        self.assertFalse(change_lxc_machine_status("banaan"))
+
+    def test_change_lxc_machine_status_returns_true_on_success(self):
+        self.assertTrue(change_lxc_machine_status("banaan", status="start"))
 
 
 class TestCreateMachines(VNetTestCase):
@@ -201,11 +360,25 @@ class TestCreateMachines(VNetTestCase):
 
     def test_create_machines_calls_create_lxc_machines_with_config_machines(self):
         create_machines(settings.CONFIG)
-        self.create_lxc_machines_from_base_image.assert_called_once_with(settings.CONFIG, settings.CONFIG["machines"].keys())
+        self.create_lxc_machines_from_base_image.assert_called_once_with(
+            settings.CONFIG, settings.CONFIG["machines"].keys(), parallel=settings.VNET_PARALLEL_WORKERS, hosts=True
+        )
 
     def test_create_machines_calls_create_lxc_machine_with_custom_machine_list(self):
         create_machines(settings.CONFIG, machines=["test1", "test2"])
-        self.create_lxc_machines_from_base_image.assert_called_once_with(settings.CONFIG, ["test1", "test2"])
+        self.create_lxc_machines_from_base_image.assert_called_once_with(
+            settings.CONFIG, ["test1", "test2"], parallel=settings.VNET_PARALLEL_WORKERS, hosts=True
+        )
+
+    def test_create_machines_calls_create_lxc_machine_with_parallel_workers(self):
+        create_machines(settings.CONFIG, machines=["test1"], parallel=4)
+        self.create_lxc_machines_from_base_image.assert_called_once_with(settings.CONFIG, ["test1"], parallel=4, hosts=True)
+
+    def test_create_machines_calls_create_lxc_machine_without_hosts(self):
+        create_machines(settings.CONFIG, machines=["test1"], hosts=False)
+        self.create_lxc_machines_from_base_image.assert_called_once_with(
+            settings.CONFIG, ["test1"], parallel=settings.VNET_PARALLEL_WORKERS, hosts=False
+        )
 
 
 class TestCreateLXCMachinesFromBaseImage(VNetTestCase):
@@ -215,16 +388,20 @@ class TestCreateLXCMachinesFromBaseImage(VNetTestCase):
         self.lxd_client = self.set_up_patch("vnet_manager.operations.machine.get_lxd_client")
         self.client = Mock()
         self.lxd_client.return_value = self.client
-        self.place_lxc_interface_configuration_on_container = self.set_up_patch(
-            "vnet_manager.operations.machine.place_lxc_interface_configuration_on_container"
-        )
+        self.provision_machine = self.set_up_patch("vnet_manager.operations.machine.provision_machine")
+        self.generate_machine_file_bundle = self.set_up_patch("vnet_manager.operations.machine.generate_machine_file_bundle")
+        self.generate_machine_file_bundle.side_effect = self.generate_bundle
+        self.put_file_bundle = self.set_up_patch("vnet_manager.operations.machine.put_file_bundle_on_lxc_container")
         self.request_confirm = self.set_up_patch("vnet_manager.operations.machine.request_confirmation")
         self.config = deepcopy(settings.CONFIG)
         self.excepted_config = {
             "name": "router100",
-            "source": {"alias": settings.LXC_BASE_IMAGE_ALIAS, "type": "image"},
+            "source": {"alias": get_lxc_base_image_alias(), "type": "image"},
             "ephemeral": False,
-            "config": {"user.network-config": "disabled"},
+            "config": {
+                "user.network-config": "disabled",
+                settings.LXC_FILE_MANIFEST_CONFIG_KEY: dumps(self.generate_bundle(self.config, "router100").hashes(), sort_keys=True),
+            },
             "devices": {
                 "eth0": {"type": "none"},
                 "eth12": {
@@ -239,28 +416,65 @@ class TestCreateLXCMachinesFromBaseImage(VNetTestCase):
             "profiles": [settings.LXC_VNET_PROFILE],
         }
 
+    @staticmethod
+    def generate_bundle(_, machine: str, hosts: bool = True) -> FileBundle:
+        bundle = FileBundle(machine)
+        bundle.add("/etc/hostname", machine)
+        if hosts:
+            bundle.add("/etc/hosts", "hosts")
+        return bundle
+
+    def placed_bundles(self) -> list:
+        return sorted((args[1].machine, kwargs["running"]) for args, kwargs in self.put_file_bundle.call_args_list)
+
+    def set_up_warm_pool(self, containers: list) -> Mock:
+        self.set_up_patch("vnet_manager.operations.machine.settings.LXC_WARM_POOL_SIZE", 2)
+        self.set_up_patch("vnet_manager.operations.machine.get_lxc_warm_pool_containers", return_value=containers)
+        self.check_refill = self.set_up_patch("vnet_manager.operations.machine.check_if_lxc_warm_pool_refill_running")
+        self.check_refill.return_value = False
+        return self.set_up_patch("vnet_manager.operations.machine.start_lxc_warm_pool_refill")
+
     def test_create_lxc_machines_from_base_image_calls_lxc_client(self):
         create_lxc_machines_from_base_image(settings.CONFIG, ["router100", "router101"])
         self.lxd_client.assert_called_once_with()
 
-    def test_create_lxc_machines_from_base_image_does_nothing_if_machines_already_exist(self):
+    def test_create_lxc_machines_from_base_image_only_provisions_machines_that_already_exist(self):
         self.check_if_lxc_machine_exists.return_value = True
         create_lxc_machines_from_base_image(self.config, ["router100", "router101"])
-        self.assertFalse(self.place_lxc_interface_configuration_on_container.called)
         self.assertFalse(self.client.containers.create.called)
+        self.assertEqual(self.provision_machine.call_count, 2)
+        self.provision_machine.assert_any_call(self.config, "router101", hosts=True)
+
+    def test_create_lxc_machines_from_base_image_asks_confirmation_before_provisioning_existing_machines(self):
+        self.check_if_lxc_machine_exists.return_value = True
+        self.request_confirm.side_effect = SystemExit
+        with self.assertRaises(SystemExit):
+            create_lxc_machines_from_base_image(self.config, ["router100"])
+        self.assertFalse(self.provision_machine.called)
 
     def test_create_lxc_machines_from_base_image_calls_containers_create_method(self):
         create_lxc_machines_from_base_image(self.config, ["router100"])
         self.client.containers.create.assert_called_once_with(self.excepted_config, wait=True)
 
-    def test_create_lxc_machines_from_base_image_calls_place_lxc_interface_configuration_on_container(self):
+    def test_create_lxc_machines_from_base_image_places_the_files_on_the_created_container(self):
         create_lxc_machines_from_base_image(self.config, ["router100"])
-        self.place_lxc_interface_configuration_on_container.assert_called_once_with(self.config, "router100")
+        self.generate_machine_file_bundle.assert_called_once_with(self.config, "router100", hosts=True)
+        self.put_file_bundle.assert_called_once_with(self.client.containers.create.return_value, ANY, running=False)
+        self.assertEqual(self.placed_bundles(), [("router100", False)])
+        self.assertFalse(self.provision_machine.called)
+
+    def test_create_lxc_machines_from_base_image_places_the_files_without_hosts(self):
+        create_lxc_machines_from_base_image(self.config, ["router100"], hosts=False)
+        self.generate_machine_file_bundle.assert_called_once_with(self.config, "router100", hosts=False)
+        self.excepted_config["config"][settings.LXC_FILE_MANIFEST_CONFIG_KEY] = dumps(
+            self.generate_bundle(self.config, "router100", hosts=False).hashes(), sort_keys=True
+        )
+        self.client.containers.create.assert_called_once_with(self.excepted_config, wait=True)
 
     def test_create_lxc_machine_from_base_image_calls_create_functions_on_the_basis_of_the_number_of_containers(self):
         create_lxc_machines_from_base_image(self.config, ["router100", "router101", "host102"])
         self.assertEqual(self.client.containers.create.call_count, 3)
-        self.assertEqual(self.place_lxc_interface_configuration_on_container.call_count, 3)
+        self.assertEqual(self.placed_bundles(), [("host102", False), ("router100", False), ("router101", False)])
 
     def test_create_lxc_machines_from_base_image_calls_request_confirmation_if_containers_already_created(self):
         self.check_if_lxc_machine_exists.return_value = True
@@ -270,11 +484,147 @@ class TestCreateLXCMachinesFromBaseImage(VNetTestCase):
             "host and user config files on those containers"
         )
 
+    def test_create_lxc_machines_from_base_image_creates_all_containers_with_multiple_workers(self):
+        create_lxc_machines_from_base_image(self.config, ["router100", "router101", "host102"], parallel=3)
+        self.assertEqual(self.client.containers.create.call_count, 3)
+        self.assertEqual(self.put_file_bundle.call_count, 3)
+
+    def test_create_lxc_machines_from_base_image_continues_after_failed_container(self):
+        response = Mock(status_code=500)
+        response.json.return_value = {"error": "blaap"}
+        self.client.containers.create.side_effect = [LXDAPIException(response), None]
+        ret = create_lxc_machines_from_base_image(self.config, ["router100", "router101"])
+        self.assertEqual(self.client.containers.create.call_count, 2)
+        self.assertEqual(self.placed_bundles(), [("router101", False)])
+        self.assertEqual(ret, ["router100"])
+
+    def test_create_lxc_machines_from_base_image_continues_after_a_non_lxd_error(self):
+        def generate_bundle(config, machine, hosts=True):
+            if machine == "router100":
+                raise FileNotFoundError("/root/missing")
+            return self.generate_bundle(config, machine, hosts=hosts)
+
+        self.generate_machine_file_bundle.side_effect = generate_bundle
+        ret = create_lxc_machines_from_base_image(self.config, ["router100", "router101"])
+        self.assertEqual(self.placed_bundles(), [("router101", False)])
+        self.assertEqual(ret, ["router100"])
+
+    def test_create_lxc_machines_from_base_image_returns_empty_list_when_all_containers_created(self):
+        self.assertEqual(create_lxc_machines_from_base_image(self.config, ["router100"]), [])
+
+    def test_create_lxc_machines_from_base_image_does_not_use_a_golden_container_by_default(self):
+        get_lxc_golden_container = self.set_up_patch("vnet_manager.operations.machine.get_lxc_golden_container")
+        create_lxc_machines_from_base_image(self.config, ["router100"])
+        self.assertFalse(get_lxc_golden_container.called)
+
+    def test_create_lxc_machines_from_base_image_clones_the_golden_container_in_clone_mode(self):
+        self.set_up_patch("vnet_manager.operations.machine.settings.LXC_CREATE_MODE", "clone")
+        get_lxc_golden_container = self.set_up_patch("vnet_manager.operations.machine.get_lxc_golden_container")
+        get_lxc_golden_container.return_value = "vnet-golden-blaap"
+        create_lxc_machines_from_base_image(self.config, ["router100", "router101"])
+        get_lxc_golden_container.assert_called_once_with()
+        self.excepted_config["source"] = {"source": "vnet-golden-blaap", "type": "copy", "container_only": True}
+        self.excepted_config["config"][settings.LXC_GOLDEN_CONTAINER_CONFIG_KEY] = ""
+        self.client.containers.create.assert_any_call(self.excepted_config, wait=True)
+
+    def test_create_lxc_machines_from_base_image_does_not_use_the_warm_pool_by_default(self):
+        get_lxc_warm_pool_containers = self.set_up_patch("vnet_manager.operations.machine.get_lxc_warm_pool_containers")
+        start_refill = self.set_up_patch("vnet_manager.operations.machine.start_lxc_warm_pool_refill")
+        create_lxc_machines_from_base_image(self.config, ["router100"])
+        self.assertFalse(get_lxc_warm_pool_containers.called)
+        self.assertFalse(start_refill.called)
+
+    def test_create_lxc_machines_from_base_image_claims_warm_pool_containers(self):
+        self.set_up_warm_pool(["vnet-warm-aaaa"])
+        claim = self.set_up_patch("vnet_manager.operations.machine.claim_lxc_warm_pool_container")
+        create_lxc_machines_from_base_image(self.config, ["router100", "router101"])
+        claim.assert_called_once_with(self.client, "vnet-warm-aaaa", self.excepted_config)
+        # There is only one warm container, the other machine is created from the base image
+        self.assertEqual(self.client.containers.create.call_count, 1)
+        self.put_file_bundle.assert_any_call(claim.return_value, ANY, running=False)
+        self.assertEqual(self.placed_bundles(), [("router100", False), ("router101", False)])
+
+    def test_create_lxc_machines_from_base_image_refills_the_warm_pool_in_the_background(self):
+        start_refill = self.set_up_warm_pool(["vnet-warm-aaaa"])
+        self.set_up_patch("vnet_manager.operations.machine.claim_lxc_warm_pool_container")
+        create_lxc_machines_from_base_image(self.config, ["router100"], parallel=3)
+        start_refill.assert_called_once_with(golden=None, parallel=3)
+
+    def test_create_lxc_machines_from_base_image_refills_the_warm_pool_after_claiming(self):
+        start_refill = self.set_up_warm_pool(["vnet-warm-aaaa", "vnet-warm-bbbb"])
+        claim = self.set_up_patch("vnet_manager.operations.machine.claim_lxc_warm_pool_container")
+        manager = Mock()
+        manager.attach_mock(claim, "claim")
+        manager.attach_mock(start_refill, "start_refill")
+        create_lxc_machines_from_base_image(self.config, ["router100", "router101"])
+        self.assertEqual([name for name, _, _ in manager.mock_calls], ["claim", "claim", "start_refill"])
+
+    def test_create_lxc_machines_from_base_image_does_not_claim_while_the_warm_pool_is_refilled(self):
+        self.set_up_warm_pool(["vnet-warm-aaaa"])
+        self.check_refill.return_value = True
+        claim = self.set_up_patch("vnet_manager.operations.machine.claim_lxc_warm_pool_container")
+        create_lxc_machines_from_base_image(self.config, ["router100"])
+        self.assertFalse(claim.called)
+        self.client.containers.create.assert_called_once_with(self.excepted_config, wait=True)
+
+    def test_create_lxc_machines_from_base_image_creates_the_container_when_claiming_fails(self):
+        self.set_up_warm_pool(["vnet-warm-aaaa"])
+        self.set_up_patch("vnet_manager.operations.machine.claim_lxc_warm_pool_container").return_value = None
+        create_lxc_machines_from_base_image(self.config, ["router100"])
+        self.client.containers.create.assert_called_once_with(self.excepted_config, wait=True)
+
+    def test_create_lxc_machines_from_base_image_uses_the_base_image_when_there_is_no_golden_container(self):
+        self.set_up_patch("vnet_manager.operations.machine.settings.LXC_CREATE_MODE", "clone")
+        self.set_up_patch("vnet_manager.operations.machine.get_lxc_golden_container", return_value=None)
+        create_lxc_machines_from_base_image(self.config, ["router100"])
+        self.client.containers.create.assert_called_once_with(self.excepted_config, wait=True)
+
+
+class TestGenerateLXCContainerConfig(VNetTestCase):
+    def test_generate_lxc_container_config_adds_a_nic_device_per_interface(self):
+        container_config = generate_lxc_container_config(settings.CONFIG, "router101")
+        self.assertEqual(set(container_config["devices"].keys()), {"eth0", "eth12", "eth23"})
+        self.assertEqual(container_config["devices"]["eth23"]["parent"], "vnet-br1")
+        self.assertEqual(container_config["devices"]["eth23"]["host_name"], "router101-eth23")
+
+    def test_generate_lxc_container_config_uses_base_image_alias(self):
+        container_config = generate_lxc_container_config(settings.CONFIG, "router101")
+        self.assertEqual(container_config["source"], {"alias": get_lxc_base_image_alias(), "type": "image"})
+
+    def test_generate_lxc_container_config_copies_the_golden_container(self):
+        container_config = generate_lxc_container_config(settings.CONFIG, "router101", golden="vnet-golden-blaap")
+        self.assertEqual(container_config["source"], {"source": "vnet-golden-blaap", "type": "copy", "container_only": True})
+        self.assertEqual(set(container_config["devices"].keys()), {"eth0", "eth12", "eth23"})
+
+    def test_generate_lxc_container_config_clears_the_golden_container_config_key_of_the_copy(self):
+        container_config = generate_lxc_container_config(settings.CONFIG, "router101", golden="vnet-golden-blaap")
+        self.assertEqual(container_config["config"][settings.LXC_GOLDEN_CONTAINER_CONFIG_KEY], "")
+
+    def test_generate_lxc_container_config_tags_the_container_with_the_config_path(self):
+        config = deepcopy(settings.CONFIG)
+        config["config_path"] = "/root/config.yaml"
+        container_config = generate_lxc_container_config(config, "router101")
+        self.assertEqual(container_config["config"]["user.vnet.config"], "/root/config.yaml")
+
+    def test_generate_lxc_container_config_does_not_tag_without_config_path(self):
+        container_config = generate_lxc_container_config(settings.CONFIG, "router101")
+        self.assertEqual(container_config["config"], {"user.network-config": "disabled"})
+
+    def test_generate_lxc_container_config_records_the_file_manifest_of_the_bundle(self):
+        bundle = FileBundle("router101")
+        bundle.add("/etc/hosts", "hosts")
+        container_config = generate_lxc_container_config(settings.CONFIG, "router101", bundle=bundle)
+        self.assertEqual(container_config["config"][settings.LXC_FILE_MANIFEST_CONFIG_KEY], dumps(bundle.hashes(), sort_keys=True))
+
 
 class TestDestroyMachines(VNetTestCase):
     def setUp(self) -> None:
         self.request_confirm = self.set_up_patch("vnet_manager.operations.machine.request_confirmation")
         self.destroy_lxc_machine = self.set_up_patch("vnet_manager.operations.machine.destroy_lxc_machine")
+        self.destroy_lxc_machines_concurrently = self.set_up_patch(
+            "vnet_manager.operations.machine.destroy_lxc_machines_concurrently", Mock(return_value={})
+        )
+        self.run_async = self.set_up_patch("vnet_manager.operations.machine.run_async", return_value={})
 
     def test_destroy_machines_calls_request_confirmation(self):
         destroy_machines(settings.CONFIG)
@@ -292,6 +642,119 @@ class TestDestroyMachines(VNetTestCase):
         destroy_machines(settings.CONFIG, machines=["router100"])
         self.destroy_lxc_machine.assert_called_once_with("router100")
 
+    def test_destroy_machines_returns_an_empty_list_when_all_machines_are_destroyed(self):
+        self.assertEqual(destroy_machines(settings.CONFIG), [])
+
+    def test_destroy_machines_continues_after_a_failed_machine(self):
+        response = Mock(status_code=500)
+        response.json.return_value = {"error": "blaap"}
+        self.destroy_lxc_machine.side_effect = [LXDAPIException(response), None, None]
+        self.assertEqual(destroy_machines(settings.CONFIG), ["router100"])
+        self.assertEqual(self.destroy_lxc_machine.call_count, 3)
+
+    def test_destroy_machines_destroys_lxc_machines_concurrently_with_multiple_workers(self):
+        destroy_machines(settings.CONFIG, parallel=8)
+        self.assertFalse(self.destroy_lxc_machine.called)
+        self.destroy_lxc_machines_concurrently.assert_called_once_with(["router100", "router101", "host102"], max_connections=8)
+        self.run_async.assert_called_once_with(self.destroy_lxc_machines_concurrently.return_value)
+
+    def test_destroy_machines_returns_the_machines_that_failed_to_be_destroyed_concurrently(self):
+        self.run_async.return_value = {"router101": "blaap"}
+        self.assertEqual(destroy_machines(settings.CONFIG, parallel=8), ["router101"])
+
+
+class FailingDeleteLXDServer(FakeLXDServer):
+    def route(self, method: str, path: str, headers: dict, body: bytes) -> tuple:
+        if method == "DELETE" and path.endswith("/router101"):
+            return self.operation(status_code=400, err="blaap")
+        return super().route(method, path, headers, body)
+
+
+class TestDestroyLXCMachinesConcurrently(VNetTestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = mkdtemp()
+        self.addCleanup(rmtree, self.tmp_dir)
+        self.set_up_patch("vnet_manager.providers.lxc_async.environ", {"LXD_DIR": self.tmp_dir})
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+        self.server = FailingDeleteLXDServer(join(self.tmp_dir, "unix.socket"))
+        self.loop.run_until_complete(self.server.start())
+        self.addCleanup(self.loop.run_until_complete, self.server.stop())
+        self.server.containers = {
+            "router100": {"name": "router100", "status": "Running"},
+            "router101": {"name": "router101", "status": "Stopped"},
+            "host102": {"name": "host102", "status": "Running"},
+        }
+        self.logger = self.set_up_patch("vnet_manager.operations.machine.logger")
+
+    def destroy(self, machines: list) -> dict:
+        return self.loop.run_until_complete(destroy_lxc_machines_concurrently(machines, max_connections=4))
+
+    def test_destroy_lxc_machines_concurrently_deletes_the_containers(self):
+        self.destroy(["router100", "host102"])
+        self.assertEqual(list(self.server.containers), ["router101"])
+
+    def test_destroy_lxc_machines_concurrently_reports_failed_containers(self):
+        failed = self.destroy(["router100", "router101", "host102"])
+        self.assertEqual(list(failed), ["router101"])
+        self.assertEqual(list(self.server.containers), ["router101"])
+
+    def test_destroy_lxc_machines_concurrently_skips_containers_that_do_not_exist(self):
+        self.assertEqual(self.destroy(["router100", "router102"]), {})
+        self.logger.warning.assert_called_once_with(
+            "Tried to delete LXC machine router102, but it does not exist. Maybe it was already deleted?"
+        )
+
+
+class TestSnapshotAndResetMachines(VNetTestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = mkdtemp()
+        self.addCleanup(rmtree, self.tmp_dir)
+        self.set_up_patch("vnet_manager.providers.lxc_async.environ", {"LXD_DIR": self.tmp_dir})
+        self.logger = self.set_up_patch("vnet_manager.operations.machine.logger")
+        self.server = FakeLXDServer(join(self.tmp_dir, "unix.socket"))
+        self.server.containers = {name: {"name": name, "status": "Running"} for name in settings.CONFIG["machines"]}
+        # run_async() runs every call on a new event loop, so the fake server gets its own loop in a thread
+        self.loop = asyncio.new_event_loop()
+        self.loop.run_until_complete(self.server.start())
+        self.thread = Thread(target=self.loop.run_forever)
+        self.thread.start()
+        self.addCleanup(self.stop_server)
+
+    def stop_server(self):
+        asyncio.run_coroutine_threadsafe(self.server.stop(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    def test_snapshot_machines_snapshots_all_machines_in_the_config(self):
+        self.assertEqual(snapshot_machines(settings.CONFIG, parallel=4), [])
+        self.assertEqual(self.server.snapshots, {name: [settings.LXC_DEFAULT_SNAPSHOT_NAME] for name in settings.CONFIG["machines"]})
+
+    def test_snapshot_machines_replaces_an_existing_snapshot(self):
+        self.server.snapshots["router100"] = ["clean", "other"]
+        snapshot_machines(settings.CONFIG, snapshot="clean", machines=["router100"])
+        self.assertEqual(self.server.snapshots["router100"], ["other", "clean"])
+
+    def test_snapshot_machines_skips_machines_that_are_not_in_the_config(self):
+        snapshot_machines(settings.CONFIG, machines=["router100", "blaap"])
+        self.assertEqual(list(self.server.snapshots), ["router100"])
+
+    def test_snapshot_machines_returns_the_machines_that_failed(self):
+        del self.server.containers["router101"]
+        self.assertEqual(snapshot_machines(settings.CONFIG, parallel=4), ["router101"])
+        self.logger.error.assert_called_with("Failed to snapshot the following machines: router101")
+
+    def test_reset_machines_restores_the_snapshot(self):
+        self.server.snapshots = {name: ["clean"] for name in settings.CONFIG["machines"]}
+        self.assertEqual(reset_machines(settings.CONFIG, snapshot="clean", parallel=4), [])
+        self.assertTrue(all(container["restored"] == "clean" for container in self.server.containers.values()))
+
+    def test_reset_machines_returns_the_machines_without_snapshot(self):
+        self.server.snapshots = {"router100": ["clean"]}
+        failed = reset_machines(settings.CONFIG, snapshot="clean", parallel=4)
+        self.assertEqual(failed, sorted(name for name in settings.CONFIG["machines"] if name != "router100"))
+
 
 class TestDestroyLXCMachine(VNetTestCase):
     def setUp(self) -> None:
@@ -325,6 +788,262 @@ class TestDestroyLXCMachine(VNetTestCase):
         self.assertFalse(self.machine.stop.called)
 
 
+class TestGetLXCGoldenContainer(VNetTestCase):
+    def setUp(self) -> None:
+        self.check_if_machine_exists = self.set_up_patch("vnet_manager.operations.machine.check_if_lxc_machine_exists")
+        self.check_if_machine_exists.return_value = False
+        self.destroy_lxc_golden_containers = self.set_up_patch("vnet_manager.operations.machine.destroy_lxc_golden_containers")
+        self.lxd_client = self.set_up_patch("vnet_manager.operations.machine.get_lxd_client")
+        self.client = Mock()
+        self.lxd_client.return_value = self.client
+        self.client.images.get_by_alias.return_value.fingerprint = "0123456789abcdef0123"
+        self.logger = self.set_up_patch("vnet_manager.operations.machine.logger")
+
+    def test_get_lxc_golden_container_names_the_container_after_the_image_fingerprint(self):
+        self.assertEqual(get_lxc_golden_container(), "vnet-golden-0123456789ab")
+        self.client.images.get_by_alias.assert_called_once_with(get_lxc_base_image_alias())
+
+    def test_get_lxc_golden_container_creates_a_stopped_container_from_the_base_image(self):
+        get_lxc_golden_container()
+        self.client.containers.create.assert_called_once_with(
+            {
+                "name": "vnet-golden-0123456789ab",
+                "source": {"alias": get_lxc_base_image_alias(), "type": "image"},
+                "ephemeral": False,
+                "config": {"user.network-config": "disabled", settings.LXC_GOLDEN_CONTAINER_CONFIG_KEY: get_lxc_base_image_alias()},
+                "devices": {"eth0": {"type": "none"}},
+                "profiles": [settings.LXC_VNET_PROFILE],
+            },
+            wait=True,
+        )
+        self.assertFalse(self.client.containers.get.return_value.start.called)
+
+    def test_get_lxc_golden_container_destroys_stale_golden_containers_before_creating_one(self):
+        get_lxc_golden_container()
+        self.destroy_lxc_golden_containers.assert_called_once_with(alias=get_lxc_base_image_alias())
+
+    def test_get_lxc_golden_container_reuses_an_existing_golden_container(self):
+        self.check_if_machine_exists.return_value = True
+        self.assertEqual(get_lxc_golden_container(), "vnet-golden-0123456789ab")
+        self.assertFalse(self.client.containers.create.called)
+        self.assertFalse(self.destroy_lxc_golden_containers.called)
+
+    def test_get_lxc_golden_container_returns_none_when_creation_fails(self):
+        response = Mock(status_code=500)
+        response.json.return_value = {"error": "blaap"}
+        self.client.containers.create.side_effect = LXDAPIException(response)
+        self.assertIsNone(get_lxc_golden_container())
+        self.assertTrue(self.logger.warning.called)
+
+
+class TestDestroyLXCGoldenContainers(VNetTestCase):
+    def setUp(self) -> None:
+        self.get_lxc_instances = self.set_up_patch("vnet_manager.operations.machine.get_lxc_instances")
+        self.get_lxc_instances.return_value = {
+            "router100": {"config": {"user.vnet.config": "/root/config.yaml"}},
+            # Cloned from the golden container, inheriting its config key
+            "router101": {"config": {settings.LXC_GOLDEN_CONTAINER_CONFIG_KEY: get_lxc_base_image_alias()}},
+            "vnet-golden-aaaa": {"config": {settings.LXC_GOLDEN_CONTAINER_CONFIG_KEY: get_lxc_base_image_alias()}},
+            "vnet-golden-bbbb": {"config": {settings.LXC_GOLDEN_CONTAINER_CONFIG_KEY: "custom-image"}},
+        }
+        self.destroy_lxc_machine = self.set_up_patch("vnet_manager.operations.machine.destroy_lxc_machine")
+
+    def test_destroy_lxc_golden_containers_destroys_all_golden_containers(self):
+        destroy_lxc_golden_containers()
+        self.destroy_lxc_machine.assert_has_calls([call("vnet-golden-aaaa", wait=True), call("vnet-golden-bbbb", wait=True)])
+        self.assertEqual(self.destroy_lxc_machine.call_count, 2)
+
+    def test_destroy_lxc_golden_containers_only_destroys_golden_containers_of_the_alias(self):
+        destroy_lxc_golden_containers(alias="custom-image")
+        self.destroy_lxc_machine.assert_called_once_with("vnet-golden-bbbb", wait=True)
+
+    def test_destroy_lxc_golden_containers_does_not_destroy_machines_cloned_from_a_golden_container(self):
+        destroy_lxc_golden_containers(alias=get_lxc_base_image_alias())
+        self.destroy_lxc_machine.assert_called_once_with("vnet-golden-aaaa", wait=True)
+
+
+class TestClaimLXCWarmPoolContainer(VNetTestCase):
+    def setUp(self) -> None:
+        self.client = Mock()
+        self.container = self.client.containers.get.return_value
+        self.container.config = {settings.LXC_WARM_POOL_CONFIG_KEY: "abcd"}
+        self.container.devices = {"eth0": {"type": "none"}}
+        self.container_config = generate_lxc_container_config(settings.CONFIG, "router100")
+        self.logger = self.set_up_patch("vnet_manager.operations.machine.logger")
+
+    def test_claim_lxc_warm_pool_container_renames_the_container(self):
+        self.assertEqual(claim_lxc_warm_pool_container(self.client, "vnet-warm-aaaa", self.container_config), self.container)
+        self.client.containers.get.assert_called_once_with("vnet-warm-aaaa")
+        self.container.rename.assert_called_once_with("router100", wait=True)
+
+    def test_claim_lxc_warm_pool_container_applies_the_config_and_devices(self):
+        claim_lxc_warm_pool_container(self.client, "vnet-warm-aaaa", self.container_config)
+        self.assertEqual(self.container.config, self.container_config["config"])
+        self.assertEqual(self.container.devices, self.container_config["devices"])
+        self.container.save.assert_called_once_with(wait=True)
+
+    def test_claim_lxc_warm_pool_container_keeps_the_config_and_devices_of_the_container(self):
+        self.container.config = {"volatile.base_image": "abcd", "user.network-config": "blaap", settings.LXC_WARM_POOL_CONFIG_KEY: "abcd"}
+        self.container.devices = {"root": {"type": "disk", "path": "/", "pool": "vnet-pool"}, "eth0": {"type": "bridged"}}
+        claim_lxc_warm_pool_container(self.client, "vnet-warm-aaaa", self.container_config)
+        self.assertEqual(self.container.config, dict(self.container_config["config"], **{"volatile.base_image": "abcd"}))
+        self.assertEqual(
+            self.container.devices, dict(self.container_config["devices"], root={"type": "disk", "path": "/", "pool": "vnet-pool"})
+        )
+
+    def test_claim_lxc_warm_pool_container_drops_the_warm_pool_config_before_renaming(self):
+        claim_lxc_warm_pool_container(self.client, "vnet-warm-aaaa", self.container_config)
+        self.assertEqual([name for name, _, _ in self.container.mock_calls], ["save", "rename"])
+
+    def test_claim_lxc_warm_pool_container_returns_false_when_the_container_does_not_exist(self):
+        response = Mock(status_code=404)
+        response.json.return_value = {"error": "not found"}
+        self.client.containers.get.side_effect = NotFound(response)
+        self.assertIsNone(claim_lxc_warm_pool_container(self.client, "vnet-warm-aaaa", self.container_config))
+        self.assertTrue(self.logger.warning.called)
+
+    def test_claim_lxc_warm_pool_container_puts_the_container_back_in_the_pool_when_rename_fails(self):
+        response = Mock(status_code=500)
+        response.json.return_value = {"error": "blaap"}
+        self.container.rename.side_effect = LXDAPIException(response)
+        self.assertIsNone(claim_lxc_warm_pool_container(self.client, "vnet-warm-aaaa", self.container_config))
+        self.assertEqual(self.container.config, {settings.LXC_WARM_POOL_CONFIG_KEY: "abcd"})
+        self.assertEqual(self.container.devices, {"eth0": {"type": "none"}})
+        self.assertEqual(self.container.save.call_count, 2)
+
+    def test_claim_lxc_warm_pool_container_deletes_the_container_when_it_cannot_be_put_back(self):
+        destroy_lxc_machine = self.set_up_patch("vnet_manager.operations.machine.destroy_lxc_machine")
+        self.container.name = "vnet-warm-aaaa"
+        response = Mock(status_code=500)
+        response.json.return_value = {"error": "blaap"}
+        self.container.save.side_effect = LXDAPIException(response)
+        self.assertIsNone(claim_lxc_warm_pool_container(self.client, "vnet-warm-aaaa", self.container_config))
+        self.assertFalse(self.container.rename.called)
+        destroy_lxc_machine.assert_called_once_with("vnet-warm-aaaa", wait=True)
+
+
+class TestGetLXCWarmPoolContainers(VNetTestCase):
+    def setUp(self) -> None:
+        self.get_fingerprint = self.set_up_patch("vnet_manager.operations.machine.get_lxc_base_image_fingerprint", return_value="abcd")
+        self.get_lxc_instances = self.set_up_patch("vnet_manager.operations.machine.get_lxc_instances")
+        self.get_lxc_instances.return_value = {
+            "router100": {"config": {}},
+            "vnet-warm-bbbb": {"config": {settings.LXC_WARM_POOL_CONFIG_KEY: "abcd"}},
+            "vnet-warm-aaaa": {"config": {settings.LXC_WARM_POOL_CONFIG_KEY: "abcd"}},
+            "vnet-warm-cccc": {"config": {settings.LXC_WARM_POOL_CONFIG_KEY: "old"}},
+        }
+
+    def test_get_lxc_warm_pool_containers_returns_the_containers_of_the_current_base_image(self):
+        self.assertEqual(get_lxc_warm_pool_containers(), ["vnet-warm-aaaa", "vnet-warm-bbbb"])
+
+    def test_get_lxc_warm_pool_containers_returns_nothing_without_base_image(self):
+        self.get_fingerprint.side_effect = NotFound(response="blaap")
+        self.assertEqual(get_lxc_warm_pool_containers(), [])
+
+
+class TestRefillLXCWarmPool(VNetTestCase):
+    def setUp(self) -> None:
+        self.lxd_client = self.set_up_patch("vnet_manager.operations.machine.get_lxd_client")
+        self.client = self.lxd_client.return_value
+        self.get_fingerprint = self.set_up_patch("vnet_manager.operations.machine.get_lxc_base_image_fingerprint", return_value="abcd")
+        self.get_lxc_instances = self.set_up_patch("vnet_manager.operations.machine.get_lxc_instances")
+        self.get_lxc_instances.return_value = {
+            "router100": {"config": {}},
+            "vnet-warm-aaaa": {"config": {settings.LXC_WARM_POOL_CONFIG_KEY: "abcd"}},
+            "vnet-warm-cccc": {"config": {settings.LXC_WARM_POOL_CONFIG_KEY: "old"}},
+        }
+        self.destroy_lxc_machine = self.set_up_patch("vnet_manager.operations.machine.destroy_lxc_machine")
+        self.logger = self.set_up_patch("vnet_manager.operations.machine.logger")
+
+    def test_refill_lxc_warm_pool_creates_the_missing_containers(self):
+        refill_lxc_warm_pool(size=3)
+        self.assertEqual(self.client.containers.create.call_count, 2)
+        container_config = self.client.containers.create.call_args[0][0]
+        self.assertTrue(container_config["name"].startswith(settings.LXC_WARM_POOL_CONTAINER_PREFIX))
+        self.assertEqual(container_config["source"], {"alias": get_lxc_base_image_alias(), "type": "image"})
+        self.assertEqual(container_config["config"][settings.LXC_WARM_POOL_CONFIG_KEY], "abcd")
+
+    def test_refill_lxc_warm_pool_does_nothing_when_the_pool_is_full(self):
+        refill_lxc_warm_pool(size=1)
+        self.assertFalse(self.client.containers.create.called)
+
+    def test_refill_lxc_warm_pool_copies_the_golden_container(self):
+        refill_lxc_warm_pool(golden="vnet-golden-abcd", size=2)
+        container_config = self.client.containers.create.call_args[0][0]
+        self.assertEqual(container_config["source"], {"source": "vnet-golden-abcd", "type": "copy", "container_only": True})
+        self.assertEqual(container_config["config"][settings.LXC_GOLDEN_CONTAINER_CONFIG_KEY], "")
+
+    def test_refill_lxc_warm_pool_destroys_containers_of_a_previous_base_image(self):
+        refill_lxc_warm_pool(size=1)
+        self.destroy_lxc_machine.assert_called_once_with("vnet-warm-cccc", wait=True)
+
+    def test_refill_lxc_warm_pool_logs_a_warning_when_a_container_cannot_be_created(self):
+        response = Mock(status_code=500)
+        response.json.return_value = {"error": "blaap"}
+        self.client.containers.create.side_effect = [LXDAPIException(response), None]
+        refill_lxc_warm_pool(size=3, parallel=2)
+        self.assertEqual(self.client.containers.create.call_count, 2)
+        self.logger.warning.assert_called_once()
+
+    def test_refill_lxc_warm_pool_logs_a_warning_on_errors(self):
+        response = Mock(status_code=500)
+        response.json.return_value = {"error": "blaap"}
+        self.get_fingerprint.side_effect = LXDAPIException(response)
+        refill_lxc_warm_pool(size=1)
+        self.assertTrue(self.logger.warning.called)
+        self.assertFalse(self.client.containers.create.called)
+
+
+class TestLXCWarmPoolRefillProcess(VNetTestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = mkdtemp()
+        self.addCleanup(rmtree, self.tmp_dir)
+        self.lock = join(self.tmp_dir, "warm-pool", "warm-pool.lock")
+        self.log = join(self.tmp_dir, "warm-pool", "warm-pool.log")
+        self.set_up_patch("vnet_manager.operations.machine.settings.LXC_WARM_POOL_REFILL_LOCK", self.lock)
+        self.set_up_patch("vnet_manager.operations.machine.settings.LXC_WARM_POOL_REFILL_LOG", self.log)
+        self.popen = self.set_up_patch("vnet_manager.operations.machine.Popen")
+        self.refill = self.set_up_patch("vnet_manager.operations.machine.refill_lxc_warm_pool")
+
+    def test_start_lxc_warm_pool_refill_starts_a_detached_process(self):
+        start_lxc_warm_pool_refill(golden="vnet-golden-abcd", parallel=3)
+        args, kwargs = self.popen.call_args
+        self.assertEqual(args[0][1:], ["-m", "vnet_manager.operations.machine", "3", "vnet-golden-abcd"])
+        self.assertTrue(kwargs["start_new_session"])
+        self.assertEqual(kwargs["stdout"].name, self.log)
+
+    def test_start_lxc_warm_pool_refill_does_not_pass_a_golden_container_by_default(self):
+        start_lxc_warm_pool_refill(parallel=1)
+        self.assertEqual(self.popen.call_args[0][0][1:], ["-m", "vnet_manager.operations.machine", "1"])
+
+    def test_run_lxc_warm_pool_refill_refills_the_warm_pool(self):
+        run_lxc_warm_pool_refill(golden="vnet-golden-abcd", parallel=3)
+        self.refill.assert_called_once_with(golden="vnet-golden-abcd", parallel=3)
+
+    def test_check_if_lxc_warm_pool_refill_running_returns_false_without_refill(self):
+        self.assertFalse(check_if_lxc_warm_pool_refill_running())
+
+    def test_check_if_lxc_warm_pool_refill_running_returns_true_during_a_refill(self):
+        self.refill.side_effect = lambda **_: self.assertTrue(check_if_lxc_warm_pool_refill_running())
+        run_lxc_warm_pool_refill()
+        self.assertTrue(self.refill.called)
+        self.assertFalse(check_if_lxc_warm_pool_refill_running())
+
+
+class TestDestroyLXCWarmPool(VNetTestCase):
+    def setUp(self) -> None:
+        self.get_lxc_instances = self.set_up_patch("vnet_manager.operations.machine.get_lxc_instances")
+        self.get_lxc_instances.return_value = {
+            "router100": {"config": {}},
+            "vnet-warm-aaaa": {"config": {settings.LXC_WARM_POOL_CONFIG_KEY: "abcd"}},
+        }
+        self.destroy_lxc_machine = self.set_up_patch("vnet_manager.operations.machine.destroy_lxc_machine")
+
+    def test_destroy_lxc_warm_pool_destroys_the_warm_pool_containers(self):
+        destroy_lxc_warm_pool()
+        self.destroy_lxc_machine.assert_called_once_with("vnet-warm-aaaa", wait=True)
+
+
 class TestCreateLXCBaseImageContainer(VNetTestCase):
     def setUp(self) -> None:
         self.check_if_machine_exists = self.set_up_patch("vnet_manager.operations.machine.check_if_lxc_machine_exists")
@@ -386,35 +1105,82 @@ class TestCreateLXCBaseImageContainer(VNetTestCase):
         create_lxc_base_image_container()
         self.client.containers.create.assert_called_once_with(excepted_config, wait=True)
 
+    def test_create_lxc_base_image_container_does_not_mount_the_apt_package_cache_by_default(self):
+        create_lxc_base_image_container()
+        self.assertNotIn("apt-cache", self.client.containers.create.call_args[0][0]["devices"])
 
-class TestPlaceLXCInterfaceConfigurationOnContainer(VNetTestCase):
-    def setUp(self) -> None:
-        self.network_conf = self.set_up_patch("vnet_manager.operations.machine.generate_machine_netplan_config")
-        self.network_conf.return_value = {"int": "456"}
-        self.write_files_to_lxc_container = self.set_up_patch("vnet_manager.operations.machine.write_file_to_lxc_container")
-        self.config = {"int": "123"}
-
-    def test_place_lxc_interface_configuration_on_container_calls_generate_machine_netplan_config(self):
-        place_lxc_interface_configuration_on_container(self.config, "router100")
-        self.network_conf.assert_called_once_with(self.config, "router100")
-
-    def test_place_lxc_interface_configuration_on_container_calls_write_file_to_lxc_container(self):
-        place_lxc_interface_configuration_on_container(self.config, "router100")
-        self.write_files_to_lxc_container.assert_called_once_with(
-            "router100", settings.VNET_NETPLAN_CONFIG_FILE_PATH, safe_dump(self.network_conf.return_value)
+    def test_create_lxc_base_image_container_mounts_the_apt_package_cache(self):
+        self.set_up_patch("vnet_manager.operations.machine.settings.VNET_APT_CACHE_DIR", "/var/cache/vnet-apt")
+        self.set_up_patch("vnet_manager.operations.machine.ensure_apt_cache_dir")
+        self.client.containers.create.return_value.config = {}
+        create_lxc_base_image_container()
+        self.assertEqual(
+            self.client.containers.create.call_args[0][0]["devices"]["apt-cache"],
+            {"type": "disk", "source": "/var/cache/vnet-apt", "path": settings.LXC_APT_CACHE_GUEST_PATH},
         )
 
+    def test_create_lxc_base_image_container_makes_the_apt_package_cache_owned_by_the_container_root(self):
+        self.set_up_patch("vnet_manager.operations.machine.settings.VNET_APT_CACHE_DIR", "/var/cache/vnet-apt")
+        ensure_apt_cache_dir = self.set_up_patch("vnet_manager.operations.machine.ensure_apt_cache_dir")
+        self.client.containers.create.return_value.config = {
+            "volatile.idmap.next": '[{"Isuid":true,"Isgid":true,"Hostid":1000000,"Nsid":0,"Maprange":1000000000}]'
+        }
+        create_lxc_base_image_container()
+        ensure_apt_cache_dir.assert_called_with(1000000, 1000000)
 
-class TestEnableTypeSpecificMachineConfiguration(VNetTestCase):
-    def setUp(self) -> None:
-        self.configure_lxc_ip_forwarding = self.set_up_patch("vnet_manager.operations.machine.configure_lxc_ip_forwarding")
 
-    def test_enable_type_specific_machine_configuration_calls_configure_lxc_forwarding_for_each_machine(self):
-        enable_type_specific_machine_configuration(settings.CONFIG)
-        self.configure_lxc_ip_forwarding.assert_has_calls(
-            [call("router100", enable=True), call("router101", enable=True), call("host102", enable=False)]
+class TestGetLXCBaseImageAlias(VNetTestCase):
+    def setUp(self) -> None:
+        self.providers = deepcopy(settings.PROVIDERS)
+        self.set_up_patch("vnet_manager.operations.machine.settings.PROVIDERS", self.providers)
+
+    def test_get_lxc_base_image_build_fingerprint_is_stable(self):
+        self.assertEqual(get_lxc_base_image_build_fingerprint(), get_lxc_base_image_build_fingerprint())
+        self.assertEqual(len(get_lxc_base_image_build_fingerprint()), 12)
+
+    def test_get_lxc_base_image_build_fingerprint_changes_with_the_guest_packages(self):
+        fingerprint = get_lxc_base_image_build_fingerprint()
+        self.providers["lxc"]["guest_packages"].append("blaap")
+        self.assertNotEqual(get_lxc_base_image_build_fingerprint(), fingerprint)
+
+    def test_get_lxc_base_image_build_fingerprint_ignores_the_order_of_the_guest_packages(self):
+        fingerprint = get_lxc_base_image_build_fingerprint()
+        self.providers["lxc"]["guest_packages"].reverse()
+        self.assertEqual(get_lxc_base_image_build_fingerprint(), fingerprint)
+
+    def test_get_lxc_base_image_build_fingerprint_changes_with_the_frr_release(self):
+        fingerprint = get_lxc_base_image_build_fingerprint()
+        self.set_up_patch("vnet_manager.operations.machine.settings.FRR_RELEASE", "frr-7")
+        self.assertNotEqual(get_lxc_base_image_build_fingerprint(), fingerprint)
+
+    def test_get_lxc_base_image_build_fingerprint_changes_with_the_base_image_os(self):
+        fingerprint = get_lxc_base_image_build_fingerprint()
+        self.providers["lxc"]["base_image"]["os"] = "20.04"
+        self.assertNotEqual(get_lxc_base_image_build_fingerprint(), fingerprint)
+
+    def test_get_lxc_base_image_alias_appends_the_build_fingerprint(self):
+        self.assertEqual(get_lxc_base_image_alias(), "{}-{}".format(settings.LXC_BASE_IMAGE_ALIAS, get_lxc_base_image_build_fingerprint()))
+
+    def test_get_lxc_base_image_alias_uses_custom_base_images_as_is(self):
+        self.set_up_patch("vnet_manager.operations.machine.settings.LXC_BASE_IMAGE_VERSIONED", False)
+        self.assertEqual(get_lxc_base_image_alias(), settings.LXC_BASE_IMAGE_ALIAS)
+
+
+class TestGetLXCMachineRootIds(VNetTestCase):
+    def test_get_lxc_machine_root_ids_returns_the_host_ids_of_root(self):
+        container = Mock(
+            config={
+                "volatile.idmap.next": '[{"Isuid":true,"Isgid":false,"Hostid":100000,"Nsid":0,"Maprange":65536},'
+                '{"Isuid":false,"Isgid":true,"Hostid":200000,"Nsid":0,"Maprange":65536}]'
+            }
         )
-        self.assertEqual(self.configure_lxc_ip_forwarding.call_count, 3)
+        self.assertEqual(get_lxc_machine_root_ids(container), (100000, 200000))
+
+    def test_get_lxc_machine_root_ids_returns_none_for_privileged_containers(self):
+        self.assertEqual(get_lxc_machine_root_ids(Mock(config={})), (None, None))
+
+    def test_get_lxc_machine_root_ids_returns_none_for_invalid_idmaps(self):
+        self.assertEqual(get_lxc_machine_root_ids(Mock(config={"volatile.idmap.next": "blaap"})), (None, None))
 
 
 class TestConfigureLXCIPForwarding(VNetTestCase):
@@ -431,6 +1197,96 @@ class TestConfigureLXCIPForwarding(VNetTestCase):
         )
         self.assertEqual(self.write_file_to_lxc_container.call_count, 2)
 
+    def test_configure_lxc_ip_forwarding_adds_files_to_the_bundle(self):
+        bundle = FileBundle("router100")
+        configure_lxc_ip_forwarding("router100", enable=False, bundle=bundle)
+        self.assertFalse(self.write_file_to_lxc_container.called)
+        self.assertEqual(bundle.files["/etc/sysctl.d/20-net.ipv4.ip_forward.conf"], b"net.ipv4.ip_forward=0\n")
+        self.assertEqual(bundle.files["/etc/sysctl.d/20-net.ipv6.conf.all.forwarding.conf"], b"net.ipv6.conf.all.forwarding=0\n")
+
+
+class TestProvisionMachine(VNetTestCase):
+    def setUp(self) -> None:
+        self.generate_machine_file_bundle = self.set_up_patch("vnet_manager.operations.machine.generate_machine_file_bundle")
+        self.generate_machine_file_bundle.return_value = MagicMock()
+        self.deliver_file_bundle = self.set_up_patch("vnet_manager.operations.machine.deliver_file_bundle")
+
+    def test_provision_machine_calls_generate_machine_file_bundle(self):
+        provision_machine(settings.CONFIG, "router100", hosts=False)
+        self.generate_machine_file_bundle.assert_called_once_with(settings.CONFIG, "router100", hosts=False)
+
+    def test_provision_machine_delivers_the_bundle_with_the_machine_provider(self):
+        provision_machine(settings.CONFIG, "router100")
+        self.deliver_file_bundle.assert_called_once_with(self.generate_machine_file_bundle.return_value, "lxc")
+
+    def test_provision_machine_returns_the_delivery_result(self):
+        self.deliver_file_bundle.return_value = False
+        self.assertFalse(provision_machine(settings.CONFIG, "router100"))
+
+
+class TestGenerateMachineFileBundle(VNetTestCase):
+    def setUp(self) -> None:
+        self.network_conf = self.set_up_patch("vnet_manager.operations.machine.render_machine_netplan_config")
+        self.network_conf.return_value = "int: '456'\n"
+        self.add_files_to_bundle = self.set_up_patch("vnet_manager.operations.machine.add_files_to_bundle")
+        self.config = deepcopy(settings.CONFIG)
+
+    def test_generate_machine_file_bundle_adds_the_netplan_config(self):
+        bundle = generate_machine_file_bundle(self.config, "router100")
+        self.network_conf.assert_called_once_with(self.config, "router100")
+        self.assertEqual(bundle.files[settings.VNET_NETPLAN_CONFIG_FILE_PATH], b"int: '456'\n")
+
+    def test_generate_machine_file_bundle_adds_the_user_files_and_hosts_file(self):
+        bundle = generate_machine_file_bundle(self.config, "router100")
+        self.add_files_to_bundle.assert_has_calls(
+            [call(bundle, self.config["machines"]["router100"]["files"]), call(bundle, {settings.VNET_ETC_HOSTS_FILE_PATH: "/etc/hosts"})]
+        )
+
+    def test_generate_machine_file_bundle_skips_the_hosts_file(self):
+        bundle = generate_machine_file_bundle(self.config, "router100", hosts=False)
+        self.add_files_to_bundle.assert_called_once_with(bundle, self.config["machines"]["router100"]["files"])
+
+    def test_generate_machine_file_bundle_skips_user_files_if_not_configured(self):
+        del self.config["machines"]["router100"]["files"]
+        bundle = generate_machine_file_bundle(self.config, "router100", hosts=False)
+        self.assertFalse(self.add_files_to_bundle.called)
+        self.assertIn(settings.VNET_NETPLAN_CONFIG_FILE_PATH, bundle.files)
+
+    def test_generate_machine_file_bundle_adds_type_specific_config(self):
+        bundle = generate_machine_file_bundle(self.config, "router100")
+        self.assertEqual(bundle.files["/etc/sysctl.d/20-net.ipv4.ip_forward.conf"], b"net.ipv4.ip_forward=1\n")
+
+
+class TestRenderMachineNetplanConfig(VNetTestCase):
+    def setUp(self) -> None:
+        self.config = deepcopy(settings.CONFIG)
+        self.set_up_patch("vnet_manager.operations.machine._netplan_render_cache", {})
+        self.generate_machine_netplan_config = self.set_up_patch(
+            "vnet_manager.operations.machine.generate_machine_netplan_config", Mock(side_effect=generate_machine_netplan_config)
+        )
+
+    def test_render_machine_netplan_config_returns_the_netplan_config_yaml(self):
+        self.assertEqual(
+            safe_load(render_machine_netplan_config(self.config, "router100")), generate_machine_netplan_config(self.config, "router100")
+        )
+
+    def test_render_machine_netplan_config_matches_the_pure_python_emitter(self):
+        self.assertEqual(
+            render_machine_netplan_config(self.config, "router100"), safe_dump(generate_machine_netplan_config(self.config, "router100"))
+        )
+
+    def test_render_machine_netplan_config_renders_an_unchanged_machine_once(self):
+        first = render_machine_netplan_config(self.config, "router100")
+        self.config["machines"]["router100"]["files"] = {"blaap": "/etc/blaap"}
+        self.assertEqual(render_machine_netplan_config(self.config, "router100"), first)
+        self.generate_machine_netplan_config.assert_called_once_with(self.config, "router100")
+
+    def test_render_machine_netplan_config_renders_again_when_the_interfaces_change(self):
+        render_machine_netplan_config(self.config, "router100")
+        self.config["machines"]["router100"]["interfaces"]["eth12"]["ipv4"] = "10.0.0.1/24"
+        self.assertIn("10.0.0.1/24", render_machine_netplan_config(self.config, "router100"))
+        self.assertEqual(self.generate_machine_netplan_config.call_count, 2)
+
 
 class TestGenerateMachineNetplanConfig(VNetTestCase):
     def setUp(self) -> None:
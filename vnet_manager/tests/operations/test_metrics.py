@@ -0,0 +1,152 @@
+from copy import deepcopy
+from json import dumps
+from os import listdir, stat
+from os.path import join
+from shutil import rmtree
+from stat import S_IMODE
+from tempfile import mkdtemp
+
+from vnet_manager.tests import VNetTestCase
+from vnet_manager.conf import settings
+from vnet_manager.operations.metrics import (
+    get_lab_name,
+    write_file_atomically,
+    load_action_durations,
+    record_action_duration,
+    format_labels,
+    generate_lab_metrics,
+    write_lab_metrics,
+)
+
+
+def links(*statuses) -> tuple:
+    by_name = {ifname: {"ifname": ifname, "state": state} for ifname, state in statuses}
+    return by_name, {}
+
+
+class MetricsTestCase(VNetTestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = mkdtemp()
+        self.addCleanup(rmtree, self.tmp_dir)
+        self.set_up_patch("vnet_manager.operations.metrics.settings.VNET_METRICS_DIR", self.tmp_dir)
+        self.config = deepcopy(settings.CONFIG)
+        self.config["config_path"] = "/root/configs/lab1.yaml"
+
+
+class TestGetLabName(VNetTestCase):
+    def test_get_lab_name_returns_the_name_of_the_config_file(self):
+        self.assertEqual(get_lab_name({"config_path": "/root/configs/lab1.yaml"}), "lab1")
+
+    def test_get_lab_name_defaults_to_default(self):
+        self.assertEqual(get_lab_name({}), "default")
+
+
+class TestWriteFileAtomically(MetricsTestCase):
+    def test_write_file_atomically_writes_the_file(self):
+        path = join(self.tmp_dir, "blaap.prom")
+        write_file_atomically(path, "blaap 1\n")
+        with open(path) as fh:
+            self.assertEqual(fh.read(), "blaap 1\n")
+        self.assertEqual(listdir(self.tmp_dir), ["blaap.prom"])
+
+    def test_write_file_atomically_makes_the_file_world_readable(self):
+        path = join(self.tmp_dir, "blaap.prom")
+        write_file_atomically(path, "blaap 1\n")
+        self.assertEqual(S_IMODE(stat(path).st_mode), 0o644)
+
+
+class TestActionDurations(MetricsTestCase):
+    def test_load_action_durations_returns_nothing_without_state(self):
+        self.assertEqual(load_action_durations("lab1"), {})
+
+    def test_load_action_durations_returns_nothing_for_invalid_state(self):
+        with open(join(self.tmp_dir, ".vnet_manager_lab1.json"), "w") as fh:
+            fh.write("blaap")
+        self.assertEqual(load_action_durations("lab1"), {})
+
+    def test_load_action_durations_starts_over_when_the_buckets_changed(self):
+        with open(join(self.tmp_dir, ".vnet_manager_lab1.json"), "w") as fh:
+            fh.write(dumps({"le": [1, 2], "actions": {"create": {"buckets": [1, 1], "sum": 1, "count": 1}}}))
+        self.assertEqual(load_action_durations("lab1"), {})
+
+    def test_record_action_duration_fills_the_histogram(self):
+        record_action_duration(self.config, "create", 7)
+        record_action_duration(self.config, "create", 100)
+        histogram = load_action_durations("lab1")["create"]
+        self.assertEqual(histogram["count"], 2)
+        self.assertEqual(histogram["sum"], 107)
+        # The buckets are cumulative
+        expected = [int(7 <= le) + int(100 <= le) for le in settings.VNET_METRICS_DURATION_BUCKETS]
+        self.assertEqual(histogram["buckets"], expected)
+
+    def test_record_action_duration_keeps_actions_apart(self):
+        record_action_duration(self.config, "create", 7)
+        record_action_duration(self.config, "destroy", 3)
+        self.assertEqual(sorted(load_action_durations("lab1")), ["create", "destroy"])
+
+
+class TestFormatLabels(VNetTestCase):
+    def test_format_labels_formats_the_labels(self):
+        self.assertEqual(format_labels(lab="lab1", machine="router100"), '{lab="lab1",machine="router100"}')
+
+    def test_format_labels_escapes_the_values(self):
+        self.assertEqual(format_labels(lab='a"b\\c\nd'), '{lab="a\\"b\\\\c\\nd"}')
+
+
+class TestGenerateLabMetrics(MetricsTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.get_machine_statuses = self.set_up_patch("vnet_manager.operations.metrics.get_machine_statuses")
+        self.get_machine_statuses.return_value = [
+            ["router100", "Running", "LXC"],
+            ["router101", "Stopped", "LXC"],
+            ["host102", "NA", "LXC"],
+        ]
+        self.get_vnet_link_statuses = self.set_up_patch("vnet_manager.operations.metrics.get_vnet_link_statuses")
+        self.get_vnet_link_statuses.return_value = links(("vnet-br0", "up"), ("vnet-br1", "down"), ("vnet-veth0", "up"))
+        self.get_running_sniffers = self.set_up_patch("vnet_manager.operations.metrics.get_running_sniffers")
+        self.get_running_sniffers.side_effect = lambda ifnames: {ifname: 42 for ifname in ifnames}
+
+    def test_generate_lab_metrics_uses_the_machine_statuses_of_show(self):
+        generate_lab_metrics(self.config)
+        self.get_machine_statuses.assert_called_once_with(self.config)
+
+    def test_generate_lab_metrics_exports_the_machine_states(self):
+        lines = generate_lab_metrics(self.config)
+        self.assertIn('vnet_machine_running{lab="lab1",machine="router100",provider="lxc"} 1', lines)
+        self.assertIn('vnet_machine_running{lab="lab1",machine="router101",provider="lxc"} 0', lines)
+        self.assertIn('vnet_machine_exists{lab="lab1",machine="router101",provider="lxc"} 1', lines)
+        self.assertIn('vnet_machine_exists{lab="lab1",machine="host102",provider="lxc"} 0', lines)
+
+    def test_generate_lab_metrics_exports_the_interface_states(self):
+        lines = generate_lab_metrics(self.config)
+        self.assertIn('vnet_interface_up{lab="lab1",interface="vnet-br0",kind="bridge"} 1', lines)
+        self.assertIn('vnet_interface_up{lab="lab1",interface="vnet-br1",kind="bridge"} 0', lines)
+        self.assertIn('vnet_interface_up{lab="lab1",interface="vnet-veth0",kind="veth"} 1', lines)
+        self.assertIn('vnet_interface_up{lab="lab1",interface="vnet-veth1",kind="veth"} 0', lines)
+        self.get_vnet_link_statuses.assert_called_once_with()
+
+    def test_generate_lab_metrics_exports_the_sniffer_presence(self):
+        self.get_vnet_link_statuses.return_value = links(("vnet-br0", "up"))
+        lines = generate_lab_metrics(self.config)
+        self.assertIn('vnet_sniffer_running{lab="lab1",interface="vnet-br0"} 1', lines)
+        # No need to look for sniffers on interfaces that do not exist
+        self.assertIn('vnet_sniffer_running{lab="lab1",interface="vnet-br1"} 0', lines)
+        self.get_running_sniffers.assert_called_once_with(["vnet-br0"])
+
+    def test_generate_lab_metrics_exports_the_action_duration_histograms(self):
+        record_action_duration(self.config, "create", 7)
+        lines = generate_lab_metrics(self.config)
+        self.assertIn('vnet_action_duration_seconds_bucket{lab="lab1",action="create",le="5"} 0', lines)
+        self.assertIn('vnet_action_duration_seconds_bucket{lab="lab1",action="create",le="10"} 1', lines)
+        self.assertIn('vnet_action_duration_seconds_bucket{lab="lab1",action="create",le="+Inf"} 1', lines)
+        self.assertIn('vnet_action_duration_seconds_sum{lab="lab1",action="create"} 7.0', lines)
+        self.assertIn('vnet_action_duration_seconds_count{lab="lab1",action="create"} 1', lines)
+        self.assertIn("# TYPE vnet_action_duration_seconds histogram", lines)
+
+    def test_write_lab_metrics_writes_the_prom_file(self):
+        write_lab_metrics(self.config)
+        with open(join(self.tmp_dir, "vnet_manager_lab1.prom")) as fh:
+            content = fh.read()
+        self.assertIn("# TYPE vnet_machine_running gauge\n", content)
+        self.assertTrue(content.endswith("\n"))
@@ -0,0 +1,83 @@
+import tarfile
+from os import makedirs
+from os.path import isdir, join
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from vnet_manager.tests import VNetTestCase
+from vnet_manager.operations.packages import get_cached_apt_packages, ensure_apt_cache_dir, import_apt_packages
+
+
+class PackagesTestCase(VNetTestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = mkdtemp()
+        self.addCleanup(rmtree, self.tmp_dir)
+        self.cache_dir = join(self.tmp_dir, "cache")
+        self.set_up_patch("vnet_manager.operations.packages.settings.VNET_APT_CACHE_DIR", self.cache_dir)
+
+    def create_file(self, path: str, content: bytes = b"blaap"):
+        with open(path, "wb") as fh:
+            fh.write(content)
+
+
+class TestGetCachedAptPackages(PackagesTestCase):
+    def test_get_cached_apt_packages_returns_nothing_when_the_cache_does_not_exist(self):
+        self.assertEqual(get_cached_apt_packages(), [])
+
+    def test_get_cached_apt_packages_returns_nothing_when_the_cache_is_disabled(self):
+        self.set_up_patch("vnet_manager.operations.packages.settings.VNET_APT_CACHE_DIR", "")
+        self.assertEqual(get_cached_apt_packages(), [])
+
+    def test_get_cached_apt_packages_returns_the_deb_packages(self):
+        ensure_apt_cache_dir()
+        self.create_file(join(self.cache_dir, "radvd_2.17_amd64.deb"))
+        self.create_file(join(self.cache_dir, "frr_7.5_amd64.deb"))
+        self.create_file(join(self.cache_dir, "lock"))
+        self.assertEqual(get_cached_apt_packages(), ["frr_7.5_amd64.deb", "radvd_2.17_amd64.deb"])
+
+
+class TestEnsureAptCacheDir(PackagesTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.chown = self.set_up_patch("vnet_manager.operations.packages.chown")
+
+    def test_ensure_apt_cache_dir_creates_the_cache_and_partial_dir(self):
+        ensure_apt_cache_dir()
+        self.assertTrue(isdir(join(self.cache_dir, "partial")))
+        self.assertFalse(self.chown.called)
+
+    def test_ensure_apt_cache_dir_changes_the_owner_of_the_cache_and_packages(self):
+        makedirs(self.cache_dir)
+        self.create_file(join(self.cache_dir, "frr_7.5_amd64.deb"))
+        ensure_apt_cache_dir(1000000, 1000000)
+        chowned = sorted(c[0][0] for c in self.chown.call_args_list)
+        self.assertEqual(chowned, sorted([self.cache_dir, join(self.cache_dir, "partial"), join(self.cache_dir, "frr_7.5_amd64.deb")]))
+
+
+class TestImportAptPackages(PackagesTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.bundle_dir = join(self.tmp_dir, "bundle")
+        makedirs(join(self.bundle_dir, "pool"))
+        self.create_file(join(self.bundle_dir, "frr_7.5_amd64.deb"), b"frr")
+        self.create_file(join(self.bundle_dir, "pool", "radvd_2.17_amd64.deb"), b"radvd")
+        self.create_file(join(self.bundle_dir, "README"))
+
+    def test_import_apt_packages_copies_the_packages_of_a_directory(self):
+        self.assertEqual(import_apt_packages(self.bundle_dir), 1)
+        self.assertEqual(get_cached_apt_packages(), ["frr_7.5_amd64.deb"])
+
+    def test_import_apt_packages_extracts_the_packages_of_a_tar_archive(self):
+        bundle = join(self.tmp_dir, "bundle.tar.gz")
+        with tarfile.open(bundle, "w:gz") as tar:
+            tar.add(self.bundle_dir, arcname="bundle")
+        self.assertEqual(import_apt_packages(bundle), 2)
+        self.assertEqual(get_cached_apt_packages(), ["frr_7.5_amd64.deb", "radvd_2.17_amd64.deb"])
+        with open(join(self.cache_dir, "radvd_2.17_amd64.deb"), "rb") as fh:
+            self.assertEqual(fh.read(), b"radvd")
+
+    def test_import_apt_packages_raises_for_invalid_bundles(self):
+        bundle = join(self.tmp_dir, "README")
+        self.create_file(bundle)
+        with self.assertRaises(RuntimeError):
+            import_apt_packages(bundle)
@@ -0,0 +1,327 @@
+from copy import deepcopy
+from json import dumps
+from unittest.mock import Mock, MagicMock, call
+from pylxd.exceptions import NotFound, LXDAPIException
+
+from vnet_manager.tests import VNetTestCase
+from vnet_manager.conf import settings
+from vnet_manager.operations.files import FileBundle
+from vnet_manager.operations.machine import generate_lxc_container_config
+from vnet_manager.operations.plan import (
+    generate_plan,
+    plan_vnet_interface_changes,
+    plan_lxc_machine_changes,
+    get_changed_lxc_machine_files,
+    show_plan,
+    apply_plan,
+    update_lxc_machine_devices,
+)
+
+
+class TestGeneratePlan(VNetTestCase):
+    def setUp(self) -> None:
+        self.generate_vnet_hosts_file = self.set_up_patch("vnet_manager.operations.plan.generate_vnet_hosts_file")
+        self.plan_vnet_interface_changes = self.set_up_patch("vnet_manager.operations.plan.plan_vnet_interface_changes")
+        self.plan_vnet_interface_changes.return_value = [{"resource": "bridge"}]
+        self.plan_lxc_machine_changes = self.set_up_patch("vnet_manager.operations.plan.plan_lxc_machine_changes")
+        self.plan_lxc_machine_changes.return_value = [{"resource": "machine"}]
+
+    def test_generate_plan_generates_the_hosts_file(self):
+        generate_plan(settings.CONFIG)
+        self.generate_vnet_hosts_file.assert_called_once_with(settings.CONFIG)
+
+    def test_generate_plan_does_not_generate_the_hosts_file_without_hosts(self):
+        generate_plan(settings.CONFIG, hosts=False)
+        self.assertFalse(self.generate_vnet_hosts_file.called)
+
+    def test_generate_plan_returns_interface_changes_before_machine_changes(self):
+        self.assertEqual(generate_plan(settings.CONFIG, machines=["router100"]), [{"resource": "bridge"}, {"resource": "machine"}])
+        self.plan_lxc_machine_changes.assert_called_once_with(settings.CONFIG, machines=["router100"], hosts=True)
+
+
+class TestPlanVNetInterfaceChanges(VNetTestCase):
+    def setUp(self) -> None:
+        self.links = {
+            "vnet-br0": {"index": 1, "ifname": "vnet-br0", "state": "up", "master": None, "stp": 0},
+            "vnet-br1": {"index": 2, "ifname": "vnet-br1", "state": "up", "master": None, "stp": 1},
+            "vnet-veth0": {"index": 3, "ifname": "vnet-veth0", "state": "up", "master": 1, "stp": None},
+            "vnet-veth1": {"index": 4, "ifname": "vnet-veth1", "state": "up", "master": 2, "stp": None},
+        }
+        self.get_vnet_link_statuses = self.set_up_patch("vnet_manager.operations.plan.get_vnet_link_statuses")
+        self.get_vnet_link_statuses.side_effect = lambda: (self.links, {link["index"]: link for link in self.links.values()})
+        self.config = deepcopy(settings.CONFIG)
+
+    def test_plan_vnet_interface_changes_returns_nothing_if_everything_matches(self):
+        self.assertEqual(plan_vnet_interface_changes(self.config), [])
+
+    def test_plan_vnet_interface_changes_gets_the_links_once(self):
+        plan_vnet_interface_changes(self.config)
+        self.get_vnet_link_statuses.assert_called_once_with()
+
+    def test_plan_vnet_interface_changes_creates_missing_bridges(self):
+        del self.links["vnet-br0"]
+        changes = plan_vnet_interface_changes(self.config)
+        self.assertIn({"resource": "bridge", "name": "vnet-br0", "change": "create", "details": "missing"}, changes)
+
+    def test_plan_vnet_interface_changes_brings_up_bridges_that_are_down(self):
+        self.links["vnet-br0"]["state"] = "down"
+        changes = plan_vnet_interface_changes(self.config)
+        self.assertEqual(changes, [{"resource": "bridge", "name": "vnet-br0", "change": "modify", "details": "down"}])
+
+    def test_plan_vnet_interface_changes_sets_the_stp_state_of_bridges(self):
+        self.links["vnet-br0"]["stp"] = 1
+        self.links["vnet-br1"]["stp"] = 0
+        changes = plan_vnet_interface_changes(self.config)
+        self.assertEqual(
+            changes,
+            [
+                {"resource": "bridge", "name": "vnet-br1", "change": "stp", "details": "stp on", "stp": True},
+                {"resource": "bridge", "name": "vnet-br0", "change": "stp", "details": "stp off", "stp": False},
+            ],
+        )
+
+    def test_plan_vnet_interface_changes_enables_stp_on_missing_bridges(self):
+        del self.links["vnet-br1"]
+        changes = plan_vnet_interface_changes(self.config)
+        self.assertIn({"resource": "bridge", "name": "vnet-br1", "change": "stp", "details": "stp on", "stp": True}, changes)
+
+    def test_plan_vnet_interface_changes_creates_missing_veths_with_a_peer(self):
+        del self.links["vnet-veth0"]
+        del self.links["vnet-veth1"]
+        changes = plan_vnet_interface_changes(self.config)
+        created = [change["name"] for change in changes if change["resource"] == "veth"]
+        self.assertEqual(created, [name for name, data in self.config["veths"].items() if "peer" in data])
+
+    def test_plan_vnet_interface_changes_modifies_veths_with_the_wrong_master(self):
+        self.links["vnet-veth0"]["master"] = 2
+        self.links["vnet-veth1"]["master"] = None
+        changes = plan_vnet_interface_changes(self.config)
+        self.assertEqual(
+            [(change["name"], change["details"]) for change in changes],
+            [("vnet-veth1", "master vnet-br1"), ("vnet-veth0", "master vnet-br0")],
+        )
+
+    def test_plan_vnet_interface_changes_brings_up_veths_that_are_down(self):
+        self.links["vnet-veth0"]["state"] = "down"
+        changes = plan_vnet_interface_changes(self.config)
+        self.assertEqual([(change["name"], change["change"], change["details"]) for change in changes], [("vnet-veth0", "modify", "down")])
+
+
+class TestPlanLXCMachineChanges(VNetTestCase):
+    def setUp(self) -> None:
+        self.config = deepcopy(settings.CONFIG)
+        self.config["config_path"] = "/root/config.yaml"
+        self.get_lxc_instances = self.set_up_patch("vnet_manager.operations.plan.get_lxc_instances")
+        self.get_lxc_instances.return_value = {
+            name: {"name": name, "devices": generate_lxc_container_config(self.config, name)["devices"], "config": {}}
+            for name in self.config["machines"]
+        }
+        self.generate_machine_file_bundle = self.set_up_patch("vnet_manager.operations.plan.generate_machine_file_bundle")
+        self.get_changed_lxc_machine_files = self.set_up_patch("vnet_manager.operations.plan.get_changed_lxc_machine_files")
+        self.get_changed_lxc_machine_files.return_value = FileBundle("router100")
+
+    def test_plan_lxc_machine_changes_returns_nothing_if_everything_matches(self):
+        self.assertEqual(plan_lxc_machine_changes(self.config), [])
+
+    def test_plan_lxc_machine_changes_creates_missing_machines(self):
+        del self.get_lxc_instances.return_value["router101"]
+        changes = plan_lxc_machine_changes(self.config)
+        self.assertEqual(changes, [{"resource": "machine", "name": "router101", "change": "create", "details": "missing"}])
+
+    def test_plan_lxc_machine_changes_modifies_changed_devices(self):
+        self.get_lxc_instances.return_value["router100"]["devices"]["eth12"] = {"type": "nic", "parent": "vnet-br3"}
+        changes = plan_lxc_machine_changes(self.config)
+        self.assertEqual(len(changes), 1)
+        self.assertEqual(changes[0]["change"], "modify")
+        self.assertEqual(changes[0]["details"], "devices eth12")
+        self.assertEqual(changes[0]["devices"], generate_lxc_container_config(self.config, "router100")["devices"])
+
+    def test_plan_lxc_machine_changes_provisions_changed_files(self):
+        bundle = FileBundle("router100")
+        bundle.add("/etc/hosts", "data")
+        self.get_changed_lxc_machine_files.side_effect = lambda b: bundle if b is self.generate_machine_file_bundle.return_value else b
+        self.generate_machine_file_bundle.side_effect = lambda config, machine, hosts: (
+            self.generate_machine_file_bundle.return_value if machine == "router100" else FileBundle(machine)
+        )
+        changes = plan_lxc_machine_changes(self.config, hosts=False)
+        self.assertEqual(
+            changes, [{"resource": "machine", "name": "router100", "change": "provision", "details": "files /etc/hosts", "bundle": bundle}]
+        )
+        self.generate_machine_file_bundle.assert_any_call(self.config, "router100", hosts=False)
+
+    def test_plan_lxc_machine_changes_deletes_tagged_machines_that_are_not_in_the_config(self):
+        self.get_lxc_instances.return_value["router200"] = {"name": "router200", "config": {"user.vnet.config": "/root/config.yaml"}}
+        self.get_lxc_instances.return_value["other"] = {"name": "other", "config": {"user.vnet.config": "/root/other.yaml"}}
+        changes = plan_lxc_machine_changes(self.config)
+        self.assertEqual(changes, [{"resource": "machine", "name": "router200", "change": "delete", "details": "not in config"}])
+
+    def test_plan_lxc_machine_changes_does_not_delete_when_planning_for_specific_machines(self):
+        self.get_lxc_instances.return_value["router200"] = {"name": "router200", "config": {"user.vnet.config": "/root/config.yaml"}}
+        self.assertEqual(plan_lxc_machine_changes(self.config, machines=["router100"]), [])
+
+    def test_plan_lxc_machine_changes_skips_unknown_machines(self):
+        self.assertEqual(plan_lxc_machine_changes(self.config, machines=["blaap"]), [])
+
+
+class TestGetChangedLXCMachineFiles(VNetTestCase):
+    def setUp(self) -> None:
+        self.lxd_client = self.set_up_patch("vnet_manager.operations.plan.get_lxd_client")
+        self.container = self.lxd_client.return_value.containers.get.return_value
+        self.guest_files = {"/etc/hosts": b"hosts"}
+        self.container.files.get.side_effect = self.get_guest_file
+        self.container.config = {}
+        self.bundle = FileBundle("router100")
+        self.bundle.add("/etc/hosts", "hosts")
+        self.bundle.add("/etc/frr/frr.conf", "frr")
+
+    def get_guest_file(self, path):
+        if path not in self.guest_files:
+            raise NotFound(response="blaap")
+        return self.guest_files[path]
+
+    def test_get_changed_lxc_machine_files_only_returns_missing_files(self):
+        changed = get_changed_lxc_machine_files(self.bundle)
+        self.assertEqual(changed.machine, "router100")
+        self.assertEqual(list(changed.files), ["/etc/frr/frr.conf"])
+
+    def test_get_changed_lxc_machine_files_returns_changed_files(self):
+        self.guest_files = {"/etc/hosts": b"old", "/etc/frr/frr.conf": b"frr"}
+        self.assertEqual(list(get_changed_lxc_machine_files(self.bundle).files), ["/etc/hosts"])
+
+    def test_get_changed_lxc_machine_files_does_not_read_files_that_match_the_manifest(self):
+        self.container.config = {settings.LXC_FILE_MANIFEST_CONFIG_KEY: dumps(self.bundle.hashes())}
+        self.assertFalse(get_changed_lxc_machine_files(self.bundle))
+        self.assertFalse(self.container.files.get.called)
+
+    def test_get_changed_lxc_machine_files_gets_the_container_once(self):
+        get_changed_lxc_machine_files(self.bundle)
+        self.lxd_client.return_value.containers.get.assert_called_once_with("router100")
+
+
+class TestShowPlan(VNetTestCase):
+    def setUp(self) -> None:
+        self.tabulate = self.set_up_patch("vnet_manager.operations.plan.tabulate")
+        self.logger = self.set_up_patch("vnet_manager.operations.plan.logger")
+        self.print = self.set_up_patch("builtins.print")
+
+    def test_show_plan_tabulates_the_changes(self):
+        show_plan([{"resource": "machine", "name": "router100", "change": "create", "details": "missing"}])
+        self.tabulate.assert_called_once_with(
+            [["machine", "router100", "create", "missing"]], headers=["Resource", "Name", "Change", "Details"], tablefmt="pretty"
+        )
+
+    def test_show_plan_notes_that_interfaces_are_not_deleted(self):
+        show_plan([{"resource": "machine", "name": "router100", "change": "create", "details": "missing"}])
+        self.print.assert_called_with("Interfaces that are no longer in the config are not deleted, use 'destroy' to remove them")
+
+    def test_show_plan_logs_when_there_is_nothing_to_do(self):
+        show_plan([])
+        self.assertFalse(self.tabulate.called)
+        self.logger.info.assert_called_once_with("The VNet environment matches the config, nothing to do")
+
+
+class TestApplyPlan(VNetTestCase):
+    def setUp(self) -> None:
+        self.destroy_lxc_machine = self.set_up_patch("vnet_manager.operations.plan.destroy_lxc_machine")
+        self.create_vnet_interface = self.set_up_patch("vnet_manager.operations.plan.create_vnet_interface")
+        self.ensure_vnet_iptables_rules = self.set_up_patch("vnet_manager.operations.plan.ensure_vnet_iptables_rules")
+        self.create_veth_interface = self.set_up_patch("vnet_manager.operations.plan.create_veth_interface")
+        self.configure_veth_interface = self.set_up_patch("vnet_manager.operations.plan.configure_veth_interface")
+        self.configure_vnet_interface = self.set_up_patch("vnet_manager.operations.plan.configure_vnet_interface")
+        self.ensure_vnet_lxc_environment = self.set_up_patch("vnet_manager.operations.plan.ensure_vnet_lxc_environment")
+        self.create_lxc_machines = self.set_up_patch("vnet_manager.operations.plan.create_lxc_machines_from_base_image")
+        self.create_lxc_machines.return_value = []
+        self.configure_vnet_interface_stp = self.set_up_patch("vnet_manager.operations.plan.configure_vnet_interface_stp")
+        self.logger = self.set_up_patch("vnet_manager.operations.plan.logger")
+        self.update_lxc_machine_devices = self.set_up_patch("vnet_manager.operations.plan.update_lxc_machine_devices")
+        self.deliver_file_bundle = self.set_up_patch("vnet_manager.operations.plan.deliver_file_bundle")
+        self.bundle = FileBundle("router101")
+        self.changes = [
+            {"resource": "bridge", "name": "vnet-br1", "change": "create", "details": ""},
+            {"resource": "veth", "name": "vnet-veth0", "change": "create", "details": "", "data": {"bridge": "vnet-br0", "peer": "x"}},
+            {"resource": "veth", "name": "vnet-veth1", "change": "modify", "details": "", "data": {"bridge": "vnet-br1"}},
+            {"resource": "machine", "name": "router100", "change": "create", "details": ""},
+            {"resource": "machine", "name": "router101", "change": "modify", "details": "", "devices": {"eth0": {}}},
+            {"resource": "machine", "name": "router101", "change": "provision", "details": "", "bundle": self.bundle},
+            {"resource": "machine", "name": "router200", "change": "delete", "details": ""},
+        ]
+
+    def test_apply_plan_deletes_machines(self):
+        apply_plan(settings.CONFIG, self.changes)
+        self.destroy_lxc_machine.assert_called_once_with("router200", wait=True)
+
+    def test_apply_plan_creates_bridges(self):
+        apply_plan(settings.CONFIG, self.changes)
+        self.create_vnet_interface.assert_called_once_with("vnet-br1")
+        self.ensure_vnet_iptables_rules.assert_called_once_with()
+
+    def test_apply_plan_does_not_touch_the_iptables_rules_without_bridges_to_create(self):
+        apply_plan(settings.CONFIG, self.changes[1:])
+        self.assertFalse(self.ensure_vnet_iptables_rules.called)
+
+    def test_apply_plan_creates_and_configures_veths(self):
+        apply_plan(settings.CONFIG, self.changes)
+        self.create_veth_interface.assert_called_once_with("vnet-veth0", {"bridge": "vnet-br0", "peer": "x"})
+        self.configure_veth_interface.assert_has_calls(
+            [call("vnet-veth0", {"bridge": "vnet-br0", "peer": "x"}), call("vnet-veth1", {"bridge": "vnet-br1"})]
+        )
+        self.assertEqual(self.configure_vnet_interface.call_count, 2)
+
+    def test_apply_plan_creates_machines(self):
+        apply_plan(settings.CONFIG, self.changes, parallel=3, hosts=False)
+        self.ensure_vnet_lxc_environment.assert_called_once_with(settings.CONFIG)
+        self.create_lxc_machines.assert_called_once_with(settings.CONFIG, ["router100"], parallel=3, hosts=False)
+
+    def test_apply_plan_does_not_ensure_the_environment_without_machines_to_create(self):
+        apply_plan(settings.CONFIG, self.changes[4:])
+        self.assertFalse(self.ensure_vnet_lxc_environment.called)
+        self.assertFalse(self.create_lxc_machines.called)
+
+    def test_apply_plan_updates_devices_and_delivers_changed_files(self):
+        apply_plan(settings.CONFIG, self.changes)
+        self.update_lxc_machine_devices.assert_called_once_with("router101", {"eth0": {}})
+        self.deliver_file_bundle.assert_called_once_with(self.bundle, "lxc")
+
+    def test_apply_plan_configures_bridges_that_are_down_and_their_stp_state(self):
+        changes = [
+            {"resource": "bridge", "name": "vnet-br0", "change": "modify", "details": "down"},
+            {"resource": "bridge", "name": "vnet-br1", "change": "stp", "details": "stp on", "stp": True},
+        ]
+        apply_plan(settings.CONFIG, changes)
+        self.configure_vnet_interface.assert_called_once_with("vnet-br0")
+        self.configure_vnet_interface_stp.assert_called_once_with("vnet-br1", True)
+
+    def test_apply_plan_returns_empty_list_when_all_changes_are_applied(self):
+        self.assertEqual(apply_plan(settings.CONFIG, self.changes), [])
+        self.assertFalse(self.logger.error.called)
+
+    def test_apply_plan_continues_after_a_failing_machine(self):
+        response = Mock(status_code=500)
+        response.json.return_value = {"error": "blaap"}
+        self.update_lxc_machine_devices.side_effect = LXDAPIException(response)
+        self.create_lxc_machines.return_value = ["router100"]
+        self.assertEqual(apply_plan(settings.CONFIG, self.changes), ["router100", "router101"])
+        self.deliver_file_bundle.assert_called_once_with(self.bundle, "lxc")
+        self.assertTrue(self.logger.error.called)
+
+    def test_apply_plan_reports_machines_of_which_the_files_could_not_be_placed(self):
+        self.deliver_file_bundle.return_value = False
+        self.assertEqual(apply_plan(settings.CONFIG, self.changes), ["router101"])
+
+    def test_apply_plan_does_nothing_without_changes(self):
+        apply_plan(settings.CONFIG, [])
+        for mock in (self.destroy_lxc_machine, self.create_vnet_interface, self.create_lxc_machines, self.deliver_file_bundle):
+            self.assertFalse(mock.called)
+
+
+class TestUpdateLXCMachineDevices(VNetTestCase):
+    def setUp(self) -> None:
+        self.lxd_client = self.set_up_patch("vnet_manager.operations.plan.get_lxd_client")
+        self.container = MagicMock()
+        self.lxd_client.return_value.containers.get.return_value = self.container
+
+    def test_update_lxc_machine_devices_saves_the_new_devices(self):
+        update_lxc_machine_devices("router100", {"eth0": {"type": "none"}})
+        self.lxd_client.return_value.containers.get.assert_called_once_with("router100")
+        self.assertEqual(self.container.devices, {"eth0": {"type": "none"}})
+        self.container.save.assert_called_once_with(wait=True)
@@ -0,0 +1,430 @@
+import gzip
+import sys
+from os import listdir, stat, utime
+from os.path import exists, join
+from shutil import rmtree
+from signal import SIGTERM
+from subprocess import DEVNULL, STDOUT, TimeoutExpired
+from tempfile import mkdtemp
+from unittest.mock import Mock, call
+
+from psutil import AccessDenied, NoSuchProcess
+
+from vnet_manager.tests import VNetTestCase
+from vnet_manager.conf import settings
+from vnet_manager.operations.sniffer import (
+    get_sniffer_pid_file,
+    register_sniffer,
+    unregister_sniffer,
+    get_registered_sniffer_pid,
+    scan_for_sniffers,
+    get_running_sniffers,
+    check_if_sniffer_exists,
+    get_sniffer_capture_path,
+    get_tcpdump_command,
+    get_sniffer_log_path,
+    get_sniffer_capture_files,
+    compress_capture_file,
+    rotate_sniffer_capture_files,
+    supervise_sniffer,
+    start_tcpdump_on_vnet_interface,
+    stop_sniffers,
+)
+
+
+def process(pid: int, name: str, cmdline) -> Mock:
+    mock = Mock()
+    mock.pid = pid
+    mock.info = {"name": name}
+    if isinstance(cmdline, Exception):
+        mock.cmdline.side_effect = cmdline
+    else:
+        mock.cmdline.return_value = cmdline
+    return mock
+
+
+class SnifferTestCase(VNetTestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = mkdtemp()
+        self.addCleanup(rmtree, self.tmp_dir)
+        self.pid_dir = join(self.tmp_dir, "sniffers")
+        self.set_up_patch("vnet_manager.operations.sniffer.settings.VNET_SNIFFER_PID_DIR", self.pid_dir)
+
+
+class TestSnifferRegistry(SnifferTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.process = self.set_up_patch("vnet_manager.operations.sniffer.Process")
+        self.process.return_value.cmdline.return_value = ["tcpdump", "-i", "vnet-br0", "-U", "-w", "/tmp/vnet-br0.pcap"]
+
+    def test_get_sniffer_pid_file_returns_a_file_in_the_registry(self):
+        self.assertEqual(get_sniffer_pid_file("vnet-br0"), join(self.pid_dir, "vnet-br0.pid"))
+
+    def test_register_sniffer_writes_the_pid_file(self):
+        register_sniffer("vnet-br0", 42)
+        with open(join(self.pid_dir, "vnet-br0.pid")) as fh:
+            self.assertEqual(fh.read(), "42\n")
+
+    def test_unregister_sniffer_removes_the_pid_file(self):
+        register_sniffer("vnet-br0", 42)
+        unregister_sniffer("vnet-br0")
+        self.assertEqual(listdir(self.pid_dir), [])
+
+    def test_unregister_sniffer_does_nothing_if_the_sniffer_is_not_registered(self):
+        unregister_sniffer("vnet-br0")
+
+    def test_get_registered_sniffer_pid_returns_the_pid_of_a_running_sniffer(self):
+        register_sniffer("vnet-br0", 42)
+        self.assertEqual(get_registered_sniffer_pid("vnet-br0"), 42)
+        self.process.assert_called_once_with(42)
+
+    def test_get_registered_sniffer_pid_returns_none_if_the_sniffer_is_not_registered(self):
+        self.assertIsNone(get_registered_sniffer_pid("vnet-br0"))
+        self.assertFalse(self.process.called)
+
+    def test_get_registered_sniffer_pid_returns_none_for_an_invalid_pid_file(self):
+        register_sniffer("vnet-br0", "blaap")
+        self.assertIsNone(get_registered_sniffer_pid("vnet-br0"))
+
+    def test_get_registered_sniffer_pid_removes_the_registration_if_the_sniffer_is_gone(self):
+        self.process.side_effect = NoSuchProcess(42)
+        register_sniffer("vnet-br0", 42)
+        self.assertIsNone(get_registered_sniffer_pid("vnet-br0"))
+        self.assertEqual(listdir(self.pid_dir), [])
+
+    def test_get_registered_sniffer_pid_removes_the_registration_if_the_pid_has_been_reused(self):
+        self.process.return_value.cmdline.return_value = ["sleep", "100"]
+        register_sniffer("vnet-br0", 42)
+        self.assertIsNone(get_registered_sniffer_pid("vnet-br0"))
+        self.assertEqual(listdir(self.pid_dir), [])
+
+
+class TestScanForSniffers(VNetTestCase):
+    def setUp(self) -> None:
+        self.process_iter = self.set_up_patch("vnet_manager.operations.sniffer.process_iter")
+        self.process_iter.return_value = [
+            process(1, "systemd", ["/sbin/init"]),
+            process(42, "tcpdump", ["/usr/sbin/tcpdump", "-i", "vnet-br0", "-n"]),
+            process(43, "tcpdump", []),
+            process(44, "vim", ["vim", "-i", "vnet-br1"]),
+            process(45, "tcpdump", NoSuchProcess(45)),
+            process(46, "tcpdump", AccessDenied(46)),
+        ]
+
+    def test_scan_for_sniffers_walks_the_processes_once(self):
+        scan_for_sniffers()
+        self.process_iter.assert_called_once_with(["name"])
+
+    def test_scan_for_sniffers_indexes_the_tcpdump_processes_by_interface(self):
+        self.assertEqual(scan_for_sniffers(), {"vnet-br0": 42})
+
+    def test_scan_for_sniffers_only_reads_the_command_line_of_tcpdump_processes(self):
+        scan_for_sniffers()
+        self.assertFalse(self.process_iter.return_value[0].cmdline.called)
+        self.assertFalse(self.process_iter.return_value[3].cmdline.called)
+        self.process_iter.return_value[1].cmdline.assert_called_once_with()
+
+
+class TestGetRunningSniffers(VNetTestCase):
+    def setUp(self) -> None:
+        self.get_registered_sniffer_pid = self.set_up_patch("vnet_manager.operations.sniffer.get_registered_sniffer_pid")
+        self.get_registered_sniffer_pid.side_effect = {"vnet-br0": 42, "vnet-br1": None, "vnet-br2": None}.get
+        self.scan_for_sniffers = self.set_up_patch("vnet_manager.operations.sniffer.scan_for_sniffers")
+        self.scan_for_sniffers.return_value = {"vnet-br1": 43, "vnet-br3": 44}
+
+    def test_get_running_sniffers_combines_the_registry_and_a_single_scan(self):
+        self.assertEqual(get_running_sniffers(["vnet-br0", "vnet-br1", "vnet-br2"]), {"vnet-br0": 42, "vnet-br1": 43})
+        self.scan_for_sniffers.assert_called_once_with()
+
+    def test_get_running_sniffers_does_not_scan_if_all_sniffers_are_registered(self):
+        self.assertEqual(get_running_sniffers(["vnet-br0"]), {"vnet-br0": 42})
+        self.assertFalse(self.scan_for_sniffers.called)
+
+    def test_get_running_sniffers_does_nothing_without_interfaces(self):
+        self.assertEqual(get_running_sniffers([]), {})
+        self.assertFalse(self.scan_for_sniffers.called)
+
+
+class TestCheckIfSnifferExists(VNetTestCase):
+    def setUp(self) -> None:
+        self.get_running_sniffers = self.set_up_patch("vnet_manager.operations.sniffer.get_running_sniffers")
+        self.get_running_sniffers.return_value = {}
+
+    def test_check_if_sniffer_exists_returns_false_if_sniffer_does_not_exist(self):
+        self.assertFalse(check_if_sniffer_exists("dev0"))
+        self.get_running_sniffers.assert_called_once_with(["dev0"])
+
+    def test_check_if_sniffer_exists_returns_true_if_sniffer_exists(self):
+        self.get_running_sniffers.return_value = {"dev1": 42}
+        self.assertTrue(check_if_sniffer_exists("dev1"))
+
+
+class CaptureFilesTestCase(VNetTestCase):
+    def setUp(self) -> None:
+        self.pcap_dir = mkdtemp()
+        self.addCleanup(rmtree, self.pcap_dir)
+        self.set_up_patch("vnet_manager.operations.sniffer.settings.VNET_SNIFFER_PCAP_DIR", self.pcap_dir)
+        self.set_up_patch("vnet_manager.operations.sniffer.settings.VNET_SNIFFER_COMPRESS", False)
+        self.set_up_patch("vnet_manager.operations.sniffer.settings.VNET_SNIFFER_MAX_FILES", 0)
+
+    def make_file(self, name: str, mtime: int, data: bytes = b"packets") -> str:
+        path = join(self.pcap_dir, name)
+        with open(path, "wb") as fh:
+            fh.write(data)
+        utime(path, (mtime, mtime))
+        return path
+
+
+class TestGetTcpdumpCommand(VNetTestCase):
+    def setUp(self) -> None:
+        self.set_up_patch("vnet_manager.operations.sniffer.settings.VNET_SNIFFER_SNAPLEN", 0)
+        self.set_up_patch("vnet_manager.operations.sniffer.settings.VNET_SNIFFER_FILTER", "")
+        self.set_up_patch("vnet_manager.operations.sniffer.settings.VNET_SNIFFER_ROTATE_SIZE", 0)
+        self.set_up_patch("vnet_manager.operations.sniffer.settings.VNET_SNIFFER_ROTATE_SECONDS", 0)
+        self.path = join(settings.VNET_SNIFFER_PCAP_DIR, "dev1.pcap")
+
+    def test_get_sniffer_capture_path_returns_a_pcap_file_per_interface(self):
+        self.assertEqual(get_sniffer_capture_path("dev1"), self.path)
+
+    def test_get_sniffer_capture_path_adds_a_timestamp_when_rotating_by_time(self):
+        self.set_up_patch("vnet_manager.operations.sniffer.settings.VNET_SNIFFER_ROTATE_SECONDS", 3600)
+        self.assertEqual(get_sniffer_capture_path("dev1"), join(settings.VNET_SNIFFER_PCAP_DIR, "dev1-%Y%m%d-%H%M%S.pcap"))
+
+    def test_get_tcpdump_command_captures_full_packets_by_default(self):
+        self.assertEqual(get_tcpdump_command("dev1"), ["tcpdump", "-i", "dev1", "-U", "-w", self.path])
+
+    def test_get_tcpdump_command_sets_the_snaplen(self):
+        self.set_up_patch("vnet_manager.operations.sniffer.settings.VNET_SNIFFER_SNAPLEN", 128)
+        self.assertEqual(get_tcpdump_command("dev1")[-2:], ["-s", "128"])
+
+    def test_get_tcpdump_command_rotates_by_size_and_time(self):
+        self.set_up_patch("vnet_manager.operations.sniffer.settings.VNET_SNIFFER_ROTATE_SIZE", 100)
+        self.set_up_patch("vnet_manager.operations.sniffer.settings.VNET_SNIFFER_ROTATE_SECONDS", 3600)
+        self.assertEqual(get_tcpdump_command("dev1")[-4:], ["-C", "100", "-G", "3600"])
+        # The maximum amount of files is enforced by the supervisor
+        self.assertNotIn("-W", get_tcpdump_command("dev1"))
+
+    def test_get_tcpdump_command_appends_the_bpf_filter(self):
+        self.set_up_patch("vnet_manager.operations.sniffer.settings.VNET_SNIFFER_FILTER", "not ip6 and port 179")
+        self.assertEqual(get_tcpdump_command("dev1")[-5:], ["not", "ip6", "and", "port", "179"])
+
+
+class TestGetSnifferCaptureFiles(CaptureFilesTestCase):
+    def test_get_sniffer_capture_files_returns_the_files_from_oldest_to_newest(self):
+        newest = self.make_file("dev1.pcap2", 300)
+        oldest = self.make_file("dev1.pcap", 100)
+        middle = self.make_file("dev1.pcap1.gz", 200)
+        self.assertEqual(get_sniffer_capture_files("dev1"), [oldest, middle, newest])
+
+    def test_get_sniffer_capture_files_finds_time_rotated_files(self):
+        path = self.make_file("dev1-20261018-101500.pcap", 100)
+        self.assertEqual(get_sniffer_capture_files("dev1"), [path])
+
+    def test_get_sniffer_capture_files_ignores_files_of_other_interfaces_and_temporary_files(self):
+        for name in ["dev10.pcap", "dev1.pcap.gz.tmp", "dev1.txt", "dev2-20261018-101500.pcap"]:
+            self.make_file(name, 100)
+        self.assertEqual(get_sniffer_capture_files("dev1"), [])
+
+    def test_get_sniffer_capture_files_returns_nothing_without_pcap_dir(self):
+        self.set_up_patch("vnet_manager.operations.sniffer.settings.VNET_SNIFFER_PCAP_DIR", join(self.pcap_dir, "blaap"))
+        self.assertEqual(get_sniffer_capture_files("dev1"), [])
+
+
+class TestCompressCaptureFile(CaptureFilesTestCase):
+    def test_compress_capture_file_replaces_the_file_with_a_gzip_file(self):
+        path = self.make_file("dev1.pcap", 100)
+        self.assertEqual(compress_capture_file(path), path + ".gz")
+        self.assertEqual(listdir(self.pcap_dir), ["dev1.pcap.gz"])
+        with gzip.open(path + ".gz") as fh:
+            self.assertEqual(fh.read(), b"packets")
+
+    def test_compress_capture_file_keeps_the_modification_time(self):
+        path = self.make_file("dev1.pcap", 100)
+        compress_capture_file(path)
+        self.assertEqual(get_sniffer_capture_files("dev1"), [path + ".gz"])
+        self.assertEqual(int(stat(path + ".gz").st_mtime), 100)
+
+
+class TestRotateSnifferCaptureFiles(CaptureFilesTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.oldest = self.make_file("dev1.pcap", 100)
+        self.middle = self.make_file("dev1.pcap1", 200)
+        self.current = self.make_file("dev1.pcap2", 300)
+
+    def test_rotate_sniffer_capture_files_does_nothing_by_default(self):
+        rotate_sniffer_capture_files("dev1")
+        self.assertEqual(get_sniffer_capture_files("dev1"), [self.oldest, self.middle, self.current])
+
+    def test_rotate_sniffer_capture_files_compresses_all_but_the_current_file(self):
+        self.set_up_patch("vnet_manager.operations.sniffer.settings.VNET_SNIFFER_COMPRESS", True)
+        rotate_sniffer_capture_files("dev1")
+        self.assertEqual(get_sniffer_capture_files("dev1"), [self.oldest + ".gz", self.middle + ".gz", self.current])
+
+    def test_rotate_sniffer_capture_files_compresses_the_current_file_when_final(self):
+        self.set_up_patch("vnet_manager.operations.sniffer.settings.VNET_SNIFFER_COMPRESS", True)
+        rotate_sniffer_capture_files("dev1", final=True)
+        self.assertEqual(get_sniffer_capture_files("dev1"), [self.oldest + ".gz", self.middle + ".gz", self.current + ".gz"])
+
+    def test_rotate_sniffer_capture_files_removes_the_oldest_files(self):
+        self.set_up_patch("vnet_manager.operations.sniffer.settings.VNET_SNIFFER_MAX_FILES", 2)
+        rotate_sniffer_capture_files("dev1")
+        self.assertEqual(get_sniffer_capture_files("dev1"), [self.middle, self.current])
+
+    def test_rotate_sniffer_capture_files_removes_the_oldest_compressed_files(self):
+        self.set_up_patch("vnet_manager.operations.sniffer.settings.VNET_SNIFFER_COMPRESS", True)
+        self.set_up_patch("vnet_manager.operations.sniffer.settings.VNET_SNIFFER_MAX_FILES", 1)
+        rotate_sniffer_capture_files("dev1")
+        self.assertEqual(get_sniffer_capture_files("dev1"), [self.current])
+
+
+class TestSuperviseSniffer(VNetTestCase):
+    def setUp(self) -> None:
+        self.signal = self.set_up_patch("vnet_manager.operations.sniffer.signal")
+        self.event = self.set_up_patch("vnet_manager.operations.sniffer.Event")
+        self.event.return_value.wait.side_effect = [False, True]
+        self.event.return_value.is_set.return_value = True
+        self.popen = self.set_up_patch("vnet_manager.operations.sniffer.Popen")
+        self.popen.return_value.poll.return_value = None
+        self.get_tcpdump_command = self.set_up_patch("vnet_manager.operations.sniffer.get_tcpdump_command", return_value=["tcpdump"])
+        self.rotate_sniffer_capture_files = self.set_up_patch("vnet_manager.operations.sniffer.rotate_sniffer_capture_files")
+        self.get_registered_sniffer_pid = self.set_up_patch("vnet_manager.operations.sniffer.get_registered_sniffer_pid")
+        self.getpid = self.set_up_patch("vnet_manager.operations.sniffer.getpid", return_value=42)
+        self.get_registered_sniffer_pid.return_value = 42
+        self.unregister_sniffer = self.set_up_patch("vnet_manager.operations.sniffer.unregister_sniffer")
+
+    def test_supervise_sniffer_runs_tcpdump(self):
+        supervise_sniffer("dev1")
+        self.get_tcpdump_command.assert_called_once_with("dev1")
+        self.popen.assert_called_once_with(["tcpdump"], stdin=DEVNULL)
+
+    def test_supervise_sniffer_stops_on_sigterm(self):
+        supervise_sniffer("dev1")
+        self.assertIn(SIGTERM, [c[0][0] for c in self.signal.call_args_list])
+
+    def test_supervise_sniffer_rotates_the_capture_files_while_running_and_when_stopped(self):
+        supervise_sniffer("dev1")
+        self.assertEqual(self.rotate_sniffer_capture_files.call_args_list[0][0], ("dev1",))
+        self.rotate_sniffer_capture_files.assert_called_with("dev1", final=True)
+        self.assertEqual(self.rotate_sniffer_capture_files.call_count, 2)
+
+    def test_supervise_sniffer_terminates_tcpdump_when_stopped(self):
+        self.assertEqual(supervise_sniffer("dev1"), 0)
+        self.popen.return_value.terminate.assert_called_once_with()
+        self.popen.return_value.wait.assert_called_once_with(timeout=settings.VNET_SNIFFER_STOP_TIMEOUT)
+
+    def test_supervise_sniffer_kills_tcpdump_if_it_does_not_stop(self):
+        self.popen.return_value.wait.side_effect = [TimeoutExpired("tcpdump", 1), 0]
+        supervise_sniffer("dev1")
+        self.popen.return_value.kill.assert_called_once_with()
+
+    def test_supervise_sniffer_returns_the_exit_code_if_tcpdump_exits(self):
+        self.event.return_value.is_set.return_value = False
+        self.event.return_value.wait.side_effect = [False]
+        self.popen.return_value.poll.return_value = 1
+        self.popen.return_value.returncode = 1
+        self.assertEqual(supervise_sniffer("dev1"), 1)
+        self.assertFalse(self.popen.return_value.terminate.called)
+        self.rotate_sniffer_capture_files.assert_called_once_with("dev1", final=True)
+
+    def test_supervise_sniffer_unregisters_itself(self):
+        supervise_sniffer("dev1")
+        self.unregister_sniffer.assert_called_once_with("dev1")
+
+    def test_supervise_sniffer_does_not_unregister_another_sniffer(self):
+        self.get_registered_sniffer_pid.return_value = 43
+        supervise_sniffer("dev1")
+        self.assertFalse(self.unregister_sniffer.called)
+
+
+class TestStopSniffers(VNetTestCase):
+    def setUp(self) -> None:
+        self.get_running_sniffers = self.set_up_patch("vnet_manager.operations.sniffer.get_running_sniffers")
+        self.get_running_sniffers.return_value = {"dev1": 42}
+        self.process = self.set_up_patch("vnet_manager.operations.sniffer.Process")
+        self.tcpdump = Mock()
+        self.process.return_value.children.return_value = [self.tcpdump]
+        self.wait_procs = self.set_up_patch("vnet_manager.operations.sniffer.wait_procs", return_value=([], []))
+        self.unregister_sniffer = self.set_up_patch("vnet_manager.operations.sniffer.unregister_sniffer")
+
+    def test_stop_sniffers_terminates_the_sniffers(self):
+        stop_sniffers(["dev1", "dev2"])
+        self.get_running_sniffers.assert_called_once_with(["dev1", "dev2"])
+        self.process.assert_called_once_with(42)
+        self.process.return_value.terminate.assert_called_once_with()
+
+    def test_stop_sniffers_waits_for_the_sniffers_and_their_tcpdump(self):
+        stop_sniffers(["dev1"])
+        self.wait_procs.assert_called_once_with([self.process.return_value, self.tcpdump], timeout=settings.VNET_SNIFFER_STOP_TIMEOUT)
+
+    def test_stop_sniffers_kills_the_processes_that_do_not_stop(self):
+        self.wait_procs.return_value = ([], [self.tcpdump])
+        stop_sniffers(["dev1"])
+        self.tcpdump.kill.assert_called_once_with()
+
+    def test_stop_sniffers_ignores_sniffers_that_are_already_gone(self):
+        self.process.side_effect = NoSuchProcess(42)
+        stop_sniffers(["dev1"])
+        self.wait_procs.assert_called_once_with([], timeout=settings.VNET_SNIFFER_STOP_TIMEOUT)
+
+    def test_stop_sniffers_unregisters_the_sniffers(self):
+        stop_sniffers(["dev1", "dev2"])
+        self.unregister_sniffer.assert_has_calls([call("dev1"), call("dev2")])
+
+
+class TestStartTcpdumpOnVNetInterface(SnifferTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.set_up_patch("vnet_manager.operations.sniffer.settings.VNET_SNIFFER_PCAP_DIR", self.tmp_dir)
+        self.popen = self.set_up_patch("vnet_manager.operations.sniffer.Popen")
+        self.popen.return_value.pid = 42
+        self.popen.return_value.wait.side_effect = TimeoutExpired("test", 1)
+        self.popen.return_value.returncode = 1
+        self.logger = self.set_up_patch("vnet_manager.operations.sniffer.logger")
+
+    def test_get_sniffer_log_path_returns_a_file_next_to_the_captures(self):
+        self.assertEqual(get_sniffer_log_path("dev1"), join(self.tmp_dir, "dev1.log"))
+
+    def test_start_tcpdump_on_vnet_interface_starts_a_sniffer_supervisor(self):
+        start_tcpdump_on_vnet_interface("dev1")
+        self.popen.assert_called_once_with(
+            [sys.executable, "-m", "vnet_manager.operations.sniffer", "dev1"],
+            stdin=DEVNULL,
+            stdout=self.popen.call_args[1]["stdout"],
+            stderr=STDOUT,
+            start_new_session=True,
+        )
+
+    def test_start_tcpdump_on_vnet_interface_sends_the_supervisor_output_to_the_log_file(self):
+        start_tcpdump_on_vnet_interface("dev1")
+        log = self.popen.call_args[1]["stdout"]
+        self.assertEqual(log.name, join(self.tmp_dir, "dev1.log"))
+        self.assertEqual(log.mode, "a")
+        self.assertTrue(log.closed)
+
+    def test_start_tcpdump_on_vnet_interface_creates_the_capture_directory(self):
+        self.set_up_patch("vnet_manager.operations.sniffer.settings.VNET_SNIFFER_PCAP_DIR", join(self.tmp_dir, "pcap"))
+        start_tcpdump_on_vnet_interface("dev1")
+        self.assertTrue(exists(join(self.tmp_dir, "pcap", "dev1.log")))
+
+    def test_start_tcpdump_on_vnet_interface_waits_for_the_sniffer_to_start(self):
+        start_tcpdump_on_vnet_interface("dev1")
+        self.popen.return_value.wait.assert_called_once_with(timeout=settings.VNET_SNIFFER_STARTUP_TIMEOUT)
+
+    def test_start_tcpdump_on_vnet_interface_logs_error_if_the_sniffer_exits_right_away(self):
+        self.popen.return_value.wait.side_effect = None
+        start_tcpdump_on_vnet_interface("dev1")
+        self.logger.error.assert_called_once_with(
+            "Sniffer on VNet interface dev1 exited with code 1 right after starting, see {}".format(join(self.tmp_dir, "dev1.log"))
+        )
+
+    def test_start_tcpdump_on_vnet_interface_does_not_register_a_sniffer_that_exits_right_away(self):
+        self.popen.return_value.wait.side_effect = None
+        start_tcpdump_on_vnet_interface("dev1")
+        self.assertFalse(exists(join(self.pid_dir, "dev1.pid")))
+
+    def test_start_tcpdump_on_vnet_interface_registers_the_sniffer(self):
+        start_tcpdump_on_vnet_interface("dev1")
+        self.assertFalse(self.logger.error.called)
+        with open(join(self.pid_dir, "dev1.pid")) as fh:
+            self.assertEqual(fh.read(), "42\n")
@@ -1,7 +1,15 @@
 from unittest.mock import Mock
 
 from vnet_manager.tests import VNetTestCase
-from vnet_manager.operations.storage import check_if_lxc_storage_pool_exists, create_lxc_storage_pool, delete_lxc_storage_pool
+from vnet_manager.operations.storage import (
+    check_if_lxc_storage_pool_exists,
+    generate_lxc_storage_pool_config,
+    get_tmpfs_size,
+    mount_lxc_storage_pool_tmpfs,
+    unmount_lxc_storage_pool_tmpfs,
+    create_lxc_storage_pool,
+    delete_lxc_storage_pool,
+)
 from vnet_manager.conf import settings
 
 
@@ -47,6 +55,70 @@ class TestCreateLXCStoragePool(VNetTestCase):
             {"name": "blaap", "driver": "driver", "config": {"size": settings.LXC_STORAGE_POOL_SIZE}}
         )
 
+    def test_create_lxc_storage_pool_uses_the_source(self):
+        create_lxc_storage_pool("blaap", "btrfs", source="/dev/sdb")
+        self.client.storage_pools.create.assert_called_once_with({"name": "blaap", "driver": "btrfs", "config": {"source": "/dev/sdb"}})
+
+    def test_create_lxc_storage_pool_mounts_a_tmpfs_for_the_pool(self):
+        mount = self.set_up_patch("vnet_manager.operations.storage.mount_lxc_storage_pool_tmpfs")
+        create_lxc_storage_pool("blaap", "dir", tmpfs=True)
+        mount.assert_called_once_with(settings.LXC_STORAGE_POOL_TMPFS_PATH, size=settings.LXC_STORAGE_POOL_SIZE)
+        self.client.storage_pools.create.assert_called_once_with(
+            {"name": "blaap", "driver": "dir", "config": {"source": settings.LXC_STORAGE_POOL_TMPFS_PATH}}
+        )
+
+    def test_create_lxc_storage_pool_raises_runtime_error_for_tmpfs_without_dir_driver(self):
+        mount = self.set_up_patch("vnet_manager.operations.storage.mount_lxc_storage_pool_tmpfs")
+        with self.assertRaises(RuntimeError):
+            create_lxc_storage_pool("blaap", "btrfs", tmpfs=True)
+        self.assertFalse(mount.called)
+
+
+class TestGenerateLXCStoragePoolConfig(VNetTestCase):
+    def test_generate_lxc_storage_pool_config_creates_a_loop_file_by_default(self):
+        self.assertEqual(generate_lxc_storage_pool_config("btrfs", size="10GB"), {"size": "10GB"})
+
+    def test_generate_lxc_storage_pool_config_uses_the_source(self):
+        self.assertEqual(generate_lxc_storage_pool_config("zfs", source="tank/vnet"), {"source": "tank/vnet"})
+
+    def test_generate_lxc_storage_pool_config_has_no_size_for_dir_pools(self):
+        self.assertEqual(generate_lxc_storage_pool_config("dir"), {})
+
+
+class TestStoragePoolTmpfs(VNetTestCase):
+    def setUp(self) -> None:
+        self.check_call = self.set_up_patch("vnet_manager.operations.storage.check_call")
+        self.makedirs = self.set_up_patch("vnet_manager.operations.storage.makedirs")
+        self.ismount = self.set_up_patch("vnet_manager.operations.storage.ismount", return_value=False)
+
+    def test_get_tmpfs_size_converts_lxd_sizes(self):
+        self.assertEqual(get_tmpfs_size("30GB"), "30g")
+        self.assertEqual(get_tmpfs_size("512MiB"), "512m")
+        self.assertEqual(get_tmpfs_size("1024"), "1024")
+
+    def test_get_tmpfs_size_raises_value_error_for_invalid_sizes(self):
+        with self.assertRaises(ValueError):
+            get_tmpfs_size("blaap")
+
+    def test_mount_lxc_storage_pool_tmpfs_mounts_a_tmpfs(self):
+        mount_lxc_storage_pool_tmpfs("/var/lib/vnet", size="8GB")
+        self.makedirs.assert_called_once_with("/var/lib/vnet", exist_ok=True)
+        self.check_call.assert_called_once_with(["mount", "-t", "tmpfs", "-o", "size=8g,mode=0711", "tmpfs", "/var/lib/vnet"])
+
+    def test_mount_lxc_storage_pool_tmpfs_does_nothing_when_already_mounted(self):
+        self.ismount.return_value = True
+        mount_lxc_storage_pool_tmpfs("/var/lib/vnet")
+        self.assertFalse(self.check_call.called)
+
+    def test_unmount_lxc_storage_pool_tmpfs_unmounts_the_tmpfs(self):
+        self.ismount.return_value = True
+        unmount_lxc_storage_pool_tmpfs("/var/lib/vnet")
+        self.check_call.assert_called_once_with(["umount", "/var/lib/vnet"])
+
+    def test_unmount_lxc_storage_pool_tmpfs_does_nothing_when_not_mounted(self):
+        unmount_lxc_storage_pool_tmpfs("/var/lib/vnet")
+        self.assertFalse(self.check_call.called)
+
 
 class TestDeleteLXCStoragePool(VNetTestCase):
     def setUp(self) -> None:
@@ -1,10 +1,27 @@
+from threading import BoundedSemaphore
+from unittest.mock import Mock, ANY
+
+from pylxd.client import EventType, _APINode  # pylint: disable=protected-access
+from requests import Session
+
 from vnet_manager.tests import VNetTestCase
-from vnet_manager.providers.lxc import get_lxd_client
+from vnet_manager.conf import settings
+from vnet_manager.providers.lxc import (
+    get_lxd_client,
+    lxd_client_manager,
+    LXDClientManager,
+    LXDEventMonitor,
+    PooledUnixSocketAdapter,
+    SharedSessionAPINode,
+    _limit_concurrency,
+)
 
 
 class TestGetLXDClient(VNetTestCase):
     def setUp(self) -> None:
         self.client = self.set_up_patch("vnet_manager.providers.lxc.client")
+        lxd_client_manager.reset()
+        self.addCleanup(lxd_client_manager.reset)
 
     def test_get_lxd_client_calls_client(self):
         get_lxd_client()
@@ -13,3 +30,129 @@ class TestGetLXDClient(VNetTestCase):
     def test_get_lxc_client_calls_client_with_arguments(self):
         get_lxd_client(socket="blaap")
         self.client.Client.assert_called_once_with(socket="blaap")
+
+    def test_get_lxd_client_reuses_the_client(self):
+        first = get_lxd_client()
+        second = get_lxd_client()
+        self.assertIs(first, second)
+        self.client.Client.assert_called_once_with()
+
+    def test_get_lxd_client_creates_a_client_per_set_of_arguments(self):
+        get_lxd_client()
+        get_lxd_client(socket="blaap")
+        self.assertEqual(self.client.Client.call_count, 2)
+
+
+class TestLXDClientManager(VNetTestCase):
+    def setUp(self) -> None:
+        self.client = self.set_up_patch("vnet_manager.providers.lxc.client")
+
+    def test_lxd_client_manager_uses_max_concurrent_requests_from_settings(self):
+        self.assertEqual(LXDClientManager().max_requests, settings.LXD_MAX_CONCURRENT_REQUESTS)
+
+    def test_lxd_client_manager_reset_forgets_the_clients(self):
+        manager = LXDClientManager()
+        manager.get_client()
+        manager.reset()
+        manager.get_client()
+        self.assertEqual(self.client.Client.call_count, 2)
+
+
+class TestShareSession(VNetTestCase):
+    def setUp(self) -> None:
+        self.client = Mock()
+        self.client.api = _APINode("http+unix://%2Fvar%2Flib%2Flxd%2Funix.socket", session=Session())
+        self.session = self.client.api.session
+
+    def test_share_session_pools_the_session_of_the_client(self):
+        LXDClientManager()._share_session(self.client)
+        self.assertIsInstance(self.session.get_adapter("http+unix://blaap"), PooledUnixSocketAdapter)
+
+    def test_share_session_leaves_the_api_nodes_alone_when_they_share_the_session_themselves(self):
+        LXDClientManager()._share_session(self.client)
+        self.assertNotIsInstance(self.client.api, SharedSessionAPINode)
+        self.assertIs(self.client.api.instances["router100"].session, self.session)
+
+    def test_share_session_hands_the_session_down_in_the_pinned_pylxd_version(self):
+        self.set_up_patch("vnet_manager.providers.lxc.check_if_api_node_shares_session", return_value=False)
+        self.set_up_patch("vnet_manager.providers.lxc.pylxd_version", "2.2.10")
+        LXDClientManager()._share_session(self.client)
+        self.assertIsInstance(self.client.api, SharedSessionAPINode)
+        self.assertIs(self.client.api.instances["router100"].state.session, self.session)
+
+    def test_share_session_does_not_change_the_api_nodes_of_unknown_pylxd_versions(self):
+        self.set_up_patch("vnet_manager.providers.lxc.check_if_api_node_shares_session", return_value=False)
+        self.set_up_patch("vnet_manager.providers.lxc.pylxd_version", "3.0.0")
+        LXDClientManager()._share_session(self.client)
+        self.assertNotIsInstance(self.client.api, SharedSessionAPINode)
+
+
+class TestPooledUnixSocketAdapter(VNetTestCase):
+    def test_pooled_unix_socket_adapter_reuses_the_pool_per_socket(self):
+        adapter = PooledUnixSocketAdapter(4)
+        first = adapter.get_connection("http+unix://%2Fvar%2Flib%2Flxd%2Funix.socket/1.0/containers")
+        second = adapter.get_connection("http+unix://%2Fvar%2Flib%2Flxd%2Funix.socket/1.0/images")
+        self.assertIs(first, second)
+        self.assertEqual(first.socket_path, "/var/lib/lxd/unix.socket")
+
+    def test_pooled_unix_socket_adapter_sizes_the_pool(self):
+        adapter = PooledUnixSocketAdapter(4)
+        pool = adapter.get_connection("http+unix://%2Fvar%2Flib%2Flxd%2Funix.socket/1.0")
+        self.assertEqual(pool.pool.maxsize, 4)
+
+
+class TestLimitConcurrency(VNetTestCase):
+    def test_limit_concurrency_acquires_and_releases_the_semaphore(self):
+        semaphore = Mock(wraps=BoundedSemaphore(1))
+        semaphore.__enter__ = Mock(return_value=None)
+        semaphore.__exit__ = Mock(return_value=None)
+        func = Mock(return_value=42)
+        self.assertEqual(_limit_concurrency(func, semaphore)(1, a=2), 42)
+        func.assert_called_once_with(1, a=2)
+        semaphore.__enter__.assert_called_once_with()
+        semaphore.__exit__.assert_called_once()
+
+
+class TestLXDEventMonitor(VNetTestCase):
+    def setUp(self) -> None:
+        self.lxd_client = self.set_up_patch("vnet_manager.providers.lxc.get_lxd_client")
+        self.thread = self.set_up_patch("vnet_manager.providers.lxc.Thread")
+        self.monitor = LXDEventMonitor()
+
+    def test_lxd_event_monitor_subscribes_to_lifecycle_events_once(self):
+        self.monitor.watch("router100")
+        self.monitor.watch("router101")
+        self.lxd_client.return_value.events.assert_called_once_with(websocket_client=ANY, event_types={EventType.Lifecycle})
+        self.lxd_client.return_value.events.return_value.connect.assert_called_once_with()
+        self.assertTrue(self.monitor.connected)
+
+    def test_lxd_event_monitor_returns_none_when_subscription_fails(self):
+        self.lxd_client.return_value.events.return_value.connect.side_effect = OSError()
+        self.assertIsNone(self.monitor.watch("router100"))
+        self.assertIsNone(self.monitor.watch("router100"))
+        self.lxd_client.return_value.events.assert_called_once()
+
+    def test_lxd_event_monitor_dispatch_sets_the_event_of_the_instance(self):
+        event = self.monitor.watch("router100")
+        other = self.monitor.watch("router101")
+        self.monitor.dispatch({"type": "lifecycle", "metadata": {"action": "instance-started", "source": "/1.0/instances/router100"}})
+        self.assertTrue(event.is_set())
+        self.assertFalse(other.is_set())
+
+    def test_lxd_event_monitor_dispatch_ignores_other_event_types(self):
+        event = self.monitor.watch("router100")
+        self.monitor.dispatch({"type": "operation", "metadata": {"source": "/1.0/containers/router100"}})
+        self.assertFalse(event.is_set())
+
+    def test_lxd_event_monitor_dispatch_does_not_set_unwatched_events(self):
+        event = self.monitor.watch("router100")
+        self.monitor.unwatch("router100", event)
+        self.monitor.dispatch({"type": "lifecycle", "metadata": {"source": "/1.0/containers/router100?project=default"}})
+        self.assertFalse(event.is_set())
+
+    def test_lxd_event_monitor_closed_wakes_all_watchers_and_disables_the_stream(self):
+        event = self.monitor.watch("router100")
+        self.monitor.closed()
+        self.assertTrue(event.is_set())
+        self.assertFalse(self.monitor.connected)
+        self.assertIsNone(self.monitor.watch("router100"))
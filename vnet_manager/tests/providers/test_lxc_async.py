@@ -0,0 +1,273 @@
+import asyncio
+from json import dumps, loads
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+from urllib.parse import urlparse, parse_qs, unquote
+
+from vnet_manager.tests import VNetTestCase
+from vnet_manager.providers.lxc_async import AsyncLXDClient, LXDAsyncAPIError, get_lxd_socket_path, run_async
+
+
+class FakeLXDServer:
+    """
+    A minimal LXD REST API on a unix socket, keeps its containers in memory
+    """
+
+    def __init__(self, socket_path: str, close_connections: bool = False):
+        self.socket_path = socket_path
+        self.close_connections = close_connections
+        self.containers = {}
+        self.files = {}
+        self.snapshots = {}
+        self.operations = {}
+        self.connections = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_unix_server(self.handle, path=self.socket_path)
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode().split(" ")
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line == b"\r\n":
+                        break
+                    key, value = line.decode().split(":", 1)
+                    headers[key.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                self.in_flight += 1
+                self.max_in_flight = max(self.max_in_flight, self.in_flight)
+                await asyncio.sleep(0.001)
+                status, data, chunked = self.route(method, path, headers, body)
+                self.in_flight -= 1
+                if chunked:
+                    payload = b"".join(b"%x\r\n%s\r\n" % (len(part), part) for part in (data[:3], data[3:]) if part) + b"0\r\n\r\n"
+                    writer.write(b"HTTP/1.1 %d OK\r\nTransfer-Encoding: chunked\r\n\r\n" % status + payload)
+                else:
+                    writer.write(b"HTTP/1.1 %d OK\r\nContent-Length: %d\r\n\r\n" % (status, len(data)) + data)
+                await writer.drain()
+                if self.close_connections:
+                    break
+        finally:
+            writer.close()
+
+    def operation(self, metadata: dict = None, status_code: int = 200, err: str = "") -> tuple:
+        operation_id = str(len(self.operations))
+        self.operations[operation_id] = {"status_code": status_code, "err": err, "metadata": metadata}
+        response = {"type": "async", "status_code": 100, "operation": "/1.0/operations/{}".format(operation_id), "metadata": {}}
+        return 202, dumps(response).encode(), False
+
+    @staticmethod
+    def sync(metadata=None) -> tuple:
+        return 200, dumps({"type": "sync", "status_code": 200, "metadata": metadata}).encode(), False
+
+    @staticmethod
+    def error(code: int, message: str) -> tuple:
+        return code, dumps({"type": "error", "error_code": code, "error": message}).encode(), False
+
+    def route(self, method: str, path: str, headers: dict, body: bytes) -> tuple:
+        url = urlparse(path)
+        parts = [unquote(part) for part in url.path.strip("/").split("/")]
+        query = parse_qs(url.query)
+        if parts[:2] == ["1.0", "operations"] and parts[-1] == "wait":
+            return self.sync(self.operations[parts[2]])
+        if parts == ["1.0", "containers"]:
+            if method == "POST":
+                config = loads(body.decode())
+                if config["name"] in self.containers:
+                    return self.operation(status_code=400, err="Container already exists")
+                self.containers[config["name"]] = dict(config, status="Stopped")
+                return self.operation()
+            return self.sync(list(self.containers.values()))
+        name = parts[2]
+        if name not in self.containers:
+            return self.error(404, "not found")
+        if len(parts) == 3:
+            if method == "DELETE":
+                del self.containers[name]
+                return self.operation()
+            if method == "PUT":
+                snapshot = loads(body.decode())["restore"]
+                if snapshot not in self.snapshots.get(name, []):
+                    return self.operation(status_code=404, err="snapshot not found")
+                self.containers[name]["restored"] = snapshot
+                return self.operation()
+            return self.sync(self.containers[name])
+        if parts[3] == "state":
+            action = loads(body.decode())["action"]
+            self.containers[name]["status"] = "Running" if action == "start" else "Stopped"
+            return self.operation()
+        if parts[3] == "snapshots":
+            snapshots = self.snapshots.setdefault(name, [])
+            if method == "POST":
+                snapshots.append(loads(body.decode())["name"])
+                return self.operation()
+            if parts[4] not in snapshots:
+                return self.error(404, "not found")
+            snapshots.remove(parts[4])
+            return self.operation()
+        if parts[3] == "files":
+            file_path = query["path"][0]
+            if method == "POST":
+                self.files[(name, file_path)] = (body, headers.get("x-lxd-mode"))
+                return self.sync()
+            if (name, file_path) not in self.files:
+                return self.error(404, "not found")
+            return 200, self.files[(name, file_path)][0], True
+        if parts[3] == "exec":
+            output = {"1": "/1.0/containers/{}/logs/exec.stdout".format(name), "2": "/1.0/containers/{}/logs/exec.stderr".format(name)}
+            return self.operation(metadata={"return": 3, "output": output})
+        if parts[3] == "logs":
+            return 200, b"out" if parts[4].endswith("stdout") else b"err", False
+        return self.error(404, "not found")
+
+
+class TestAsyncLXDClient(VNetTestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = mkdtemp()
+        self.addCleanup(rmtree, self.tmp_dir)
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+        self.server = self.start_server()
+        self.client = AsyncLXDClient(socket_path=self.server.socket_path, max_connections=4)
+        self.addCleanup(self.shut_down)
+
+    def start_server(self) -> FakeLXDServer:
+        server = FakeLXDServer(join(self.tmp_dir, "unix.socket"))
+        self.loop.run_until_complete(server.start())
+        return server
+
+    def shut_down(self):
+        self.client.close()
+        # Let the server handlers see the closed connections before stopping the server
+        self.loop.run_until_complete(asyncio.sleep(0.01))
+        self.loop.run_until_complete(self.server.stop())
+
+    def run_coroutine(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+    def test_async_lxd_client_creates_a_container_and_waits_for_the_operation(self):
+        self.run_coroutine(self.client.create({"name": "router100", "devices": {}}))
+        self.assertEqual(self.server.containers["router100"]["status"], "Stopped")
+
+    def test_async_lxd_client_raises_when_the_operation_fails(self):
+        self.server.containers["router100"] = {"name": "router100", "status": "Stopped"}
+        with self.assertRaises(LXDAsyncAPIError) as e:
+            self.run_coroutine(self.client.create({"name": "router100"}))
+        self.assertEqual(e.exception.status_code, 400)
+        self.assertEqual(e.exception.error, "Container already exists")
+
+    def test_async_lxd_client_raises_on_api_errors(self):
+        with self.assertRaises(LXDAsyncAPIError) as e:
+            self.run_coroutine(self.client.get_instance("router100"))
+        self.assertEqual(e.exception.status_code, 404)
+
+    def test_async_lxd_client_starts_and_stops_containers(self):
+        self.server.containers["router100"] = {"name": "router100", "status": "Stopped"}
+        self.run_coroutine(self.client.start("router100"))
+        self.assertEqual(self.run_coroutine(self.client.get_instance_statuses()), {"router100": "Running"})
+        self.run_coroutine(self.client.stop("router100", force=True))
+        self.assertEqual(self.run_coroutine(self.client.get_instance("router100"))["status"], "Stopped")
+
+    def test_async_lxd_client_deletes_containers(self):
+        self.server.containers["router100"] = {"name": "router100", "status": "Stopped"}
+        self.run_coroutine(self.client.delete("router100"))
+        self.assertEqual(self.server.containers, {})
+
+    def test_async_lxd_client_creates_and_deletes_snapshots(self):
+        self.server.containers["router100"] = {"name": "router100", "status": "Running"}
+        self.run_coroutine(self.client.create_snapshot("router100", "clean"))
+        self.assertEqual(self.server.snapshots, {"router100": ["clean"]})
+        self.run_coroutine(self.client.delete_snapshot("router100", "clean"))
+        self.assertEqual(self.server.snapshots, {"router100": []})
+
+    def test_async_lxd_client_restores_snapshots(self):
+        self.server.containers["router100"] = {"name": "router100", "status": "Running"}
+        self.server.snapshots["router100"] = ["clean"]
+        self.run_coroutine(self.client.restore_snapshot("router100", "clean"))
+        self.assertEqual(self.server.containers["router100"]["restored"], "clean")
+
+    def test_async_lxd_client_raises_when_restoring_a_missing_snapshot(self):
+        self.server.containers["router100"] = {"name": "router100", "status": "Running"}
+        with self.assertRaises(LXDAsyncAPIError):
+            self.run_coroutine(self.client.restore_snapshot("router100", "clean"))
+
+    def test_async_lxd_client_puts_and_gets_files(self):
+        self.server.containers["router100"] = {"name": "router100", "status": "Stopped"}
+        self.run_coroutine(self.client.put_file("router100", "/etc/frr/frr.conf", b"hostname router100\n", mode="0644"))
+        self.assertEqual(self.server.files[("router100", "/etc/frr/frr.conf")], (b"hostname router100\n", "0644"))
+        # The fake server sends files chunked
+        self.assertEqual(self.run_coroutine(self.client.get_file("router100", "/etc/frr/frr.conf")), b"hostname router100\n")
+
+    def test_async_lxd_client_get_file_raises_for_missing_files(self):
+        self.server.containers["router100"] = {"name": "router100", "status": "Stopped"}
+        with self.assertRaises(LXDAsyncAPIError):
+            self.run_coroutine(self.client.get_file("router100", "/etc/blaap"))
+
+    def test_async_lxd_client_executes_commands(self):
+        self.server.containers["router100"] = {"name": "router100", "status": "Running"}
+        self.assertEqual(self.run_coroutine(self.client.execute("router100", ["false"])), (3, b"out", b"err"))
+
+    def test_async_lxd_client_runs_many_concurrent_operations_over_a_capped_amount_of_connections(self):
+        for i in range(50):
+            self.server.containers["host{}".format(i)] = {"name": "host{}".format(i), "status": "Stopped"}
+
+        async def start_all():
+            await asyncio.gather(*[self.client.start(name) for name in list(self.server.containers)])
+
+        self.run_coroutine(start_all())
+        self.assertTrue(all(container["status"] == "Running" for container in self.server.containers.values()))
+        self.assertLessEqual(self.server.connections, 4)
+        self.assertLessEqual(self.server.max_in_flight, 4)
+
+    def test_async_lxd_client_reuses_connections(self):
+        for _ in range(5):
+            self.run_coroutine(self.client.get_instances())
+        self.assertEqual(self.server.connections, 1)
+
+    def test_async_lxd_client_retries_when_an_idle_connection_was_closed(self):
+        self.server.close_connections = True
+        for _ in range(3):
+            self.assertEqual(self.run_coroutine(self.client.get_instances()), [])
+        self.assertEqual(self.server.connections, 3)
+
+
+class TestGetLXDSocketPath(VNetTestCase):
+    def setUp(self) -> None:
+        self.exists = self.set_up_patch("vnet_manager.providers.lxc_async.exists")
+        self.environ = self.set_up_patch("vnet_manager.providers.lxc_async.environ", {})
+
+    def test_get_lxd_socket_path_uses_lxd_dir(self):
+        self.environ["LXD_DIR"] = "/tmp/lxd"
+        self.assertEqual(get_lxd_socket_path(), "/tmp/lxd/unix.socket")
+
+    def test_get_lxd_socket_path_uses_the_default_socket(self):
+        self.exists.return_value = True
+        self.assertEqual(get_lxd_socket_path(), "/var/lib/lxd/unix.socket")
+
+    def test_get_lxd_socket_path_falls_back_to_the_snap_socket(self):
+        self.exists.return_value = False
+        self.assertEqual(get_lxd_socket_path(), "/var/snap/lxd/common/lxd/unix.socket")
+
+
+class TestRunAsync(VNetTestCase):
+    def test_run_async_returns_the_result_of_the_coroutine(self):
+        async def coroutine():
+            await asyncio.sleep(0)
+            return 42
+
+        self.assertEqual(run_async(coroutine()), 42)
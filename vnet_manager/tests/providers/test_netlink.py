@@ -0,0 +1,55 @@
+from vnet_manager.tests import VNetTestCase
+from vnet_manager.providers.netlink import NetlinkSessionManager, get_iproute, get_ndb, netlink_session_manager
+
+
+class TestNetlinkSessionManager(VNetTestCase):
+    def setUp(self) -> None:
+        self.iproute = self.set_up_patch("vnet_manager.providers.netlink.IPRoute")
+        self.ndb = self.set_up_patch("vnet_manager.providers.netlink.NDB")
+        self.manager = NetlinkSessionManager()
+
+    def test_netlink_session_manager_reuses_the_iproute_socket(self):
+        self.assertIs(self.manager.get_iproute(), self.manager.get_iproute())
+        self.iproute.assert_called_once_with()
+
+    def test_netlink_session_manager_only_starts_ndb_when_needed(self):
+        self.manager.get_iproute()
+        self.assertFalse(self.ndb.called)
+
+    def test_netlink_session_manager_reuses_the_ndb(self):
+        self.assertIs(self.manager.get_ndb(), self.manager.get_ndb())
+        self.ndb.assert_called_once_with(log=False)
+
+    def test_netlink_session_manager_close_closes_the_sessions(self):
+        self.manager.get_iproute()
+        self.manager.get_ndb()
+        self.manager.close()
+        self.iproute.return_value.close.assert_called_once_with()
+        self.ndb.return_value.close.assert_called_once_with()
+
+    def test_netlink_session_manager_close_does_nothing_without_sessions(self):
+        self.manager.close()
+        self.assertFalse(self.iproute.called)
+        self.assertFalse(self.ndb.called)
+
+    def test_netlink_session_manager_opens_a_new_session_after_close(self):
+        self.manager.get_iproute()
+        self.manager.close()
+        self.manager.get_iproute()
+        self.assertEqual(self.iproute.call_count, 2)
+
+
+class TestGetNetlinkSessions(VNetTestCase):
+    def setUp(self) -> None:
+        self.iproute = self.set_up_patch("vnet_manager.providers.netlink.IPRoute")
+        self.ndb = self.set_up_patch("vnet_manager.providers.netlink.NDB")
+        netlink_session_manager.close()
+        self.addCleanup(netlink_session_manager.close)
+
+    def test_get_iproute_returns_the_shared_iproute_socket(self):
+        self.assertIs(get_iproute(), get_iproute())
+        self.iproute.assert_called_once_with()
+
+    def test_get_ndb_returns_the_shared_ndb(self):
+        self.assertIs(get_ndb(), get_ndb())
+        self.ndb.assert_called_once_with(log=False)
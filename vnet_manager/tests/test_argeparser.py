@@ -1,16 +1,30 @@
 from io import StringIO
 from unittest.mock import patch
 
+from vnet_manager.conf import settings
 from vnet_manager.argeparser import parse_vnet_args
 from vnet_manager.tests import VNetTestCase
 
-
 default_args = ["list", "config"]
 
 
 class TestParseArgs(VNetTestCase):
     def test_parse_args_produces_known_args(self):
-        known_args = ("action", "config", "machines", "yes", "verbose", "sniffer", "base_image", "no_hosts")
+        known_args = (
+            "action",
+            "config",
+            "machines",
+            "yes",
+            "verbose",
+            "sniffer",
+            "base_image",
+            "no_hosts",
+            "parallel",
+            "graceful",
+            "stop_timeout",
+            "trace",
+            "snapshot",
+        )
         args = parse_vnet_args(default_args)
         for arg in known_args:
             self.assertTrue(hasattr(args, arg), msg="Argument {} not found in parse_args return value".format(arg))
@@ -21,6 +35,12 @@ class TestParseArgs(VNetTestCase):
             parse_vnet_args(["create"])
         self.assertTrue(stderr.getvalue().strip().endswith("This action requires a config file to be passed"))
 
+    @patch("sys.stderr", new_callable=StringIO)
+    def test_parse_args_exists_when_path_required_action_without_path_is_passed(self, stderr):
+        with self.assertRaises(SystemExit):
+            parse_vnet_args(["import-image"])
+        self.assertTrue(stderr.getvalue().strip().endswith("This action requires a path to be passed"))
+
     @patch("sys.stderr", new_callable=StringIO)
     def test_parse_args_exists_when_sniffer_is_passed_without_start_action(self, stderr):
         with self.assertRaises(SystemExit):
@@ -37,8 +57,54 @@ class TestParseArgs(VNetTestCase):
     def test_parse_args_exists_when_no_hosts_passed_without_create_action(self, stderr):
         with self.assertRaises(SystemExit):
             parse_vnet_args(["list", "config", "--no-hosts"])
-        self.assertTrue(stderr.getvalue().strip().endswith("The no_hosts option only makes sense with the 'create' action"))
+        self.assertTrue(
+            stderr.getvalue()
+            .strip()
+            .endswith("The no_hosts option only makes sense with the following actions: {}".format(", ".join(settings.HOSTS_ACTIONS)))
+        )
+
+    def test_parse_args_accepts_no_hosts_with_apply_action(self):
+        args = parse_vnet_args(["apply", "config", "--no-hosts"])
+        self.assertTrue(args.no_hosts)
+
+    def test_parse_args_sets_the_snapshot_name(self):
+        args = parse_vnet_args(["reset", "config", "--snapshot", "clean"])
+        self.assertEqual(args.snapshot, "clean")
+
+    @patch("sys.stderr", new_callable=StringIO)
+    def test_parse_args_exits_when_snapshot_passed_with_unsupported_action(self, stderr):
+        with self.assertRaises(SystemExit):
+            parse_vnet_args(["start", "config", "--snapshot", "clean"])
+        self.assertIn("The snapshot option only makes sense with the following actions", stderr.getvalue())
 
     def test_parse_args_sets_show_action_on_status_action(self):
         args = parse_vnet_args(["status", "config"])
         self.assertEqual(args.action, "show")
+
+    @patch("sys.stderr", new_callable=StringIO)
+    def test_parse_args_exits_when_parallel_passed_with_unsupported_action(self, stderr):
+        with self.assertRaises(SystemExit):
+            parse_vnet_args(["list", "config", "--parallel", "4"])
+        self.assertIn("The parallel option only makes sense with the following actions", stderr.getvalue())
+
+    @patch("sys.stderr", new_callable=StringIO)
+    def test_parse_args_exits_when_parallel_is_not_positive(self, stderr):
+        with self.assertRaises(SystemExit):
+            parse_vnet_args(["create", "config", "--parallel", "0"])
+        self.assertTrue(stderr.getvalue().strip().endswith("The parallel option requires a positive amount of workers"))
+
+    def test_parse_args_sets_parallel_workers(self):
+        args = parse_vnet_args(["create", "config", "--parallel", "8"])
+        self.assertEqual(args.parallel, 8)
+
+    @patch("sys.stderr", new_callable=StringIO)
+    def test_parse_args_exits_when_graceful_passed_without_stop_action(self, stderr):
+        with self.assertRaises(SystemExit):
+            parse_vnet_args(["start", "config", "--graceful"])
+        self.assertTrue(stderr.getvalue().strip().endswith("The graceful option only makes sense with the 'stop' action"))
+
+    @patch("sys.stderr", new_callable=StringIO)
+    def test_parse_args_exits_when_stop_timeout_passed_without_stop_action(self, stderr):
+        with self.assertRaises(SystemExit):
+            parse_vnet_args(["start", "config", "--stop-timeout", "5"])
+        self.assertTrue(stderr.getvalue().strip().endswith("The stop_timeout option only makes sense with the 'stop' action"))
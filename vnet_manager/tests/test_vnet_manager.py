@@ -17,6 +17,16 @@ class TestVNetManagerMain(VNetTestCase):
         self.action_manager = self.set_up_patch("vnet_manager.vnet_manager.ActionManager")
         self.action_manager.return_value = self.manager
         self.environ = dict(environ)
+        self.manager_kwargs = {
+            "config_path": "config",
+            "sniffer": False,
+            "base_image": False,
+            "no_hosts": False,
+            "parallel": settings.VNET_PARALLEL_WORKERS,
+            "graceful": False,
+            "stop_timeout": settings.LXC_STOP_TIMEOUT,
+            "snapshot": settings.LXC_DEFAULT_SNAPSHOT_NAME,
+        }
 
     def tearDown(self) -> None:
         environ.clear()
@@ -50,19 +60,32 @@ class TestVNetManagerMain(VNetTestCase):
 
     def test_main_calls_action_manager(self):
         main(default_args)
-        self.action_manager.assert_called_once_with(base_image=False, config_path="config", no_hosts=False, sniffer=False)
+        self.action_manager.assert_called_once_with(**self.manager_kwargs)
 
     def test_main_calls_action_manager_with_base_image(self):
         main(["destroy", "config", "--base-image"])
-        self.action_manager.assert_called_once_with(base_image=True, config_path="config", no_hosts=False, sniffer=False)
+        self.manager_kwargs.update(base_image=True)
+        self.action_manager.assert_called_once_with(**self.manager_kwargs)
 
     def test_main_calls_action_manager_with_no_hosts(self):
         main(["create", "config", "--no-hosts"])
-        self.action_manager.assert_called_once_with(base_image=False, config_path="config", no_hosts=True, sniffer=False)
+        self.manager_kwargs.update(no_hosts=True)
+        self.action_manager.assert_called_once_with(**self.manager_kwargs)
 
     def test_main_calls_action_manager_with_sniffer(self):
         main(["start", "config", "--sniffer"])
-        self.action_manager.assert_called_once_with(base_image=False, config_path="config", no_hosts=False, sniffer=True)
+        self.manager_kwargs.update(sniffer=True)
+        self.action_manager.assert_called_once_with(**self.manager_kwargs)
+
+    def test_main_calls_action_manager_with_parallel(self):
+        main(["create", "config", "--parallel", "4"])
+        self.manager_kwargs.update(parallel=4)
+        self.action_manager.assert_called_once_with(**self.manager_kwargs)
+
+    def test_main_calls_action_manager_with_graceful_and_stop_timeout(self):
+        main(["stop", "config", "--graceful", "--stop-timeout", "5"])
+        self.manager_kwargs.update(graceful=True, stop_timeout=5)
+        self.action_manager.assert_called_once_with(**self.manager_kwargs)
 
     def test_main_sets_manager_machine_attribute(self):
         main(default_args + ["--machines", "test1", "test2"])
@@ -72,3 +95,23 @@ class TestVNetManagerMain(VNetTestCase):
         self.manager.execute.return_value = 42
         ret = main(default_args)
         self.assertEqual(ret, 42)
+
+    def test_main_does_not_enable_the_tracer_by_default(self):
+        tracer = self.set_up_patch("vnet_manager.vnet_manager.tracer")
+        main(default_args)
+        self.assertFalse(tracer.enable.called)
+        self.assertFalse(tracer.write_chrome_trace.called)
+
+    def test_main_writes_the_trace_and_shows_the_summary_when_trace_passed(self):
+        tracer = self.set_up_patch("vnet_manager.vnet_manager.tracer")
+        main(default_args + ["--trace", "/tmp/vnet-trace.json"])
+        tracer.enable.assert_called_once_with()
+        tracer.write_chrome_trace.assert_called_once_with("/tmp/vnet-trace.json")
+        tracer.show_summary.assert_called_once_with()
+
+    def test_main_writes_the_trace_when_the_action_fails(self):
+        tracer = self.set_up_patch("vnet_manager.vnet_manager.tracer")
+        self.manager.execute.side_effect = RuntimeError
+        with self.assertRaises(RuntimeError):
+            main(default_args + ["--trace", "/tmp/vnet-trace.json"])
+        tracer.write_chrome_trace.assert_called_once_with("/tmp/vnet-trace.json")
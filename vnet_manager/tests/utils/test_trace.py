@@ -0,0 +1,124 @@
+from json import load
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+from threading import Thread
+
+from vnet_manager.tests import VNetTestCase
+from vnet_manager.utils.trace import Tracer, tracer, trace_span
+
+
+class TestTracer(VNetTestCase):
+    def setUp(self) -> None:
+        self.tracer = Tracer()
+        self.tracer.enable()
+
+    def add_span(self, name: str, start: float, end: float, thread: int = 1, **tags):
+        self.tracer.spans.append({"name": name, "category": "vnet", "start": start, "end": end, "thread": thread, "tags": tags})
+
+    def test_tracer_does_not_record_spans_when_disabled(self):
+        self.tracer.reset()
+        with self.tracer.span("create container", machine="router100"):
+            pass
+        self.assertEqual(self.tracer.spans, [])
+
+    def test_tracer_records_spans_with_tags(self):
+        with self.tracer.span("create container", category="lxd", machine="router100"):
+            pass
+        self.assertEqual(len(self.tracer.spans), 1)
+        span = self.tracer.spans[0]
+        self.assertEqual(span["name"], "create container")
+        self.assertEqual(span["category"], "lxd")
+        self.assertEqual(span["tags"], {"machine": "router100"})
+        self.assertLessEqual(span["start"], span["end"])
+
+    def test_tracer_records_nested_spans(self):
+        with self.tracer.span("provision", machine="router100"):
+            with self.tracer.span("push files", machine="router100"):
+                pass
+        inner, outer = self.tracer.spans
+        self.assertEqual(inner["name"], "push files")
+        self.assertTrue(Tracer._contains(outer, inner))
+
+    def test_tracer_records_the_span_when_the_block_raises(self):
+        with self.assertRaises(RuntimeError):
+            with self.tracer.span("create container"):
+                raise RuntimeError
+        self.assertEqual(len(self.tracer.spans), 1)
+
+    def test_tracer_records_spans_from_multiple_threads(self):
+        def work():
+            with self.tracer.span("create container"):
+                pass
+
+        threads = [Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(self.tracer.spans), 4)
+
+    def test_tracer_reset_forgets_the_spans(self):
+        self.add_span("create container", 0, 1)
+        self.tracer.reset()
+        self.assertEqual(self.tracer.spans, [])
+        self.assertFalse(self.tracer.enabled)
+
+    def test_tracer_to_chrome_trace_creates_complete_events_in_microseconds(self):
+        self.add_span("create container", 0.5, 2, machine="router100")
+        event = self.tracer.to_chrome_trace()["traceEvents"][0]
+        self.assertEqual(event["ph"], "X")
+        self.assertEqual(event["ts"], 500000)
+        self.assertEqual(event["dur"], 1500000)
+        self.assertEqual(event["tid"], 1)
+        self.assertEqual(event["args"], {"machine": "router100"})
+
+    def test_tracer_to_chrome_trace_names_the_threads(self):
+        self.add_span("create machines", 0, 3, thread=1234)
+        self.add_span("create container", 1, 2, thread=5678)
+        events = self.tracer.to_chrome_trace()["traceEvents"]
+        names = {event["tid"]: event["args"]["name"] for event in events if event["ph"] == "M"}
+        self.assertEqual(names, {1: "main", 2: "worker 1"})
+
+    def test_tracer_write_chrome_trace_writes_json(self):
+        tmp_dir = mkdtemp()
+        self.addCleanup(rmtree, tmp_dir)
+        self.add_span("create container", 0, 1)
+        self.tracer.write_chrome_trace(join(tmp_dir, "trace.json"))
+        with open(join(tmp_dir, "trace.json")) as fh:
+            self.assertEqual(load(fh), self.tracer.to_chrome_trace())
+
+    def test_tracer_get_phase_summary_sorts_phases_by_total_time(self):
+        self.add_span("push files", 0, 1)
+        self.add_span("create container", 0, 2)
+        self.add_span("push files", 2, 4)
+        self.assertEqual(self.tracer.get_phase_summary(), [["push files", 2, 3, 2], ["create container", 1, 2, 2]])
+
+    def test_tracer_get_phase_summary_limits_the_amount_of_phases(self):
+        self.add_span("push files", 0, 1)
+        self.add_span("create container", 0, 2)
+        self.assertEqual(len(self.tracer.get_phase_summary(limit=1)), 1)
+
+    def test_tracer_get_machine_summary_uses_the_slowest_leaf_span(self):
+        self.add_span("create container", 0, 5, machine="router100")
+        self.add_span("provision", 5, 9, machine="router100")
+        self.add_span("push files", 6, 9, machine="router100")
+        self.add_span("create container", 0, 2, machine="router101")
+        self.assertEqual(
+            self.tracer.get_machine_summary(), [["router100", 9, "create container", 5], ["router101", 2, "create container", 2]]
+        )
+
+    def test_tracer_get_machine_summary_ignores_spans_without_machine(self):
+        self.add_span("create machines", 0, 5)
+        self.assertEqual(self.tracer.get_machine_summary(), [])
+
+
+class TestTraceSpan(VNetTestCase):
+    def setUp(self) -> None:
+        tracer.enable()
+        self.addCleanup(tracer.reset)
+
+    def test_trace_span_records_on_the_global_tracer(self):
+        with trace_span("bring up interface", category="interface", interface="vnet-br0"):
+            pass
+        self.assertEqual(tracer.spans[0]["tags"], {"interface": "vnet-br0"})
@@ -0,0 +1,152 @@
+from contextlib import contextmanager
+from json import dump
+from logging import getLogger
+from os import getpid
+from threading import Lock, get_ident
+from time import perf_counter
+from typing import List
+
+from tabulate import tabulate
+
+logger = getLogger(__name__)
+
+
+class Tracer:
+    """
+    Records timed, tagged spans of the VNet operations
+    Spans can be nested and recorded from multiple threads, recording is a no-op until the tracer is enabled.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.spans = []
+        self._lock = Lock()
+        self._origin = perf_counter()
+
+    def enable(self):
+        """
+        Start recording spans
+        """
+        self.reset()
+        self.enabled = True
+
+    def reset(self):
+        """
+        Stop recording spans and forget the recorded spans
+        """
+        self.enabled = False
+        self.spans = []
+        self._origin = perf_counter()
+
+    @contextmanager
+    def span(self, name: str, category: str = "vnet", **tags):
+        """
+        Time the code in the with block
+        :param str name: The name of the phase
+        :param str category: The category of the phase
+        :param tags: Tags of the span, like the machine or interface it belongs to
+        """
+        if not self.enabled:
+            yield
+            return
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            end = perf_counter()
+            span = {"name": name, "category": category, "start": start - self._origin, "end": end - self._origin}
+            span.update({"thread": get_ident(), "tags": tags})
+            with self._lock:
+                self.spans.append(span)
+
+    def to_chrome_trace(self) -> dict:
+        """
+        Converts the recorded spans to the Chrome trace event format, which can be loaded in chrome://tracing or Perfetto
+        :return: dict: The Chrome trace
+        """
+        pid = getpid()
+        threads = {}
+        events = []
+        for span in sorted(self.spans, key=lambda s: s["start"]):
+            tid = threads.setdefault(span["thread"], len(threads) + 1)
+            events.append(
+                {
+                    "name": span["name"],
+                    "cat": span["category"],
+                    "ph": "X",
+                    "ts": round(span["start"] * 1e6, 3),
+                    "dur": round((span["end"] - span["start"]) * 1e6, 3),
+                    "pid": pid,
+                    "tid": tid,
+                    "args": span["tags"],
+                }
+            )
+        for tid in threads.values():
+            name = "main" if tid == 1 else "worker {}".format(tid - 1)
+            events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}})
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write_chrome_trace(self, path: str):
+        """
+        Writes the recorded spans to a Chrome trace file
+        :param str path: The path of the trace file
+        """
+        logger.info("Writing trace with {} spans to {}".format(len(self.spans), path))
+        with open(path, "w") as fh:
+            dump(self.to_chrome_trace(), fh)
+
+    def get_phase_summary(self, limit: int = 10) -> List[List]:
+        """
+        :param int limit: The amount of phases to return
+        :return: list: The phase name, count, total and maximum duration of the slowest phases
+        """
+        phases = {}
+        for span in self.spans:
+            phases.setdefault(span["name"], []).append(span["end"] - span["start"])
+        rows = [[name, len(durations), round(sum(durations), 3), round(max(durations), 3)] for name, durations in phases.items()]
+        return sorted(rows, key=lambda row: row[2], reverse=True)[:limit]
+
+    def get_machine_summary(self, limit: int = 10) -> List[List]:
+        """
+        The time of a machine is the time between its first and last span, its slowest phase the longest span without nested spans
+        :param int limit: The amount of machines to return
+        :return: list: The machine name, time, slowest phase and duration of the slowest phase of the slowest machines
+        """
+        machines = {}
+        for span in self.spans:
+            if "machine" in span["tags"]:
+                machines.setdefault(span["tags"]["machine"], []).append(span)
+        rows = []
+        for machine, spans in machines.items():
+            leaves = [span for span in spans if not any(self._contains(span, other) for other in spans if other is not span)]
+            slowest = max(leaves, key=lambda s: s["end"] - s["start"])
+            total = max(s["end"] for s in spans) - min(s["start"] for s in spans)
+            rows.append([machine, round(total, 3), slowest["name"], round(slowest["end"] - slowest["start"], 3)])
+        return sorted(rows, key=lambda row: row[1], reverse=True)[:limit]
+
+    @staticmethod
+    def _contains(outer: dict, inner: dict) -> bool:
+        return outer["thread"] == inner["thread"] and outer["start"] <= inner["start"] and inner["end"] <= outer["end"]
+
+    def show_summary(self, limit: int = 10):
+        """
+        Prints the slowest phases and machines
+        :param int limit: The amount of phases and machines to show
+        """
+        print(tabulate(self.get_phase_summary(limit), headers=["Phase", "Count", "Total (s)", "Max (s)"], tablefmt="pretty"))
+        machines = self.get_machine_summary(limit)
+        if machines:
+            print(tabulate(machines, headers=["Machine", "Time (s)", "Slowest phase", "Phase time (s)"], tablefmt="pretty"))
+
+
+tracer = Tracer()
+
+
+def trace_span(name: str, category: str = "vnet", **tags):
+    """
+    Time the code in the with block with the global tracer
+    :param str name: The name of the phase
+    :param str category: The category of the phase
+    :param tags: Tags of the span, like the machine or interface it belongs to
+    """
+    return tracer.span(name, category=category, **tags)
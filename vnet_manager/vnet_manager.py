@@ -7,6 +7,7 @@ from vnet_manager.conf import settings
 from vnet_manager.log import setup_console_logging, get_logging_verbosity
 from vnet_manager.actions.manager import ActionManager
 from vnet_manager.utils.user import check_for_root_user
+from vnet_manager.utils.trace import tracer, trace_span
 from vnet_manager.argeparser import parse_vnet_args
 
 logger = getLogger(__name__)
@@ -28,10 +29,27 @@ def main(args: Sequence = None) -> int:
         logger.critical("This program should only be run as root")
         return EX_NOPERM
     # Let the action manager handle the rest
-    manager = ActionManager(config_path=args.config, sniffer=args.sniffer, base_image=args.base_image, no_hosts=args.no_hosts)
+    manager = ActionManager(
+        config_path=args.config,
+        sniffer=args.sniffer,
+        base_image=args.base_image,
+        no_hosts=args.no_hosts,
+        parallel=args.parallel,
+        graceful=args.graceful,
+        stop_timeout=args.stop_timeout,
+        snapshot=args.snapshot,
+    )
     if args.machines:
         manager.machines = args.machines
-    return manager.execute(args.action)
+    if not args.trace:
+        return manager.execute(args.action)
+    tracer.enable()
+    try:
+        with trace_span(args.action, category="action"):
+            return manager.execute(args.action)
+    finally:
+        tracer.write_chrome_trace(args.trace)
+        tracer.show_summary()
 
 
 if __name__ == "__main__":